@@ -5,6 +5,7 @@ DirTreeMirror_PrdPrjSw:
 This package-name (comm) stands for "commands".
 
 This package organizes subpackages such as:
+   cmm/bench: benchmark scripts (hashing, walking & copying throughput)
    cmm/clean: contains subpackages for db- & os- cleaning functions
    cmm/del: scripts that delete files
    cmm/mirr: mirroring or backing-up scripts
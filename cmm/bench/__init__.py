@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+"""
+DirTreeMirror_PrdPrjSw:
+  cmm/bench/__init__.py
+This package-name (bench) stands for "benchmarks".
+
+Here are organized the scripts
+  that measure how fast the hashing, the dirtree walk and the copying run on a given machine.
+  They work on synthetic data in temp folders, ie no real dirtree is touched.
+"""
+pass
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+cmm/bench/hashing_throughput_bench_cm.py
+  Measures the throughput of the hashing, walking and copying paths on synthetic data
+  and outputs the results as JSON, so that runs may be compared across releases and hardware.
+
+Datasets (created in a temp folder, removed at the end unless --keep is given):
+  - 'small': many small files (4KiB to 64KiB);
+  - 'huge': a few huge files (128MiB each);
+  - 'mixed': a log-normal size distribution (most files small, some of several MiB);
+  - 'sparse': a few huge sparse files (1GiB each, 1/16 of it data, the rest holes).
+  --scale=<float> multiplies the number of files (small & mixed) and the file sizes (huge & sparse).
+
+Cases (each one is run on each dataset):
+  - 'legacy_read64k': the former calc_sha1_from_file() loop, ie f.read(BUF_SIZE) into new bytes-objects;
+  - 'readinto_<size>', 'mmap', 'sparse', 'auto', 'auto-mmap': HashingEngine's strategies and block sizes;
+  - 'blake2b': the default engine with hashalgo blake2b;
+  - 'pool_<n>w': Sha1HashingPool with n worker threads;
+  - 'iopolicy_<policy>': the default engine under each IOPolicy;
+  - 'walker': FilesUpDirTreeWalker.walkup_dirtree_files() with a fresh db (db-inserts included);
+  - 'copy_<policy>': device_io_scheduler_mod.run_copy() into a temp target folder under each IOPolicy.
+  Each case is run --repeat=<n> times, the fastest run is kept.
+
+Metrics per case: wall_secs, cpu_secs (process-wide, ie including worker threads), mb_per_s, files_per_s
+  and digests_ok (whether the digests agree with the legacy loop's).
+Files are freshly written, ie the page cache is warm, unless --cold is given: then the dataset's pages are
+  dropped (posix_fadvise DONTNEED) before each run, which gets close to, but is not quite, a cold cache.
+
+Usage:
+  $hashing_throughput_bench_cm.py [--datasets=small,huge,mixed,sparse] [--cases=<case1,case2,...>] [--scale=<float>]
+    [--repeat=<n>] [--cold] [--keep] [--tmpdir=<folder>] [--json=<output_filepath>]
+
+Example:
+  $hashing_throughput_bench_cm.py --datasets=small,mixed --repeat=3 --json=bench_2026-10-18.json
+"""
+import contextlib
+import datetime
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import ssl
+import sys
+import tempfile
+import time
+import llib.hashfunctions.hash_mod as hm
+import llib.hashfunctions.hashpool_mod as hpool
+import llib.os.device_io_scheduler_mod as devsched
+import llib.os.io_policy_mod as iopol
+BENCH_FORMAT_VERSION = 1
+DATASET_NAMES = ['small', 'huge', 'mixed', 'sparse']
+READINTO_BLOCK_SIZES = [64 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+POOL_N_WORKERS = [1, 2, 4]
+SMALL_N_FILES = 2000
+SMALL_MIN_SIZE, SMALL_MAX_SIZE = 4 * 1024, 64 * 1024
+HUGE_N_FILES = 2
+HUGE_FILE_SIZE = 128 * 1024 * 1024
+MIXED_N_FILES = 300
+MIXED_MAX_SIZE = 64 * 1024 * 1024
+SPARSE_N_FILES = 2
+SPARSE_FILE_SIZE = 1024 * 1024 * 1024
+SPARSE_N_EXTENTS = 16
+SPARSE_DATA_FRACTION = 1 / 16
+FILES_PER_FOLDER = 100
+WRITE_CHUNK_SIZE = 1024 * 1024
+
+
+def legacy_calc_sha1_from_file(filepath):
+  """
+  The hashing loop as it was before HashingEngine, kept here as the benchmark's baseline
+  """
+  sha1 = hashlib.sha1()
+  with open(filepath, 'rb') as f:
+    while True:
+      data = f.read(hm.BUF_SIZE)
+      if not data:
+        break
+      sha1.update(data)
+  return sha1.digest()
+
+
+def write_random_file(filepath, bytesize):
+  with open(filepath, 'wb') as f:
+    n_remaining = bytesize
+    while n_remaining > 0:
+      chunk_size = min(n_remaining, WRITE_CHUNK_SIZE)
+      f.write(os.urandom(chunk_size))
+      n_remaining -= chunk_size
+
+
+def write_sparse_file(filepath, bytesize):
+  """
+  Writes SPARSE_N_EXTENTS random-data extents evenly spread, the bytes in between are holes
+  """
+  stride = bytesize // SPARSE_N_EXTENTS
+  extent_size = max(1, int(stride * SPARSE_DATA_FRACTION))
+  with open(filepath, 'wb') as f:
+    for i in range(SPARSE_N_EXTENTS):
+      f.seek(i * stride)
+      n_remaining = min(extent_size, bytesize - i * stride)
+      while n_remaining > 0:
+        chunk_size = min(n_remaining, WRITE_CHUNK_SIZE)
+        f.write(os.urandom(chunk_size))
+        n_remaining -= chunk_size
+    f.truncate(bytesize)
+
+
+class SyntheticDataset:
+  """
+  A dataset is a folder with files spread in subfolders of FILES_PER_FOLDER files
+    (the walker does not process files in the mountpath folder itself)
+  """
+
+  def __init__(self, name, basefolder, scale=1.0, seed=None):
+    if name not in DATASET_NAMES:
+      error_msg = 'Dataset (%s) is not one of %s.' % (str(name), str(DATASET_NAMES))
+      raise ValueError(error_msg)
+    self.name = name
+    self.scale = scale
+    self.rng = random.Random(name if seed is None else seed)
+    self.mountpath = os.path.join(basefolder, 'dataset_' + name)
+    self.filepaths = []
+    self.total_bytes = 0
+
+  def form_bytesizes(self):
+    if self.name == 'small':
+      n_files = max(1, int(SMALL_N_FILES * self.scale))
+      return [self.rng.randint(SMALL_MIN_SIZE, SMALL_MAX_SIZE) for _ in range(n_files)]
+    if self.name == 'huge':
+      return [max(1, int(HUGE_FILE_SIZE * self.scale))] * HUGE_N_FILES
+    if self.name == 'sparse':
+      return [max(1, int(SPARSE_FILE_SIZE * self.scale))] * SPARSE_N_FILES
+    # mixed: median ~64KiB, a long tail up to MIXED_MAX_SIZE
+    n_files = max(1, int(MIXED_N_FILES * self.scale))
+    return [min(MIXED_MAX_SIZE, int(self.rng.lognormvariate(11.0, 2.0))) for _ in range(n_files)]
+
+  def create(self):
+    for i, bytesize in enumerate(self.form_bytesizes()):
+      folderpath = os.path.join(self.mountpath, 'd%04d' % (i // FILES_PER_FOLDER))
+      os.makedirs(folderpath, exist_ok=True)
+      filepath = os.path.join(folderpath, 'f%06d.bin' % i)
+      if self.name == 'sparse':
+        write_sparse_file(filepath, bytesize)
+      else:
+        write_random_file(filepath, bytesize)
+      self.filepaths.append(filepath)
+      self.total_bytes += bytesize
+    return self
+
+  def drop_from_page_cache(self):
+    if not iopol.is_fadvise_supported():
+      return False
+    for filepath in self.filepaths:
+      with open(filepath, 'rb') as f:
+        os.fsync(f.fileno())
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    return True
+
+  def as_dict(self):
+    return {
+      'name': self.name,
+      'n_files': len(self.filepaths),
+      'total_bytes': self.total_bytes,
+      'scale': self.scale,
+    }
+
+
+class HashingThroughputBench:
+
+  def __init__(self, dataset_names=None, case_names=None, scale=1.0, n_repeat=1, cold=False, tmpdir=None):
+    self.dataset_names = DATASET_NAMES if dataset_names is None else dataset_names
+    self.case_names = case_names  # None means all
+    self.scale = scale
+    self.n_repeat = max(1, int(n_repeat))
+    self.cold = cold
+    self.basefolder = tempfile.mkdtemp(prefix='pymirror_bench_', dir=tmpdir)
+    self.results = []
+    self.datasets = []
+    self.expected_digests = {}
+
+  def form_cases(self):
+    """
+    Returns the list of (case_name, case_function), a case_function receives the dataset
+      and returns the digests it calculated (or None, when the case does not hash, eg copying)
+    """
+    cases = [('legacy_read64k', self.run_legacy)]
+    for block_size in READINTO_BLOCK_SIZES:
+      case_name = 'readinto_%dk' % (block_size // 1024)
+      engine = hm.HashingEngine(readinto_block_size=block_size, strategy='readinto')
+      cases.append((case_name, self.form_engine_case(engine)))
+    cases.append(('mmap', self.form_engine_case(hm.HashingEngine(strategy='mmap'))))
+    cases.append(('sparse', self.form_engine_case(hm.HashingEngine(strategy='sparse'))))
+    cases.append(('auto', self.form_engine_case(hm.HashingEngine())))
+    cases.append(('auto-mmap', self.form_engine_case(hm.HashingEngine(strategy='auto-mmap'))))
+    cases.append(('blake2b', self.form_engine_case(hm.HashingEngine(), 'blake2b')))
+    for n_workers in POOL_N_WORKERS:
+      cases.append(('pool_%dw' % n_workers, self.form_pool_case(n_workers)))
+    for policy_name in iopol.IO_POLICIES:
+      engine = hm.HashingEngine(io_policy=iopol.IOPolicy(policy_name))
+      cases.append(('iopolicy_' + policy_name, self.form_engine_case(engine)))
+    cases.append(('walker', self.run_walker))
+    for policy_name in iopol.IO_POLICIES:
+      cases.append(('copy_' + policy_name, self.form_copy_case(iopol.IOPolicy(policy_name))))
+    if self.case_names is not None:
+      cases = [(case_name, fn) for case_name, fn in cases if case_name in self.case_names]
+    return cases
+
+  @staticmethod
+  def run_legacy(dataset):
+    return [legacy_calc_sha1_from_file(filepath) for filepath in dataset.filepaths]
+
+  @staticmethod
+  def form_engine_case(engine, hashalgo=None):
+    hashobj_factory = hm.get_hashobj_factory(hashalgo)
+
+    def run_engine(dataset):
+      return [engine.hash_file(filepath, hashobj_factory) for filepath in dataset.filepaths]
+    return run_engine
+
+  @staticmethod
+  def form_pool_case(n_workers):
+
+    def run_pool(dataset):
+      pool = hpool.Sha1HashingPool(n_workers=n_workers)
+      jobs = []
+      for filepath in dataset.filepaths:
+        job = hpool.HashJob(filepath, os.path.basename(filepath), '/', None, None)
+        jobs += pool.submit(job)
+      jobs += list(pool.drain())
+      pool.shutdown()
+      return [job.sha1 for job in jobs]
+    return run_pool
+
+  @staticmethod
+  def run_walker(dataset):
+    import cmm.walkup_dirtree_files_cm as walkup  # imported here, it depends on default_settings
+    sqlite_filepath = os.path.join(dataset.mountpath, '.updirfileentries.sqlite')
+    if os.path.isfile(sqlite_filepath):
+      os.remove(sqlite_filepath)
+    with contextlib.redirect_stdout(io.StringIO()):
+      walker = walkup.FilesUpDirTreeWalker(dataset.mountpath)
+      walker.walkup_dirtree_files()
+      walker.hashpool.shutdown()
+    os.remove(sqlite_filepath)
+    return None
+
+  def form_copy_case(self, io_policy):
+
+    def run_copy(dataset):
+      trg_folderpath = os.path.join(self.basefolder, 'copy_target')
+      os.makedirs(trg_folderpath, exist_ok=True)
+      for i, filepath in enumerate(dataset.filepaths):
+        devsched.run_copy(filepath, os.path.join(trg_folderpath, 'f%06d.bin' % i), io_policy)
+      shutil.rmtree(trg_folderpath)
+      return None
+    return run_copy
+
+  def measure(self, dataset, case_name, case_fn):
+    best = None
+    digests = None
+    for _ in range(self.n_repeat):
+      if self.cold:
+        dataset.drop_from_page_cache()
+      wall_start, cpu_start = time.perf_counter(), time.process_time()
+      digests = case_fn(dataset)
+      wall_secs = time.perf_counter() - wall_start
+      cpu_secs = time.process_time() - cpu_start
+      if best is None or wall_secs < best[0]:
+        best = (wall_secs, cpu_secs)
+    wall_secs, cpu_secs = best
+    result = {
+      'dataset': dataset.name,
+      'case': case_name,
+      'n_files': len(dataset.filepaths),
+      'total_bytes': dataset.total_bytes,
+      'n_repeat': self.n_repeat,
+      'wall_secs': round(wall_secs, 6),
+      'cpu_secs': round(cpu_secs, 6),
+      'mb_per_s': round(dataset.total_bytes / (1024 * 1024) / wall_secs, 3) if wall_secs > 0 else None,
+      'files_per_s': round(len(dataset.filepaths) / wall_secs, 3) if wall_secs > 0 else None,
+      'digests_ok': self.check_digests(dataset, case_name, digests),
+    }
+    return result
+
+  def check_digests(self, dataset, case_name, digests):
+    """
+    Digests are compared to the legacy loop's; blake2b and the non-hashing cases are not comparable (None)
+    """
+    if digests is None or case_name == 'blake2b':
+      return None
+    if dataset.name not in self.expected_digests:
+      self.expected_digests[dataset.name] = self.run_legacy(dataset)
+    return digests == self.expected_digests[dataset.name]
+
+  def run(self):
+    cases = self.form_cases()
+    for dataset_name in self.dataset_names:
+      print('Creating dataset', dataset_name, 'in', self.basefolder, file=sys.stderr)
+      dataset = SyntheticDataset(dataset_name, self.basefolder, self.scale).create()
+      self.datasets.append(dataset)
+      for case_name, case_fn in cases:
+        result = self.measure(dataset, case_name, case_fn)
+        self.results.append(result)
+        print(
+          dataset_name, case_name, '%.2f MB/s' % (result['mb_per_s'] or 0),
+          '%.1f files/s' % (result['files_per_s'] or 0), file=sys.stderr
+        )
+    return self.results
+
+  @staticmethod
+  def form_machine_dict():
+    return {
+      'platform': platform.platform(),
+      'machine': platform.machine(),
+      'processor': platform.processor(),
+      'cpu_count': os.cpu_count(),
+      'python': platform.python_version(),
+      'openssl': ssl.OPENSSL_VERSION,
+      'fadvise_supported': iopol.is_fadvise_supported(),
+    }
+
+  def as_dict(self):
+    return {
+      'bench': 'hashing_throughput',
+      'format_version': BENCH_FORMAT_VERSION,
+      'run_at': datetime.datetime.now().isoformat(timespec='seconds'),
+      'machine': self.form_machine_dict(),
+      'options': {'scale': self.scale, 'n_repeat': self.n_repeat, 'cold': self.cold},
+      'datasets': [dataset.as_dict() for dataset in self.datasets],
+      'results': self.results,
+    }
+
+  def cleanup(self):
+    shutil.rmtree(self.basefolder, ignore_errors=True)
+
+
+def get_args():
+  """
+  The cli args are read as --<name>=<value> (and --cold, --keep as flags), see Usage in the module's docstring
+  """
+  args = {
+    'datasets': None, 'cases': None, 'scale': 1.0, 'repeat': 1,
+    'cold': False, 'keep': False, 'tmpdir': None, 'json': None
+  }
+  for arg in sys.argv[1:]:
+    if arg in ['--cold', '--keep']:
+      args[arg[2:]] = True
+      continue
+    if not arg.startswith('--') or '=' not in arg:
+      continue
+    name, value = arg[2:].split('=', 1)
+    if name in ['datasets', 'cases']:
+      args[name] = [v.strip() for v in value.split(',') if v.strip() != '']
+    elif name == 'scale':
+      args[name] = float(value)
+    elif name == 'repeat':
+      args[name] = int(value)
+    elif name in ['tmpdir', 'json']:
+      args[name] = value
+  return args
+
+
+def process():
+  args = get_args()
+  bench = HashingThroughputBench(
+    dataset_names=args['datasets'], case_names=args['cases'], scale=args['scale'],
+    n_repeat=args['repeat'], cold=args['cold'], tmpdir=args['tmpdir']
+  )
+  try:
+    bench.run()
+  finally:
+    if not args['keep']:
+      bench.cleanup()
+  outjson = json.dumps(bench.as_dict(), indent=2)
+  if args['json'] is None:
+    print(outjson)
+    return
+  with open(args['json'], 'w') as f:
+    f.write(outjson + '\n')
+  print('Results written to', args['json'], file=sys.stderr)
+
+
+if __name__ == '__main__':
+  process()
@@ -104,9 +104,7 @@ class TargetSameSha1ForceDeleter:
         self.register_all_trgfiles_with_specific_sha1_for_later_deletion(src_sha1)
 
   def loop_thru_targetdirtree_db_entries(self):
-    generated_rows = self.bak_dbtree.do_select_all_w_limit_n_offset()
-    for trg_rows in generated_rows:
-      self.lookup_sha1s_in_trg_that_exist_in_src(trg_rows)
+    self.lookup_sha1s_in_trg_that_exist_in_src(self.bak_dbtree.do_select_rows_by_keyset())
 
   def delete_entry_in_os_n_in_db(self, _id):
     """
@@ -138,7 +136,7 @@ class TargetSameSha1ForceDeleter:
           '/', trg_total_to_del, '/', self.trg_total_files, '>>> DELETING', _id, dirnode.name
         )
         return False
-      self.bak_dbtree.delete_row_by_id(_id)
+      self.bak_dbtree.delete_row(_id)  # buffered, see do_batch_deletion_if_confirmed()
 
   def do_batch_deletion_if_confirmed(self):
     """
@@ -151,8 +149,9 @@ class TargetSameSha1ForceDeleter:
     """
     if not self.deletion_confirmed:
       return 0
-    for _id in self.trg_delete_ids:
-      self.delete_entry_in_os_n_in_db(_id)
+    with self.bak_dbtree.buffered_writes():
+      for _id in self.trg_delete_ids:
+        self.delete_entry_in_os_n_in_db(_id)
 
   def print_out_all_files_to_delete(self):
     trg_del_total = len(self.trg_delete_ids)
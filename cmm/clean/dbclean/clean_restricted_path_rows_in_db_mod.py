@@ -44,10 +44,11 @@ class RowsWithRestrictedPathsCleaner:
 
   def do_delete_rows(self):
     self.n_processed_deletes = 0
-    for _id in self.rows_with_restricted_paths_ids:
-      self.n_processed_deletes += 1
-      print(self.n_processed_deletes, 'deleting', _id)
-      self.dbtree.delete_row_by_id(_id)
+    with self.dbtree.buffered_writes():
+      for _id in self.rows_with_restricted_paths_ids:
+        self.n_processed_deletes += 1
+        print(self.n_processed_deletes, 'deleting', _id)
+        self.dbtree.delete_row(_id)
 
   def show_delete_ids(self):
     print('show_delete_ids')
@@ -70,17 +71,15 @@ class RowsWithRestrictedPathsCleaner:
       print('No processing - defaults.RESTRICTED_DIRNAMES_FOR_WALK is empty.')
       return
     listvalues = []
-    sql = 'SELECT * FROM %(tablename)s WHERE '
+    where_clause = ''
     for restricted_dir_prefix in defaults.RESTRICTED_DIRNAMES_FOR_WALK:
       restricted_sql_value = '%' + restricted_dir_prefix + '%'
       listvalues.append(restricted_sql_value)
-      sql += 'parentpath LIKE ? OR '
-    sql = sql.rstrip(' OR ') + ';'
+      where_clause += 'parentpath LIKE ? OR '
+    where_clause = where_clause.rstrip(' OR ')
     tuplevalues = tuple(listvalues)
-    generated_rows = self.dbtree.do_select_sql_n_tuplevalues_w_limit_n_offset(sql, tuplevalues)
-    for rows in generated_rows:
-      for row in rows:
-        self.verify_if_row_has_a_restricted_dir_prefix_n_append_if_so(row)
+    for row in self.dbtree.do_select_rows_by_keyset(where_clause, tuplevalues):
+      self.verify_if_row_has_a_restricted_dir_prefix_n_append_if_so(row)
 
   def process(self):
     self.loop_thru_rows_that_have_paths_in_restricted_dirs()
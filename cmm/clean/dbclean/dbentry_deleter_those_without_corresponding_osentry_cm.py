@@ -25,6 +25,13 @@ For example: suppose a back-up operation is started. An operation in this chain
   It's expected that this might help resync files that were moved and if name, size and mdate are the same,
     it's reasonable to expect this file was previously moved.
   So this script does this checking recording True (1) of False (0) in the is_present field.
+
+Nowadays, the check is a set difference: one os.scandir() pass over the dirtree fills a temp table
+  with the (parentpath, name) of the files on disk, then the db rows not in it are deleted
+  with one anti-join DELETE, in one transaction (see DBDirTree.delete_rows_without_os_entries()).
+  That pass is unpruned (a file under z-del, z-tri, a dot dir etc still has its row kept),
+  whereas total_files_os & total_dirs_os are reported, as before, without the restricted dirs:
+  they are counted along the same pass, the unpruned totals reported next to them.
 """
 import datetime
 import os.path
@@ -32,6 +39,7 @@ import os.path
 import default_settings as defaults
 import llib.db.dbdirtree_mod as dbt
 import llib.dirfilefs.dir_n_file_fs_mod as dirfil
+import llib.dirfilefs.scandir_walk_mod as scdw
 import llib.strnlistfs.strfunctions_mod as strf
 import models.entries.dirnode_mod as dn
 SQL_SELECT_LIMIT_DEFAULT = 50
@@ -48,71 +56,65 @@ class DBEntryWithoutCorrespondingOsEntryDeleter:
     self.delete_ids = []
     self.total_rows_deleted = 0
     self.n_processed_in_db = 0
-    self.n_while_rounds = 0
     self.total_files_os = 0
     self.total_dirs_os = 0
+    self.total_files_os_unpruned = 0
+    self.total_dirs_os_unpruned = 0
     self.total_files_in_db = 0
     self.total_sha1s_in_db = 0
     self.n_updates = 0
+    self.unlisted_parentpaths = []
     self.mountpath = mountpath
     self.dbtree = dbt.DBDirTree(self.mountpath)
     self.count_totals()
-    # this below is zeroed at every pass thru outside loop (the one with sql-limit/offset)
-    # its counting ajusts the db-select-offset (it's here for the IDE to reflect it)
-    self.n_deleted_in_loop = 0
 
   def count_totals(self):
     self.total_files_in_db = self.dbtree.count_rows_as_int()
     self.total_sha1s_in_db = self.dbtree.count_unique_sha1s_as_int()
-    self.total_files_os, self.total_dirs_os = dirfil.count_total_files_n_folders_with_restriction(self.mountpath)
+    # the os totals come from the scandir pass (see delete_dbentries_without_osentries())
 
-  def delete_dbentry_if_theres_no_equivalent_os_entry(self, row):
-    self.n_processed_in_db += 1
+  def print_deleted_dbentry(self, row):
     dirnode = dn.DirNode.create_with_tuplerow(row, self.dbtree.fieldnames)
-    filepath = dirnode.get_abspath_with_mountpath(self.mountpath)
-    if not os.path.isfile(filepath):
-      self.delete_ids.append(dirnode.get_db_id())
-      _ = self.dbtree.delete_row_by_id(dirnode.get_db_id())  # del_result
-      self.n_deleted_dbentries += 1
-      self.n_deleted_in_loop += 1
-      print(' *-=-' * 4, 'DELETE DBENTRY', ' *-=-' * 4)
-      print(
-        'tot del', self.n_deleted_dbentries, 'proc', self.n_processed_in_db, '/', self.total_files_in_db,
-        'deleted dbentry for', dirnode.get_db_id(),
-        dirnode.name, strf.put_ellipsis_in_str_middle(dirnode.parentpath, 50)
-      )
-
-  def fetch_dbentries_n_check_their_osentries(self):
-    offset = 0
-    k_limit = 50
-    while 1:  # see below the condition for interrupting this while-infinite-loop
-      self.n_while_rounds += 1
-      limit_clause = ' LIMIT %(limit)d OFFSET %(offset)d ;' \
-          % {'limit': k_limit, 'offset': offset}
-      sql = 'SELECT * FROM %(tablename)s' + limit_clause
-      rows = self.dbtree.do_select_with_sql_without_tuplevalues(sql)
-      self.n_deleted_in_loop = 0
-      for i, row in enumerate(rows):
-        print(
-          i + 1, 'whl rnd', self.n_while_rounds, 'proc', self.n_processed_in_db, '/', self.total_files_in_db
-        )
-        self.delete_dbentry_if_theres_no_equivalent_os_entry(row)
-      offset = offset + k_limit  # - self.n_deleted_in_loop
-      if len(rows) < k_limit:  # this is the condition for interrupting the while-infinite-loop "WHILE 1" above
-        print('Interrupting while-1 loop: len(rows)', len(rows), ' < k_limit', k_limit, 'offset', offset)
-        break
-      if self.n_while_rounds > defaults.LIMIT_NUMBER_IN_WHILE_LOOP:
-        screen_msg = 'self.n_while_rounds (%d) > defaults.LIMIT_NUMBER_IN_WHILE_LOOP (%d)' \
-          % (self.n_while_rounds, defaults.LIMIT_NUMBER_IN_WHILE_LOOP)
-        print(screen_msg)
-        break
-
-  def execute_delete_ids(self):
-    self.total_rows_deleted = self.dbtree.delete_ids(self.delete_ids)
+    self.delete_ids.append(dirnode.get_db_id())
+    self.n_deleted_dbentries += 1
+    print(' *-=-' * 4, 'DELETE DBENTRY', ' *-=-' * 4)
+    print(
+      'tot del', self.n_deleted_dbentries, 'proc', self.n_processed_in_db, '/', self.total_files_in_db,
+      'deleted dbentry for', dirnode.get_db_id(),
+      dirnode.name, strf.put_ellipsis_in_str_middle(dirnode.parentpath, 50)
+    )
+
+  def generate_parentpath_n_filename_counting_os_totals(self, scandir_walker):
+    """
+    Yields the unpruned walk's (parentpath, filename)'s, counting on the way total_files_os & total_dirs_os
+      as a walk with the restricted dirs pruned would (see dirfil.count_total_files_n_folders_with_restriction()),
+      ie without a second pass over the dirtree
+    """
+    restricted_walker = scdw.ScandirDirTreeWalker(self.mountpath)  # only used for its restrictions
+    for _, parentpath, file_direntries in scandir_walker.generate_folders():
+      if parentpath != scdw.ROOT_PARENTPATH and not restricted_walker.is_restricted_parentpath(parentpath):
+        self.total_dirs_os += 1
+        self.total_files_os += len(file_direntries)
+      for direntry in file_direntries:
+        yield parentpath, direntry.name
+
+  def delete_dbentries_without_osentries(self):
+    """
+    All rows are checked at once against the scandir pass (see the module's docstring)
+    """
+    self.n_processed_in_db = self.dbtree.count_rows_as_int()
+    scandir_walker = scdw.ScandirDirTreeWalker(self.mountpath, restricted_dirnames=[], forbidden_first_level_dirs=[])
+    orphan_rows, self.total_rows_deleted = self.dbtree.delete_rows_without_os_entries(
+      self.generate_parentpath_n_filename_counting_os_totals(scandir_walker), scandir_walker.failed_parentpaths
+    )
+    # the rows in the folders that could not be listed are kept (their files are unknown, not missing)
+    self.unlisted_parentpaths = scandir_walker.failed_parentpaths
+    self.total_files_os_unpruned, self.total_dirs_os_unpruned = scandir_walker.get_totals(include_root=False)
+    for row in orphan_rows:
+      self.print_deleted_dbentry(row)
 
   def process(self):
-    self.fetch_dbentries_n_check_their_osentries()
-    self.execute_delete_ids()
+    self.delete_dbentries_without_osentries()
     # self.delete_empty_dirs()
     self.report()
 
@@ -124,10 +126,15 @@ class DBEntryWithoutCorrespondingOsEntryDeleter:
     print('total_files_in_db', self.total_files_in_db)
     print('total_files_os', self.total_files_os)
     print('total_dirs_os', self.total_dirs_os)
+    print('total_files_os_unpruned (restricted dirs included, as checked)', self.total_files_os_unpruned)
+    print('total_dirs_os_unpruned (restricted dirs included, as checked)', self.total_dirs_os_unpruned)
     print('total_sha1s_in_db', self.total_sha1s_in_db)
     print('n_processed_in_db', self.n_processed_in_db)
     print('n_deleted_dbentries', self.n_deleted_dbentries)
     print('total_rows_deleted', self.total_rows_deleted)
+    print('n_unlisted_folders (their dbentries were kept)', len(self.unlisted_parentpaths))
+    for parentpath in self.unlisted_parentpaths:
+      print(' unlisted folder', parentpath)
     print('End of Processing')
 
   def delete_empty_dirs(self):
@@ -174,9 +181,7 @@ class PresentInDBNotInDirTreeReporter:
         print(screen_line)
 
   def loop_thru_files_in_db(self):
-    for generated_rows in self.dbtree.do_select_all_w_limit_n_offset():
-      for rows in generated_rows:
-        self.gather_ids_not_present_in_os(rows)
+    self.gather_ids_not_present_in_os(self.dbtree.do_select_rows_by_keyset())
 
   def report_files_in_db_not_in_os(self):
     for _id in self.ids_present_in_db_not_in_os:
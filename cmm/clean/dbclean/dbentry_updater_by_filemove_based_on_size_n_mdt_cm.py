@@ -14,35 +14,43 @@ This supposition is based on the following reasoning:
 2) the bytesize and mdatetime are reasonably stable, ie the file will keep its two attributes across a move;
 3) there is no further files with the same bytesize and mdatetime;
 4) the file was not modified (though it could be modified still keeping its original size) seen by its mdatetime.
+
+Implementation: instead of two queries per file, the dirtree is scanned once (os.scandir) and the checks above are
+  done in bulk by DBDirTree.reconcile_moved_rows(): the files without dbentries (only these are stat'ed) and
+  the dbentries without files go to two temp tables joined on (bytesize, mdatetime), the moves are applied
+  with one UPDATE and the ambiguous keys are written to db-table file_move_ambiguities for a later look.
 """
 import os
+import shutil
+import tempfile
 import llib.db.dbdirtree_mod as dbdt
 import default_settings as defaults
 import llib.dirfilefs.dir_n_file_fs_mod as dirf
+import llib.dirfilefs.scandir_walk_mod as scdw
 import llib.strnlistfs.strfunctions_mod as strf
-import models.entries.dirnode_mod as dn
 
 
 class DBEntryUpdater:
 
   def __init__(self, mountpath):
     self.dbtree = dbdt.DBDirTree(mountpath)
-    self.current_abspath = None
     self.n_dbupdates = 0
     self.n_failed_filestats = 0
     self.n_processed_files = 0
     self.n_processed_dirs = 0
+    self.n_unregistered_files = 0
+    self.n_orphan_dbentries = 0
+    self.n_ambiguous_keys = 0
     self.total_files_in_db = 0
     self.total_files_in_os = 0
     self.total_dirs_in_os = 0
     self.total_unique_sha1s = 0
-    self.count_total_files_n_dirs_in_os()
+    self.count_totals_in_db()
 
-  def count_total_files_n_dirs_in_os(self):
-    print('@ count_total_files_n_dirs_in_os(). Please, wait.')
-    total_files, total_dirs = dirf.count_total_files_n_folders_with_restriction(self.dbtree.mountpath)
-    self.total_files_in_os = total_files
-    self.total_dirs_in_os = total_dirs
+  def count_totals_in_db(self):
+    """
+    The os totals come from the scandir pass itself (see update_moved_dbentries())
+    """
     self.total_files_in_db = self.dbtree.count_rows_as_int()
     self.total_unique_sha1s = self.dbtree.count_unique_sha1s_as_int()
 
@@ -50,129 +58,49 @@ class DBEntryUpdater:
   def total_repeats_in_db(self):
     return self.total_files_in_db - self.total_unique_sha1s
 
-  def verify_if_an_update_can_happen(
-      self,
-      row_found, filename, parentpath_to_be
-    ):
-    """
-    bytesize, mdatetime are not used here but row_found had these two equal
-    If this point is reached in program flow, the following TWO condtions are met:
-      1) a file in os does not have a correspondent entry in db (a dbentry);
-      2) one sole dbentry exists with the same bytesize and mdatetime as file's (ie no ambiguity in files);
-    The third one will be checked/tested here:
-      3) that dbentry in 2) does not have its correspondent in os (dirtree);
-    With the 3 above conditions met, it's reasonable to update dbentry
-      with the new file location (hkey, name, parentpath)
-    """
-    # check if dbentry has its correspondent osentry:
-    _id = row_found[0]
-    idx = self.dbtree.fieldnames.index('name')
-    name = row_found[idx]
-    idx = self.dbtree.fieldnames.index('parentpath')
-    parentpath = row_found[idx]
-    middlepath = parentpath.lstrip('/')
-    folderpath = os.path.join(self.dbtree.mountpath, middlepath)
-    filepath = os.path.join(folderpath, name)
-    if os.path.isfile(filepath):
-      return False
-    # now it is false to update dbentry to an osentry with the supposition of same bytesize and mdatetime
-    sql = '''
-    UPDATE %(tablename)s
-    SET
-      name=?,
-      parentpath=?
-    WHERE
-      id=?;
-    '''
-    print(sql)
-    tuplevalues = (filename, parentpath_to_be, _id)
-    update_result = self.dbtree.do_update_with_sql_n_tuplevalues(sql, tuplevalues)
-    if update_result:
-      self.n_dbupdates += 1
-      return True
-    return False
-
-  def verify_if_many_exist_if_dbfound_exists_in_os_or_update_location(
-      self, fetched_list, filename, parentpath
-    ):
+  def is_move_target(self, parentpath):
     """
-    middlepath is dirnode.parentpath (with the starting '/')
+    As in the previous per-folder walk, the files at the root folder and in the forbidden dirpasses are not move targets,
+      the dirpass looked up is the one below mountpath (as ScandirDirTreeWalker does), ie the mountpath's own
+      dirnames (eg a '/media/user/.mnt/disk') are neither restricted names nor its first level
     """
-    if fetched_list is None or len(fetched_list) == 0:
+    if parentpath == '/':
       return False
-    if len(fetched_list) > 1:
-      # ambiguity problem: give up updating db
-      return False
-    if len(fetched_list) == 1:
-      row_found = fetched_list[0]
-      return self.verify_if_an_update_can_happen(
-        row_found, filename, parentpath
-      )
-    return False
-
-  def verify_file_by_its_bysize_n_mdatetime(self, filename, parentpath):
-    filepath = os.path.join(self.current_abspath, filename)
-    try:
-      filestat = os.stat(filepath)
-    except OSError:
-      self.n_failed_filestats += 1
-      return False
-    bytesize = filestat.st_size
-    mdatetime = filestat.st_mtime
-    print(self.n_processed_files, '/', self.total_files_in_os, 'bytesize', bytesize, 'mdatetime', mdatetime)
-    sql = 'SELECT * FROM %(tablename)s WHERE bytesize=? AND mdatetime=?;'
-    tuplevalues = (bytesize, mdatetime)
-    fetched_list = self.dbtree.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
-    if len(fetched_list) > 0:
-      return self.verify_if_many_exist_if_dbfound_exists_in_os_or_update_location(
-        fetched_list, filename, parentpath
-      )
-    else:
-      print(self.n_processed_files, '/', self.total_files_in_os, filename, 'was not found by bytesize and mdatetime')
-    return False
+    return not dirf.is_forbidden_dirpass(parentpath.lstrip('/'))
 
-  def get_dirnode_or_none_with_name_n_parent(self, filename, parentpath):
-    """
-    """
-    sql = 'SELECT * FROM %(tablename)s WHERE name=? AND parentpath=?;'
-    tuplevalues = (filename, parentpath)
-    fetched_list = self.dbtree.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
-    if fetched_list or len(fetched_list) == 1:
-      row = fetched_list[0]
-      dirnode = dn.DirNode.create_with_tuplerow(row, self.dbtree.fieldnames)
-      print(
-        self.n_processed_files, '/', self.total_files_in_os,
-        'file EXISTS in db:', filename, '@', strf.put_ellipsis_in_str_middle(dirnode.parentpath, 50),
-        ' Continuing.'
-      )
-      return dirnode
-    return None
-
-  def verify_files_possibly_moved_n_dbupdate(self, files):
-    middlepath = self.current_abspath[len(self.dbtree.mountpath):]
-    if middlepath.startswith('/'):
-      middlepath = middlepath.lstrip('/')
-    parentpath = '/' + middlepath
-    for filename in files:
+  def generate_os_entries(self, scandir_walker):
+    for parentpath, filename in scandir_walker.generate_parentpath_n_filename():
       self.n_processed_files += 1
-      dirnode = self.get_dirnode_or_none_with_name_n_parent(filename, parentpath)
-      if dirnode is not None:
-        continue
-      # file may have been moved, try find it via bytesize and mdatetime
-      self.verify_file_by_its_bysize_n_mdatetime(filename, parentpath)
-
-  def walkup_dirtree_to_verify_possible_moveupdates(self):
-    print('total os-files', self.total_files_in_db, '@ walkup_dirtree_to_verify_possible_moveupdates()')
-    for self.current_abspath, folders, files in os.walk(self.dbtree.mountpath):
-      if self.current_abspath == self.dbtree.mountpath:
-        continue
-      if dirf.is_forbidden_dirpass(self.current_abspath):
-        continue
-      self.n_processed_dirs += 1
+      yield parentpath, filename
+    self.n_processed_dirs = scandir_walker.n_folders
+    self.total_files_in_os, self.total_dirs_in_os = scandir_walker.get_totals(include_root=False)
+
+  def print_moves(self, moves):
+    for i, move in enumerate(moves):
+      _id, old_parentpath, old_name, parentpath, name = move
       print(
-        'dir', self.n_processed_dirs, '/', self.total_dirs_in_os, self.current_abspath
+        i + 1, '/', len(moves), 'id', _id, 'moved from', strf.put_ellipsis_in_str_middle(old_parentpath, 50),
+        old_name, 'to', strf.put_ellipsis_in_str_middle(parentpath, 50), name
       )
-      self.verify_files_possibly_moved_n_dbupdate(files)
+
+  def update_moved_dbentries(self):
+    """
+    The dirtree is scanned once and the moves are found & applied in bulk by DBDirTree.reconcile_moved_rows(),
+      the ambiguous (bytesize, mdatetime) keys are left in db-table file_move_ambiguities (see dbmoveambiguities_mod)
+    """
+    print('total db-files', self.total_files_in_db, '@ update_moved_dbentries()')
+    scandir_walker = scdw.ScandirDirTreeWalker(self.dbtree.mountpath, restricted_dirnames=[], forbidden_first_level_dirs=[])
+    result = self.dbtree.reconcile_moved_rows(
+      self.generate_os_entries(scandir_walker), self.is_move_target, scandir_walker.failed_parentpaths
+    )
+    for parentpath in scandir_walker.failed_parentpaths:
+      print('unlisted folder (its dbentries are not taken as moved)', parentpath)
+    self.print_moves(result['moves'])
+    self.n_dbupdates = len(result['moves'])
+    self.n_failed_filestats = result['n_failed_filestats']
+    self.n_unregistered_files = result['n_unregistered_files']
+    self.n_orphan_dbentries = result['n_orphan_rows']
+    self.n_ambiguous_keys = result['n_ambiguous_keys']
 
   def report(self):
     print('='*40)
@@ -183,10 +111,13 @@ class DBEntryUpdater:
     print('total_unique_sha1s', self.total_unique_sha1s)
     print('total_repeats_in_db', self.total_repeats_in_db)
     print('total_files_in_os', self.total_files_in_os)
-    print('total_dirs_in_os', self.total_dirs_in_os, '(obs: rootdir files do not count.)')
+    print('total_dirs_in_os', self.total_dirs_in_os, '(obs: rootdir files are not move targets.)')
     print('n_processed_dirs', self.n_processed_dirs)
     print('n_processed_files_in_trg', self.n_processed_files)
     print('n_failed_filestats', self.n_failed_filestats)
+    print('n_unregistered_files (files in os without a dbentry)', self.n_unregistered_files)
+    print('n_orphan_dbentries (dbentries without a file in os)', self.n_orphan_dbentries)
+    print('n_ambiguous_keys', self.n_ambiguous_keys, '(bytesize & mdatetime pairs left in db-table file_move_ambiguities)')
     print('n_dbupdates', self.n_dbupdates, "(meaning files that were moved before and got unsync'd, now db-sync'd)")
 
   def set_totals_in_db(self, n_files_in_db=None, n_unique_sha1s=None):
@@ -200,10 +131,36 @@ class DBEntryUpdater:
       self.total_unique_sha1s = self.dbtree.count_unique_sha1s_as_int()
 
   def process(self):
-    self.walkup_dirtree_to_verify_possible_moveupdates()
+    self.update_moved_dbentries()
     self.report()
 
 
+def adhoc_test():
+  """
+  Checks is_move_target() and a move's reconciliation under a mountpath with a dotted dirname (.mnt)
+  """
+  mountpath = os.path.join(tempfile.mkdtemp(), '.mnt', 'disk')
+  os.makedirs(os.path.join(mountpath, 'sub', 'folder'))
+  updater = DBEntryUpdater(mountpath)
+  cases = [
+    ('/sub/folder', True), ('/', False), ('/z-del/folder', False), ('/sub/.hidden', False),
+    ('/System Volume Information', False), ('/sub/System Volume Information', True),
+  ]
+  for parentpath, expected in cases:
+    boolres = updater.is_move_target(parentpath)
+    print('is_move_target', parentpath, '=>', boolres, 'ok' if boolres == expected else 'WRONG')
+  filepath = os.path.join(mountpath, 'sub', 'folder', 'moved.txt')
+  with open(filepath, 'w') as f:
+    f.write('moved')
+  filestat = os.stat(filepath)
+  updater.dbtree.add_row('moved.txt', '/old', b'0' * 20, filestat.st_size, filestat.st_mtime)
+  updater.dbtree.flush_writes()
+  updater.process()
+  dirnode = updater.dbtree.fetch_dirnode_with_name_n_parent('moved.txt', '/sub/folder')
+  print('move reconciled under', mountpath, '=>', 'ok' if dirnode is not None else 'WRONG')
+  shutil.rmtree(os.path.dirname(os.path.dirname(mountpath)))
+
+
 def process():
   """
   """
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+cmm/clean/dbclean/normalize_dirtree_storage_cm.py
+  Moves a dirtree's files_in_tree rows to the normalized storage or (with --flat) back to the flat table.
+
+Normalized, the folders are kept in table files_in_tree_dirs (one row per folder) and the files
+  in table files_in_tree_files (with the folder's id in place of the parentpath string),
+  files_in_tree becomes a view that the other scripts read & write as before
+  (see DBDirTree.normalize_storage() in llib/db/dbdirtree_mod.py).
+  A folder rename (eg by cmm/mv/moveRenameDestDirBasedOnSource.py) then updates the folder's row,
+  not the rows of all the files under it.
+
+The conversion runs in one transaction, the row ids are kept.
+
+Usage:
+  $normalize_dirtree_storage_cm.py <mountpath> [--flat]
+
+Example:
+  $normalize_dirtree_storage_cm.py "/Science Videos"
+"""
+import datetime
+import sys
+import llib.db.dbdirtree_mod as dbdt
+import default_settings as defaults
+
+
+class DirTreeStorageConverter:
+
+  def __init__(self, mountpath, to_flat=False):
+    self.mountpath = mountpath
+    self.to_flat = to_flat
+    self.was_converted = False
+    self.dbtree = dbdt.DBDirTree(self.mountpath)
+    self.was_normalized = self.dbtree.is_view
+
+  def process(self):
+    if self.to_flat:
+      self.was_converted = self.dbtree.flatten_storage()
+    else:
+      self.was_converted = self.dbtree.normalize_storage()
+    self.report()
+
+  def report(self):
+    print('-'*50)
+    print('mountpath', self.mountpath)
+    print('storage before', 'normalized' if self.was_normalized else 'flat')
+    print('storage now', 'normalized' if self.dbtree.is_view else 'flat')
+    print('was_converted', self.was_converted)
+    print('stats', self.dbtree.stats())
+
+
+def get_args():
+  to_flat = False
+  for arg in sys.argv:
+    if arg == '--flat':
+      to_flat = True
+  return to_flat
+
+
+def process():
+  start_time = datetime.datetime.now()
+  print('Start Time', start_time)
+  # ------------------
+  mountpath, _ = defaults.get_src_n_trg_mountpath_args_or_default()
+  to_flat = get_args()
+  converter = DirTreeStorageConverter(mountpath, to_flat)
+  converter.process()
+  finish_time = datetime.datetime.now()
+  elapsed_time = finish_time - start_time
+  # ------------------
+  print('-'*50)
+  print('Finish Time:', finish_time)
+  print('Run Time:', elapsed_time)
+
+
+if __name__ == '__main__':
+  process()
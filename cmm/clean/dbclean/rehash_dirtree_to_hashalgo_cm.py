@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+cmm/clean/dbclean/rehash_dirtree_to_hashalgo_cm.py
+  Moves a dirtree (ie its files_in_tree rows) from one hash algorithm to another, eg from sha1 to blake2b.
+
+First, the dirtree's default_hashalgo (in table tree_settings) is set to the target hashalgo,
+  so that from then on the walker hashes new files with it.
+Then, rows with a different hashalgo are rehashed in id order, at most n_max_files per run
+  (-n=<n_max_files>, 0 means all), so a large dirtree may be moved incrementally, run after run.
+  The script is resumable, an interrupted run just leaves some rows with the older hashalgo.
+
+A row is left as is when its file is missing or its bytesize differs from the db's
+  (the walker and the dbclean scripts should be run first to bring the db up to date).
+
+Notice that, while a dirtree is in transition, the mirror and dedupe scripts only compare
+  rows having the same hashalgo, ie rows not yet rehashed do not match the rehashed ones.
+  Two dirtrees that are to be mirrored should be rehashed to the same hashalgo.
+
+Usage:
+  $rehash_dirtree_to_hashalgo_cm.py <mountpath> [--algo=<hashalgo>] [-n=<n_max_files>] [--io-policy=<policy>]
+
+Example:
+  $rehash_dirtree_to_hashalgo_cm.py "/Science Videos" --algo=blake2b -n=10000 --io-policy=nocache
+"""
+import datetime
+import os
+import sys
+import llib.db.dbdirtree_mod as dbdt
+import llib.db.dbhashcache_mod as dbhc
+import llib.db.dbprofile_mod as dbprof
+import llib.db.dbtreesettings_mod as dbts
+import llib.hashfunctions.hash_mod as hm
+import llib.hashfunctions.hashpool_mod as hpool
+import llib.os.io_policy_mod as iopol
+import default_settings as defaults
+REHASH_TARGET_HASHALGO_DEFAULT = 'blake2b'
+
+
+class DirTreeRehasher:
+
+  def __init__(self, mountpath, hashalgo=None, n_max_files=None, n_hash_workers=None):
+    self.mountpath = mountpath
+    if not os.path.isdir(self.mountpath):
+      error_msg = 'Missing folder error: mountpath (%s) does not exist.' % self.mountpath
+      raise OSError(error_msg)
+    if hashalgo is None:
+      hashalgo = REHASH_TARGET_HASHALGO_DEFAULT
+    _ = hm.get_hashobj_factory(hashalgo)  # raises ValueError for an unknown hashalgo
+    self.hashalgo = hashalgo
+    self.n_max_files = 0 if n_max_files is None else n_max_files
+    self.n_rows_to_rehash = 0
+    self.n_processed_rows = 0
+    self.n_rehashed = 0
+    self.n_missing_files = 0
+    self.n_size_changed = 0
+    self.n_failed_hashes = 0
+    self.n_failed_updates = 0
+    self.dbtree = dbdt.DBDirTree(self.mountpath)
+    self.treesettings = dbts.DBTreeSettings(self.mountpath)
+    self.hashcache = dbhc.DBHashCache(self.mountpath)
+    self.hashpool = hpool.Sha1HashingPool(n_workers=n_hash_workers)
+
+  def count_rows_to_rehash(self):
+    sql = 'SELECT count(*) FROM %(tablename)s WHERE hashalgo != ?;'
+    rows = self.dbtree.do_select_with_sql_n_tuplevalues(sql, (self.hashalgo, ))
+    self.n_rows_to_rehash = rows[0][0] if len(rows) > 0 else 0
+
+  def fetch_rows_to_rehash_after_id(self, last_id):
+    """
+    Rows are taken in id order after last_id, so rows that are left as is are not fetched again
+    """
+    sql = 'SELECT * FROM %(tablename)s WHERE hashalgo != ? AND id > ? ORDER BY id LIMIT %(limit)d;'
+    sql = sql % {'tablename': '%(tablename)s', 'limit': defaults.SQL_SELECT_LIMIT_DEFAULT}
+    return self.dbtree.do_select_with_sql_n_tuplevalues(sql, (self.hashalgo, last_id))
+
+  def form_hashjob_or_none(self, row):
+    idx = self.dbtree.fieldnames.index('name')
+    name = row[idx]
+    idx = self.dbtree.fieldnames.index('parentpath')
+    parentpath = row[idx]
+    idx = self.dbtree.fieldnames.index('bytesize')
+    bytesize = row[idx]
+    filepath = os.path.join(self.mountpath, parentpath.lstrip('/'), name)
+    try:
+      filestat = os.stat(filepath)
+    except OSError:
+      self.n_missing_files += 1
+      print('Missing file', name, '@', parentpath)
+      return None
+    if filestat.st_size != bytesize:
+      self.n_size_changed += 1
+      print('Bytesize changed (walk the dirtree first)', name, '@', parentpath)
+      return None
+    job = hpool.HashJob(
+      filepath, name, parentpath, bytesize, None,
+      st_dev=filestat.st_dev, st_ino=filestat.st_ino, mtime_ns=filestat.st_mtime_ns, hashalgo=self.hashalgo
+    )
+    job.db_id = row[0]
+    job.sha1 = self.hashcache.fetch_sha1_by_filestat_or_none(filestat, self.hashalgo)
+    return job
+
+  def update_row_with_hashed_job(self, job):
+    if job.sha1 is None:
+      self.n_failed_hashes += 1
+      print('Could not hash', job.name, '@', job.parentpath)
+      return False
+    self.hashcache.store_sha1_with_cachekey(job.st_dev, job.st_ino, job.bytesize, job.mtime_ns, job.sha1, job.hashalgo)
+    sql = 'UPDATE %(tablename)s SET sha1=?, hashalgo=? WHERE id=?;'
+    tuplevalues = (job.sha1, job.hashalgo, job.db_id)
+    if not self.dbtree.do_update_with_sql_n_tuplevalues(sql, tuplevalues):
+      self.n_failed_updates += 1
+      return False
+    self.n_rehashed += 1
+    print(self.n_rehashed, '/', self.n_rows_to_rehash, job.hashalgo, job.sha1.hex(), job.name, '@', job.parentpath)
+    return True
+
+  def has_reached_n_max_files(self):
+    return 0 < self.n_max_files <= self.n_processed_rows
+
+  def rehash_rows(self):
+    last_id = 0
+    while not self.has_reached_n_max_files():
+      rows = self.fetch_rows_to_rehash_after_id(last_id)
+      if len(rows) == 0:
+        break
+      for row in rows:
+        if self.has_reached_n_max_files():
+          break
+        last_id = row[0]
+        self.n_processed_rows += 1
+        job = self.form_hashjob_or_none(row)
+        if job is None:
+          continue
+        if job.sha1 is not None:
+          self.update_row_with_hashed_job(job)
+          continue
+        for finished_job in self.hashpool.submit(job):
+          self.update_row_with_hashed_job(finished_job)
+    for job in self.hashpool.drain():
+      self.update_row_with_hashed_job(job)
+    self.hashpool.shutdown()
+
+  def process(self):
+    self.treesettings.set_default_hashalgo(self.hashalgo)
+    self.count_rows_to_rehash()
+    self.rehash_rows()
+    self.report()
+
+  def report(self):
+    print('-'*50)
+    print('mountpath', self.mountpath)
+    print('target hashalgo', self.hashalgo, '| dirtree default_hashalgo', self.treesettings.get_default_hashalgo())
+    print('n_rows_to_rehash (at start)', self.n_rows_to_rehash, '| n_max_files', self.n_max_files or 'all')
+    print('n_processed_rows', self.n_processed_rows)
+    print('n_rehashed', self.n_rehashed)
+    print('n_missing_files', self.n_missing_files)
+    print('n_size_changed', self.n_size_changed)
+    print('n_failed_hashes', self.n_failed_hashes)
+    print('n_failed_updates', self.n_failed_updates)
+    n_remaining = self.n_rows_to_rehash - self.n_rehashed
+    print('n_remaining (rows with another hashalgo)', n_remaining)
+    self.hashpool.report()
+    self.hashcache.report()
+    iopol.get_default_policy().report()
+
+
+def get_args():
+  hashalgo, n_max_files = None, None
+  for arg in sys.argv:
+    if arg.startswith('--algo='):
+      hashalgo = arg[len('--algo='):]
+    elif arg.startswith('-n='):
+      try:
+        n_max_files = int(arg[len('-n='):])
+      except ValueError:
+        pass
+  return hashalgo, n_max_files
+
+
+def process():
+  start_time = datetime.datetime.now()
+  print('Start Time', start_time)
+  # ------------------
+  mountpath, _ = defaults.get_src_n_trg_mountpath_args_or_default()
+  hashalgo, n_max_files = get_args()
+  iopol.set_default_policy_from_args()  # --io-policy=<none|sequential|nocache>
+  dbprof.set_default_profile_from_args()  # --db-profile=<none|safe|bulk-walk|read-only-report>
+  rehasher = DirTreeRehasher(mountpath, hashalgo, n_max_files)
+  rehasher.process()
+  finish_time = datetime.datetime.now()
+  elapsed_time = finish_time - start_time
+  # ------------------
+  print('-'*50)
+  print('Finish Time:', finish_time)
+  print('Run Time:', elapsed_time)
+
+
+if __name__ == '__main__':
+  process()
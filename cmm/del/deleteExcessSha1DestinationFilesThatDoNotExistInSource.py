@@ -8,6 +8,8 @@ Description:
 ===========
 This scripts reads ori and bak db's (*) and takes files by sha1 that exist in bak but don't in ori.
 These files (in bak not in ori) are called here excess files and are listed for deletion upon user confirmation.
+They are the 'excess' rows of a mirror plan (see llib/db/dbmirrorplan_mod.py) built with the two db's attached,
+  ie files are compared by (sha1, hashalgo) and there are no per-sha1 lookups into bak's db.
 
 (*) db-os syncronization, by the user, is pressuposed
 
@@ -26,25 +28,21 @@ $deleteExcessSha1DestinationFilesThatDoNotExistInSource.py "/media/user/disk_sci
 """
 import os.path
 import sys
+import llib.db.dbmirrorplan_mod as dbmp
 import models.entries.dirtree_mod as dt
-import models.entries.dirnode_mod as dn
 import default_settings as defaults
 import llib.dirfilefs.dir_n_file_fs_mod as dirf
 
 
-def print_sha1_set(missing_set, dbtree_opposite, mountpath):
-  for i, sha1 in enumerate(missing_set):
+def print_excess_plan_rows(plan, mountpath):
+  for i, plan_row in enumerate(plan.iter_plan_rows('excess')):
+    dirnode = plan.transform_row_to_trg_dirnode(plan_row)
     print('-' * 70)
-    print(i + 1, sha1.hex() + ' in ' + mountpath)
+    print(i + 1, dirnode.hashalgo, dirnode.sha1.hex() + ' in ' + mountpath)
     print('-' * 70)
-    sql = 'SELECT * FROM %(tablename)s WHERE sha1=?;'
-    tuplevalues = (sha1,)
-    fetched_list = dbtree_opposite.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
-    for row in fetched_list:
-      dirnode = dn.DirNode.create_with_tuplerow(row, dbtree_opposite.fieldnames)
-      filepath = dirnode.get_abspath_with_mountpath(mountpath)
-      print(filepath)
-      print(dirnode)
+    filepath = dirnode.get_abspath_with_mountpath(mountpath)
+    print(filepath)
+    print(dirnode)
 
 
 class FilesMissingFinderBySha1:
@@ -52,7 +50,8 @@ class FilesMissingFinderBySha1:
   def __init__(self, src_mountpath, trg_mountpath):
     self.ori_dt = dt.DirTree('ori', src_mountpath)
     self.bak_dt = dt.DirTree('bak', trg_mountpath)
-    self.sha1_in_bak_missing_in_ori = None
+    self.plan = dbmp.DBMirrorPlan(src_mountpath, trg_mountpath)
+    self.n_files_in_bak_missing_in_ori = 0
     self.total_srcfiles_in_db = 0
     self.total_trgfiles_in_db = 0
     self.total_unique_srcfiles = 0
@@ -81,19 +80,13 @@ class FilesMissingFinderBySha1:
     self.total_trgfiles_in_os = total_files
     self.total_trgdirs_in_os = total_dirs
 
-  @property
-  def total_sha1s_in_bak_missing_in_ori(self):
-    if self.sha1_in_bak_missing_in_ori is None:
-      return 0
-    return len(self.sha1_in_bak_missing_in_ori)
-
   def delete_file(self, dirnode):
     if dirnode is None:
       self.n_failed_deletes += 1
-      print(self.n_failed_deletes, self.total_sha1s_in_bak_missing_in_ori, 'dirnode is None')
+      print(self.n_failed_deletes, self.n_files_in_bak_missing_in_ori, 'dirnode is None')
       return False
     del_trg_filepath = dirnode.get_abspath_with_mountpath(self.bak_dt.mountpath)
-    total_to_del = self.total_sha1s_in_bak_missing_in_ori
+    total_to_del = self.n_files_in_bak_missing_in_ori
     if not os.path.isfile(del_trg_filepath):
       print('cannot delete, trg file does exist', dirnode)
       print(del_trg_filepath)
@@ -108,48 +101,43 @@ class FilesMissingFinderBySha1:
       print('failed copy IOError|OSError', dirnode)
       self.n_failed_deletes += 1
       return False
-    return dirnode.delete_from_db(self.bak_dt.dbtree)
+    return self.bak_dt.dbtree.delete_row(dirnode.get_db_id())  # buffered, see process()
 
   def fetch_n_delete_trg_files(self):
-    sql = 'SELECT * FROM %(tablename)s WHERE sha1=?;'
-    for i, sha1 in enumerate(self.sha1_in_bak_missing_in_ori):
-      tuplevalues = (sha1,)
-      fetched_list = self.bak_dt.dbtree.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
-      for row in fetched_list:
-        dirnode = dn.DirNode.create_with_tuplerow(row, self.bak_dt.dbtree.fieldnames)
-        self.delete_file(dirnode)
+    """
+    The plan's 'excess' rows are the bak files whose (sha1, hashalgo) does not exist in ori
+    """
+    for plan_row in self.plan.iter_plan_rows('excess'):
+      dirnode = self.plan.transform_row_to_trg_dirnode(plan_row)
+      self.delete_file(dirnode)
 
   def confirm_delete(self):
-    print('total_sha1s_in_bak_missing_in_ori', self.total_sha1s_in_bak_missing_in_ori)
+    print('n_files_in_bak_missing_in_ori', self.n_files_in_bak_missing_in_ori)
     screen_msg = 'Confirm the deletes above? (*Y/n) ([ENTER] also means yes) '
     ans = input(screen_msg)
     if ans in ['Y', 'y', '']:
       return True
     return False
 
-  def find_missing_files_in_src_that_exist_in_trg(self, sha1s_ori, sha1s_bak):
-    self.sha1_in_bak_missing_in_ori = set(filter(lambda x: x not in sha1s_ori, sha1s_bak))
-    # sorted(self.sha1_in_bak_missing_in_ori)
-    print_sha1_set(self.sha1_in_bak_missing_in_ori, self.bak_dt.dbtree, self.bak_dt.mountpath)
-
-  def fetch_all_sha1s_in_src_n_trg_n_find_trg_excess(self):
-    sql = 'SELECT DISTINCT sha1 FROM %(tablename)s ORDER BY parentpath;'
-    fetched_list = self.ori_dt.dbtree.do_select_with_sql_without_tuplevalues(sql)
-    sha1s = [tupl[0] for tupl in fetched_list]
-    sha1s_ori = set(sha1s)
-    fetched_list = self.bak_dt.dbtree.do_select_with_sql_without_tuplevalues(sql)
-    sha1s = [tupl[0] for tupl in fetched_list]
-    sha1s_bak = set(sha1s)
+  def find_trg_excess_by_plan(self):
+    """
+    The plan is built with the two dbs attached to one connection (see llib/db/dbmirrorplan_mod.py),
+      files are compared by (sha1, hashalgo), ie a bak file hashed with another hashalgo than ori's is taken as excess
+      (the dirtrees should have the same hashalgo, see cmm/clean/dbclean/rehash_dirtree_to_hashalgo_cm.py)
+    """
     print('ori qtd', self.total_unique_srcfiles)
     print('bak qtd', self.total_unique_trgfiles)
     print('Please wait. Processing finding missing files either in ori or in bak.')
-    self.find_missing_files_in_src_that_exist_in_trg(sha1s_ori, sha1s_bak)
+    self.plan.build_plan()
+    self.n_files_in_bak_missing_in_ori = self.plan.n_actions['excess']
+    print_excess_plan_rows(self.plan, self.bak_dt.mountpath)
 
   def process(self):
-    self.fetch_all_sha1s_in_src_n_trg_n_find_trg_excess()
-    if self.total_sha1s_in_bak_missing_in_ori > 0:
+    self.find_trg_excess_by_plan()
+    if self.n_files_in_bak_missing_in_ori > 0:
       if self.confirm_delete():
-        self.fetch_n_delete_trg_files()
+        with self.bak_dt.dbtree.buffered_writes():
+          self.fetch_n_delete_trg_files()
         self.prune_empty_folders()
     self.report()
 
@@ -174,7 +162,7 @@ class FilesMissingFinderBySha1:
   def report(self):
     print('=_+_+_='*3, 'TrgBasedByrcSha1sMolder Report', '=_+_+_='*3)
     self.print_counters()
-    print('total sha1 in bak missing in ori:', self.total_sha1s_in_bak_missing_in_ori)
+    print('total files in bak missing in ori:', self.n_files_in_bak_missing_in_ori)
     print('n_deletes:', self.n_deletes)
     print('n_failed_deletes:', self.n_failed_deletes)
     print('n_empty_dirs_removed:', self.n_empty_dirs_removed)
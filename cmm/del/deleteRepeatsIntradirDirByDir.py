@@ -5,7 +5,7 @@ DirTreeMirror_PrdPrjSw:
 Description below.
 
 This script does the following:
-  1) it loops with os.walk() all directories;
+  1) it loops with os.scandir() all directories (see scandir_walk_mod, the restricted ones pruned);
   2) per directory, it looks up repeats via db;
   3) repeats inside directories (compared to files with the same directory not elsewhere)
      are marked for deletion if any;
@@ -19,7 +19,7 @@ import models.entries.dirnode_mod as dn
 import default_settings as defaults
 import llib.strnlistfs.strfunctions_mod as strf
 import llib.strnlistfs.listfunctions_mod as listf
-import llib.dirfilefs.dir_n_file_fs_mod as dirf
+import llib.dirfilefs.scandir_walk_mod as scdw
 
 
 class IntraDirRepeatsDeleter:
@@ -41,8 +41,9 @@ class IntraDirRepeatsDeleter:
     self.calc_totals()
 
   def calc_totals(self):
-    tot_osfiles, tot_osdirs = dirf.count_total_files_n_folders_with_restriction(self.ori_dbtree.mountpath)
-    self.total_files_in_os, self.total_dirs_in_os = tot_osfiles, tot_osdirs
+    """
+    The os totals come from the walk itself (see walk_dir_by_by_to_find_repeats())
+    """
     self.total_files_in_db = self.ori_dbtree.count_rows_as_int()
     self.total_sha1s_files_in_db = self.ori_dbtree.count_unique_sha1s_as_int()
 
@@ -77,7 +78,7 @@ class IntraDirRepeatsDeleter:
         strf.put_ellipsis_in_str_middle(dirnode.parentpath, 50), ']'
       )
     self.trg_ids_to_delete_upon_confirm += ids
-    print(self.n_processed_dirs, '/', self.total_dirs_in_os, 'Directory [', self.current_folder_abspath, ']')
+    print(self.n_processed_dirs, 'Directory [', self.current_folder_abspath, ']')
     print('Total accumulated delete items:', len(self.trg_ids_to_delete_upon_confirm))
     return
 
@@ -94,13 +95,13 @@ class IntraDirRepeatsDeleter:
     return self.process_sha1s_in_folder(sha1_dict)
 
   def walk_dir_by_by_to_find_repeats(self):
-    for self.current_folder_abspath, _, _ in os.walk(self.ori_dbtree.mountpath):
-      if self.current_folder_abspath == self.ori_dbtree.mountpath:
-        continue
-      if dirf.is_forbidden_dirpass(self.current_folder_abspath):
+    scandir_walker = scdw.ScandirDirTreeWalker(self.ori_dbtree.mountpath)
+    for self.current_folder_abspath, parentpath, _ in scandir_walker.generate_folders():
+      if parentpath == scdw.ROOT_PARENTPATH:
         continue
       self.n_processed_dirs += 1
       self.process_current_folder_lookingup_inner_repeats()
+    self.total_files_in_os, self.total_dirs_in_os = scandir_walker.get_totals(include_root=False)
 
   def confirm_deletion(self):
     print('Confirm deletion: ids:')
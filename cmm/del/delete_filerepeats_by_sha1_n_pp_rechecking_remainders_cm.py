@@ -20,13 +20,13 @@ Usage:
 Example:
   $delete_filerepeats_by_sha1_n_pp_rechecking_remainders_cm.py "/Science/Physics/Einsteian Relativity"
 """
-# import fs.db.dbrepeats_mod as dbr
 import os.path
 import llib.db.dbdirtree_mod as dbt
+import llib.db.dbrepeats_mod as dbr
 import llib.dirfilefs.dir_n_file_fs_mod as dirf
-import models.entries.dirnode_mod as dn
 import default_settings as defaults
 import llib.hashfunctions.hash_mod as hm
+import llib.os.device_io_scheduler_mod as devsched
 
 
 class FileRepeatsDeleter:
@@ -53,8 +53,8 @@ class FileRepeatsDeleter:
     self.n_found_files_size_n_date_in_db = 0
     self.n_updated_dbentries = 0
     self.n_files_empty_sha1 = 0
-    # self.dbrepeat = dbr.DBRepeat(mountpath)
     self.dbtree = dbt.DBDirTree(mountpath)
+    self.dbrepeat = dbr.DBRepeat(mountpath)
 
   def calc_totals(self):
     """
@@ -86,21 +86,13 @@ class FileRepeatsDeleter:
     return sum(total)
 
   def transpose_sha1s_n_ids_to_sha1_n_dirnodes(self):
-    for sha1 in self.sha1s:
-      sql = 'SELECT * from %(tablename)s where sha1=?;'
-      tuplevalues = (sha1,)
-      rowlist = self.dbtree.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
-      for row in rowlist:
-        dirnode = dn.DirNode.create_with_tuplerow(row, self.dbtree.fieldnames)
-        self.n_processed_files += 1
-        print(self.n_processed_files, self.total_files_in_db, 'transposing', dirnode)
-        try:
-          self.sha1_n_dirnodes_dict[sha1].append(dirnode)
-        except KeyError:
-          self.sha1_n_dirnodes_dict[sha1] = [dirnode]
-    for sha1 in self.sha1s:
-      dirnodes = self.sha1_n_dirnodes_dict[sha1]
-      print(len(dirnodes), sha1.hex())
+    """
+    The dict's keys are (sha1, hashalgo) tuples: content hashes are only comparable within the same hashalgo
+      fetch_repeat_sha1s() has already filled it from the repeats view (see llib/db/dbrepeats_mod.py)
+    """
+    for sha1, hashalgo in self.sha1s:
+      dirnodes = self.sha1_n_dirnodes_dict[(sha1, hashalgo)]
+      print(len(dirnodes), hashalgo, sha1.hex())
     pass
 
   def check_if_dirnode_is_sha1able(self, dirnode):
@@ -112,8 +104,8 @@ class FileRepeatsDeleter:
     if dirnode.bytesize != filestat.st_size:
       # error_msg = 'file size in db %d is diff than in os %d %s' % (dirnode.bytesize, filestat.st_size, filepath)
       return False
-    print('Recalculating sha1')
-    sha1 = hm.calc_sha1_from_file(filepath)
+    print('Recalculating', dirnode.hashalgo)
+    sha1 = devsched.calc_hash_from_file(filepath, dirnode.hashalgo)
     if dirnode.sha1 != sha1:
       # error_msg = 'sha1 recalculated %s is diff than in db %s %s' % (dirnode.sha1.hex(), sha1.hex(), filepath)
       return False
@@ -152,8 +144,8 @@ class FileRepeatsDeleter:
     total_sha1s = len(self.sha1_n_dirnodes_dict)
     remove_sha1s_later = set()
     acc_to_del = 0
-    for i, sha1 in enumerate(self.sha1_n_dirnodes_dict):
-      dirnodes = self.sha1_n_dirnodes_dict[sha1]
+    for i, sha1_n_hashalgo in enumerate(self.sha1_n_dirnodes_dict):
+      dirnodes = self.sha1_n_dirnodes_dict[sha1_n_hashalgo]
       tuplelist_dirnode_n_ppcharsize = []
       for dirnode in dirnodes:
         # fpath is os.path.join(parentpath, name)
@@ -162,7 +154,7 @@ class FileRepeatsDeleter:
         tuplelist_dirnode_n_ppcharsize.append(dirnode_n_ppcharsize_tupl)
       sorted(tuplelist_dirnode_n_ppcharsize, key=lambda e: e[1])
       if len(tuplelist_dirnode_n_ppcharsize) < 2:
-        remove_sha1s_later.add(sha1)
+        remove_sha1s_later.add(sha1_n_hashalgo)
       inner_ids_to_del = []
       while len(tuplelist_dirnode_n_ppcharsize) > 1:
         # the last one is not to be deleted
@@ -176,19 +168,19 @@ class FileRepeatsDeleter:
       if len(inner_ids_to_del) > 0:
         self.dirnodes_to_del += inner_ids_to_del
       else:
-        remove_sha1s_later.add(sha1)
+        remove_sha1s_later.add(sha1_n_hashalgo)
       n_loop = i + 1  # n_loop is also the number of "files to save" (or files to remain)
       len_tuplelist = len(tuplelist_dirnode_n_ppcharsize)
       acc_to_del += len_tuplelist - 1
       print(
-        sha1.hex(),
+        sha1_n_hashalgo[0].hex(),
         'len dirnodes_to_del', len(self.dirnodes_to_del),
         'prep', n_loop, 'tot sha1s', total_sha1s,
         'len ids_n_ppcharsizes', len_tuplelist, 'remains', n_loop, 'to confirm del', acc_to_del
       )
     # lastly remove the sha1s that do not have at least two elements anymore
-    for sha1 in remove_sha1s_later:
-      del self.sha1_n_dirnodes_dict[sha1]
+    for sha1_n_hashalgo in remove_sha1s_later:
+      del self.sha1_n_dirnodes_dict[sha1_n_hashalgo]
 
   def show_totals_to_del(self):
     print('total_dirnodes_in_sha1_dict', self.total_dirnodes_in_sha1_dict)
@@ -210,7 +202,9 @@ class FileRepeatsDeleter:
 
   def fetch_repeat_sha1s(self):
     """
-    First SELECT in here generates a list that shows records starting by sha1s, ordered by sha1.
+    The repeats are streamed from table file_repeats, kept current from files_in_tree by triggers,
+      ie neither a GROUP BY sha1 over the whole dirtree nor a SELECT per sha1 is needed.
+      The groups come the most wasteful first, ie the largest files' repeats are the first ones dealt with.
     It goes like the following example:
     sha1 s1:
       - s1 row1
@@ -221,30 +215,20 @@ class FileRepeatsDeleter:
       - s2 row2 (if more)
       - s2 row etc (if more)
     etc.
-
-    '''
-      SELECT DISTINCT t1.sha1, t2.* FROM %(tablename)s as t1
-        INNER JOIN %(tablename)s as t2
-        WHERE t1.sha1 = t2.sha1
-        ORDER BY t1.sha1
-    '''
     """
-    sql = '''
-    SELECT DISTINCT sha1, count(sha1) as c FROM files_in_tree
-      GROUP BY sha1
-      HAVING count(sha1) > 1;
-    '''
-    rowlist = self.dbtree.do_select_with_sql_without_tuplevalues(sql)
     print('-=+|+=-'*10)
     n_sha1s = 0
-    for row in rowlist:
-      sha1 = row[0]
-      if sha1 == hm.EMPTY_SHA1_AS_BIN:
+    for sha1, hashalgo, counted, _, rows in self.dbrepeat.iter_repeat_groups():
+      if sha1 == hm.get_empty_digest(hashalgo):
         continue
-      counted = row[1]
       n_sha1s += 1
-      print(n_sha1s, 'qtd', counted, '|', sha1.hex())
-      self.sha1s.add(sha1)
+      print(n_sha1s, 'qtd', counted, '|', hashalgo, sha1.hex())
+      self.sha1s.add((sha1, hashalgo))
+      for row in rows:
+        dirnode = self.dbrepeat.transform_row_to_dirnode(row)
+        self.n_processed_files += 1
+        print(self.n_processed_files, self.total_files_in_db, 'transposing', dirnode)
+        self.sha1_n_dirnodes_dict.setdefault((sha1, hashalgo), []).append(dirnode)
     pass
 
   def process(self):
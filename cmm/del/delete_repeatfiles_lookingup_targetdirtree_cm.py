@@ -190,17 +190,18 @@ class ForceDeleterLookingDirUp:
     if not self.bool_del_confirmed:
       return False
     self.n_processed_deletes = 0
-    for _id in self.trg_ids_to_delete_upon_confirm:
-      print(self.n_processed_deletes + 1, 'Deleting id', _id, 'in db and in os.')
-      dirnode = self.ori_dbtree.fetch_dirnode_by_id(_id)
-      file_abspath = dirnode.get_abspath_with_mountpath(self.ori_dbtree.mountpath)
-      if os.path.isfile(file_abspath):
-        print(self.n_trg_os_phys_files_deleted + 1, 'Deleting', file_abspath)
-        os.remove(file_abspath)
-        self.n_trg_os_phys_files_deleted += 1
-      print('Deleting in db', _id, dirnode.name, '@', strf.put_ellipsis_in_str_middle(dirnode.parentpath, 50))
-      _ = self.ori_dbtree.delete_row_by_id(_id)
-      self.n_processed_deletes += 1
+    with self.ori_dbtree.buffered_writes():
+      for _id in self.trg_ids_to_delete_upon_confirm:
+        print(self.n_processed_deletes + 1, 'Deleting id', _id, 'in db and in os.')
+        dirnode = self.ori_dbtree.fetch_dirnode_by_id(_id)
+        file_abspath = dirnode.get_abspath_with_mountpath(self.ori_dbtree.mountpath)
+        if os.path.isfile(file_abspath):
+          print(self.n_trg_os_phys_files_deleted + 1, 'Deleting', file_abspath)
+          os.remove(file_abspath)
+          self.n_trg_os_phys_files_deleted += 1
+        print('Deleting in db', _id, dirnode.name, '@', strf.put_ellipsis_in_str_middle(dirnode.parentpath, 50))
+        _ = self.ori_dbtree.delete_row(_id)
+        self.n_processed_deletes += 1
     print('-'*50)
     print('Deleted altogether', self.n_processed_deletes, 'ids')
     print('-'*50)
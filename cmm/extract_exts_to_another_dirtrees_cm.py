@@ -109,17 +109,16 @@ class FilesByExtToAnotherDirTreeMover:
     return trg_dirnode.dbupdate_new_path_to(src_dirnode, self.bak_dt)
 
   def verify_moving_files_thru_target(self):
-    for rows in self.bak_dt.do_select_all_w_limit_n_offset():
-      for row in rows:
-        trg_dirnode = dn.DirNode.create_with_tuplerow(row, self.bak_dt.fieldnames)
-        inner_sql = 'SELECT * FROM %(tablename)s WHERE sha1=?;'
-        tuplevalues = (trg_dirnode.sha1, )
-        fetched_rows = self.ori_dt.do_select_with_sql_n_tuplevalues(inner_sql, tuplevalues)
-        if len(fetched_rows) > 0:
-          src_row = fetched_rows[0]
-          src_dirnode = dn.DirNode.create_with_tuplerow(src_row, self.bak_dt.fieldnames)
-          if src_dirnode.path != trg_dirnode.path:
-            self.move_file_within_target_using_src_position(src_dirnode, trg_dirnode)
+    for row in self.bak_dt.do_select_rows_by_keyset():
+      trg_dirnode = dn.DirNode.create_with_tuplerow(row, self.bak_dt.fieldnames)
+      inner_sql = 'SELECT * FROM %(tablename)s WHERE sha1=?;'
+      tuplevalues = (trg_dirnode.sha1, )
+      fetched_rows = self.ori_dt.do_select_with_sql_n_tuplevalues(inner_sql, tuplevalues)
+      if len(fetched_rows) > 0:
+        src_row = fetched_rows[0]
+        src_dirnode = dn.DirNode.create_with_tuplerow(src_row, self.bak_dt.fieldnames)
+        if src_dirnode.path != trg_dirnode.path:
+          self.move_file_within_target_using_src_position(src_dirnode, trg_dirnode)
 
   def copy_filepath(self, srcfilepath, trgfilepath):
     """
@@ -307,18 +306,17 @@ class FilesByExtToAnotherDirTreeMover:
 
   def erase_excess_of_src_in_trg(self):
     delete_list = []
-    for bak_rowlist in self.bak_dt.do_select_all_w_limit_n_offset():
-      for trg_row in bak_rowlist:
-        trg_dirnode = dn.DirNode.create_with_tuplerow(trg_row, self.bak_dt.fieldnames)
-        common_middlepath = trg_dirnode.path
-        common_middlepath = common_middlepath.lstrip('/')
-        trg_filepath = os.path.join(self.bak_dt.mount_abspath, common_middlepath)
-        if not os.path.isfile(trg_filepath):
-          continue
-        # if its corresponding source is missing, target-file is in excess
-        src_filepath = os.path.join(self.ori_dt.mount_abspath, common_middlepath)
-        if not os.path.isfile(src_filepath):
-          delete_list.append(trg_filepath)
+    for trg_row in self.bak_dt.do_select_rows_by_keyset():
+      trg_dirnode = dn.DirNode.create_with_tuplerow(trg_row, self.bak_dt.fieldnames)
+      common_middlepath = trg_dirnode.path
+      common_middlepath = common_middlepath.lstrip('/')
+      trg_filepath = os.path.join(self.bak_dt.mount_abspath, common_middlepath)
+      if not os.path.isfile(trg_filepath):
+        continue
+      # if its corresponding source is missing, target-file is in excess
+      src_filepath = os.path.join(self.ori_dt.mount_abspath, common_middlepath)
+      if not os.path.isfile(src_filepath):
+        delete_list.append(trg_filepath)
     if len(delete_list) > 0:
       return self.confirm_delete_list_if_any(delete_list)
     return 0
@@ -12,6 +12,7 @@ import llib.db.dbdirtree_mod as dbdt
 import llib.db.dbfailed_filecopy_mod as dbfailedcopy
 import llib.strnlistfs.strfunctions_mod as strf
 import llib.dirfilefs.dir_n_file_fs_mod as dirf
+import llib.dirfilefs.scandir_walk_mod as scdw
 import default_settings as defaults
 import cmm.mv.move_rename_target_based_on_source_mod as moverename
 
@@ -45,7 +46,7 @@ class FilesByExtToAnotherDirTreeWoSha1Mover:
     self.total_unique_srcfiles = 0
     self.total_unique_trgfiles = 0
     self.fetch_total_unique_files_in_src_n_trg()  # idem
-    self.ongoing_folderpath = None  # assignment for the IDE, variable used the currentpath first return of os.walk()
+    self.ongoing_folderpath = None  # assignment for the IDE, the folder being walked (see move_files_if_ext())
     self.dbfailedcopyreporter = dbfailedcopy.DBFailFileCopyReporter(self.ori_dt.mountpath)
 
   @property
@@ -114,17 +115,16 @@ class FilesByExtToAnotherDirTreeWoSha1Mover:
     return trg_dirnode.dbupdate_new_path_to(src_dirnode, self.bak_dt)
 
   def verify_moving_files_thru_target(self):
-    for rows in self.bak_dt.do_select_all_w_limit_n_offset():
-      for row in rows:
-        trg_dirnode = dn.DirNode.create_with_tuplerow(row, self.bak_dt.fieldnames)
-        inner_sql = 'SELECT * FROM %(tablename)s WHERE sha1=?;'
-        tuplevalues = (trg_dirnode.sha1, )
-        fetched_rows = self.ori_dt.do_select_with_sql_n_tuplevalues(inner_sql, tuplevalues)
-        if len(fetched_rows) > 0:
-          src_row = fetched_rows[0]
-          src_dirnode = dn.DirNode.create_with_tuplerow(src_row, self.bak_dt.fieldnames)
-          if src_dirnode.path != trg_dirnode.path:
-            self.move_file_within_target_using_src_position(src_dirnode, trg_dirnode)
+    for row in self.bak_dt.do_select_rows_by_keyset():
+      trg_dirnode = dn.DirNode.create_with_tuplerow(row, self.bak_dt.fieldnames)
+      inner_sql = 'SELECT * FROM %(tablename)s WHERE sha1=?;'
+      tuplevalues = (trg_dirnode.sha1, )
+      fetched_rows = self.ori_dt.do_select_with_sql_n_tuplevalues(inner_sql, tuplevalues)
+      if len(fetched_rows) > 0:
+        src_row = fetched_rows[0]
+        src_dirnode = dn.DirNode.create_with_tuplerow(src_row, self.bak_dt.fieldnames)
+        if src_dirnode.path != trg_dirnode.path:
+          self.move_file_within_target_using_src_position(src_dirnode, trg_dirnode)
 
   def copy_filepath(self, srcfilepath, trgfilepath):
     """
@@ -279,11 +279,15 @@ class FilesByExtToAnotherDirTreeWoSha1Mover:
     return whereclause, tuplevalues
 
   def move_files_if_ext(self):
-    for self.ongoing_folderpath, dirs, files in os.walk(self.ori_dt.mountpath):
-      if self.ongoing_folderpath == self.ori_dt.mountpath:
-        continue
-      if dirf.is_any_name_in_path_startingwith_any_prefix_in_list(self.ongoing_folderpath):
+    """
+    The source is walked with os.scandir() (see scandir_walk_mod, the restricted dirs pruned),
+      each folder is listed whole before its files are moved
+    """
+    scandir_walker = scdw.ScandirDirTreeWalker(self.ori_dt.mountpath)
+    for self.ongoing_folderpath, parentpath, file_direntries in scandir_walker.generate_folders():
+      if parentpath == scdw.ROOT_PARENTPATH:
         continue
+      files = [direntry.name for direntry in file_direntries]
       filtered_files = dirf.filter_in_files_with_exts(files, self.extensionlist)
       if len(filtered_files) == 0:
         continue
@@ -294,18 +298,17 @@ class FilesByExtToAnotherDirTreeWoSha1Mover:
 
   def erase_excess_of_src_in_trg(self):
     delete_list = []
-    for bak_rowlist in self.bak_dt.do_select_all_w_limit_n_offset():
-      for trg_row in bak_rowlist:
-        trg_dirnode = dn.DirNode.create_with_tuplerow(trg_row, self.bak_dt.fieldnames)
-        common_middlepath = trg_dirnode.path
-        common_middlepath = common_middlepath.lstrip('/')
-        trg_filepath = os.path.join(self.bak_dt.mount_abspath, common_middlepath)
-        if not os.path.isfile(trg_filepath):
-          continue
-        # if its corresponding source is missing, target-file is in excess
-        src_filepath = os.path.join(self.ori_dt.mount_abspath, common_middlepath)
-        if not os.path.isfile(src_filepath):
-          delete_list.append(trg_filepath)
+    for trg_row in self.bak_dt.do_select_rows_by_keyset():
+      trg_dirnode = dn.DirNode.create_with_tuplerow(trg_row, self.bak_dt.fieldnames)
+      common_middlepath = trg_dirnode.path
+      common_middlepath = common_middlepath.lstrip('/')
+      trg_filepath = os.path.join(self.bak_dt.mount_abspath, common_middlepath)
+      if not os.path.isfile(trg_filepath):
+        continue
+      # if its corresponding source is missing, target-file is in excess
+      src_filepath = os.path.join(self.ori_dt.mount_abspath, common_middlepath)
+      if not os.path.isfile(src_filepath):
+        delete_list.append(trg_filepath)
     if len(delete_list) > 0:
       return self.confirm_delete_list_if_any(delete_list)
     return 0
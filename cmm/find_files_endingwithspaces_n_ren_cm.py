@@ -6,6 +6,7 @@ If so, it will rename them in folder and update corresponding entries in db.
 """
 import datetime
 import os
+import llib.dirfilefs.scandir_walk_mod as scdw
 import models.entries.dirtree_mod as dt
 import models.entries.dirnode_mod as dn
 import default_settings as ds
@@ -79,19 +80,14 @@ class FileFinderTreeTraversor:
         self.treat_file_with_endingspaces(row)
 
   def os_traverse_to_count_files(self):
-    self.n_files_in_dirtree = 0
-    is_root_dir = True
-    for _, _, files in os.walk(self.mountpath):
-      if is_root_dir:
-        # ie files are not counted in rootdir
-        is_root_dir = False
-        continue
-      self.n_files_in_dirtree += len(files)
-      self.n_dirs_in_dirtree += len(files)
+    """
+    One scandir pass (no stat per file), files are not counted in rootdir
+    """
+    scandir_walker = scdw.ScandirDirTreeWalker(self.mountpath, restricted_dirnames=[], forbidden_first_level_dirs=[])
+    self.n_files_in_dirtree, self.n_dirs_in_dirtree = scandir_walker.count_files_n_folders(include_root=False)
 
   def db_traverse_to_find_files_endingwithspaces(self):
-    for rowlist in self.dirtree.dbtree.do_select_all_w_limit_n_offset():
-      self.verify_endingspaces_in_names(rowlist)
+    self.verify_endingspaces_in_names(self.dirtree.dbtree.do_select_rows_by_keyset())
 
   def process(self):
     self.os_traverse_to_count_files()
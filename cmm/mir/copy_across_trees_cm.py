@@ -9,6 +9,10 @@ This script does basically three things:
 
 Notice that script [mold_trg_based_on_src_mod.py] also does the two first actions above as a sort of "mold" operation.
 
+The three are taken from a mirror plan (see llib/db/dbmirrorplan_mod.py) built at the start with the two dbs attached,
+  ie there are no per-file lookups into the other db: the moves are its 'misplaced' rows, the copies its 'missing' rows
+  and the excess candidates its 'excess' rows. Repeats (the plan's 'ambiguous' rows) are only reported.
+
 Things this script doesn't do:
   1) this script DOESN'T do removals in source
      (note above that it removes excess files in target under user confirmation);
@@ -25,10 +29,13 @@ Other scripts in this system/app complete the mirroring effect, for example:
 import datetime
 import os.path
 import shutil
-import models.entries.dirnode_mod as dn
 import llib.db.dbdirtree_mod as dbdt
 import llib.db.dbfailed_filecopy_mod as dbfailedcopy
+import llib.db.dbmirrorplan_mod as dbmp
+import llib.db.dbprofile_mod as dbprof
 import llib.hashfunctions.hash_mod as hm
+import llib.os.device_io_scheduler_mod as devsched
+import llib.os.io_policy_mod as iopol
 import llib.strnlistfs.strfunctions_mod as strf
 import default_settings as defaults
 import cmm.mv.move_rename_target_based_on_source_mod as moverename
@@ -40,6 +47,7 @@ class MirrorDirTree:
     self.start_time = datetime.datetime.now()
     self.ori_dt = dbdt.DBDirTree(ori_mountpath)
     self.bak_dt = dbdt.DBDirTree(bak_mountpath)
+    self.plan = dbmp.DBMirrorPlan(ori_mountpath, bak_mountpath)
     self.n_files_processed = 0
     self.total_filerepeats = 0
     self.n_copied_files = 0
@@ -77,7 +85,7 @@ class MirrorDirTree:
     if fetched_list:
       self.total_unique_trgfiles = int(fetched_list[0][0])
 
-  def fetch_row_if_sha1_exists_in_target(self, sha1):
+  def fetch_row_if_sha1_exists_in_target(self, sha1, hashalgo=None):
     """
     Duplicates may exist in which case functionality elsewhere will treat removing excess
 
@@ -89,9 +97,7 @@ class MirrorDirTree:
                 " when it's a UNIQUE fields ie it can only contains one" % sha1
     raise ValueError(error_msg)
     """
-    sql = 'SELECT * FROM %(tablename)s WHERE sha1=?;'
-    tuplevalues = (sha1,)
-    fetched_list = self.bak_dt.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
+    fetched_list = self.bak_dt.fetch_rows_by_sha1_n_hashalgo(sha1, hashalgo)
     return fetched_list
 
   def move_file_within_its_dirtree(self, trg_dirnode_to_move, src_ref_dirnode):
@@ -122,17 +128,13 @@ class MirrorDirTree:
     return trg_dirnode.dbupdate_new_path_to(src_dirnode, self.bak_dt)
 
   def verify_moving_files_thru_target(self):
-    for rows in self.bak_dt.do_select_all_w_limit_n_offset():
-      for row in rows:
-        trg_dirnode = dn.DirNode.create_with_tuplerow(row, self.bak_dt.fieldnames)
-        inner_sql = 'SELECT * FROM %(tablename)s WHERE sha1=?;'
-        tuplevalues = (trg_dirnode.sha1, )
-        fetched_rows = self.ori_dt.do_select_with_sql_n_tuplevalues(inner_sql, tuplevalues)
-        if len(fetched_rows) > 0:
-          src_row = fetched_rows[0]
-          src_dirnode = dn.DirNode.create_with_tuplerow(src_row, self.bak_dt.fieldnames)
-          if src_dirnode.path != trg_dirnode.path:
-            self.move_file_within_target_using_src_position(src_dirnode, trg_dirnode)
+    """
+    The plan's 'misplaced' rows are the files, unique on both sides, that are elsewhere in target
+    """
+    for plan_row in self.plan.iter_plan_rows('misplaced'):
+      src_dirnode = self.plan.transform_row_to_src_dirnode(plan_row)
+      trg_dirnode = self.plan.transform_row_to_trg_dirnode(plan_row)
+      self.move_file_within_target_using_src_position(src_dirnode, trg_dirnode)
 
   def copy_filepath(self, srcfilepath, trgfilepath):
     """
@@ -150,7 +152,7 @@ class MirrorDirTree:
       if not os.path.isfile(trgfilepath):
         self.n_copied_files += 1
         print(self.n_copied_files, 'Copying', trgfilepath)
-        shutil.copy2(srcfilepath, trgfilepath)
+        devsched.copy_file(srcfilepath, trgfilepath)
       else:
         return False
       # if files copied does not exist, set boolean for raising an exception later on
@@ -168,22 +170,20 @@ class MirrorDirTree:
 
   def insert_node_after_copy(self, trg_dirnode, trgfilepath):
     if os.path.isdir(trgfilepath):
-      trg_dirnode.insert_into_db(self.bak_dt)
+      self.bak_dt.add_row_with_dirnode(trg_dirnode)
     else:
       error_msg = 'Runtime Error: Copy of %(trg_dirnode) failed.' % trg_dirnode
       raise ValueError(error_msg)
 
-  def sha1_exists_in_trg_try_move_within_target(self, src_dirnode, trg_row):
+  def sha1_exists_in_trg_try_move_within_target(self, src_dirnode, trg_dirnode):
     """
     If program flow gets here, target-file does not exist in its correspondent position, but exists elsewhere.
     Obs the hashkey for name and parentpath was discontinued in the app/system.
     """
-    if type(trg_row) != tuple or len(trg_row) < len(self.ori_dt.fieldnames) - 1:
+    if trg_dirnode is None:
       return False
-    idx = self.ori_dt.fieldnames.index('parentpath')
-    oldparentpath = trg_row[idx]
-    idx = self.ori_dt.fieldnames.index('name')
-    oldname = trg_row[idx]
+    oldparentpath = trg_dirnode.parentpath
+    oldname = trg_dirnode.name
     old_trg_folderpath = os.path.join(self.bak_dt.mountpath, oldparentpath.lstrip('/'))
     old_trg_filepath = os.path.join(old_trg_folderpath, oldname)
     if not os.path.isfile(old_trg_filepath):
@@ -215,71 +215,85 @@ class MirrorDirTree:
     WHERE
       name=? and
       parentpath=? and
-      sha1=?
+      sha1=? and
+      hashalgo=?
     '''
-    tuplevalues = (newname, newparentpath, oldname, oldparentpath,  src_dirnode.sha1)
+    tuplevalues = (newname, newparentpath, oldname, oldparentpath,  src_dirnode.sha1, src_dirnode.hashalgo)
     return self.bak_dt.do_update_with_sql_n_tuplevalues(sql, tuplevalues)
 
-  def copy_source_files_to_target_if_needed(self, src_rowlist):
+  def is_src_file_backable(self, src_dirnode):
+    if src_dirnode.sha1 == hm.get_empty_digest(src_dirnode.hashalgo):
+      self.n_file_not_backable += 1
+      print('Continuing for next. File not copiable (the zero sha1):', src_dirnode.name)
+      return False
+    if src_dirnode.name.endswith('.part'):
+      self.n_file_not_backable += 1
+      print('Continuing for next. File not copiable (.part extension):', src_dirnode.name)
+      return False
+    if strf.any_dir_in_path_startswith(src_dirnode.parentpath, 'mp3s '):
+      self.n_file_not_backable += 1
+      return False
+    lowercharspath = src_dirnode.parentpath.lower()
+    if lowercharspath.find('z-del') > -1:
+      self.n_file_not_backable += 1
+      print('Continuing for next. [z-del] foldername detected:', src_dirnode.parentpath)
+      return False
+    src_filepath = src_dirnode.get_abspath_with_mountpath(self.ori_dt.mount_abspath)
+    if not os.path.isfile(src_filepath):
+      print(self.n_files_processed, '/', self.total_srcfiles_in_db,
+            'Continuing for next. Source file does not exist (%s) ' % src_filepath)
+      return False
+    return True
+
+  def report_ambiguous_files_by_plan(self):
     """
-    TO-DO: create a constant-list that contains the index-position of fields in a centralized way
-      0 id | 1 hkey | 2 name | 3 parentpath | 4 is_present | 5 sha1 | 6 bytesize | 7 mdatetime
+    The plan's 'ambiguous' rows are the (sha1, hashalgo)'s that repeat and are not all in place,
+      the script does not copy or move them (in thesis, they must be solved before this point and none left here)
     """
-    for src_row in src_rowlist:
+    idx_n_src, idx_n_trg = self.plan.fieldnames.index('n_src'), self.plan.fieldnames.index('n_trg')
+    for plan_row in self.plan.iter_plan_rows('ambiguous'):
       self.n_files_processed += 1
-      src_dirnode = dn.DirNode.create_with_tuplerow(src_row, self.ori_dt.fieldnames)
-      print(self.n_files_processed, 'verifying copy/move for', src_row)
-      # if src has repeats, it should not copy or move files, because repeats are ambiguity
-      # (in thesis, they must be solved before this point and none left here)
-      sql = 'SELECT count(id) FROM %(tablename)s WHERE sha1=?;'
-      tuplevalues = (src_dirnode.sha1, )
-      fetched_list = self.ori_dt.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
-      if fetched_list:
-        n_of_filerepeats = int(fetched_list[0][0])
-        self.total_filerepeats += n_of_filerepeats
-        if n_of_filerepeats > 1:
-          print(
-            self.n_files_processed, '/', self.total_srcfiles_in_db,
-            'Ambiguity: script cannot copy or move with repeats =', n_of_filerepeats,
-            ' for', src_dirnode.name, 'in dir:', src_dirnode.parentpath, 'Continuing.'
-          )
-          continue
-      if src_dirnode.sha1 == hm.EMPTY_SHA1_AS_BIN:
-        self.n_file_not_backable += 1
-        print('Continuing for next. File not copiable (the zero sha1):', src_dirnode.name)
-        continue
-      if src_dirnode.name.endswith('.part'):
-        self.n_file_not_backable += 1
-        print('Continuing for next. File not copiable (.part extension):', src_dirnode.name)
-        continue
-      if strf.any_dir_in_path_startswith(src_dirnode.parentpath, 'mp3s '):
-        self.n_file_not_backable += 1
+      src_dirnode = self.plan.transform_row_to_src_dirnode(plan_row)
+      n_of_filerepeats = plan_row[idx_n_src]
+      self.total_filerepeats += n_of_filerepeats
+      print(
+        self.n_files_processed, '/', self.total_srcfiles_in_db,
+        'Ambiguity: script cannot copy or move with repeats =', n_of_filerepeats, '| in target =', plan_row[idx_n_trg],
+        ' for', src_dirnode.name, 'in dir:', src_dirnode.parentpath, 'Continuing.'
+      )
+
+  def move_misplaced_files_by_plan(self):
+    """
+    The plan's 'misplaced' rows are the files, unique on both sides, that are elsewhere in target
+    """
+    for plan_row in self.plan.iter_plan_rows('misplaced'):
+      self.n_files_processed += 1
+      src_dirnode = self.plan.transform_row_to_src_dirnode(plan_row)
+      print(self.n_files_processed, 'verifying move for', src_dirnode.name, '@', src_dirnode.parentpath)
+      if not self.is_src_file_backable(src_dirnode):
         continue
-      lowercharspath = src_dirnode.parentpath.lower()
-      if lowercharspath.find('z-del') > -1:
-        self.n_file_not_backable += 1
-        print('Continuing for next. [z-del] foldername detected:', src_dirnode.parentpath)
+      trg_dirnode = self.plan.transform_row_to_trg_dirnode(plan_row)
+      _ = self.sha1_exists_in_trg_try_move_within_target(src_dirnode, trg_dirnode)
+
+  def copy_missing_files_by_plan(self):
+    """
+    The plan's 'missing' rows are the source files whose (sha1, hashalgo) does not exist in target
+    """
+    for plan_row in self.plan.iter_plan_rows('missing'):
+      self.n_files_processed += 1
+      src_dirnode = self.plan.transform_row_to_src_dirnode(plan_row)
+      print(self.n_files_processed, 'verifying copy for', src_dirnode.name, '@', src_dirnode.parentpath)
+      if not self.is_src_file_backable(src_dirnode):
         continue
       src_filepath = src_dirnode.get_abspath_with_mountpath(self.ori_dt.mount_abspath)
-      if not os.path.isfile(src_filepath):
-        print(self.n_files_processed, '/', self.total_srcfiles_in_db,
-              'Continuing for next. Source file does not exist (%s) ' % src_filepath)
-        continue
-      trg_dirnode = dn.DirNode.create_with_tuplerow(src_row, self.ori_dt.fieldnames)
-      trg_filepath = trg_dirnode.get_abspath_with_mountpath(self.bak_dt.mount_abspath)
+      trg_filepath = src_dirnode.get_abspath_with_mountpath(self.bak_dt.mount_abspath)
       if os.path.isfile(trg_filepath):
         print(self.n_files_processed, '/', self.total_srcfiles_in_db,
               'Continuing for next. Target file exists (%s) ' % src_filepath)
         continue
-      trg_rows = self.fetch_row_if_sha1_exists_in_target(src_dirnode.sha1)
-      if trg_rows is not None and len(trg_rows) > 0:
-        print('sha1 of target file exists. Check if a move is appropriate/possible.')
-        trg_row = trg_rows[0]
-        _ = self.sha1_exists_in_trg_try_move_within_target(src_dirnode, trg_row)
-        continue
       bool_copied = self.copy_filepath(src_filepath, trg_filepath)
       if bool_copied:
-        return trg_dirnode.insert_into_db(self.bak_dt)
+        self.bak_dt.add_row_with_dirnode(src_dirnode)
       else:
         self.report_failed_copy(src_dirnode)
 
@@ -296,23 +310,27 @@ class MirrorDirTree:
     moverenamer.process()
 
   def mirror_by_copying_across_dirtrees(self):
-    for i, src_rowlist in enumerate(self.ori_dt.do_select_all_w_limit_n_offset()):
-      self.copy_source_files_to_target_if_needed(src_rowlist)
+    self.report_ambiguous_files_by_plan()
+    self.move_misplaced_files_by_plan()
+    self.copy_missing_files_by_plan()
 
   def erase_excess_of_src_in_trg(self):
+    """
+    The plan's 'excess' rows are the target files whose (sha1, hashalgo) does not exist in source,
+      of these the ones whose path exists in source are kept (their content differs, they are not deleted here)
+    """
     delete_list = []
-    for bak_rowlist in self.bak_dt.do_select_all_w_limit_n_offset():
-      for trg_row in bak_rowlist:
-        trg_dirnode = dn.DirNode.create_with_tuplerow(trg_row, self.bak_dt.fieldnames)
-        common_middlepath = trg_dirnode.path
-        common_middlepath = common_middlepath.lstrip('/')
-        trg_filepath = os.path.join(self.bak_dt.mount_abspath, common_middlepath)
-        if not os.path.isfile(trg_filepath):
-          continue
-        # if its corresponding source is missing, target-file is in excess
-        src_filepath = os.path.join(self.ori_dt.mount_abspath, common_middlepath)
-        if not os.path.isfile(src_filepath):
-          delete_list.append(trg_filepath)
+    for plan_row in self.plan.iter_plan_rows('excess'):
+      trg_dirnode = self.plan.transform_row_to_trg_dirnode(plan_row)
+      common_middlepath = trg_dirnode.path
+      common_middlepath = common_middlepath.lstrip('/')
+      trg_filepath = os.path.join(self.bak_dt.mount_abspath, common_middlepath)
+      if not os.path.isfile(trg_filepath):
+        continue
+      # if its corresponding source is missing, target-file is in excess
+      src_filepath = os.path.join(self.ori_dt.mount_abspath, common_middlepath)
+      if not os.path.isfile(src_filepath):
+        delete_list.append(trg_filepath)
     if len(delete_list) > 0:
       return self.confirm_delete_list_if_any(delete_list)
     return 0
@@ -345,10 +363,15 @@ class MirrorDirTree:
     self.fetch_total_files_in_src_n_trg()
     self.fetch_total_unique_files_in_src_n_trg()
     print('-'*70)
-    self.mirror_by_copying_across_dirtrees()
-    print('After mirroring source to target, erase excess in target')
-    print('-'*70)
-    self.erase_excess_of_src_in_trg()
+    print('Planning the mirroring (source db attached to target db)')
+    self.plan.build_plan()
+    self.plan.report()
+    # the target's db-writes are committed in batches (see DBDirTree.buffered_writes())
+    with self.bak_dt.buffered_writes():
+      self.mirror_by_copying_across_dirtrees()
+      print('After mirroring source to target, erase excess in target')
+      print('-'*70)
+      self.erase_excess_of_src_in_trg()
     self.report()
 
   def report(self):
@@ -381,6 +404,8 @@ def process():
   """
   """
   src_mountpath, trg_mountpath = defaults.get_src_n_trg_mountpath_args_or_default()
+  iopol.set_default_policy_from_args()  # --io-policy=<none|sequential|nocache>
+  dbprof.set_default_profile_from_args()  # --db-profile=<none|safe|bulk-walk|read-only-report>
   mirror = MirrorDirTree(src_mountpath, trg_mountpath)
   mirror.process()
 
@@ -4,24 +4,24 @@
 """
 import copy
 import os.path
-import shutil
+import llib.db.dbmirrorplan_mod as dbmp
+import llib.db.dbprofile_mod as dbprof
 import models.entries.dirtree_mod as dt
-import models.entries.dirnode_mod as dn
 import default_settings as defaults
 import llib.dirfilefs.dir_n_file_fs_mod as dirf
+import llib.os.device_io_scheduler_mod as devsched
+import llib.os.io_policy_mod as iopol
 
 
-def print_sha1_set(missing_set, dbtree_opposite, direction_str):
-  for i, sha1 in enumerate(missing_set):
+def print_plan_rows(plan, action, direction_str):
+  for i, plan_row in enumerate(plan.iter_plan_rows(action)):
+    dirnode = plan.transform_row_to_src_dirnode(plan_row)
+    if dirnode is None:
+      dirnode = plan.transform_row_to_trg_dirnode(plan_row)
     print('-' * 70)
-    print(i + 1, sha1.hex() + ' ' + direction_str)
+    print(i + 1, dirnode.hashalgo, dirnode.sha1.hex() + ' ' + direction_str)
     print('-' * 70)
-    sql = 'select * from %(tablename)s where sha1=?;'
-    tuplevalues = (sha1,)
-    fetched_list = dbtree_opposite.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
-    for row in fetched_list:
-      dirnode = dn.DirNode.create_with_tuplerow(row, dbtree_opposite.fieldnames)
-      print(dirnode)
+    print(dirnode)
 
 
 class FilesMissingFinderBySha1:
@@ -29,8 +29,9 @@ class FilesMissingFinderBySha1:
   def __init__(self, src_mountpath, trg_mountpath):
     self.ori_dt = dt.DirTree('ori', src_mountpath)
     self.bak_dt = dt.DirTree('bak', trg_mountpath)
-    self.sha1_in_bak_missing_in_ori = None
-    self.sha1_in_ori_missing_in_bak = None
+    self.plan = dbmp.DBMirrorPlan(src_mountpath, trg_mountpath)
+    self.n_files_in_bak_missing_in_ori = 0
+    self.n_files_in_ori_missing_in_bak = 0
     self.total_srcfiles_in_db = 0
     self.total_trgfiles_in_db = 0
     self.total_unique_srcfiles = 0
@@ -65,7 +66,7 @@ class FilesMissingFinderBySha1:
       return False
     to_be_trg_dirnode = copy.copy(dirnode)
     trg_filepath = to_be_trg_dirnode.get_abspath_with_mountpath(to_dirtree.mountpath)
-    if not os.path.isfile(src_filepath):
+    if os.path.isfile(trg_filepath):
       print('cannot copy, trg file exists', dirnode)
       return False
     try:
@@ -74,7 +75,7 @@ class FilesMissingFinderBySha1:
         print('Creating missing directory', p)
         os.makedirs(p)
       print('Initiating copy of', filename)
-      shutil.copy2(src_filepath, trg_filepath)
+      devsched.copy_file(src_filepath, trg_filepath)
       self.n_copied_files += 1
       print(self.n_copied_files, '/', total_to_copy, 'COPIED')
       print('FROM', src_filepath)
@@ -83,73 +84,50 @@ class FilesMissingFinderBySha1:
       print('failed copy IOError|OSError', dirnode)
       self.n_failed_copies += 1
       return False
-    return to_be_trg_dirnode.insert_into_db(to_dirtree.dbtree)
+    return to_dirtree.dbtree.add_row_with_dirnode(to_be_trg_dirnode)
 
   def copy_over_missing_either_way(self):
-    sql = 'select * from %(tablename)s where sha1=?;'
-    for i, sha1 in enumerate(self.sha1_in_bak_missing_in_ori):
-      tuplevalues = (sha1,)
-      fetched_list = self.bak_dt.dbtree.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
-      for row in fetched_list:
-        dirnode = dn.DirNode.create_with_tuplerow(row, self.bak_dt.dbtree.fieldnames)
-        total_to_copy = self.total_sha1s_in_bak_missing_in_ori
-        self.copy_over(dirnode, self.bak_dt, self.ori_dt, total_to_copy)
-    for i, sha1 in enumerate(self.sha1_in_ori_missing_in_bak):
-      tuplevalues = (sha1,)
-      fetched_list = self.ori_dt.dbtree.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
-      for row in fetched_list:
-        dirnode = dn.DirNode.create_with_tuplerow(row, self.ori_dt.dbtree.fieldnames)
-        print(dirnode)
-        total_to_copy = self.total_sha1s_in_bak_missing_in_ori
-        self.copy_over(dirnode, self.ori_dt, self.bak_dt, total_to_copy)
-
-  @property
-  def total_sha1s_in_ori_missing_in_bak(self):
-    if self.sha1_in_ori_missing_in_bak is None:
-      return 0
-    return len(self.sha1_in_ori_missing_in_bak)
-
-  @property
-  def total_sha1s_in_bak_missing_in_ori(self):
-    if self.sha1_in_bak_missing_in_ori is None:
-      return 0
-    return len(self.sha1_in_bak_missing_in_ori)
+    """
+    The plan's 'excess' rows are the bak files missing in ori and its 'missing' rows the ori files missing in bak
+    """
+    for plan_row in self.plan.iter_plan_rows('excess'):
+      dirnode = self.plan.transform_row_to_trg_dirnode(plan_row)
+      self.copy_over(dirnode, self.bak_dt, self.ori_dt, self.n_files_in_bak_missing_in_ori)
+    for plan_row in self.plan.iter_plan_rows('missing'):
+      dirnode = self.plan.transform_row_to_src_dirnode(plan_row)
+      print(dirnode)
+      self.copy_over(dirnode, self.ori_dt, self.bak_dt, self.n_files_in_ori_missing_in_bak)
 
   def confirm_copy(self):
-    print('ori to bak number of copies', self.total_sha1s_in_ori_missing_in_bak)
-    print('bak to ori number of copies', self.total_sha1s_in_bak_missing_in_ori)
+    print('ori to bak number of copies', self.n_files_in_ori_missing_in_bak)
+    print('bak to ori number of copies', self.n_files_in_bak_missing_in_ori)
     screen_msg = 'Confirm the copies above? (*Y/n) ([ENTER] also means yes) '
     ans = input(screen_msg)
     if ans in ['Y', 'y', '']:
       return True
     return False
 
-  def find_missing_files_either_way(self, sha1s_ori, sha1s_bak):
-    self.sha1_in_bak_missing_in_ori = set(filter(lambda x: x not in sha1s_ori, sha1s_bak))
-    direction_str = 'present in bak, missing in ori'
-    print_sha1_set(self.sha1_in_bak_missing_in_ori, self.bak_dt.dbtree, direction_str)
-    self.sha1_in_ori_missing_in_bak = set(filter(lambda x: x not in sha1s_bak, sha1s_ori))
-    direction_str = 'present in ori, missing in bak'
-    print_sha1_set(self.sha1_in_ori_missing_in_bak, self.ori_dt.dbtree, direction_str)
-
-  def find_sha1s_missing_either_way(self):
-    sql = 'select DISTINCT sha1 from %(tablename)s;'
-    fetched_list = self.ori_dt.dbtree.do_select_with_sql_without_tuplevalues(sql)
-    sha1s = [tupl[0] for tupl in fetched_list]
-    sha1s_ori = set(sha1s)
-    fetched_list = self.bak_dt.dbtree.do_select_with_sql_without_tuplevalues(sql)
-    sha1s = [tupl[0] for tupl in fetched_list]
-    sha1s_bak = set(sha1s)
+  def find_missing_files_either_way(self):
+    """
+    The plan is built with the two dbs attached to one connection (see llib/db/dbmirrorplan_mod.py),
+      files are compared by (sha1, hashalgo): a content hash is only comparable with one of the same hashalgo
+      (the dirtrees should have the same hashalgo, see cmm/clean/dbclean/rehash_dirtree_to_hashalgo_cm.py)
+    """
     print('ori qtd', self.total_unique_srcfiles)
     print('bak qtd', self.total_unique_trgfiles)
     print('Please wait. Processing finding missing files either in ori or in bak.')
-    self.find_missing_files_either_way(sha1s_ori, sha1s_bak)
+    self.plan.build_plan()
+    self.n_files_in_bak_missing_in_ori = self.plan.n_actions['excess']
+    self.n_files_in_ori_missing_in_bak = self.plan.n_actions['missing']
+    print_plan_rows(self.plan, 'excess', 'present in bak, missing in ori')
+    print_plan_rows(self.plan, 'missing', 'present in ori, missing in bak')
 
   def process(self):
-    self.find_sha1s_missing_either_way()
-    if self.total_sha1s_in_bak_missing_in_ori > 0 or self.total_sha1s_in_ori_missing_in_bak > 0:
+    self.find_missing_files_either_way()
+    if self.n_files_in_bak_missing_in_ori > 0 or self.n_files_in_ori_missing_in_bak > 0:
       if self.confirm_copy():
-        self.copy_over_missing_either_way()
+        with self.ori_dt.dbtree.buffered_writes(), self.bak_dt.dbtree.buffered_writes():
+          self.copy_over_missing_either_way()
     self.report()
 
   def print_counters(self):
@@ -165,8 +143,8 @@ class FilesMissingFinderBySha1:
   def report(self):
     print('=_+_+_='*3, 'TrgBasedByrcSha1sMolder Report', '=_+_+_='*3)
     self.print_counters()
-    print('total sha1 in ori missing in bak:', self.total_sha1s_in_ori_missing_in_bak)
-    print('total sha1 in bak missing in ori:', self.total_sha1s_in_bak_missing_in_ori)
+    print('total files in ori missing in bak:', self.n_files_in_ori_missing_in_bak)
+    print('total files in bak missing in ori:', self.n_files_in_bak_missing_in_ori)
     print('n_copied_files:', self.n_copied_files)
     print('n_failed_copies:', self.n_failed_copies)
 
@@ -175,6 +153,8 @@ def process():
   """
   """
   src_mountpath, trg_mountpath = defaults.get_src_n_trg_mountpath_args_or_default()
+  iopol.set_default_policy_from_args()  # --io-policy=<none|sequential|nocache>
+  dbprof.set_default_profile_from_args()  # --db-profile=<none|safe|bulk-walk|read-only-report>
   finder = FilesMissingFinderBySha1(src_mountpath, trg_mountpath)
   finder.process()
 
@@ -7,6 +7,10 @@ This script does basically three things:
   2) it copies to the target-tree missing files that exists in the source-tree;
   3) it deletes under confirmation excess files in target, ie files that exist in target but do not in source;
 
+The copies (in each direction) are taken from a mirror plan (see llib/db/dbmirrorplan_mod.py) built with
+  the two dbs attached, ie there are no per-file sha1 lookups into the other db: the copies are its 'missing' rows
+  and the moves its 'misplaced' rows; repeats (its 'ambiguous' rows) are only reported.
+
 Things this script doesn't do:
   1) this script DOESN'T do removals in source (note above that it removes under confirmation excess files in target);
   2) this script DOESN'T do the inverse of the three operations above;
@@ -22,10 +26,13 @@ import datetime
 import os.path
 import shutil
 import sys
-import models.entries.dirnode_mod as dn
 import llib.db.dbdirtree_mod as dbdt
 import llib.db.dbfailed_filecopy_mod as dbfailedcopy
+import llib.db.dbmirrorplan_mod as dbmp
+import llib.db.dbprofile_mod as dbprof
 import llib.hashfunctions.hash_mod as hm
+import llib.os.device_io_scheduler_mod as devsched
+import llib.os.io_policy_mod as iopol
 import llib.strnlistfs.strfunctions_mod as strf
 import llib.dirfilefs.dir_n_file_fs_mod as dirf
 import default_settings as defaults
@@ -38,6 +45,7 @@ class DoubleDirectionCopier:
     self.start_time = datetime.datetime.now()
     self.ori_dt = dbdt.DBDirTree(ori_mountpath)
     self.bak_dt = dbdt.DBDirTree(bak_mountpath)
+    self.plan = dbmp.DBMirrorPlan(ori_mountpath, bak_mountpath)
     self.restart_at = restart_at
     self.n_files_processed = 0
     self.n_copied_files = 0
@@ -76,7 +84,7 @@ class DoubleDirectionCopier:
     if fetched_list:
       self.total_unique_trgfiles = int(fetched_list[0][0])
 
-  def fetch_row_if_sha1_exists_in_target(self, sha1):
+  def fetch_row_if_sha1_exists_in_target(self, sha1, hashalgo=None):
     """
     Duplicates may exist in which case functionality elsewhere will treat removing excess
 
@@ -88,9 +96,7 @@ class DoubleDirectionCopier:
                 " when it's a UNIQUE fields ie it can only contains one" % sha1
     raise ValueError(error_msg)
     """
-    sql = 'SELECT * FROM %(tablename)s WHERE sha1=?;'
-    tuplevalues = (sha1,)
-    fetched_list = self.bak_dt.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
+    fetched_list = self.bak_dt.fetch_rows_by_sha1_n_hashalgo(sha1, hashalgo)
     return fetched_list
 
   def move_file_within_its_dirtree(self, trg_dirnode_to_move, src_ref_dirnode):
@@ -121,17 +127,13 @@ class DoubleDirectionCopier:
     return trg_dirnode.dbupdate_new_path_to(src_dirnode, self.bak_dt)
 
   def verify_moving_files_thru_target(self):
-    for rows in self.bak_dt.do_select_all_w_limit_n_offset():
-      for row in rows:
-        trg_dirnode = dn.DirNode.create_with_tuplerow(row, self.bak_dt.fieldnames)
-        inner_sql = 'SELECT * FROM %(tablename)s WHERE sha1=?;'
-        tuplevalues = (trg_dirnode.sha1, )
-        fetched_rows = self.ori_dt.do_select_with_sql_n_tuplevalues(inner_sql, tuplevalues)
-        if len(fetched_rows) > 0:
-          src_row = fetched_rows[0]
-          src_dirnode = dn.DirNode.create_with_tuplerow(src_row, self.bak_dt.fieldnames)
-          if src_dirnode.path != trg_dirnode.path:
-            self.move_file_within_target_using_src_position(src_dirnode, trg_dirnode)
+    """
+    The plan's 'misplaced' rows are the files, unique on both sides, that are elsewhere in target
+    """
+    for plan_row in self.plan.iter_plan_rows('misplaced'):
+      src_dirnode = self.plan.transform_row_to_src_dirnode(plan_row)
+      trg_dirnode = self.plan.transform_row_to_trg_dirnode(plan_row)
+      self.move_file_within_target_using_src_position(src_dirnode, trg_dirnode)
 
   def copy_filepath(self, srcfilepath, trgfilepath):
     """
@@ -149,7 +151,7 @@ class DoubleDirectionCopier:
       if not os.path.isfile(trgfilepath):
         self.n_copied_files += 1
         print(self.n_copied_files, 'Copying', trgfilepath)
-        shutil.copy2(srcfilepath, trgfilepath)
+        devsched.copy_file(srcfilepath, trgfilepath)
       else:
         return False
       # if files copied does not exist, set boolean for raising an exception later on
@@ -172,17 +174,15 @@ class DoubleDirectionCopier:
       error_msg = 'Runtime Error: Copy of %(trg_dirnode) failed.' % trg_dirnode
       raise ValueError(error_msg)
 
-  def sha1_exists_in_trg_try_move_within_target(self, src_dirnode, trg_row):
+  def sha1_exists_in_trg_try_move_within_target(self, src_dirnode, trg_dirnode):
     """
     If program flow gets here, target-file does not exist in its correspondent position, but exists elsewhere.
     Obs the hashkey for name and parentpath was discontinued in the app/system.
     """
-    if type(trg_row) != tuple or len(trg_row) < len(self.ori_dt.fieldnames) - 1:
+    if trg_dirnode is None:
       return False
-    idx = self.ori_dt.fieldnames.index('parentpath')
-    oldparentpath = trg_row[idx]
-    idx = self.ori_dt.fieldnames.index('name')
-    oldname = trg_row[idx]
+    oldparentpath = trg_dirnode.parentpath
+    oldname = trg_dirnode.name
     old_trg_folderpath = os.path.join(self.bak_dt.mountpath, oldparentpath.lstrip('/'))
     old_trg_filepath = os.path.join(old_trg_folderpath, oldname)
     if not os.path.isfile(old_trg_filepath):
@@ -214,70 +214,86 @@ class DoubleDirectionCopier:
     WHERE
       name=? and
       parentpath=? and
-      sha1=?
+      sha1=? and
+      hashalgo=?
     '''
-    tuplevalues = (newname, newparentpath, oldname, oldparentpath,  src_dirnode.sha1)
+    tuplevalues = (newname, newparentpath, oldname, oldparentpath,  src_dirnode.sha1, src_dirnode.hashalgo)
     return self.bak_dt.do_update_with_sql_n_tuplevalues(sql, tuplevalues)
 
-  def copy_source_files_to_target_if_needed(self, src_rowlist):
+  def is_src_file_backable(self, src_dirnode):
+    if src_dirnode.sha1 == hm.get_empty_digest(src_dirnode.hashalgo):
+      self.n_file_not_backable += 1
+      print('Continuing for next. File not copiable (the zero sha1):', src_dirnode.name)
+      return False
+    if src_dirnode.name.endswith('.part'):
+      self.n_file_not_backable += 1
+      print('Continuing for next. File not copiable (.part extension):', src_dirnode.name)
+      return False
+    if strf.any_dir_in_path_startswith(src_dirnode.parentpath, 'mp3s '):
+      self.n_file_not_backable += 1
+      return False
+    lowercharspath = src_dirnode.parentpath.lower()
+    if lowercharspath.find('z-del') > -1:
+      self.n_file_not_backable += 1
+      print('Continuing for next. [z-del] foldername detected:', src_dirnode.parentpath)
+      return False
+    src_filepath = src_dirnode.get_abspath_with_mountpath(self.ori_dt.mount_abspath)
+    if not os.path.isfile(src_filepath):
+      print(self.n_files_processed, '/', self.total_srcfiles_in_db,
+            'Continuing for next. Source file does not exist (%s) ' % src_filepath)
+      return False
+    return True
+
+  def report_ambiguous_files_by_plan(self):
     """
-    TO-DO: create a constant-list that contains the index-position of fields in a centralized way
-      0 id | 1 hkey | 2 name | 3 parentpath | 4 is_present | 5 sha1 | 6 bytesize | 7 mdatetime
+    The plan's 'ambiguous' rows are the (sha1, hashalgo)'s that repeat and are not all in place,
+      the script does not copy or move them (in thesis, they must be solved before this point and none left here)
     """
-    for src_row in src_rowlist:
+    idx_n_src, idx_n_trg = self.plan.fieldnames.index('n_src'), self.plan.fieldnames.index('n_trg')
+    for plan_row in self.plan.iter_plan_rows('ambiguous'):
       self.n_files_processed += 1
-      src_dirnode = dn.DirNode.create_with_tuplerow(src_row, self.ori_dt.fieldnames)
-      print(self.n_files_processed, 'verifying copy/move for', src_row)
-      # if src has repeats, it should not copy or move files, because repeats are ambiguity
-      # (in thesis, they must be solved before this point and none left here)
-      sql = 'SELECT count(id) FROM %(tablename)s WHERE sha1=?;'
-      tuplevalues = (src_dirnode.sha1, )
-      fetched_list = self.ori_dt.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
-      if fetched_list:
-        n_of_filerepeats = int(fetched_list[0][0])
-        if n_of_filerepeats > 1:
-          print(
-            self.n_files_processed, '/', self.total_srcfiles_in_db,
-            'Ambiguity: script cannot copy or move with repeats =', n_of_filerepeats,
-            ' for', src_dirnode.name, 'in dir:', src_dirnode.parentpath, 'Continuing.'
-          )
-          continue
-      if src_dirnode.sha1 == hm.EMPTY_SHA1_AS_BIN:
-        self.n_file_not_backable += 1
-        print('Continuing for next. File not copiable (the zero sha1):', src_dirnode.name)
-        continue
-      if src_dirnode.name.endswith('.part'):
-        self.n_file_not_backable += 1
-        print('Continuing for next. File not copiable (.part extension):', src_dirnode.name)
-        continue
-      if strf.any_dir_in_path_startswith(src_dirnode.parentpath, 'mp3s '):
-        self.n_file_not_backable += 1
+      src_dirnode = self.plan.transform_row_to_src_dirnode(plan_row)
+      print(
+        self.n_files_processed, '/', self.total_srcfiles_in_db,
+        'Ambiguity: script cannot copy or move with repeats =', plan_row[idx_n_src], '| in target =', plan_row[idx_n_trg],
+        ' for', src_dirnode.name, 'in dir:', src_dirnode.parentpath, 'Continuing.'
+      )
+
+  def move_misplaced_files_by_plan(self):
+    """
+    The plan's 'misplaced' rows are the files, unique on both sides, that are elsewhere in target
+    """
+    for plan_row in self.plan.iter_plan_rows('misplaced'):
+      self.n_files_processed += 1
+      src_dirnode = self.plan.transform_row_to_src_dirnode(plan_row)
+      print(self.n_files_processed, 'verifying move for', src_dirnode.name, '@', src_dirnode.parentpath)
+      if not self.is_src_file_backable(src_dirnode):
         continue
-      lowercharspath = src_dirnode.parentpath.lower()
-      if lowercharspath.find('z-del') > -1:
-        self.n_file_not_backable += 1
-        print('Continuing for next. [z-del] foldername detected:', src_dirnode.parentpath)
+      trg_dirnode = self.plan.transform_row_to_trg_dirnode(plan_row)
+      _ = self.sha1_exists_in_trg_try_move_within_target(src_dirnode, trg_dirnode)
+
+  def copy_source_files_to_target_if_needed(self):
+    """
+    Moves the plan's 'misplaced' files and copies its 'missing' ones (the source files whose (sha1, hashalgo)
+      does not exist in target), the plan is expected to be built (see DBMirrorPlan.build_plan())
+    """
+    self.report_ambiguous_files_by_plan()
+    self.move_misplaced_files_by_plan()
+    for plan_row in self.plan.iter_plan_rows('missing'):
+      self.n_files_processed += 1
+      src_dirnode = self.plan.transform_row_to_src_dirnode(plan_row)
+      print(self.n_files_processed, 'verifying copy for', src_dirnode.name, '@', src_dirnode.parentpath)
+      if not self.is_src_file_backable(src_dirnode):
         continue
       src_filepath = src_dirnode.get_abspath_with_mountpath(self.ori_dt.mount_abspath)
-      if not os.path.isfile(src_filepath):
-        print(self.n_files_processed, '/', self.total_srcfiles_in_db,
-              'Continuing for next. Source file does not exist (%s) ' % src_filepath)
-        continue
-      trg_dirnode = dn.DirNode.create_with_tuplerow(src_row, self.ori_dt.fieldnames)
-      trg_filepath = trg_dirnode.get_abspath_with_mountpath(self.bak_dt.mount_abspath)
+      trg_filepath = src_dirnode.get_abspath_with_mountpath(self.bak_dt.mount_abspath)
       if os.path.isfile(trg_filepath):
         print(self.n_files_processed, '/', self.total_srcfiles_in_db,
               'Continuing for next. Target file exists (%s) ' % src_filepath)
         continue
-      trg_rows = self.fetch_row_if_sha1_exists_in_target(src_dirnode.sha1)
-      if trg_rows is not None and len(trg_rows) > 0:
-        print('sha1 of target file exists. Check if a move is appropriate/possible.')
-        trg_row = trg_rows[0]
-        _ = self.sha1_exists_in_trg_try_move_within_target(src_dirnode, trg_row)
-        continue
       bool_copied = self.copy_filepath(src_filepath, trg_filepath)
       if bool_copied:
-        return trg_dirnode.insert_into_db(self.bak_dt)
+        src_dirnode.insert_into_db(self.bak_dt)
       else:
         self.report_failed_copy(src_dirnode)
 
@@ -309,20 +325,21 @@ class DoubleDirectionCopier:
     print('Copying file:', src_dirnode.name)
     print(' => ppath:', strf.put_ellipsis_in_str_middle(src_dirnode.parentpath, 120))
     print(' => direction:', self.ori_dt.mountpath, '=>', self.bak_dt.mountpath)
-    shutil.copy2(srcpath, trgpath)
+    devsched.copy_file(srcpath, trgpath)
     sql = '''
-      INSERT INTO %(tablename)s
-        (name, parentpath, sha1, bytesize, mdatetime)
+      INSERT OR IGNORE INTO %(tablename)s
+        (name, parentpath, sha1, bytesize, mdatetime, hashalgo)
       VALUES 
-        (?,?,?,?,?);'''
+        (?,?,?,?,?,?);'''
     tuplevalues = (
       src_dirnode.name,
       src_dirnode.parentpath,
       src_dirnode.sha1,
       src_dirnode.bytesize,
-      src_dirnode.mdatetime
+      src_dirnode.mdatetime,
+      src_dirnode.hashalgo
     )
-    _ = trg_dirtree.do_insert_with_sql_n_tuplevalues(sql, tuplevalues)
+    _ = trg_dirtree.buffer_write(sql, tuplevalues)  # buffered, see copy_onedirtree_to_another()
     return True
 
   def copy_over(self, src_dirnode, src_dirtree, trg_dirtree):
@@ -339,7 +356,7 @@ class DoubleDirectionCopier:
     if not os.path.isfile(trgpath):
       return self.do_copy_over(srcpath, src_dirnode, trgpath, trg_dirtree)
     # at this point, trgfile exists, so its sha1 must be checked before renaming trgfile
-    trg_sha1 = hm.calc_sha1_from_file(trgpath)
+    trg_sha1 = devsched.calc_hash_from_file(trgpath, src_dirnode.hashalgo)
     if trg_sha1 is None:
       # there is a problem read (TO-DO: one solution might be to treat it with another script)
       return False
@@ -350,32 +367,36 @@ class DoubleDirectionCopier:
     trgpath = dirf.rename_filename_if_its_already_taken_in_folder(trgpath)
     return self.do_copy_over(srcpath, src_dirnode, trgpath, trg_dirtree)
 
-  def copy_missing_files_to_trg(self, src_rows, src_dirtree, trg_dirtree):
-    for src_row in src_rows:
+  def copy_missing_files_to_trg(self, plan, src_dirtree, trg_dirtree):
+    """
+    The plan's 'missing' rows are the source files whose (sha1, hashalgo) does not exist in target,
+      restart_at counts these rows (not all the source rows as before the plan)
+    """
+    for plan_row in plan.iter_plan_rows('missing'):
       self.n_looped_rows += 1
       if self.restart_at and self.n_looped_rows < self.restart_at:
         print('processing', self.n_looped_rows, 'restart at', self.restart_at)
         continue
-      src_dirnode = dn.DirNode.create_with_tuplerow(src_row, src_dirtree.fieldnames)
-      srcfilepath = src_dirnode.get_abspath_with_mountpath(self.ori_dt.mountpath)
+      src_dirnode = plan.transform_row_to_src_dirnode(plan_row)
+      srcfilepath = src_dirnode.get_abspath_with_mountpath(src_dirtree.mountpath)
       if dirf.is_any_name_in_path_startingwith_any_prefix_in_list(srcfilepath):
         print(
-          self.n_looped_rows, '/', self.total_srcfiles_in_db,
+          self.n_looped_rows, '/', plan.n_actions['missing'],
           'file in FORBIDDEN path', srcfilepath
         )
         continue
-      if trg_dirtree.does_sha1_exist_in_thisdirtree(src_dirnode):
-        print(
-          self.n_looped_rows, '/', self.total_srcfiles_in_db,
-          'sha1_exist_in_thisdirtree for', srcfilepath
-        )
-        continue
       self.copy_over(src_dirnode, src_dirtree, trg_dirtree)
 
   def copy_onedirtree_to_another(self, src_dirtree, trg_dirtree):
-    generated_rows = src_dirtree.do_select_all_w_limit_n_offset()
-    for src_rows in generated_rows:
-      self.copy_missing_files_to_trg(src_rows, src_dirtree, trg_dirtree)
+    if (src_dirtree.mountpath, trg_dirtree.mountpath) == (self.plan.src_mountpath, self.plan.trg_mountpath):
+      plan = self.plan
+    else:
+      plan = dbmp.DBMirrorPlan(src_dirtree.mountpath, trg_dirtree.mountpath)
+    print('Planning the copies (source db attached to target db)')
+    plan.build_plan()
+    plan.report()
+    with trg_dirtree.buffered_writes():
+      self.copy_missing_files_to_trg(plan, src_dirtree, trg_dirtree)
 
   def process(self):
     self.copy_onedirtree_to_another(self.ori_dt, self.bak_dt)
@@ -424,6 +445,8 @@ def process():
   """
   """
   src_mountpath, trg_mountpath = defaults.get_src_n_trg_mountpath_args_or_default()
+  iopol.set_default_policy_from_args()  # --io-policy=<none|sequential|nocache>
+  dbprof.set_default_profile_from_args()  # --db-profile=<none|safe|bulk-walk|read-only-report>
   r1_restart_at, r2_restart_at = get_cli_arg_r1_r2_restart_at_if_any()
   if r2_restart_at is None:
     copier = DoubleDirectionCopier(src_mountpath, trg_mountpath, r1_restart_at)
@@ -4,10 +4,13 @@ mirror2trees_cm.py
 
 This script does basically two things:
   1) it moves target-tree files to the relative position, in the target-tree itself, that exists in the source-tree;
-     (in case of repeats, the first one fetched will be used for moving, if possible)
+     (in case of repeats, no move is done, see below)
   2) it copies missing files in the target-tree that exists in the source-tree;
      (in case of copy, sha1 is missing in target, so there's no worries about repeats)
 
+Both are taken from a mirror plan (see llib/db/dbmirrorplan_mod.py) built at the start with the two dbs attached,
+  ie there are no per-file lookups into the target db. Repeats (the plan's 'ambiguous' rows) are not moved.
+
 Things this script doesn't do:
   1) This script DOESN'T do removals.
   2) This script DOESN'T do the inverse of the two operations above.
@@ -20,8 +23,11 @@ import datetime
 import os.path
 import shutil
 import llib.db.dbdirtree_mod as dbdt
+import llib.db.dbmirrorplan_mod as dbmp
+import llib.db.dbprofile_mod as dbprof
 import llib.dirfilefs.dir_n_file_fs_mod as dirf
-import models.entries.dirnode_mod as dn
+import llib.os.device_io_scheduler_mod as devsched
+import llib.os.io_policy_mod as iopol
 import default_settings as defaults
 
 
@@ -31,6 +37,7 @@ class MirrorDirTree:
     self.start_time = datetime.datetime.now()
     self.ori_dt = dbdt.DBDirTree(ori_mountpath)
     self.bak_dt = dbdt.DBDirTree(bak_mountpath)
+    self.plan = dbmp.DBMirrorPlan(ori_mountpath, bak_mountpath)
     self.n_moved = 0
     self.n_failed_moves = 0
     self.n_copied = 0
@@ -73,17 +80,6 @@ class MirrorDirTree:
   def total_of_repeat_trgfiles(self):
     return self.total_trgfiles_in_db - self.total_unique_trgfiles
 
-  def fetch_row_if_sha1_exists_in_target(self, sha1):
-    """
-    repeats are not treated here, so, if many files with the same sha1, return the first one in result_list
-    """
-    sql = 'SELECT * from %(tablename)s WHERE sha1=?;'
-    tuplevalues = (sha1,)
-    fetched_list = self.bak_dt.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
-    if fetched_list is None or len(fetched_list) == 0:
-      return None
-    return fetched_list[0]
-
   def verify_if_a_move_within_trg_is_needed(self, src_dirnode, trg_dirnode):
     wherefile_is_path = os.path.join(self.bak_dt.mountpath, trg_dirnode.path)
     mirrored_trg_dirnode = copy.copy(src_dirnode)
@@ -113,7 +109,7 @@ class MirrorDirTree:
       return False
     # if it really copied over, insert it into db
     if os.path.isdir(wherefile_shouldbe_path):
-      mirrored_trg_dirnode.insert_into_db(self.bak_dt)
+      self.bak_dt.add_row_with_dirnode(mirrored_trg_dirnode)
       return True
     return False
 
@@ -132,38 +128,54 @@ class MirrorDirTree:
     print('FROM: ', src_filepath)
     print('TO: ', mirrored_filepath)
     try:
-      shutil.copy2(src_filepath, mirrored_filepath)
+      devsched.copy_file(src_filepath, mirrored_filepath)
       self.n_copied += 1
     except (IOError, OSError):
       self.n_failed_copies += 1
       return False
     if os.path.isfile(mirrored_filepath):
-      return mirrored_trg_dirnode.insert_into_db(self.bak_dt)
+      return self.bak_dt.add_row_with_dirnode(mirrored_trg_dirnode)
     return False
 
-  def verify_copy_or_move_or_none(self, src_dirnode):
-    trg_row = self.fetch_row_if_sha1_exists_in_target(src_dirnode.sha1)
-    if trg_row is not None:
-      return self.copy_src_to_trg(src_dirnode)
-    trg_dirnode = dn.DirNode.create_with_tuplerow(trg_row, self.bak_dt.fieldnames)
-    return self.verify_if_a_move_within_trg_is_needed(src_dirnode, trg_dirnode)
+  def copy_missing_files_by_plan(self):
+    """
+    The plan's 'missing' rows are the source files whose sha1 does not exist in target
+    """
+    for plan_row in self.plan.iter_plan_rows('missing'):
+      self.n_processed_files += 1
+      src_dirnode = self.plan.transform_row_to_src_dirnode(plan_row)
+      print(
+        'proc', self.n_processed_files, '/', self.total_srcfiles_in_db,
+        src_dirnode.name, '@', src_dirnode.parentpath
+      )
+      bool_ret = self.copy_src_to_trg(src_dirnode)
+      print('bool_ret', bool_ret)
 
-  def process_mirroring_by_copying_or_moving(self, src_rowlist):
-    for src_row in src_rowlist:
+  def move_misplaced_files_by_plan(self):
+    """
+    The plan's 'misplaced' rows are the files, unique on both sides, that are elsewhere in target
+      (the 'ambiguous' ones, ie repeats, are left as they are)
+    """
+    for plan_row in self.plan.iter_plan_rows('misplaced'):
       self.n_processed_files += 1
-      src_dirnode = dn.DirNode.create_with_tuplerow(src_row, self.ori_dt.fieldnames)
+      src_dirnode = self.plan.transform_row_to_src_dirnode(plan_row)
+      trg_dirnode = self.plan.transform_row_to_trg_dirnode(plan_row)
       print(
         'proc', self.n_processed_files, '/', self.total_srcfiles_in_db,
         src_dirnode.name, '@', src_dirnode.parentpath
       )
-      bool_ret = self.verify_copy_or_move_or_none(src_dirnode)
+      bool_ret = self.verify_if_a_move_within_trg_is_needed(src_dirnode, trg_dirnode)
       print('bool_ret', bool_ret)
 
   def processing_dirtrees_mirroring(self):
+    print('Planning the mirroring (source db attached to target db)')
+    self.plan.build_plan()
+    self.plan.report()
     print('mirror_by_moving_within_targetdirtree')
     print('='*40)
-    for src_rowlist in self.ori_dt.do_select_all_w_limit_n_offset():
-      self.process_mirroring_by_copying_or_moving(src_rowlist)
+    with self.bak_dt.buffered_writes():
+      self.move_misplaced_files_by_plan()
+      self.copy_missing_files_by_plan()
     self.report()
 
   def report(self):
@@ -196,6 +208,8 @@ def process():
   """
   """
   src_mountpath, trg_mountpath = defaults.get_src_n_trg_mountpath_args_or_default()
+  iopol.set_default_policy_from_args()  # --io-policy=<none|sequential|nocache>
+  dbprof.set_default_profile_from_args()  # --db-profile=<none|safe|bulk-walk|read-only-report>
   mirror = MirrorDirTree(src_mountpath, trg_mountpath)
   mirror.processing_dirtrees_mirroring()
 
@@ -19,8 +19,11 @@ import shutil
 import models.entries.dirtree_mod as dt
 import models.entries.dirnode_mod as dn
 import default_settings as defaults
+import llib.db.dbprofile_mod as dbprof
 import llib.dirfilefs.dir_n_file_fs_mod as dirf
 import llib.strnlistfs.strfunctions_mod as strf
+import llib.os.device_io_scheduler_mod as devsched
+import llib.os.io_policy_mod as iopol
 
 
 class TrgBasedByrcSha1sMolder:
@@ -63,9 +66,7 @@ class TrgBasedByrcSha1sMolder:
     self.total_trgdirs_in_os = total_dirs
 
   def find_sha1_in_trg_n_return_trg_dirnode(self, src_dirnode):
-    sql = 'SELECT * FROM %(tablename)s WHERE sha1=?;'
-    tuplevalues = (src_dirnode.sha1, )
-    fetched_list = self.bak_dt.dbtree.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
+    fetched_list = self.bak_dt.dbtree.fetch_rows_by_sha1_n_hashalgo(src_dirnode.sha1, src_dirnode.hashalgo)
     if fetched_list is None or len(fetched_list) == 0:
       return None
     fieldnames = self.bak_dt.dbtree.fieldnames
@@ -149,7 +150,7 @@ class TrgBasedByrcSha1sMolder:
     boolres = old_trg_dirnode.update_db_name_n_parentpath(name, parentpath, self.bak_dt.dbtree)
     if boolres:
       return True
-    return new_trg_dirnode.insert_into_db(self.bak_dt.dbtree)
+    return self.bak_dt.dbtree.add_row_with_dirnode(new_trg_dirnode)
 
   def copy_over_src_to_trg(self, src_dirnode):
     """
@@ -176,11 +177,11 @@ class TrgBasedByrcSha1sMolder:
       'src', src_dirnode.name, '@', strf.put_ellipsis_in_str_middle(src_dirnode.parentpath, 50)
     )
     try:
-      shutil.copy2(src_filepath, trg_filepath)
+      devsched.copy_file(src_filepath, trg_filepath)
     except (OSError, IOError):
       self.n_failed_copies += 1
       return False
-    return src_dirnode.insert_into_db(self.bak_dt.dbtree)
+    return self.bak_dt.dbtree.add_row_with_dirnode(src_dirnode)
 
   def move_trg_file_based_on_src_if_applicable(self, src_dirnode, trg_dirnode):
     if trg_dirnode.name == src_dirnode.name and trg_dirnode.parentpath == src_dirnode.parentpath:
@@ -228,7 +229,7 @@ class TrgBasedByrcSha1sMolder:
       self.copy_over_src_to_trg(src_dirnode)
 
   def fetch_n_process_unique_sha1s_in_scr(self):
-    sql = 'select DISTINCT sha1, count(sha1) as c, * from %(tablename)s group by sha1 having c = 1;'
+    sql = 'select DISTINCT sha1, count(sha1) as c, * from %(tablename)s group by sha1, hashalgo having c = 1;'
     fetched_list = self.ori_dt.dbtree.do_select_with_sql_without_tuplevalues(sql)
     for larger_row in fetched_list:
       row = larger_row[2:]
@@ -239,7 +240,8 @@ class TrgBasedByrcSha1sMolder:
       self.treat_unique_src_dirnode_with_copy_move_or_none(src_dirnode)
 
   def process(self):
-    self.fetch_n_process_unique_sha1s_in_scr()
+    with self.bak_dt.dbtree.buffered_writes():
+      self.fetch_n_process_unique_sha1s_in_scr()
     self.prune_empty_folders()
     self.report()
 
@@ -281,6 +283,8 @@ def process():
   """
   """
   src_mountpath, trg_mountpath = defaults.get_src_n_trg_mountpath_args_or_default()
+  iopol.set_default_policy_from_args()  # --io-policy=<none|sequential|nocache>
+  dbprof.set_default_profile_from_args()  # --db-profile=<none|safe|bulk-walk|read-only-report>
   molder = TrgBasedByrcSha1sMolder(src_mountpath, trg_mountpath)
   molder.process()
 
@@ -8,6 +8,10 @@ This script (a little bit similar to mirror2trees_cm.py) does two things:
 
 One thing mirror2trees_cm.py does in addition is the excess target files deletion under user confirmation.
 
+Both are taken from a mirror plan (see llib/db/dbmirrorplan_mod.py) built at the start with the two dbs attached,
+  ie there are no per-file sha1 lookups into the target db: the moves are its 'misplaced' rows,
+  the copies its 'missing' rows. Repeats (the plan's 'ambiguous' rows) are neither moved nor copied.
+
 TO-DO:
   integrate the two scripts (mirror2trees_cm.py and this one [mold_trg_based_on_src_mod.py] to simplify this system.
 """
@@ -15,10 +19,13 @@ import copy
 import os.path
 import shutil
 import models.entries.dirtree_mod as dt
-import models.entries.dirnode_mod as dn
 import default_settings as defaults
+import llib.db.dbmirrorplan_mod as dbmp
+import llib.db.dbprofile_mod as dbprof
 import llib.dirfilefs.dir_n_file_fs_mod as dirf
 import llib.strnlistfs.strfunctions_mod as strf
+import llib.os.device_io_scheduler_mod as devsched
+import llib.os.io_policy_mod as iopol
 # import cmm.dbentry_deleter_those_without_corresponding_osentry_mod as dbentry_del
 
 
@@ -27,6 +34,8 @@ class TrgBasedOnSrcMolder:
   def __init__(self, src_mountpath, trg_mountpath):
     self.ori_dt = dt.DirTree('ori', src_mountpath)
     self.bak_dt = dt.DirTree('bak', trg_mountpath)
+    self.plan = dbmp.DBMirrorPlan(src_mountpath, trg_mountpath)
+    self.n_processed_rows = 0
     self.total_srcfiles_in_db = 0
     self.total_trgfiles_in_db = 0
     self.total_unique_srcfiles = 0
@@ -57,39 +66,6 @@ class TrgBasedOnSrcMolder:
     self.total_trgdirs_in_os = total_dirs
     self.print_counters()
 
-  def find_sha1_in_trg_n_return_trg_dirnode(self, sha1, src_name, src_parentpath):
-    if sha1 is None:
-      return None
-    sql = 'SELECT * FROM %(tablename)s WHERE sha1=?;'
-    tuplevalues = (sha1, )
-    fetched_list = self.bak_dt.dbtree.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
-    if fetched_list is None:
-      return None
-    fieldnames = self.bak_dt.dbtree.fieldnames
-    if len(fetched_list) == 1:
-      row = fetched_list[0]
-      trg_dirnode = dn.DirNode.create_with_tuplerow(row, fieldnames)
-      return trg_dirnode
-    # at this point len(fetched_list) > 1
-    trg_dirnode = None
-    for row in fetched_list:
-      idx = fieldnames.index('name')
-      name = row[idx]
-      idx = fieldnames.index('parentpath')
-      parentpath = row[idx]
-      if parentpath == src_parentpath:
-        trg_dirnode = dn.DirNode.create_with_tuplerow(row, fieldnames)
-        if name == src_name:
-          return trg_dirnode
-    if trg_dirnode is not None:
-      return trg_dirnode
-    # ok, at least a coincidence with parentpath was not found, take the first one and return
-    # the returning point will move it to its equivalent source parentpath and name
-    if len(fetched_list) > 0:
-      row = fetched_list[0]
-      trg_dirnode = dn.DirNode.create_with_tuplerow(row, fieldnames)
-    return trg_dirnode
-
   def move_file_within_trg_to_its_src_relative_position_if_vacant(self, src_dirnode, trg_dirnode):
     new_trg_dirnode = copy.copy(src_dirnode)  # new trg name and parentpath will be the ones from src
     oldfile = trg_dirnode.get_abspath_with_mountpath(self.bak_dt.mountpath)
@@ -123,7 +99,7 @@ class TrgBasedOnSrcMolder:
     boolres = trg_dirnode.update_db_name_n_parentpath(name, parentpath, self.bak_dt.dbtree)
     if boolres:
       return True
-    return new_trg_dirnode.insert_into_db(self.bak_dt.dbtree)
+    return self.bak_dt.dbtree.add_row_with_dirnode(new_trg_dirnode)
 
   def copy_over_src_to_trg(self, src_dirnode):
     src_filepath = src_dirnode.get_abspath_with_mountpath(self.ori_dt.mountpath)
@@ -143,39 +119,49 @@ class TrgBasedOnSrcMolder:
       'src', src_dirnode.name, '@', strf.put_ellipsis_in_str_middle(src_dirnode.parentpath, 50)
     )
     try:
-      shutil.copy2(src_filepath, trg_filepath)
+      devsched.copy_file(src_filepath, trg_filepath)
     except (OSError, IOError):
       self.n_failed_copies += 1
       return False
-    return src_dirnode.insert_into_db(self.bak_dt.dbtree)
+    return self.bak_dt.dbtree.add_row_with_dirnode(src_dirnode)
 
-  def move_trg_file_based_on_src_if_applicable(self, src_row):
-    src_dirnode = dn.DirNode.create_with_tuplerow(src_row, self.ori_dt.dbtree.fieldnames)
+  def is_src_file_moldable(self, src_dirnode):
     src_filepath = src_dirnode.get_abspath_with_mountpath(self.ori_dt.mountpath)
     if dirf.does_path_have_forbidden_dir(src_filepath):
       return False
-    if not os.path.isfile(src_filepath):
-      return False
-    trg_dirnode = self.find_sha1_in_trg_n_return_trg_dirnode(src_dirnode.sha1, src_dirnode.name, src_dirnode.parentpath)
-    if trg_dirnode is None:
+    return os.path.isfile(src_filepath)
+
+  def move_trg_file_based_on_src_if_applicable(self, plan_row):
+    """
+    plan_row is a 'misplaced' row: its (sha1, hashalgo) is unique on both sides and the target file is elsewhere
+    """
+    src_dirnode = self.plan.transform_row_to_src_dirnode(plan_row)
+    if not self.is_src_file_moldable(src_dirnode):
       return False
+    trg_dirnode = self.plan.transform_row_to_trg_dirnode(plan_row)
     trg_filepath = trg_dirnode.get_abspath_with_mountpath(self.bak_dt.mountpath)
     if not os.path.isfile(trg_filepath):
       return self.copy_over_src_to_trg(src_dirnode)
-    if trg_dirnode.name == src_dirnode.name and trg_dirnode.parentpath == src_dirnode.parentpath:
-      # no need to move target
-      return False
     return self.move_file_within_trg_to_its_src_relative_position_if_vacant(src_dirnode, trg_dirnode)
 
-  def process_src_rows(self, src_rows):
-    for src_row in src_rows:
-      _id = src_row[0]  # id is always at index 0
-      print(_id, '/', self.total_srcfiles_in_db, 'Processing:', src_row)
-      _ = self.move_trg_file_based_on_src_if_applicable(src_row)
+  def copy_src_file_if_applicable(self, plan_row):
+    """
+    plan_row is a 'missing' row: its (sha1, hashalgo) does not exist in target
+    """
+    src_dirnode = self.plan.transform_row_to_src_dirnode(plan_row)
+    if not self.is_src_file_moldable(src_dirnode):
+      return False
+    return self.copy_over_src_to_trg(src_dirnode)
+
+  def process_plan_rows(self, action, plan_row_processor):
+    for i, plan_row in enumerate(self.plan.iter_plan_rows(action)):
+      self.n_processed_rows += 1
+      print(i + 1, '/', self.plan.n_actions[action], action, 'Processing:', plan_row)
+      _ = plan_row_processor(plan_row)
 
-  def sweep_src_files_in_db(self):
-    for generated_rows in self.ori_dt.dbtree.do_select_all_w_limit_n_offset():
-      self.process_src_rows(generated_rows)
+  def sweep_plan(self):
+    self.process_plan_rows('misplaced', self.move_trg_file_based_on_src_if_applicable)
+    self.process_plan_rows('missing', self.copy_src_file_if_applicable)
 
   def print_counters(self):
     print('total_unique_srcfiles:', self.total_unique_srcfiles)
@@ -190,6 +176,7 @@ class TrgBasedOnSrcMolder:
   def report(self):
     print('=_+_+_='*3, 'TrgBasedOnSrcMolder Report', '=_+_+_='*3)
     self.print_counters()
+    print('n_processed_rows:', self.n_processed_rows)
     print('n_moved_files:', self.n_moved_files)
     print('n_copied_files:', self.n_copied_files)
     print('n_failed_moves:', self.n_failed_moves)
@@ -203,7 +190,11 @@ class TrgBasedOnSrcMolder:
     self.n_empty_dirs_fail_rm = n_failed
 
   def process(self):
-    self.sweep_src_files_in_db()
+    print('Planning the molding (source db attached to target db)')
+    self.plan.build_plan()
+    self.plan.report()
+    with self.bak_dt.dbtree.buffered_writes():
+      self.sweep_plan()
     self.prune_empty_folders()
     self.report()
 
@@ -212,6 +203,8 @@ def process():
   """
   """
   src_mountpath, trg_mountpath = defaults.get_src_n_trg_mountpath_args_or_default()
+  iopol.set_default_policy_from_args()  # --io-policy=<none|sequential|nocache>
+  dbprof.set_default_profile_from_args()  # --db-profile=<none|safe|bulk-walk|read-only-report>
 
   molder = TrgBasedOnSrcMolder(src_mountpath, trg_mountpath)
   molder.process()
@@ -85,16 +85,16 @@ class MoveRename:
         self.dbupdate_trg_middlepath_with_src(src_dirnode, trg_dirnode)
 
   def traverse_src_nodes(self):
-    sql = 'SELECT DISTINCT sha1, COUNT(id), id FROM %(tablename)s GROUP BY sha1;'
-    generator_rows = self.ori_dt.do_select_sql_n_tuplevalues_w_limit_n_offset(sql, None)
-    for rows in generator_rows:
-      for row in rows:
-        sha1 = row[0]
-        n_repeats = row[1]
-        _id = row[2]
-        print(_id, n_repeats, sha1.hex()[:20])
-        if n_repeats == 1:
-          self.compare_src_sha1_position_in_trg(sha1, _id)
+    generator_rows = self.ori_dt.do_select_rows_by_keyset(
+      fields_line='sha1, COUNT(id), id', keyfield='sha1', groupby_clause='GROUP BY sha1'
+    )
+    for row in generator_rows:
+      sha1 = row[0]
+      n_repeats = row[1]
+      _id = row[2]
+      print(_id, n_repeats, sha1.hex()[:20])
+      if n_repeats == 1:
+        self.compare_src_sha1_position_in_trg(sha1, _id)
 
   def report(self):
     print('Report:')
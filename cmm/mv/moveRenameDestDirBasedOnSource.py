@@ -27,8 +27,16 @@ mv "/media/user/disk2/Areas/xpto/SciencePo"
    "/media/user/disk2/Areas/Science"
 
 Notice that the operation happens on the destination.
+
+After the move, the destination's db rows are renamed along (see DBDirTree.rename_dir()),
+  ie a walk is not needed to bring the db up to date. If the dirtree's db is normalized
+  (see cmm/clean/dbclean/normalize_dirtree_storage_cm.py), that's an update of the folder's row only.
+
+Usage:
+  $moveRenameDestDirBasedOnSource.py --droot=<destination root> --smid=<source middlepath> --dmid=<dest middlepath>
 """
 import os
+import sys
 import shutil
 import llib.db.dbdirtree_mod as dbdt
 import models.entries.dirnode_mod as dn
@@ -42,6 +50,8 @@ class MoveCommandMaker:
     self.dst_rootpath = droot
     self.dst_middlepath = dmid
     self.src_middlepath = smid
+    self.was_moved = False
+    self.was_db_renamed = False
 
   @property
   def new_dst_fullpath(self):
@@ -60,13 +70,36 @@ class MoveCommandMaker:
     scrmsg = f'Executing move command: [{comm}]'
     print(scrmsg)
     os.system(comm)
+    self.was_moved = os.path.isdir(dst) and not os.path.isdir(src)
+
+  def rename_in_db(self):
+    """
+    The middlepaths are the db's parentpaths (without their starting '/')
+    """
+    old_parentpath = '/' + self.dst_middlepath.strip('/')
+    new_parentpath = '/' + self.src_middlepath.strip('/')
+    dbtree = dbdt.DBDirTree(self.dst_rootpath)
+    self.was_db_renamed = dbtree.rename_dir(old_parentpath, new_parentpath)
+    print('Renamed in db', old_parentpath, '=>', new_parentpath, '|', self.was_db_renamed)
 
   def process(self):
     self.move()
+    if self.was_moved:
+      self.rename_in_db()
 
 
 def get_args():
-
+  droot, dmid, smid = None, None, None
+  for arg in sys.argv:
+    if arg.startswith('--droot='):
+      droot = arg[len('--droot='):]
+    elif arg.startswith('--dmid='):
+      dmid = arg[len('--dmid='):]
+    elif arg.startswith('--smid='):
+      smid = arg[len('--smid='):]
+  if droot is None or dmid is None or smid is None:
+    error_msg = 'Parameter error: --droot=, --dmid= and --smid= must be given.'
+    raise ValueError(error_msg)
   return droot, dmid, smid
 
 
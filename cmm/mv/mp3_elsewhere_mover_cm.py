@@ -105,15 +105,13 @@ class Mp3ElsewhereMover:
     return
 
   def find_mp3s_thru_db(self):
-    sql = 'SELECT * FROM %(tablename)s WHERE SUBSTR(name, -4)=? ORDER BY parentpath;'
+    where_clause = 'SUBSTR(name, -4)=?'
     tuplevalues = ('.mp3', )
-    generator_rows = self.ori_dt.do_select_sql_n_tuplevalues_w_limit_n_offset(sql, tuplevalues)
-    for rows in generator_rows:
-      for src_row in rows:
-        self.n_files_processed += 1
-        print(src_row)
-        src_dirnode = dn.DirNode.create_with_tuplerow(src_row, self.ori_dt.fieldnames)
-        self.move_to_target_or_delete_if_its_already_there(src_dirnode)
+    for src_row in self.ori_dt.do_select_rows_by_keyset(where_clause, tuplevalues):
+      self.n_files_processed += 1
+      print(src_row)
+      src_dirnode = dn.DirNode.create_with_tuplerow(src_row, self.ori_dt.fieldnames)
+      self.move_to_target_or_delete_if_its_already_there(src_dirnode)
 
   def process(self):
     self.count_n_set_n_mp3s_from_db()
@@ -5,7 +5,9 @@ DirTreeMirror_PrdPrjSw:
 Reports file repeats showing list organized by sha1 and paths.
 
 Usage:
-  $...
+  $reportFilerepeatsOrganizedBySha1NPaths.py <mountpath> [--replica] [--db-profile=<profile>]
+    --replica: the db is copied to memory and read from there (see DBBase.open_read_replica())
+    --db-profile=<profile>: the PRAGMA profile, read-only-report by default (see llib/db/dbprofile_mod.py)
 
 Example:
   $...
@@ -13,11 +15,12 @@ Example:
 Explanation:
   ...
 """
-
-# import fs.db.dbrepeats_mod as dbr
+import sys
 import llib.db.dbdirtree_mod as dbt
+import llib.db.dbprofile_mod as dbprof
+import llib.db.dbrepeats_mod as dbr
 import llib.dirfilefs.dir_n_file_fs_mod as dirf
-import models.entries.dirnode_mod as dn
+import llib.hashfunctions.hash_mod as hm
 import default_settings as defaults
 
 
@@ -36,8 +39,8 @@ class ReportFileRepeat:
     self.n_found_files_size_n_date_in_db = 0
     self.n_updated_dbentries = 0
     self.n_files_empty_sha1 = 0
-    # self.dbrepeat = dbr.DBRepeat(mountpath)
     self.dbtree = dbt.DBDirTree(mountpath)
+    self.dbrepeat = dbr.DBRepeat(mountpath)
 
   def calc_totals(self):
     """
@@ -65,8 +68,8 @@ class ReportFileRepeat:
 
   def show_sha1s_followed_by_records(self):
     """
-    First SELECT in here generates a list that shows records starting by sha1s, ordered by sha1.
-    It goes like the following example:
+    The repeats are streamed from table file_repeats (kept current from files_in_tree, see llib/db/dbrepeats_mod.py)
+      grouped by sha1, the groups wasting more bytes first. It goes like the following example:
     sha1 s1:
       - s1 row1
       - s1 row2 (if more)
@@ -76,44 +79,23 @@ class ReportFileRepeat:
       - s2 row2 (if more)
       - s2 row etc (if more)
     etc.
-
-    '''
-      SELECT DISTINCT t1.sha1, t2.* FROM %(tablename)s as t1
-        INNER JOIN %(tablename)s as t2
-        WHERE t1.sha1 = t2.sha1
-        ORDER BY t1.sha1
-    '''
     """
-    sql = '''
-      SELECT * FROM files_in_tree
-      WHERE sha1 IN (
-        SELECT DISTINCT sha1 AS c FROM files_in_tree
-        GROUP BY sha1
-        HAVING count(sha1) > 1
-      )
-      ORDER BY 
-        sha1,
-        parentpath,
-        name;
-    '''
-    rowlist = self.dbtree.do_select_with_sql_without_tuplevalues(sql)
-    former_sha1 = None
-    former_pp = None
     print('-=+|+=-'*10)
-
-    for i, row in enumerate(rowlist):
-      dirnode = dn.DirNode.create_with_tuplerow(row, self.dbtree.fieldnames)
-      if former_sha1 != dirnode.sha1:
-        self.n_processed_sha1s += 1
-        former_sha1 = dirnode.sha1
-        print('-'*80)
-        print(self.n_processed_sha1s, dirnode.sha1.hex())
-        print('-'*45)
-      if former_pp != dirnode.parentpath:
-        former_pp = dirnode.parentpath
-        print('\t @', dirnode.parentpath, dirnode.get_db_id())
-      self.n_processed_files += 1
-      print(self.n_processed_files, '\t\t [', dirnode.name, ']', dirnode.bytesize, dirnode.mdatetime)
+    # content hashes are only comparable within the same hashalgo, the groups are (sha1, hashalgo)
+    for sha1, hashalgo, n_files, wasted_bytes, rows in self.dbrepeat.iter_repeat_groups():
+      self.n_processed_sha1s += 1
+      print('-'*80)
+      wasted_str = hm.convert_to_size_w_unit(wasted_bytes)
+      print(self.n_processed_sha1s, hashalgo, sha1.hex(), 'x', n_files, 'wasted', wasted_str)
+      print('-'*45)
+      former_pp = None
+      for row in rows:
+        dirnode = self.dbrepeat.transform_row_to_dirnode(row)
+        if former_pp != dirnode.parentpath:
+          former_pp = dirnode.parentpath
+          print('\t @', dirnode.parentpath, dirnode.get_db_id())
+        self.n_processed_files += 1
+        print(self.n_processed_files, '\t\t [', dirnode.name, ']', dirnode.bytesize)
     print('-=+|+=-'*10)
 
   def process(self):
@@ -141,7 +123,13 @@ class ReportFileRepeat:
 
 def process():
   mountpath, _ = defaults.get_src_n_trg_mountpath_args_or_default()
+  dbprof.set_default_profile_from_args('read-only-report')  # --db-profile=<none|safe|bulk-walk|read-only-report>
   reporter = ReportFileRepeat(mountpath)
+  if '--replica' in sys.argv:
+    # dbrepeat is in the same sqlitefile, ie it's also read from the replica
+    with reporter.dbtree.read_replica():
+      reporter.process()
+    return
   reporter.process()
 
 
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+cmm/rpt/report_filerepeats_by_staged_hashing_cm.py
+  Finds the file repeats (duplicates) in a dirtree hashing as little as possible
+  and records them into db-table file_repeats (see llib/db/dbrepeats_mod.py).
+
+Unlike ReportFileRepeat (cmm/rpt/reportFilerepeatsOrganizedBySha1NPaths.py) & FileRepeatsDeleter,
+  this script does not need files_in_tree populated, ie the walker's full sha1 of every file.
+  Instead, the dedupe happens in three stages, each one only looking at the previous stage's survivors:
+    1) files are grouped by bytesize (only the scandir walk's stat each, most files have a unique size and drop out here);
+    2) files sharing a size get a partial sha1 (first and last 64KiB, see hash_mod.calc_partial_sha1_from_file());
+    3) files sharing size & partial sha1 get the full sha1 (files up to 128KiB already have it from stage 2).
+
+Empty files are not considered (they are all "repeats" of one another).
+
+Usage:
+  $report_filerepeats_by_staged_hashing_cm.py <mountpath> [--io-policy=<none|sequential|nocache>]
+
+Example:
+  $report_filerepeats_by_staged_hashing_cm.py "/Science Videos"
+"""
+import datetime
+import os
+import llib.db.dbhashcache_mod as dbhc
+import llib.db.dbprofile_mod as dbprof
+import llib.db.dbrepeats_mod as dbr
+import llib.dirfilefs.scandir_walk_mod as scdw
+import llib.hashfunctions.hash_mod as hm
+import llib.os.device_io_scheduler_mod as devsched
+import llib.os.io_policy_mod as iopol
+import default_settings as defaults
+
+
+class StagedFileRepeatsFinder:
+
+  def __init__(self, mountpath):
+    self.mountpath = mountpath
+    if not os.path.isdir(self.mountpath):
+      error_msg = 'Missing folder error: mountpath (%s) does not exist.' % self.mountpath
+      raise OSError(error_msg)
+    self.files_by_size = {}  # stage 1: {bytesize: [fileentry, ...]}
+    self.repeat_groups = []  # stage 3: [(sha1, bytesize, [fileentry, ...]), ...]
+    self.n_files_seen = 0
+    self.n_empty_files = 0
+    self.n_failed_filestat = 0
+    self.n_partial_hashed = 0
+    self.n_full_hashed = 0
+    self.n_sha1s_from_hashcache = 0
+    self.n_failed_hashes = 0
+    self.total_bytes_read = 0
+    self.n_repeats_recorded = 0
+    self.dbrepeat = dbr.DBRepeat(self.mountpath)
+    self.hashcache = dbhc.DBHashCache(self.mountpath)
+    self.scheduler = devsched.DeviceIOScheduler()
+
+  def get_filepath(self, fileentry):
+    return fileentry.form_filepath(self.mountpath)
+
+  def stage1_group_by_size(self):
+    """
+    A fileentry is a scdw.ScandirFileEntry, the restricted dirs are pruned (see scandir_walk_mod)
+    """
+    print('Stage 1: grouping files by bytesize. Please wait.')
+    scandir_walker = scdw.ScandirDirTreeWalker(self.mountpath)
+    # as the walker, files in the mountpath folder itself are not processed
+    for fileentry in scandir_walker.generate_file_entries(include_root_files=False):
+      self.n_files_seen += 1
+      if fileentry.size == 0:
+        self.n_empty_files += 1
+        continue
+      self.files_by_size.setdefault(fileentry.size, []).append(fileentry)
+    self.n_failed_filestat = scandir_walker.n_failed_filestats
+    # only sizes shared by two or more files continue to stage 2
+    self.files_by_size = {k: v for k, v in self.files_by_size.items() if len(v) > 1}
+    n_candidates = sum(len(v) for v in self.files_by_size.values())
+    print('Stage 1:', self.n_files_seen, 'files seen', n_candidates, 'candidates in', len(self.files_by_size), 'sizes')
+
+  def hash_fileentries_by_device(self, fileentries, hashfunction):
+    """
+    Submits the hashings to the device scheduler (one reader per HDD, several per SSD)
+      and returns the list of [(fileentry, digest-or-None), ...] in the same order
+    """
+    futures = []
+    for fileentry in fileentries:
+      future = self.scheduler.submit_for_devices([fileentry.dev], hashfunction, self.get_filepath(fileentry))
+      futures.append((fileentry, future))
+    results = []
+    for fileentry, future in futures:
+      try:
+        digest = future.result()
+      except (IOError, OSError):
+        digest = None
+      if digest is None:
+        self.n_failed_hashes += 1
+      results.append((fileentry, digest))
+    return results
+
+  @staticmethod
+  def group_by_digest(hashresults):
+    groups = {}
+    for fileentry, digest in hashresults:
+      if digest is None:
+        continue
+      groups.setdefault(digest, []).append(fileentry)
+    return [(digest, group) for digest, group in groups.items() if len(group) > 1]
+
+  def stage2_group_by_partial_sha1(self, bytesize, fileentries):
+    hashresults = self.hash_fileentries_by_device(fileentries, hm.calc_partial_sha1_from_file)
+    self.n_partial_hashed += len(fileentries)
+    self.total_bytes_read += len(fileentries) * min(bytesize, 2 * hm.PARTIAL_HASH_EDGE_SIZE)
+    return self.group_by_digest(hashresults)
+
+  def fetch_cached_sha1_or_none(self, fileentry):
+    sha1 = self.hashcache.fetch_sha1_by_cachekey_or_none(*fileentry.cachekey)
+    if sha1 is not None:
+      self.n_sha1s_from_hashcache += 1
+    return sha1
+
+  def stage3_group_by_full_sha1(self, bytesize, fileentries):
+    hashresults, to_hash = [], []
+    for fileentry in fileentries:
+      sha1 = self.fetch_cached_sha1_or_none(fileentry)
+      if sha1 is None:
+        to_hash.append(fileentry)
+      else:
+        hashresults.append((fileentry, sha1))
+    fresh_hashresults = self.hash_fileentries_by_device(to_hash, hm.calc_sha1_from_file)
+    for fileentry, sha1 in fresh_hashresults:
+      self.hashcache.store_sha1_with_cachekey(*fileentry.cachekey, sha1)
+    self.n_full_hashed += len(to_hash)
+    self.total_bytes_read += len(to_hash) * bytesize
+    return self.group_by_digest(hashresults + fresh_hashresults)
+
+  def stages2n3_hash_candidates(self):
+    print('Stage 2 & 3: partial then full sha1 of candidates. Please wait.')
+    for bytesize in sorted(self.files_by_size, reverse=True):
+      fileentries = self.files_by_size[bytesize]
+      for partial_sha1, partial_group in self.stage2_group_by_partial_sha1(bytesize, fileentries):
+        if hm.is_partial_sha1_the_full_sha1(bytesize):
+          # the file was hashed whole in stage 2, the partial sha1 is its sha1
+          self.repeat_groups.append((partial_sha1, bytesize, partial_group))
+          continue
+        for sha1, sha1_group in self.stage3_group_by_full_sha1(bytesize, partial_group):
+          self.repeat_groups.append((sha1, bytesize, sha1_group))
+
+  def record_repeats_in_db(self):
+    """
+    The table's rows without a file_id are rewritten at each run, ie they reflect this run's findings
+      (the rows with a file_id are the ones kept from files_in_tree, see llib/db/dbrepeats_mod.py)
+    """
+    self.dbrepeat.delete_rows_without_file_id()
+    for sha1, bytesize, fileentries in self.repeat_groups:
+      for fileentry in fileentries:
+        if self.dbrepeat.insert_or_replace_repeat(fileentry.name, fileentry.parentpath, sha1, bytesize):
+          self.n_repeats_recorded += 1
+
+  def print_repeat_groups(self):
+    for i, (sha1, bytesize, fileentries) in enumerate(self.repeat_groups):
+      sha1hex = sha1.hex() if sha1 else '[no-sha1]'
+      print(i+1, sha1hex, hm.convert_to_size_w_unit(bytesize), 'x', len(fileentries))
+      for fileentry in fileentries:
+        print('   ', fileentry.name, '@', fileentry.parentpath)
+
+  def process(self):
+    self.stage1_group_by_size()
+    self.stages2n3_hash_candidates()
+    self.scheduler.shutdown()
+    self.record_repeats_in_db()
+    self.print_repeat_groups()
+    self.report()
+
+  def report(self):
+    n_files_in_groups = sum(len(fileentries) for _, _, fileentries in self.repeat_groups)
+    wasted_bytes = sum(bytesize * (len(fileentries) - 1) for _, bytesize, fileentries in self.repeat_groups)
+    print('-'*50)
+    print('mountpath', self.mountpath)
+    print('n_files_seen', self.n_files_seen)
+    print('n_empty_files (not considered)', self.n_empty_files)
+    print('n_failed_filestat', self.n_failed_filestat)
+    print('n_partial_hashed', self.n_partial_hashed)
+    print('n_full_hashed', self.n_full_hashed)
+    print('n_sha1s_from_hashcache', self.n_sha1s_from_hashcache)
+    print('n_failed_hashes', self.n_failed_hashes)
+    print('total_bytes_read', hm.convert_to_size_w_unit(self.total_bytes_read))
+    print('n_repeat_groups', len(self.repeat_groups), '| n_files_in_groups', n_files_in_groups)
+    print('wasted bytes', hm.convert_to_size_w_unit(wasted_bytes))
+    print('n_repeats_recorded (in table %s)' % self.dbrepeat.tablename, self.n_repeats_recorded)
+    self.scheduler.report()
+    iopol.get_default_policy().report()
+
+
+def process():
+  start_time = datetime.datetime.now()
+  print('Start Time', start_time)
+  # ------------------
+  src_mountpath, _ = defaults.get_src_n_trg_mountpath_args_or_default()
+  iopol.set_default_policy_from_args()  # --io-policy=<none|sequential|nocache>
+  dbprof.set_default_profile_from_args()  # --db-profile=<none|safe|bulk-walk|read-only-report>
+  finder = StagedFileRepeatsFinder(src_mountpath)
+  finder.process()
+  finish_time = datetime.datetime.now()
+  elapsed_time = finish_time - start_time
+  # ------------------
+  print('-'*50)
+  print('Finish Time:', finish_time)
+  print('Run Time:', elapsed_time)
+
+
+if __name__ == '__main__':
+  process()
@@ -4,8 +4,14 @@ mold_trg_based_on_src_mod.py
 
 This script does the following:
 
+Usage:
+  $report_list_filenames_ending_w_numbers.py <mountpath> [--replica] [--db-profile=<profile>]
+    --replica: the db is copied to memory and read from there (see DBBase.open_read_replica())
+    --db-profile=<profile>: the PRAGMA profile, read-only-report by default (see llib/db/dbprofile_mod.py)
 """
 import os.path
+import sys
+import llib.db.dbprofile_mod as dbprof
 import models.entries.dirtree_mod as dt
 import default_settings as defaults
 import llib.dirfilefs.dir_n_file_fs_mod as dirf
@@ -47,32 +53,30 @@ class ReportFilenameEndingWithNumberLister:
 
   def fetch_n_process_files_ending_with_numbers(self):
     total = self.total_unique_srcfiles
-    yielded_rows = self.dirtree.dbtree.do_select_all_w_limit_n_offset()
-    for rows in yielded_rows:
-      for i, row in enumerate(rows):
-        dirnode = dn.DirNode.create_with_tuplerow(row, self.dirtree.dbtree.fieldnames)
-        if not dirnode.does_dirnode_exist_in_disk(self.dirtree.mountpath):
-          print('### file does not exist in disk', dirnode.name, dirnode.parentpath)
+    for i, row in enumerate(self.dirtree.dbtree.do_select_rows_by_keyset()):
+      dirnode = dn.DirNode.create_with_tuplerow(row, self.dirtree.dbtree.fieldnames)
+      if not dirnode.does_dirnode_exist_in_disk(self.dirtree.mountpath):
+        print('### file does not exist in disk', dirnode.name, dirnode.parentpath)
+        continue
+      self.n_processed_files += 1
+      middlepath = dirnode.parentpath
+      filename = dirnode.name
+      extlessname, _ = os.path.splitext(filename)
+      pp = extlessname.split(' ')
+      if len(pp) > 0:
+        try:
+          supposed_number = int(pp[-1])
+          self.n_number_found += 1
+          seq = i + 1
+          print('-'*50)
+          print(
+            'found', self.n_number_found, seq, 'tot', total,
+            'number', supposed_number, 'for file'
+          )
+          print(filename)
+          print(middlepath)
+        except ValueError:
           continue
-        self.n_processed_files += 1
-        middlepath = dirnode.parentpath
-        filename = dirnode.name
-        extlessname, _ = os.path.splitext(filename)
-        pp = extlessname.split(' ')
-        if len(pp) > 0:
-          try:
-            supposed_number = int(pp[-1])
-            self.n_number_found += 1
-            seq = i + 1
-            print('-'*50)
-            print(
-              'found', self.n_number_found, seq, 'tot', total,
-              'number', supposed_number, 'for file'
-            )
-            print(filename)
-            print(middlepath)
-          except ValueError:
-            continue
 
   def process(self):
     self.fetch_n_process_files_ending_with_numbers()
@@ -103,7 +107,12 @@ def process():
   """
   """
   src_mountpath, _ = defaults.get_src_n_trg_mountpath_args_or_default()
+  dbprof.set_default_profile_from_args('read-only-report')  # --db-profile=<none|safe|bulk-walk|read-only-report>
   lister = ReportFilenameEndingWithNumberLister(src_mountpath)
+  if '--replica' in sys.argv:
+    with lister.dirtree.dbtree.read_replica():
+      lister.process()
+    return
   lister.process()
 
 
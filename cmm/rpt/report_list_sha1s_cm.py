@@ -4,10 +4,16 @@ mold_trg_based_on_src_mod.py
 
 This script does the following:
 
+Usage:
+  $report_list_sha1s_cm.py <src_mountpath> <trg_mountpath> [--replica] [--db-profile=<profile>]
+    --replica: the dbs are copied to memory and read from there (see DBBase.open_read_replica())
+    --db-profile=<profile>: the PRAGMA profile, read-only-report by default (see llib/db/dbprofile_mod.py)
 """
 import copy
 import os.path
 import shutil
+import sys
+import llib.db.dbprofile_mod as dbprof
 import models.entries.dirtree_mod as dt
 import models.entries.dirnode_mod as dn
 import default_settings as defaults
@@ -107,7 +113,12 @@ def process():
   """
   """
   src_mountpath, trg_mountpath = defaults.get_src_n_trg_mountpath_args_or_default()
+  dbprof.set_default_profile_from_args('read-only-report')  # --db-profile=<none|safe|bulk-walk|read-only-report>
   lister = ReportSha1Lister(src_mountpath, trg_mountpath)
+  if '--replica' in sys.argv:
+    with lister.ori_dt.dbtree.read_replica(), lister.bak_dt.dbtree.read_replica():
+      lister.process()
+    return
   lister.process()
 
 
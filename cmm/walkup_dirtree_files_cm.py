@@ -51,22 +51,31 @@ import sys
 import models.entries.dirtree_mod as dt
 import models.entries.dirnode_mod as dn
 import llib.hashfunctions.hash_mod as hm
+import llib.hashfunctions.hashpool_mod as hpool
 import cmm.clean.dbclean.dbentry_updater_by_filemove_based_on_size_n_mdt_cm as dbentry_upd
 import cmm.clean.dbclean.dbentry_deleter_those_without_corresponding_osentry_cm as dbentry_del
 import llib.db.dbfailed_fileread_mod as freadfail
+import llib.db.dbhashcache_mod as dbhc
+import llib.db.dbprofile_mod as dbprof
+import llib.db.dbtreesettings_mod as dbts
 import llib.dirfilefs.dir_n_file_fs_mod as dirf
+import llib.dirfilefs.scandir_walk_mod as scdw
+import llib.os.io_policy_mod as iopol
 import llib.strnlistfs.strfunctions_mod as strf
 import default_settings as defaults
+SEEN_CACHEKEYS_BATCH_SIZE = 10000
+HASHCACHE_SEEDS_BATCH_SIZE = 10000
 
 
 class FilesUpDirTreeWalker:
 
-  def __init__(self, mountpath, treename='ori', restart_at_walkloopseq=None):
+  def __init__(self, mountpath, treename='ori', restart_at_walkloopseq=None, n_hash_workers=None):
     """
     treename is generally 'ori' (source) or 'bak' (back-up)
     source and target are generally 'src' (source) or 'trg' (back-up)
     some operations may occur in the same dirtree,
       in such cases 'bak' may refer to a subdirectory in the same dirtree as 'ori'
+    n_hash_workers is the number of threads that calculate sha1's (see hashpool_mod.Sha1HashingPool)
     """
     self.total_dirs_in_os = 0
     self.total_files_in_os = 0
@@ -81,12 +90,16 @@ class FilesUpDirTreeWalker:
     self.n_files_empty_sha1 = 0
     self.n_failed_filestat = 0
     self.n_failed_sha1s = 0
+    self.n_sha1s_from_hashcache = 0
     self.n_empty_dirs_removed = 0
     self.n_empty_dirs_fail_rm = 0
     self.n_dbentries_ins_upd = 0
     self.n_dbentries_failed_ins_upd = 0
     self.all_nodes_with_osread_problem = []
-    self.ongoingfolder_abspath = None
+    self.seen_cachekeys = []  # the cachekeys of all the walked files, see prune_hashcache()
+    self.hashcache_seeds = []  # the cachekeys & sha1's of the unchanged files, see dbinsert_file_if_needed()
+    self.folder_parentpath = None  # the folder whose db rows are in folder_dirnodes_by_name
+    self.folder_dirnodes_by_name = {}
     self.mountpath = mountpath
     if not os.path.isdir(self.mountpath):
       error_msg = 'Missing file errror mount_abspath (%s) does not exist.'
@@ -98,17 +111,22 @@ class FilesUpDirTreeWalker:
     self.treat_restart_at_walkloopseq()
     # freadfailer will record the sha1 fileread failed attempts
     self.freadfailer = freadfail.DBFailFileReadReporter(self.dbtree.mountpath)
+    # hashcache keeps sha1's keyed by (st_dev, st_ino, bytesize, mtime_ns), so renamed/moved files are not reread
+    self.hashcache = dbhc.DBHashCache(self.dbtree.mountpath)
+    # new files are hashed with the dirtree's default hashalgo (sha1 unless set otherwise in table tree_settings)
+    self.hashalgo = dbts.DBTreeSettings(self.dbtree.mountpath).get_default_hashalgo()
+    # the hashing pool calculates sha1's in worker threads, db-inserts happen in this thread (the collector)
+    self.hashpool = hpool.Sha1HashingPool(n_workers=n_hash_workers)
 
   def calc_totals(self):
     """
-    count_total_files_n_folders_with_restriction(mountpath, restricted_dirnames, forbidden_first_level_dirs)
+    Only the db is counted here: the os totals come from the walk itself (see walkup_dirtree_files()),
+      until it ends, total_files_in_os is estimated by the db's count (ie the previous walk's)
     """
-    print('Counting files and dirs in db and os. Please wait.')
     self.total_unique_files_in_db = self.dbtree.count_unique_sha1s_as_int()
     self.total_files_in_db = self.dbtree.count_rows_as_int()
-    total_files, total_dirs = dirf.count_total_files_n_folders_with_restriction(self.dirtree.mountpath)
-    self.total_files_in_os = total_files
-    self.total_dirs_in_os = total_dirs
+    if self.total_dirs_in_os == 0:
+      self.total_files_in_os = self.total_files_in_db
 
   def treat_restart_at_walkloopseq(self):
     """
@@ -118,28 +136,33 @@ class FilesUpDirTreeWalker:
     if self.restart_at_walkloopseq is None:
       self.restart_at_walkloopseq = 0
 
-  def get_id_or_none_from_name_n_parentpath(self, name, parentpath):
-    sql = 'SELECT * from %(tablename)s WHERE name=? and parentpath=?;'
-    tuplevalues = (name, parentpath)
-    reslist = self.dbtree.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
-    r_id = None
-    if reslist or len(reslist) == 1:  # name and parent are UNIQUE in rows
-      row = reslist[0]
-      r_id = row[0]  # id is always index 0
-    elif len(reslist) > 1:
-      # this is considered a logical error in the database,
-      # if it happens, table schema should be inspected, there should be an "index(name, parent) UNIQUE" in the schema
-      error_msg = 'Unicity of name and parent in db is broken. There were %d found rows with same name and parent.' \
-          % len(reslist)
-      raise ValueError(error_msg)
-    return r_id
+  def load_folder_dirnodes(self, parentpath):
+    """
+    The db rows of a folder are fetched at once, when the walk enters it (instead of one or two SELECTs per file).
+    The walk visits each folder once and its rows are fetched before any of its files is processed,
+      so the writes still buffered concern other folders (or files of this one already looked up):
+      they are not executed for this read, ie the buffered_writes() batches keep their size
+    """
+    self.folder_dirnodes_by_name = {}
+    for dirnode in self.dbtree.fetch_dirnodes_in_folder(parentpath, see_pending_writes=False):
+      if dirnode is None:
+        continue
+      if dirnode.name in self.folder_dirnodes_by_name:
+        # this is considered a logical error in the database,
+        # if it happens, table schema should be inspected, there should be an "index(name, parent) UNIQUE" in the schema
+        error_msg = 'Unicity of name and parent in db is broken. There were 2+ found rows with name %s in %s.' \
+            % (dirnode.name, parentpath)
+        raise ValueError(error_msg)
+      self.folder_dirnodes_by_name[dirnode.name] = dirnode
+    self.folder_parentpath = parentpath
 
   def get_dirnode_if_name_n_parent_exists_in_db_or_none(self, name, parentpath):
-    _id = self.get_id_or_none_from_name_n_parentpath(name, parentpath)
-    if _id is None:
+    if parentpath != self.folder_parentpath:
+      self.load_folder_dirnodes(parentpath)
+    dirnode = self.folder_dirnodes_by_name.get(name)
+    if dirnode is None:
       return None
     self.n_found_files_name_n_parent_in_db += 1
-    dirnode = self.dbtree.fetch_dirnode_by_id(_id)
     return dirnode
 
   def update_db_entry_with_updated_file(self, _id, name, parentpath, sha1, bytesize, mdatetime):
@@ -153,7 +176,7 @@ class FilesUpDirTreeWalker:
       id=?;
     '''
     tuplevalues = (name, parentpath, sha1, bytesize, mdatetime, _id)
-    retval = self.dbtree.do_update_with_sql_n_tuplevalues(sql, tuplevalues)
+    retval = self.dbtree.buffer_write(sql, tuplevalues)  # written out at the next flush (see walkup_dirtree_files())
     if retval:
       self.n_updated_dbentries += 1
       print(self.n_updated_dbentries, name, parentpath)
@@ -177,11 +200,8 @@ class FilesUpDirTreeWalker:
         mdatetime
     )
 
-  def insert_db_entry_with_updated_file(self, name, parentpath, sha1, bytesize, mdatetime):
-    sql = 'INSERT into %(tablename)s (name, parentpath, sha1, bytesize, mdatetime) VALUES (?,?,?,?,?);'
-    tuplevalues = (name, parentpath, sha1, bytesize, mdatetime)
-    insert_result = self.dbtree.do_insert_with_sql_n_tuplevalues(sql, tuplevalues)
-    return insert_result
+  def insert_db_entry_with_updated_file(self, name, parentpath, sha1, bytesize, mdatetime, hashalgo):
+    return self.dbtree.add_row(name, parentpath, sha1, bytesize, mdatetime, hashalgo)
 
   def insert_db_entry_with_dirnode(self, dirnode):
     return self.insert_db_entry_with_updated_file(
@@ -189,7 +209,8 @@ class FilesUpDirTreeWalker:
         dirnode.parentpath,
         dirnode.sha1,
         dirnode.bytesize,
-        dirnode.mdatetime
+        dirnode.mdatetime,
+        dirnode.hashalgo
     )
 
   def print_screen_msg_for_file_processing(self, dirnode, screen_msg_update_insert_or_none):
@@ -201,30 +222,26 @@ class FilesUpDirTreeWalker:
       dirnode.name, sha1, '@', strf.put_ellipsis_in_str_middle(dirnode.parentpath, 50)
     )
 
-  def dbinsert_file_if_needed(self, filename, parentpath):
+  def dbinsert_file_if_needed(self, fileentry):
+    """
+    fileentry is a scdw.ScandirFileEntry, ie its size & mtime come from the walk's (cached) stat
+    """
     self.n_processed_files += 1
     if self.n_processed_files < self.restart_at_walkloopseq:
       print('Jumping', self.n_processed_files, 'until', self.restart_at_walkloopseq)
       return False
-    filepath = os.path.join(self.ongoingfolder_abspath, filename)
-    name = filename
-    try:
-      filestat = os.stat(filepath)
-    except OSError:
-      self.n_failed_filestat += 1
-      print(
-        self.n_failed_filestat, 'of', self.total_files_in_os,
-        'Could not filestat', filename
-      )
-      return False
-    bytesize = filestat.st_size
-    mdatetime = filestat.st_mtime
+    name, parentpath = fileentry.name, fileentry.parentpath
+    bytesize = fileentry.size
+    mdatetime = fileentry.mdatetime
     pydt = datetime.datetime.fromtimestamp(mdatetime)
     print(self.n_processed_files, 'of', self.total_files_in_os, name, parentpath)
     print('bytesize =', bytesize, hm.convert_to_size_w_unit(bytesize), ':: mdatetime =', mdatetime, pydt)
     dirnode = self.get_dirnode_if_name_n_parent_exists_in_db_or_none(name, parentpath)
     if dirnode:
       if dirnode.has_same_size_n_date(bytesize, mdatetime):
+        # seed the hashcache with the known sha1, so that a later rename/move of this file costs no rehashing
+        #   (in batches and without lookups, the keys already cached are kept, see write_hashcache_batches())
+        self.hashcache_seeds.append((*fileentry.cachekey, dirnode.sha1, dirnode.hashalgo))
         screen_msg_update_insert_or_none = 'DB-EXISTS size & date'
         self.print_screen_msg_for_file_processing(dirnode, screen_msg_update_insert_or_none)
         return False
@@ -237,49 +254,103 @@ class FilesUpDirTreeWalker:
       _ = self.update_db_entry_with_dirnode(dirnode, bytesize, mdatetime)
       self.print_screen_msg_for_file_processing(dirnode, screen_msg_update_insert_or_none)
       return True
+    filepath = fileentry.form_filepath(self.mountpath)
     return self.calc_sha1_n_insert_db_entry_with_fields(
-      filename, parentpath, bytesize, mdatetime, filepath
+      name, parentpath, bytesize, mdatetime, filepath, fileentry
     )
 
   def calc_sha1_n_insert_db_entry_with_fields(
-      self, name, parentpath, bytesize, mdatetime, filepath
+      self, name, parentpath, bytesize, mdatetime, filepath, fileentry=None
     ):
     """
     here name is filename, the same convention in db
+    The hashcache is looked up first: a hit (eg a renamed or moved file) is db-inserted right away.
+    Otherwise, the sha1 is calculated by the hashing pool, so the db-insert happens later,
+      when the job is collected (either here, for jobs finished in the meanwhile, or at the end of the walk)
     """
-    try:
-      sha1 = hm.calc_sha1_from_file(filepath)
-    except IOError:
+    job = hpool.HashJob(filepath, name, parentpath, bytesize, mdatetime, hashalgo=self.hashalgo)
+    if fileentry is not None:
+      job.st_dev, job.st_ino, job.mtime_ns = fileentry.dev, fileentry.inode, fileentry.mtime_ns
+      job.sha1 = self.hashcache.fetch_sha1_by_cachekey_or_none(*fileentry.cachekey, job.hashalgo)
+      if job.sha1 is not None:
+        self.n_sha1s_from_hashcache += 1
+        return self.insert_db_entry_with_hashed_job(job)
+    finished_jobs = self.hashpool.submit(job)
+    for finished_job in finished_jobs:
+      self.cache_n_insert_db_entry_with_hashed_job(finished_job)
+    return True
+
+  def insert_db_entry_with_hashed_job(self, job):
+    if job.sha1 is None:
       self.n_failed_sha1s += 1
       print(
         self.n_failed_sha1s, 'of', self.total_files_in_os,
-        'Could not sha1', name
+        'Could not sha1', job.name
       )
       return False
-    newdirnode = dn.DirNode(name, parentpath, sha1, bytesize, mdatetime)
+    newdirnode = dn.DirNode(job.name, job.parentpath, job.sha1, job.bytesize, job.mdatetime, job.hashalgo)
     _ = self.insert_db_entry_with_dirnode(newdirnode)  # row does not exist, insert it
     self.n_inserted += 1
     screen_msg_update_insert_or_none = 'DB-INSERTED'
     self.print_screen_msg_for_file_processing(newdirnode, screen_msg_update_insert_or_none)
     return True
 
-  def dbinsert_files_if_needed(self, files):
-    middlepath = self.ongoingfolder_abspath[len(self.mountpath):]
-    middlepath = middlepath.lstrip('./')
-    parentpath = '/' + middlepath
-    for filename in files:
-      _ = self.dbinsert_file_if_needed(filename, parentpath)  # returns a boolean
+  def cache_n_insert_db_entry_with_hashed_job(self, job):
+    """
+    For jobs coming from the hashing pool: the fresh sha1 is also stored in the hashcache
+    """
+    if job.sha1 is not None and job.st_ino is not None:
+      self.hashcache.store_sha1_with_cachekey(
+        job.st_dev, job.st_ino, job.bytesize, job.mtime_ns, job.sha1, job.hashalgo
+      )
+    return self.insert_db_entry_with_hashed_job(job)
+
+  def collect_remaining_hashed_jobs(self):
+    for job in self.hashpool.drain():
+      self.cache_n_insert_db_entry_with_hashed_job(job)
 
   def walkup_dirtree_files(self):
     """
-
+    The dirtree is walked with os.scandir() (see scandir_walk_mod), the restricted dirs pruned
+      and each file stat'ed once; the files in the mount_abspath folder itself are not processed.
+    The db-inserts/updates are buffered and committed in batches (see DBDirTree.buffered_writes()),
+      the hashcache's writes (same sqlitefile) are committed along with them
     """
-    for self.ongoingfolder_abspath, dirs, files in os.walk(self.mountpath):
-      if self.ongoingfolder_abspath == self.mountpath:  # this means not to process the mount_abspath folder itself
-        continue
-      if dirf.is_forbidden_dirpass(self.ongoingfolder_abspath):
-        continue
-      self.dbinsert_files_if_needed(files)
+    scandir_walker = scdw.ScandirDirTreeWalker(self.mountpath)
+    with self.dbtree.buffered_writes():
+      for fileentry in scandir_walker.generate_file_entries(include_root_files=True):
+        # all files' cachekeys are kept (the root's too), so that prune_hashcache() knows the live ones
+        self.seen_cachekeys.append(fileentry.cachekey)
+        if fileentry.parentpath != scdw.ROOT_PARENTPATH:
+          _ = self.dbinsert_file_if_needed(fileentry)  # returns a boolean
+        self.write_hashcache_batches()
+      self.write_hashcache_batches(is_final=True)
+      self.collect_remaining_hashed_jobs()
+    self.n_restricted_dirs = scandir_walker.n_restricted_dirs
+    self.n_failed_filestat += scandir_walker.n_failed_filestats
+    self.total_files_in_os, self.total_dirs_in_os = scandir_walker.get_totals(include_root=False)
+    self.prune_hashcache(scandir_walker)
+
+  def write_hashcache_batches(self, is_final=False):
+    """
+    The seen cachekeys and the sha1's to seed go to the hashcache in batches (one executemany() each)
+    """
+    if is_final or len(self.seen_cachekeys) >= SEEN_CACHEKEYS_BATCH_SIZE:
+      self.hashcache.add_seen_cachekeys(self.seen_cachekeys)
+      self.seen_cachekeys = []
+    if is_final or len(self.hashcache_seeds) >= HASHCACHE_SEEDS_BATCH_SIZE:
+      self.hashcache.seed_sha1s_if_missing(self.hashcache_seeds)
+      self.hashcache_seeds = []
+
+  def prune_hashcache(self, scandir_walker):
+    """
+    The hashcache entries whose key was not seen in the walk (gone inodes, changed files) are deleted,
+      unless some folder or file could not be read (then their entries would go too)
+    """
+    if scandir_walker.n_failed_scandirs > 0 or scandir_walker.n_failed_filestats > 0:
+      print('Hashcache not pruned: the walk was not complete.')
+      return 0
+    return self.hashcache.delete_entries_not_seen()
 
   def prune_empty_folders(self):
     n_visited, n_removed, n_failed = dirf.prune_dirtree_deleting_empty_folders(self.mountpath)
@@ -296,6 +367,7 @@ class FilesUpDirTreeWalker:
     """
     self.calc_totals()
     self.walkup_dirtree_files()
+    self.hashpool.shutdown()
     dbdeleter = dbentry_del.DBEntryWithoutCorrespondingOsEntryDeleter(self.mountpath)
     dbdeleter.process()
     self.prune_empty_folders()
@@ -343,8 +415,13 @@ class FilesUpDirTreeWalker:
     print('n_files_empty_sha1', self.n_files_empty_sha1)
     print('n_failed_filestat', self.n_failed_filestat)
     print('n_failed_sha1s', self.n_failed_sha1s)
+    print('n_sha1s_from_hashcache', self.n_sha1s_from_hashcache)
     print('n_dbentries_ins_upd', self.n_dbentries_ins_upd)
     print('n_dbentries_failed_ins_upd', self.n_dbentries_failed_ins_upd)
+    self.dbtree.report_buffered_writes()
+    self.hashpool.report()
+    self.hashcache.report()
+    iopol.get_default_policy().report()
 
 
 def get_arg_restart_at_position_or_zero():
@@ -361,16 +438,33 @@ def get_arg_restart_at_position_or_zero():
   return 0  # the default
 
 
+def get_arg_n_hash_workers_or_default():
+  """
+  This cli arg (-w=<number>) sets the number of threads that calculate sha1's
+  """
+  for arg in sys.argv:
+    if arg.startswith('-w='):
+      try:
+        arg = int(arg[len('-w='):])
+        return arg
+      except ValueError:
+        pass
+  return hpool.DEFAULT_N_HASH_WORKERS
+
+
 def process():
   start_time = datetime.datetime.now()
   print('Start Time', start_time)
   # ------------------
   src_mountpath, _ = defaults.get_src_n_trg_mountpath_args_or_default()
   restart_at_position = get_arg_restart_at_position_or_zero()
+  n_hash_workers = get_arg_n_hash_workers_or_default()
+  iopol.set_default_policy_from_args()  # --io-policy=<none|sequential|nocache>
+  dbprof.set_default_profile_from_args('bulk-walk')  # --db-profile=<none|safe|bulk-walk|read-only-report>
   treename = 'ori'  # ori stands for origin instead of target
   moved_updater = dbentry_upd.DBEntryUpdater(src_mountpath)
   moved_updater.process()
-  walker = FilesUpDirTreeWalker(src_mountpath, treename, restart_at_position)
+  walker = FilesUpDirTreeWalker(src_mountpath, treename, restart_at_position, n_hash_workers)
   walker.process()
   finish_time = datetime.datetime.now()
   elapsed_time = finish_time - start_time
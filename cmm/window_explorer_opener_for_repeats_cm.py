@@ -18,7 +18,6 @@ import llib.db.dbdirtree_mod as dbt
 import llib.db.dbrepeats_mod as dbr
 import default_settings as defaults
 import models.entries.dirnode_mod as dn
-import llib.hashfunctions.hash_mod as hm
 
 
 class RepeatVerifier:
@@ -30,7 +29,7 @@ class RepeatVerifier:
     self.sql_select_limit = sql_select_limit
     if sql_select_limit is None:
       self.sql_select_limit = defaults.SQL_SELECT_LIMIT_DEFAULT
-    self.offset = 0
+    self.last_id = 0  # keyset paging: the next chunk starts after this id
     self.chunk_rounds = 0
     self.n_item = 0
     self.db_fetch_ended = False  # this boolean stops the main while-loop in process()
@@ -77,14 +76,16 @@ class RepeatVerifier:
     else:
       print(' ********  NO REPEATS ******** acumulated repeats :', self.n_sha1_repeats)
 
-  def fetch_rows_with_offset(self):
+  def fetch_rows_after_last_id(self):
+    """
+    Rows are paged by id (not by OFFSET), so rows deleted along the way do not make the next chunk skip rows
+    """
     self.chunk_rounds += 1
-    sql_limit_n_offset_paramdict = {'limit': self.sql_select_limit, 'offset': self.offset}
-    sql_limit_n_offset = 'LIMIT %(limit)d OFFSET %(offset)d;' % sql_limit_n_offset_paramdict
-    sql = 'SELECT * from %(tablename)s ORDER by parentpath ' + sql_limit_n_offset
-    rowlist = self.dbtree.do_select_with_sql_without_tuplevalues(sql)
-    print('len', len(rowlist), 'sql', sql)
-    self.offset += self.sql_select_limit
+    sql = 'SELECT * from %(tablename)s WHERE id > ? ORDER BY id LIMIT ' + str(int(self.sql_select_limit)) + ';'
+    rowlist = self.dbtree.do_select_with_sql_n_tuplevalues(sql, (self.last_id, ))
+    print('len', len(rowlist), 'sql', sql, 'last_id', self.last_id)
+    if len(rowlist) > 0:
+      self.last_id = rowlist[-1][0]
     return rowlist
 
   def verify_sha1s_in_db(self):
@@ -92,7 +93,7 @@ class RepeatVerifier:
     1 id 2 hkey 3 name 4 parentpath 5 is_file 6 sha1 7 bytesize 8 mdatetime
 
     """
-    rowlist = self.fetch_rows_with_offset()
+    rowlist = self.fetch_rows_after_last_id()
     if len(rowlist) < self.sql_select_limit:
       self.db_fetch_ended = True
     for rowtuplevalues in rowlist:
@@ -129,6 +130,7 @@ class RepeatsGrabber:
   def __init__(self, mountpath):
     self.mountpath = mountpath
     self.dbtree = dbt.DBDirTree(self.mountpath)
+    self.dbrepeat = dbr.DBRepeat(self.mountpath)
     self.total_files_in_db = 0
     self.total_sha1s_in_db = 0
     self.n_unique_files_in_db = self.dbtree.count_unique_sha1s_as_int()
@@ -145,24 +147,21 @@ class RepeatsGrabber:
   def total_repeats_in_db(self):
     return self.total_files_in_db - self.total_sha1s_in_db
 
-  def open_window_explorer_for_user(self, n_repeats, sha1):
+  def open_window_explorer_for_user(self, n_repeats, sha1, rows):
     print('Opening Window for', sha1.hex(), 'with', n_repeats, 'repeats')
-    sql = 'SELECT * FROM %(tablename)s WHERE sha1=?;'
-    tuplevalues = (sha1, )
-    rows = self.dbtree.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
     print('Number of rows found', len(rows))
     for n_row, row in enumerate(rows):
       self.n_processed_repeated_files += 1
-      idx = self.dbtree.fieldnames.index('name')
+      idx = self.dbrepeat.fieldnames.index('name')
       name = row[idx]
       _, ext = os.path.splitext(name)
       # if ext in defaults.EXTENSIONS_IN_SHA1_VERIFICATION:
       self.go_open_windows_for_repeats(n_repeats, row, n_row)
 
   def go_open_windows_for_repeats(self, n_repeats, row, n_row):
-    idx = self.dbtree.fieldnames.index('name')
+    idx = self.dbrepeat.fieldnames.index('name')
     name = row[idx]
-    idx = self.dbtree.fieldnames.index('parentpath')
+    idx = self.dbrepeat.fieldnames.index('parentpath')
     parentpath = row[idx]
     _, ext = os.path.splitext(name)
     print(
@@ -183,20 +182,16 @@ class RepeatsGrabber:
       _ = input(screen_msg)
 
   def fetch_distinct_sha1s(self):
-    sql = 'SELECT DISTINCT sha1, COUNT(id) as c FROM %(tablename)s GROUP by sha1 having c > 1;'
-    generator_rows = self.dbtree.do_select_sql_n_tuplevalues_w_limit_n_offset(sql)
-    for generated_rows in generator_rows:
-      for i, row in enumerate(generated_rows):
-        sha1 = row[0]
-        n_repeats = row[1]
-        print(
-          i+1, '/', self.total_repeats_in_db,
-          'count', n_repeats, sha1.hex()
-        )
-        if sha1 == hm.EMPTY_SHA1_AS_BIN:
-          print('Jumping EMPTY_SHA1 ::', hm.EMPTY_SHA1HEX_STR)
-          continue
-        self.open_window_explorer_for_user(n_repeats, sha1)
+    """
+    The repeats come from table file_repeats (kept current from files_in_tree), the most wasteful first,
+      the empty files (bytesize 0, ie EMPTY_SHA1) are not taken
+    """
+    for i, (sha1, _, n_repeats, _, rows) in enumerate(self.dbrepeat.iter_repeat_groups(min_bytesize=1)):
+      print(
+        i+1, '/', self.total_repeats_in_db,
+        'count', n_repeats, sha1.hex()
+      )
+      self.open_window_explorer_for_user(n_repeats, sha1, rows)
 
   def as_dict(self):
     outdict = {
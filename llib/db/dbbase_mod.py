@@ -1,7 +1,138 @@
 #!/usr/bin/env python3
+import contextlib
+import datetime
 import os
 import sqlite3
+import threading
+import llib.db.dbprofile_mod as dbprof
+import llib.db.dbquerytiming_mod as dbqt
+import llib.db.dbutil as dbu
 import default_settings as ls
+SCHEMA_VERSION_TABLENAME = 'schema_version'
+# the largest sqlitefile a read replica takes (it's also limited to half the free RAM, see fits_memory_budget())
+READ_REPLICA_MAX_BYTES_DEFAULT = 1024 * 1024 * 1024
+
+
+class ThreadConnection:
+  """
+  The open connection of one thread to one sqlitefile plus its session nesting depth.
+  conn is None when closed (see DBBase.close()), the next get_connection() reopens it.
+  """
+
+  def __init__(self, sqlitefile_abspath):
+    self.sqlitefile_abspath = sqlitefile_abspath
+    self.conn = None
+    self.session_depth = 0
+
+  def get_or_open(self):
+    if self.conn is None:
+      read_replica = get_read_replica(self.sqlitefile_abspath)
+      if read_replica is not None:
+        self.conn = read_replica.connect()
+        self.session_depth = 0
+        return self.conn
+      # check_same_thread=False only lets close() (from another thread) close it, it's used by its own thread
+      # the factory times the statements when the timing is on (see dbquerytiming_mod)
+      self.conn = sqlite3.connect(
+        self.sqlitefile_abspath, check_same_thread=False, factory=dbqt.get_connection_factory()
+      )
+      # so that the rows deleted by an INSERT OR REPLACE also fire the delete triggers (eg DBDirTree's stats)
+      self.conn.execute('PRAGMA recursive_triggers = ON;')
+      # the run's PRAGMA profile (eg WAL for a walk, query_only for a report), see dbprofile_mod
+      dbprof.apply_profile(self.conn)
+      self.session_depth = 0
+    return self.conn
+
+  def close(self):
+    if self.conn is None:
+      return
+    try:
+      self.conn.commit()
+      self.conn.close()
+    except sqlite3.ProgrammingError:
+      # already closed
+      pass
+    self.conn = None
+
+
+_threadlocal = threading.local()  # _threadlocal.thread_connections = {sqlitefile_abspath: ThreadConnection}
+_all_thread_connections = []  # the ThreadConnection's of all threads, for close()
+_all_thread_connections_lock = threading.Lock()
+
+
+class ReadReplica:
+  """
+  An in-memory copy (sqlite3's backup(), ie with its indexes) of a sqlitefile, see DBBase.open_read_replica().
+    It's a shared-cache memory db, so that each thread's connection (see ThreadConnection) sees the same copy,
+    keeper_conn keeps it alive until close(). Its connections are query_only, ie a write raises an error
+    instead of being lost with the replica.
+  """
+
+  def __init__(self, sqlitefile_abspath):
+    self.sqlitefile_abspath = sqlitefile_abspath
+    self.uri = 'file:read_replica_%d?mode=memory&cache=shared' % id(self)
+    self.keeper_conn = None
+    self.n_bytes = 0
+
+  def load_from(self, disk_conn):
+    self.keeper_conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+    disk_conn.backup(self.keeper_conn)
+    self.n_bytes = count_db_bytes(self.keeper_conn)
+
+  def connect(self):
+    conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False, factory=dbqt.get_connection_factory())
+    conn.execute('PRAGMA query_only = ON;')
+    return conn
+
+  def close(self):
+    if self.keeper_conn is not None:
+      self.keeper_conn.close()
+      self.keeper_conn = None
+
+
+_read_replicas = {}  # {sqlitefile_abspath: ReadReplica}, the sqlitefiles whose reads are served from memory
+_read_replicas_lock = threading.Lock()
+
+
+def get_read_replica(sqlitefile_abspath):
+  with _read_replicas_lock:
+    return _read_replicas.get(sqlitefile_abspath)
+
+
+def count_db_bytes(conn):
+  page_count = conn.execute('PRAGMA page_count;').fetchone()[0]
+  page_size = conn.execute('PRAGMA page_size;').fetchone()[0]
+  return page_count * page_size
+
+
+def fits_memory_budget(n_bytes, max_bytes=None):
+  """
+  True if n_bytes is within max_bytes (default READ_REPLICA_MAX_BYTES_DEFAULT)
+    and within half the free RAM (where os.sysconf() tells it, ie on Linux)
+  """
+  if max_bytes is None:
+    max_bytes = READ_REPLICA_MAX_BYTES_DEFAULT
+  if n_bytes > max_bytes:
+    return False
+  try:
+    free_bytes = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+  except (AttributeError, ValueError, OSError):
+    return True
+  return n_bytes <= free_bytes // 2
+
+
+def get_thread_connection(sqlitefile_abspath):
+  thread_connections = getattr(_threadlocal, 'thread_connections', None)
+  if thread_connections is None:
+    thread_connections = {}
+    _threadlocal.thread_connections = thread_connections
+  thread_connection = thread_connections.get(sqlitefile_abspath)
+  if thread_connection is None:
+    thread_connection = ThreadConnection(sqlitefile_abspath)
+    thread_connections[sqlitefile_abspath] = thread_connection
+    with _all_thread_connections_lock:
+      _all_thread_connections.append(thread_connection)
+  return thread_connection
 
 
 class DBBase:
@@ -19,6 +150,42 @@ class DBBase:
 
   SQLITE_INLOCUS_FILENAME = '.updirfileentries.sqlite'
   SQLITE_TREEFILES_TABLENAME = 'files_in_tree_db'
+
+  Connections:
+    get_connection() returns the calling thread's open connection to the instance's sqlitefile,
+      ie the methods below reuse it instead of reconnecting at each call (a million-file walk
+      used to open a million-plus connections). Worker threads get their own connections.
+    The connection is per (thread, sqlitefile), not per instance: the tables living in the same sqlitefile
+      (eg files_in_tree, hash_cache and tree_settings) share it, so that a transaction held by one instance
+      does not lock out ("database is locked") another instance of the same thread.
+    Outside a session, each write is committed right away (as before).
+    Inside a session (the context manager session()), commits are deferred to the session's end,
+      ie all writes in it (to any table of the sqlitefile) make up one transaction,
+      rolled back if an exception leaves the session:
+        with dbtree.session():
+          for ...:
+            dbtree.do_insert_with_sql_n_tuplevalues(sql, tuplevalues)
+    close() closes the connections to the sqlitefile (of all threads), a later call reconnects.
+    Each connection gets the run's PRAGMA profile (journal_mode, synchronous, cache, etc, see dbprofile_mod).
+    The statements can be timed per SQL template (opt-in, see dbquerytiming_mod).
+
+  Read replica:
+    open_read_replica() copies the sqlitefile into memory (with its indexes) and serves the reads from the copy,
+      for the read-only scripts (eg the reports in cmm/rpt) that issue many small queries against a slow disk.
+      All tables of the sqlitefile (ie all instances using it) go to the copy, which is read-only:
+      a write raises sqlite3.OperationalError. A sqlitefile above the memory budget (see fits_memory_budget())
+      is left on disk, ie open_read_replica() returns False and the reads go to disk as before.
+        with dbtree.read_replica():
+          for ...:
+            dbtree.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
+
+  Schema migrations:
+    A subclass lists its migrations in get_schema_migrations() as ordered (version, description, method) tuples,
+      method receiving the cursor. migrate_schema() applies, in version order, those above the table's
+      current version and records each one in table schema_version (one row per tablename & version),
+      so that sqlitefiles created by older versions of the scripts are brought up to date when opened.
+    Migrations should be idempotent (eg CREATE INDEX IF NOT EXISTS), for a DDL statement
+      is committed by itself, ie an interrupted run may have applied a migration without recording it.
   """
 
   _mount_abspath = None
@@ -26,9 +193,15 @@ class DBBase:
   default_tablename = None
   default_limit = 50
   default_offset = 0
+  default_keyset_page_size = 500
+  # the UNIQUE fields that identify a row for the upserts (see do_upsert_with_tuplevalues()), None means no upserts
+  upsert_conflict_fieldnames = None
+  # True when tablename is a view written to by INSTEAD OF triggers (see count_changed_rows())
+  is_view = False
   tablename = None
 
   def __init__(self, mount_abspath=None, inlocus_sqlite_filename=None):
+    self.is_table_ensured = False
     self.mount_abspath = mount_abspath
     self.sqlitedir_abspath = self.mount_abspath  # it's the same as mount abspath, treat_attributes() will check it
     self.inlocus_sqlite_filename = inlocus_sqlite_filename
@@ -47,16 +220,202 @@ class DBBase:
     self.sqlitefile_abspath = os.path.join(self.sqlitedir_abspath, self.inlocus_sqlite_filename)
     if not os.path.isfile(self.sqlitefile_abspath):
       # create filepath with a connection call
-      _ = sqlite3.Connection(self.sqlitefile_abspath)
+      _ = self.get_connection()
       # try again
       if not os.path.isfile(self.sqlitefile_abspath):
         error_msg = 'Sqlitefile (%s) does not exist.' % self.sqlitefile_abspath
         raise OSError(error_msg)
-    self.sqlite_createtable_if_not_exists()
+    self.ensure_table_exists()
     return
 
   def get_connection(self):
-    return sqlite3.Connection(self.sqlitefile_abspath)
+    """
+    Returns this thread's connection to the sqlitefile, opening it at the first call (in the thread)
+      Writes buffered in the instance (if any) are executed first, so that what follows sees them.
+    """
+    conn = self.get_connection_leaving_pending_writes()
+    self.execute_pending_writes(conn)
+    return conn
+
+  def get_connection_leaving_pending_writes(self):
+    """
+    As get_connection(), but the buffered writes stay buffered: only for reads that cannot concern them,
+      as executing them at each read would break the batches into one-row executemany()'s
+    """
+    return get_thread_connection(self.sqlitefile_abspath).get_or_open()
+
+  def execute_pending_writes(self, conn):
+    """
+    This method is implemented in inherited classes that buffer writes (see DBDirTree.add_row())
+    """
+    pass
+
+  def is_in_session(self):
+    return get_thread_connection(self.sqlitefile_abspath).session_depth > 0
+
+  def commit_unless_in_session(self, conn):
+    if not self.is_in_session():
+      conn.commit()
+
+  def count_changed_rows(self, cursor, conn, n_total_changes_before):
+    """
+    Returns the cursor's rowcount, except when the table is a view (see is_view):
+      sqlite does not count the rows written by a view's INSTEAD OF triggers,
+      so it returns 1 if the statement changed anything, 0 otherwise (ie exact for the one-row statements)
+    """
+    if not self.is_view:
+      return cursor.rowcount
+    return 1 if conn.total_changes > n_total_changes_before else 0
+
+  def is_read_replica(self):
+    return get_read_replica(self.sqlitefile_abspath) is not None
+
+  def open_read_replica(self, max_bytes=None):
+    """
+    Returns True if the reads now go to the in-memory copy, False if the sqlitefile is kept on disk
+      (for it exceeds the memory budget), see the Read replica section in the class docstring
+    """
+    if self.is_read_replica():
+      return True
+    if self.is_in_session():
+      error_msg = 'Read replica error: it cannot be opened inside a session.'
+      raise ValueError(error_msg)
+    disk_conn = self.get_connection()
+    disk_conn.commit()
+    n_bytes = count_db_bytes(disk_conn)
+    if not fits_memory_budget(n_bytes, max_bytes):
+      print('Read replica: sqlitefile', self.sqlitefile_abspath, 'has', n_bytes, 'bytes, over budget, kept on disk')
+      return False
+    read_replica = ReadReplica(self.sqlitefile_abspath)
+    read_replica.load_from(disk_conn)
+    # the thread connections reopen (to the replica) at their next use
+    self.close()
+    with _read_replicas_lock:
+      _read_replicas[self.sqlitefile_abspath] = read_replica
+    return True
+
+  def close_read_replica(self):
+    """
+    The reads go back to the sqlitefile on disk
+    """
+    with _read_replicas_lock:
+      read_replica = _read_replicas.pop(self.sqlitefile_abspath, None)
+    if read_replica is None:
+      return False
+    self.close()
+    read_replica.close()
+    return True
+
+  @contextlib.contextmanager
+  def read_replica(self, max_bytes=None):
+    """
+    Opens the read replica for the block (if it fits the memory budget), closing it at the block's exit
+    """
+    was_opened_here = not self.is_read_replica() and self.open_read_replica(max_bytes)
+    try:
+      yield self
+    finally:
+      if was_opened_here:
+        self.close_read_replica()
+
+  @contextlib.contextmanager
+  def session(self):
+    """
+    Groups the writes of this thread into one transaction, committed at the end of the (outermost) session
+    """
+    thread_connection = get_thread_connection(self.sqlitefile_abspath)
+    conn = thread_connection.get_or_open()
+    thread_connection.session_depth += 1
+    try:
+      yield conn
+    except BaseException:
+      thread_connection.session_depth -= 1
+      if thread_connection.session_depth == 0:
+        conn.rollback()
+      raise
+    thread_connection.session_depth -= 1
+    if thread_connection.session_depth == 0:
+      conn.commit()
+
+  def close(self):
+    """
+    Commits and closes the connections to this instance's sqlitefile (of all threads)
+    """
+    with _all_thread_connections_lock:
+      thread_connections = [
+        tc for tc in _all_thread_connections if tc.sqlitefile_abspath == self.sqlitefile_abspath
+      ]
+    for thread_connection in thread_connections:
+      thread_connection.close()
+
+  def ensure_table_exists(self):
+    """
+    The create-table (and the subclasses' column migrations) run once per instance
+    """
+    if not self.is_table_ensured:
+      with dbprof.allowing_schema_writes(self.get_connection()):
+        self.sqlite_createtable_if_not_exists()
+      self.is_table_ensured = True
+
+  def get_schema_migrations(self):
+    """
+    This method is to be implemented in child-inherited classes that have migrations
+      it returns a list of (version, description, method) with method(cursor)
+    """
+    return []
+
+  @staticmethod
+  def create_schema_version_table_if_not_exists(cursor):
+    sql = '''CREATE TABLE IF NOT EXISTS "%(tablename)s" (
+      tablename TEXT NOT NULL,
+      version INTEGER NOT NULL,
+      description TEXT,
+      applied_at TEXT,
+      PRIMARY KEY(tablename, version)
+    )''' % {'tablename': SCHEMA_VERSION_TABLENAME}
+    cursor.execute(sql)
+
+  def fetch_schema_version_with_cursor(self, cursor):
+    sql = 'SELECT max(version) FROM "%(schematable)s" WHERE tablename=?;' % {'schematable': SCHEMA_VERSION_TABLENAME}
+    rows = cursor.execute(sql, (self.tablename, )).fetchall()
+    if len(rows) == 0 or rows[0][0] is None:
+      return 0
+    return rows[0][0]
+
+  def get_schema_version(self):
+    """
+    Returns the version of the last migration applied to the table (0 if none)
+    """
+    self.ensure_table_exists()
+    conn = self.get_connection()
+    cursor = conn.cursor()
+    self.create_schema_version_table_if_not_exists(cursor)
+    version = self.fetch_schema_version_with_cursor(cursor)
+    cursor.close()
+    return version
+
+  def migrate_schema(self, cursor):
+    """
+    Applies the pending migrations in version order, returns the number of migrations applied
+    """
+    migrations = sorted(self.get_schema_migrations(), key=lambda m: m[0])
+    if len(migrations) == 0:
+      return 0
+    self.create_schema_version_table_if_not_exists(cursor)
+    current_version = self.fetch_schema_version_with_cursor(cursor)
+    n_applied = 0
+    for version, description, method in migrations:
+      if version <= current_version:
+        continue
+      print('Migrating table', self.tablename, 'to schema version', version, ':', description)
+      method(cursor)
+      sql = 'INSERT INTO "%(schematable)s" (tablename, version, description, applied_at) VALUES (?, ?, ?, ?);' \
+            % {'schematable': SCHEMA_VERSION_TABLENAME}
+      applied_at = datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
+      cursor.execute(sql, (self.tablename, version, description, applied_at))
+      current_version = version
+      n_applied += 1
+    return n_applied
 
   def form_fields_line_for_createtable(self):
     """
@@ -87,7 +446,6 @@ class DBBase:
     # print(sql)
     # print('Created table', tablename)
     cursor.close()
-    conn.close()
 
   @property
   def fieldnames(self):
@@ -106,11 +464,11 @@ class DBBase:
     sql = 'DELETE FROM %(tablename)s;' % {'tablename': self.tablename}
     conn = self.get_connection()
     cursor = conn.cursor()
-    delete_result = cursor.execute(sql)
-    n_rows_deleted = delete_result.rowcount  # debug at this point, another option conn.total_changes
-    conn.commit()
+    n_total_changes_before = conn.total_changes
+    _ = cursor.execute(sql)
+    n_rows_deleted = self.count_changed_rows(cursor, conn, n_total_changes_before)
+    self.commit_unless_in_session(conn)
     cursor.close()
-    conn.close()
     return n_rows_deleted
 
   def delete_ids(self, delete_ids):
@@ -122,23 +480,23 @@ class DBBase:
     cursor = conn.cursor()
     for _id in delete_ids:
       tuplevalues = (_id,)
-      delete_result = cursor.execute(sql, tuplevalues)
-      n_rows_deleted = delete_result.rowcount  # debug at this point, another option conn.total_changes
+      n_total_changes_before = conn.total_changes
+      _ = cursor.execute(sql, tuplevalues)
+      n_rows_deleted = self.count_changed_rows(cursor, conn, n_total_changes_before)
       total_rows_deleted += n_rows_deleted
-    conn.commit()
+    self.commit_unless_in_session(conn)
     cursor.close()
-    conn.close()
     return total_rows_deleted
 
   def delete_with_sql_n_tuplevalues(self, sql, tuplevalues):
     sql = sql % {'tablename': self.tablename}
     conn = self.get_connection()
     cursor = conn.cursor()
-    delete_result = cursor.execute(sql, tuplevalues)
-    conn.commit()
-    n_rows_deleted = delete_result.rowcount  # debug at this point, another option conn.total_changes
+    n_total_changes_before = conn.total_changes
+    _ = cursor.execute(sql, tuplevalues)
+    self.commit_unless_in_session(conn)
+    n_rows_deleted = self.count_changed_rows(cursor, conn, n_total_changes_before)
     cursor.close()
-    conn.close()
     return n_rows_deleted
 
   def delete_row_by_id(self, _id):
@@ -148,22 +506,22 @@ class DBBase:
     tuplevalues = (_id, )
     conn = self.get_connection()
     cursor = conn.cursor()
-    delete_result = cursor.execute(sql, tuplevalues)
-    n_rows_deleted = delete_result.rowcount  # debug at this point, another option conn.total_changes
-    conn.commit()
+    n_total_changes_before = conn.total_changes
+    _ = cursor.execute(sql, tuplevalues)
+    n_rows_deleted = self.count_changed_rows(cursor, conn, n_total_changes_before)
+    self.commit_unless_in_session(conn)
     cursor.close()
-    conn.close()
     return n_rows_deleted
 
   def delete_row_with_params(self, sql, tuplevalues):
     sql = sql % {'tablename': self.tablename}
     conn = self.get_connection()
     cursor = conn.cursor()
-    delete_result = cursor.execute(sql, tuplevalues)
-    n_rows_deleted = delete_result.rowcount  # debug at this point, another option conn.total_changes
-    conn.commit()
+    n_total_changes_before = conn.total_changes
+    _ = cursor.execute(sql, tuplevalues)
+    n_rows_deleted = self.count_changed_rows(cursor, conn, n_total_changes_before)
+    self.commit_unless_in_session(conn)
     cursor.close()
-    conn.close()
     return n_rows_deleted
 
   def fetch_row_by_id(self, _id):
@@ -174,7 +532,6 @@ class DBBase:
     fetch_result = cursor.execute(sql, tuplevalues)
     result_tuple_list = fetch_result.fetchall()
     cursor.close()
-    conn.close()
     return result_tuple_list
 
   def count_rows(self):
@@ -184,7 +541,6 @@ class DBBase:
     fetch_result = cursor.execute(sql)
     result_tuple_list = fetch_result.fetchall()
     cursor.close()
-    conn.close()
     return result_tuple_list
 
   def count_rows_as_int(self):
@@ -226,9 +582,56 @@ class DBBase:
       offset += limit
       sql = sql % {'tablename': self.tablename, 'limit': limit, 'offset': offset}
     cursor.close()
-    conn.close()
     return None  # the statement "yield" above returns each chunk of data limit/offset by limit/offset
 
+  def do_select_rows_by_keyset(
+      self, where_clause=None, tuplevalues=None, page_size=None,
+      fields_line='*', keyfield='id', groupby_clause=None
+    ):
+    """
+    Yields the rows one by one, fetching them page by page in keyfield order, ie each page is
+      SELECT <fields_line> FROM <table> WHERE (<where_clause>) AND <keyfield> > <last key> ORDER BY <keyfield> LIMIT k
+    Unlike LIMIT/OFFSET (see do_select_all_w_limit_n_offset()), a page costs the same whatever its position
+      (an index seek instead of skipping the offset's rows), and deleting or inserting rows along the way
+      does not make the next pages skip or repeat rows.
+
+    where_clause & tuplevalues: an optional filter, eg ('parentpath LIKE ?', ('/a/%', ))
+    fields_line & keyfield: the key's value is taken from each row's first column,
+      ie keyfield must be the first field in fields_line (with '*' it's id, at index 0);
+      it must be unique in the results (eg id, or the GROUP BY field)
+    groupby_clause: an optional 'GROUP BY ... [HAVING ...]' (the key condition filters before the grouping)
+    """
+    limit = self.default_keyset_page_size if page_size is None else int(page_size)
+    tuplevalues = tuple(tuplevalues) if tuplevalues else tuple()
+    where_line = '(%s)' % where_clause if where_clause else '1'
+    groupby_line = groupby_clause if groupby_clause else ''
+    sql_first = 'SELECT %(fields)s FROM %(tablename)s WHERE %(where)s %(groupby)s ORDER BY %(key)s LIMIT %(limit)d;'
+    sql_next = 'SELECT %(fields)s FROM %(tablename)s WHERE %(where)s AND %(key)s > ? %(groupby)s ' \
+               'ORDER BY %(key)s LIMIT %(limit)d;'
+    interpol_dict = {
+      'fields': fields_line, 'tablename': self.tablename, 'where': where_line,
+      'groupby': groupby_line, 'key': keyfield, 'limit': limit
+    }
+    sql_first = sql_first % interpol_dict
+    sql_next = sql_next % interpol_dict
+    self.ensure_table_exists()
+    last_key = None
+    while True:
+      conn = self.get_connection()
+      cursor = conn.cursor()
+      if last_key is None:
+        rows = cursor.execute(sql_first, tuplevalues).fetchall()
+      else:
+        rows = cursor.execute(sql_next, tuplevalues + (last_key, )).fetchall()
+      cursor.close()
+      if len(rows) == 0:
+        break
+      last_key = rows[-1][0]
+      for row in rows:
+        yield row
+      if len(rows) < limit:
+        break
+
   def do_select_with_sql_wo_tuplevalues_w_limit_n_offset(self, sql, plimit=None, poffset=None):
     return self.do_select_sql_n_tuplevalues_w_limit_n_offset(sql, None, plimit, poffset)
 
@@ -241,6 +644,7 @@ class DBBase:
     IMPORTANT: this method cannot be used when record-deletions will occur along the way,
        because the limit/offset will skip ahead the same amount of deleted records,
        those not entering the underlying verifying in code
+    The scripts use do_select_rows_by_keyset() instead, which has neither this problem nor OFFSET's cost.
     """
     limit = plimit
     if limit is None:
@@ -268,7 +672,6 @@ class DBBase:
       sql = 'select * from %(tablename)s LIMIT %(limit)d OFFSET %(offset)d ;' \
             % {'tablename': self.tablename, 'limit': limit, 'offset': offset}
     cursor.close()
-    conn.close()
     return None  # the statement "yield" above returns each chunk of data limit/offset by limit/offset
 
   def do_select_all(self):
@@ -278,29 +681,26 @@ class DBBase:
     fetch_result = cursor.execute(sql)
     result_tuple_list = fetch_result.fetchall()
     cursor.close()
-    conn.close()
     return result_tuple_list
 
   def do_select_with_sql_without_tuplevalues(self, sql):
-    self.sqlite_createtable_if_not_exists()
+    self.ensure_table_exists()
     sql = sql % {'tablename': self.tablename}
     conn = self.get_connection()
     cursor = conn.cursor()
     fetch_result = cursor.execute(sql)
     result_tuple_list = fetch_result.fetchall()
     cursor.close()
-    conn.close()
     return result_tuple_list
 
   def do_select_with_sql_n_tuplevalues(self, sql, tuplevalues):
-    self.sqlite_createtable_if_not_exists()
+    self.ensure_table_exists()
     sql = sql % {'tablename': self.tablename}
     conn = self.get_connection()
     cursor = conn.cursor()
     fetch_result = cursor.execute(sql, tuplevalues)
     result_tuple_list = fetch_result.fetchall()
     cursor.close()
-    conn.close()
     return result_tuple_list
 
   def fetch_rowlist_by_id(self, _id):
@@ -324,10 +724,68 @@ class DBBase:
           return self.do_update_with_all_fields_with_tuplevalues(tuplevalues)
     return False  # ie record was not updated for contents are the same
 
+  @staticmethod
+  def is_upsert_supported():
+    """
+    INSERT ... ON CONFLICT DO UPDATE exists from sqlite 3.24 on
+    """
+    return sqlite3.sqlite_version_info >= (3, 24, 0)
+
+  def can_upsert(self):
+    return self.upsert_conflict_fieldnames is not None and self.is_upsert_supported()
+
+  def form_upsert_sql(self, fieldnames=None):
+    """
+    fieldnames defaults to all fields but id
+    """
+    if fieldnames is None:
+      fieldnames = self.fieldnames[1:]
+    return dbu.prep_upsert_sql_from_fieldnames(fieldnames, self.upsert_conflict_fieldnames)
+
+  def do_upsert_with_tuplevalues(self, tuplevalues):
+    """
+    Inserts the row or, if its upsert_conflict_fieldnames (eg name & parentpath) already exist, updates it,
+      all in one statement. tuplevalues is a whole row as in the table (its id, at index 0, is not used).
+    Returns True if the row was inserted or changed, False if it was already there with the same values
+    """
+    return self.do_upsert_rows([tuplevalues]) == 1
+
+  def do_upsert_rows(self, rows):
+    """
+    The bulk variant: upserts an iterable of whole rows (see do_upsert_with_tuplevalues()) with one executemany()
+      in one transaction, returns the number of rows inserted or changed
+    """
+    sql = self.form_upsert_sql() % {'tablename': self.tablename}
+    conn = self.get_connection()
+    cursor = conn.cursor()
+    result = cursor.executemany(sql, (tuple(row[1:]) for row in rows))
+    n_changed = max(result.rowcount, 0)
+    cursor.close()
+    self.commit_unless_in_session(conn)
+    return n_changed
+
+  def do_upsert_with_dict(self, pdict):
+    """
+    pdict has the fields to upsert (they must include the upsert_conflict_fieldnames), the others keep their values
+    """
+    fieldnames = list(pdict.keys())
+    sql = self.form_upsert_sql(fieldnames) % {'tablename': self.tablename}
+    tuplevalues = tuple(pdict[fieldname] for fieldname in fieldnames)
+    conn = self.get_connection()
+    cursor = conn.cursor()
+    result = cursor.execute(sql, tuplevalues)
+    was_changed = result.rowcount == 1
+    cursor.close()
+    self.commit_unless_in_session(conn)
+    return was_changed
+
   def do_insert_or_update_with_tuplevalues(self, tuplevalues):
     """
     returns a boolean ie True if inserted/updated False otherwise ie no inserts or updates happened
+      Tables that have upsert_conflict_fieldnames do it in one statement (see do_upsert_with_tuplevalues())
     """
+    if self.can_upsert():
+      return self.do_upsert_with_tuplevalues(tuplevalues)
     idx = self.fieldnames.index('name')
     name = tuplevalues[idx]
     idx = self.fieldnames.index('parentpath')
@@ -374,14 +832,14 @@ class DBBase:
     sql = sql % {'tablename': self.tablename}
     print('do_update =>', tuplevalues)
     try:
-      retval = cursor.execute(sql, tuplevalues)
-      if retval and retval.rowcount == 1:
+      n_total_changes_before = conn.total_changes
+      _ = cursor.execute(sql, tuplevalues)
+      if self.count_changed_rows(cursor, conn, n_total_changes_before) == 1:
         was_updated = True
     except sqlite3.IntegrityError:
       was_updated = False
     cursor.close()
-    conn.commit()
-    conn.close()
+    self.commit_unless_in_session(conn)
     return was_updated
 
   def do_insert_with_sql_n_tuplevalues(self, sql, tuplevalues):
@@ -394,8 +852,7 @@ class DBBase:
     except sqlite3.IntegrityError:
       was_inserted = False
     cursor.close()
-    conn.commit()
-    conn.close()
+    self.commit_unless_in_session(conn)
     return was_inserted
 
 
@@ -5,23 +5,76 @@ This module (dbdirtree_mod.py) contains:
 
 This class models db-table files_in_tree and inherits from class DBBase
   in module dbbase_mod. The parent class contains most of the functionalities available.
+
+Field hashalgo tells which hash algorithm produced the content hash kept in field sha1
+  (the field kept its historical name): 'sha1' (the default) or another one in hash_mod.HASHALGO_FACTORIES.
+  Content hashes are only comparable when their hashalgo's are the same.
+
+The table's schema is versioned (see get_schema_migrations() here and migrate_schema() in DBBase),
+  ie sqlitefiles created by older versions are migrated (columns, indexes) when they're opened.
+
+Buffered writes:
+  add_row(), update_row() and delete_row() keep their statements in memory and write them out
+    with executemany(), one transaction per flush, every flush_n_rows rows or flush_secs seconds,
+    instead of one transaction (ie one fsync) per row, which dominates a walk on flash media:
+      with dbtree.buffered_writes():
+        for ...:
+          dbtree.add_row(name, parentpath, sha1, bytesize, mdatetime, hashalgo)
+  The block's exit does the final flush (also when an exception leaves it, the rows written so far are kept).
+  While the block is open, the other writes to the same sqlitefile (eg the hashcache's) are committed
+    along with the flushes (see DBBase.session()). Outside a block, each row is flushed right away.
+  Any other db call on the instance (eg a select) first executes the pending rows (without committing them),
+    ie the instance reads its own writes.
+
+Stats:
+  stats() returns the number of rows, the total bytes and the number of distinct (sha1, hashalgo)
+    from a one-row table kept current by triggers on files_in_tree (with a per-sha1 refcount table),
+    count_rows_as_int(), count_unique_sha1s_as_int() and total_files() read it instead of scanning the table.
+
+Normalized storage (optional, see normalize_storage() & flatten_storage()):
+  The folders go to table files_in_tree_dirs (id, parent_id, name) and the files to table files_in_tree_files
+    with a dir_id in place of parentpath, files_in_tree becomes a view (with parentpath) written to by triggers,
+    ie the callers' SQL is the same in both modes. Each parentpath string is then stored once,
+    and rename_dir() renames a folder by updating its dirs row (and its subfolders' paths), not its files' rows.
 """
+import contextlib
 import datetime
 import hashlib
 import os
+import sqlite3
+import time
 import llib.hashfunctions.hash_mod as hm
 import llib.db.dbbase_mod as dbb
+import llib.db.dbmoveambiguities_mod as dbmamb
+import llib.db.dbrepeats_mod as dbr
 import llib.db.dbutil as dbu
+import llib.dirfilefs.dir_n_file_fs_mod as dirf
+import llib.dirfilefs.scandir_walk_mod as scdw
 import models.entries.dirnode_mod as dn
+BUFFERED_WRITES_FLUSH_N_ROWS_DEFAULT = 1000
+BUFFERED_WRITES_FLUSH_SECS_DEFAULT = 5.0
+OS_ENTRIES_TEMP_TABLENAME = 'temp_os_entries'
+UNLISTED_PARENTPATHS_TEMP_TABLENAME = 'temp_unlisted_parentpaths'
 
 
 class DBDirTree(dbb.DBBase):
 
   default_tablename = 'files_in_tree'
+  upsert_conflict_fieldnames = ('name', 'parentpath')
 
   def __init__(self, mountpath=None, inlocus_sqlite_filename=None, tablename=None):
     self.mountpath = mountpath
-    self._fieldnames = ['id', 'name', 'parentpath', 'sha1', 'bytesize', 'mdatetime']
+    self._fieldnames = ['id', 'name', 'parentpath', 'sha1', 'bytesize', 'mdatetime', 'hashalgo']
+    # the buffered writes, a list of (sql, tuplevalues), see add_row() & flush_writes()
+    self.pending_writes = []
+    self.is_buffering = False
+    self.flush_n_rows = BUFFERED_WRITES_FLUSH_N_ROWS_DEFAULT
+    self.flush_secs = BUFFERED_WRITES_FLUSH_SECS_DEFAULT
+    self.last_flush_time = time.monotonic()
+    self.n_rows_since_commit = 0
+    self.n_buffered_rows = 0
+    self.n_flushes = 0
+    self.n_unchanged_rows = 0
     if tablename is None:
       self.tablename = self.default_tablename
     super().__init__(mountpath, inlocus_sqlite_filename)
@@ -40,6 +93,7 @@ class DBDirTree(dbb.DBBase):
       sha1 BLOB NOT NULL,
       bytesize INTEGER NOT NULL,
       mdatetime TEXT,
+      hashalgo TEXT NOT NULL DEFAULT 'sha1',
       UNIQUE(name, parentpath)
     """
     return middle_sql
@@ -51,24 +105,505 @@ class DBDirTree(dbb.DBBase):
   def sqlite_createtable_if_not_exists(self):
     conn = self.get_connection()
     cursor = conn.cursor()
+    self.is_view = self.is_normalized_with_cursor(cursor)
+    # a normalized dirtree's tablename is a view, the CREATE TABLE IF NOT EXISTS below is then a no-op
     sql = self.interpolate_create_table_sql()
     cursor.execute(sql)
     # print(sql)
     # print('Created table', tablename)
+    self.migrate_schema(cursor)
+    self.commit_unless_in_session(conn)
+    cursor.close()
+
+  def get_schema_migrations(self):
+    """
+    Version 1 is the hashalgo column, the following ones are the indexes for the lookups that
+      would otherwise scan the whole table once per file:
+      - sha1: the mirror/dedupe lookups (eg does_sha1_exist_in_thisdirtree(), fetch_rows_by_sha1_n_hashalgo())
+      - (bytesize, mdatetime): the moved-file lookup in the dbentry updater
+      - parentpath: the per-folder listings (parentpath=?)
+    Version 5 is the stats (see stats()), version 6 the repeats view (see create_repeats_triggers()).
+    New migrations are appended with the next version number, a released one should not be changed.
+    """
+    return [
+      (1, 'add column hashalgo', self.add_hashalgo_column_to_older_table),
+      (2, 'create index on sha1', self.create_sha1_index),
+      (3, 'create index on (bytesize, mdatetime)', self.create_bytesize_n_mdatetime_index),
+      (4, 'create index on parentpath', self.create_parentpath_index),
+      (5, 'create the trigger-maintained stats tables', self.create_stats_tables_n_triggers),
+      (6, 'maintain table file_repeats by triggers', self.create_repeats_triggers),
+    ]
+
+  def add_hashalgo_column_to_older_table(self, cursor):
+    """
+    Tables created before field hashalgo existed get it, all their rows become 'sha1'
+    """
+    sql = 'PRAGMA table_info("%(tablename)s");' % {'tablename': self.tablename}
+    existing_colnames = [row[1] for row in cursor.execute(sql).fetchall()]
+    if 'hashalgo' in existing_colnames:
+      return False
+    sql = 'ALTER TABLE "%(tablename)s" ADD COLUMN hashalgo TEXT NOT NULL DEFAULT \'sha1\';' \
+          % {'tablename': self.tablename}
+    cursor.execute(sql)
+    return True
+
+  def create_index_if_not_exists(self, cursor, index_suffix, fields_line):
+    sql = 'CREATE INDEX IF NOT EXISTS "idx_%(tablename)s_%(suffix)s" ON "%(tablename)s" (%(fields)s);' \
+          % {'tablename': self.storage_tablename, 'suffix': index_suffix, 'fields': fields_line}
+    cursor.execute(sql)
+
+  def create_sha1_index(self, cursor):
+    self.create_index_if_not_exists(cursor, 'sha1', 'sha1')
+
+  def create_bytesize_n_mdatetime_index(self, cursor):
+    self.create_index_if_not_exists(cursor, 'bytesize_mdatetime', 'bytesize, mdatetime')
+
+  def create_parentpath_index(self, cursor):
+    if self.is_view:
+      # the normalized storage has no parentpath column, its lookups use the dirs' UNIQUE(path)
+      return
+    self.create_index_if_not_exists(cursor, 'parentpath', 'parentpath')
+
+  @property
+  def stats_tablename(self):
+    return self.tablename + '_stats'
+
+  @property
+  def sha1_refcount_tablename(self):
+    return self.tablename + '_sha1_refcount'
+
+  def form_stats_ddl_sqls(self):
+    """
+    The stats table has one row (id=1) with the number of rows, the sum of bytesize and the number
+      of distinct (sha1, hashalgo), the latter being the number of rows in the refcount table.
+    The triggers keep both tables current on each INSERT, DELETE and UPDATE (of sha1, hashalgo or bytesize)
+      in files_in_tree (the connections have recursive_triggers on, so that an INSERT OR REPLACE's delete counts).
+      The triggers are on the storage table, ie on files_in_tree_files when the dirtree is normalized.
+    """
+    interpol_dict = {
+      'tablename': self.storage_tablename, 'stats': self.stats_tablename, 'refcount': self.sha1_refcount_tablename
+    }
+    # the statements that count in a NEW row or count out an OLD row (in the trigger bodies)
+    # (no OR IGNORE in them: an outer statement's conflict policy, eg an upsert's, would override it)
+    count_in_sql = """
+        INSERT INTO "%(refcount)s" (sha1, hashalgo, refcount) SELECT NEW.sha1, NEW.hashalgo, 0
+          WHERE NOT EXISTS (SELECT 1 FROM "%(refcount)s" WHERE sha1=NEW.sha1 AND hashalgo=NEW.hashalgo);
+        UPDATE "%(refcount)s" SET refcount = refcount + 1 WHERE sha1=NEW.sha1 AND hashalgo=NEW.hashalgo;
+        UPDATE "%(stats)s" SET n_unique_sha1s = n_unique_sha1s + 1 WHERE id=1 AND
+          (SELECT refcount FROM "%(refcount)s" WHERE sha1=NEW.sha1 AND hashalgo=NEW.hashalgo) = 1;"""
+    count_out_sql = """
+        UPDATE "%(refcount)s" SET refcount = refcount - 1 WHERE sha1=OLD.sha1 AND hashalgo=OLD.hashalgo;
+        UPDATE "%(stats)s" SET n_unique_sha1s = n_unique_sha1s - 1 WHERE id=1 AND
+          (SELECT refcount FROM "%(refcount)s" WHERE sha1=OLD.sha1 AND hashalgo=OLD.hashalgo) = 0;
+        DELETE FROM "%(refcount)s" WHERE sha1=OLD.sha1 AND hashalgo=OLD.hashalgo AND refcount <= 0;"""
+    sqls = [
+      '''CREATE TABLE IF NOT EXISTS "%(stats)s" (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        n_rows INTEGER NOT NULL,
+        total_bytes INTEGER NOT NULL,
+        n_unique_sha1s INTEGER NOT NULL
+      );''',
+      '''CREATE TABLE IF NOT EXISTS "%(refcount)s" (
+        sha1 BLOB NOT NULL,
+        hashalgo TEXT NOT NULL,
+        refcount INTEGER NOT NULL,
+        PRIMARY KEY(sha1, hashalgo)
+      ) WITHOUT ROWID;''',
+      '''CREATE TRIGGER IF NOT EXISTS "trg_%(tablename)s_stats_insert" AFTER INSERT ON "%(tablename)s"
+      BEGIN
+        UPDATE "%(stats)s" SET n_rows = n_rows + 1, total_bytes = total_bytes + NEW.bytesize WHERE id=1;'''
+      + count_in_sql + '''
+      END;''',
+      '''CREATE TRIGGER IF NOT EXISTS "trg_%(tablename)s_stats_delete" AFTER DELETE ON "%(tablename)s"
+      BEGIN
+        UPDATE "%(stats)s" SET n_rows = n_rows - 1, total_bytes = total_bytes - OLD.bytesize WHERE id=1;'''
+      + count_out_sql + '''
+      END;''',
+      '''CREATE TRIGGER IF NOT EXISTS "trg_%(tablename)s_stats_update_bytesize"
+        AFTER UPDATE OF bytesize ON "%(tablename)s" WHEN OLD.bytesize IS NOT NEW.bytesize
+      BEGIN
+        UPDATE "%(stats)s" SET total_bytes = total_bytes - OLD.bytesize + NEW.bytesize WHERE id=1;
+      END;''',
+      '''CREATE TRIGGER IF NOT EXISTS "trg_%(tablename)s_stats_update_sha1"
+        AFTER UPDATE OF sha1, hashalgo ON "%(tablename)s"
+        WHEN OLD.sha1 IS NOT NEW.sha1 OR OLD.hashalgo IS NOT NEW.hashalgo
+      BEGIN'''
+      + count_out_sql + count_in_sql + '''
+      END;''',
+    ]
+    return [sql % interpol_dict for sql in sqls]
+
+  def create_stats_tables_n_triggers(self, cursor):
+    for sql in self.form_stats_ddl_sqls():
+      cursor.execute(sql)
+    self.recount_stats_with_cursor(cursor)
+
+  def recount_stats_with_cursor(self, cursor):
+    """
+    Recounts the stats from files_in_tree itself, ie with the full scans & sorts stats() saves the callers
+    """
+    interpol_dict = {
+      'tablename': self.tablename, 'stats': self.stats_tablename, 'refcount': self.sha1_refcount_tablename
+    }
+    sqls = [
+      'DELETE FROM "%(refcount)s";',
+      '''INSERT INTO "%(refcount)s" (sha1, hashalgo, refcount)
+        SELECT sha1, hashalgo, count(*) FROM "%(tablename)s" GROUP BY sha1, hashalgo;''',
+      '''INSERT OR REPLACE INTO "%(stats)s" (id, n_rows, total_bytes, n_unique_sha1s)
+        SELECT 1, count(*), ifnull(sum(bytesize), 0), (SELECT count(*) FROM "%(refcount)s") FROM "%(tablename)s";''',
+    ]
+    for sql in sqls:
+      cursor.execute(sql % interpol_dict)
+
+  def recount_stats(self):
+    """
+    The triggers keep the stats current, a recount is only needed if the db was written to
+      by a connection without recursive_triggers (eg an INSERT OR REPLACE from the sqlite3 shell)
+    """
+    conn = self.get_connection()
+    cursor = conn.cursor()
+    self.recount_stats_with_cursor(cursor)
     cursor.close()
-    conn.close()
+    self.commit_unless_in_session(conn)
+    return self.stats()
+
+  def form_repeats_trigger_sqls(self, repeats_tablename):
+    """
+    The triggers that keep the file_id rows of file_repeats (see DBRepeat) equal to the repeated rows
+      of files_in_tree: an inserted row joins its sha1's repeats if there's another row with the same
+      (sha1, hashalgo), bringing the latter in as well when it was alone; a deleted row leaves them,
+      taking the last one out when only one is left; an update is a delete of OLD followed by an insert of NEW.
+      The counts use the sha1 index, ie each trigger costs a few index lookups.
+    When the dirtree is normalized, the triggers are on the storage table (the rows are read through the view
+      for their parentpath) and a dir's rename updates its files' parentpath in file_repeats.
+    """
+    interpol_dict = {
+      'tablename': self.tablename, 'storage': self.storage_tablename, 'repeats': repeats_tablename,
+      'dirs': self.dirs_tablename,
+      'updated_fields': 'name, dir_id' if self.is_view else 'name, parentpath',
+    }
+    count_in_sql = """
+        INSERT INTO "%(repeats)s" (file_id, sha1, hashalgo, is_to_delete, name, parentpath, bytesize, mdatetime)
+          SELECT t.id, t.sha1, t.hashalgo, 0, t.name, t.parentpath, t.bytesize, t.mdatetime FROM "%(tablename)s" t
+          WHERE t.sha1=NEW.sha1 AND t.hashalgo=NEW.hashalgo
+            AND (SELECT count(*) FROM "%(storage)s" WHERE sha1=NEW.sha1 AND hashalgo=NEW.hashalgo) > 1
+            AND NOT EXISTS (SELECT 1 FROM "%(repeats)s" r WHERE r.file_id=t.id);"""
+    count_out_sql = """
+        DELETE FROM "%(repeats)s" WHERE file_id=OLD.id;
+        DELETE FROM "%(repeats)s" WHERE sha1=OLD.sha1 AND hashalgo=OLD.hashalgo AND file_id IS NOT NULL
+          AND (SELECT count(*) FROM "%(storage)s" WHERE sha1=OLD.sha1 AND hashalgo=OLD.hashalgo) < 2;"""
+    sqls = [
+      '''CREATE TRIGGER IF NOT EXISTS "trg_%(storage)s_repeats_insert" AFTER INSERT ON "%(storage)s"
+      BEGIN''' + count_in_sql + '''
+      END;''',
+      '''CREATE TRIGGER IF NOT EXISTS "trg_%(storage)s_repeats_delete" AFTER DELETE ON "%(storage)s"
+      BEGIN''' + count_out_sql + '''
+      END;''',
+      '''CREATE TRIGGER IF NOT EXISTS "trg_%(storage)s_repeats_update"
+        AFTER UPDATE OF %(updated_fields)s, sha1, bytesize, mdatetime, hashalgo ON "%(storage)s"
+      BEGIN''' + count_out_sql + count_in_sql + '''
+      END;''',
+    ]
+    if self.is_view:
+      sqls.append(
+        '''CREATE TRIGGER IF NOT EXISTS "trg_%(dirs)s_repeats_update_path"
+          AFTER UPDATE OF path ON "%(dirs)s" WHEN OLD.path IS NOT NEW.path
+        BEGIN
+          UPDATE "%(repeats)s" SET parentpath = NEW.path
+            WHERE file_id IN (SELECT id FROM "%(storage)s" WHERE dir_id=NEW.id);
+        END;'''
+      )
+    return [sql % interpol_dict for sql in sqls]
+
+  def create_repeats_triggers(self, cursor):
+    """
+    file_repeats is created (if needed) by DBRepeat itself, then its file_id rows are filled from files_in_tree
+    """
+    dbrepeat = dbr.DBRepeat(self.mount_abspath, self.inlocus_sqlite_filename)
+    for sql in self.form_repeats_trigger_sqls(dbrepeat.tablename):
+      cursor.execute(sql)
+    interpol_dict = {'tablename': self.tablename, 'repeats': dbrepeat.tablename}
+    sqls = [
+      'DELETE FROM "%(repeats)s" WHERE file_id IS NOT NULL;',
+      '''INSERT INTO "%(repeats)s" (file_id, sha1, hashalgo, is_to_delete, name, parentpath, bytesize, mdatetime)
+        SELECT t.id, t.sha1, t.hashalgo, 0, t.name, t.parentpath, t.bytesize, t.mdatetime FROM "%(tablename)s" t
+        WHERE (t.sha1, t.hashalgo) IN (
+          SELECT sha1, hashalgo FROM "%(tablename)s" GROUP BY sha1, hashalgo HAVING count(*) > 1
+        );''',
+    ]
+    for sql in sqls:
+      cursor.execute(sql % interpol_dict)
+
+  @property
+  def storage_tablename(self):
+    """
+    The table the rows are stored in: tablename itself or, when the dirtree is normalized, <tablename>_files
+    """
+    if self.is_view:
+      return self.tablename + '_files'
+    return self.tablename
+
+  @property
+  def dirs_tablename(self):
+    return self.tablename + '_dirs'
+
+  @property
+  def dirpaths_tablename(self):
+    return self.tablename + '_dirpaths'
+
+  def is_normalized_with_cursor(self, cursor):
+    sql = "SELECT count(*) FROM sqlite_master WHERE type='view' AND name=?;"
+    return cursor.execute(sql, (self.tablename, )).fetchone()[0] > 0
+
+  def form_normalized_ddl_sqls(self):
+    """
+    The normalized storage:
+      - <tablename>_dirs(id, parent_id, name, path): one row per folder, path is kept (UNIQUE) next to
+        (parent_id, name) for the parentpath=? lookups, the root folder is '/' (parent_id NULL, name '')
+      - <tablename>_dirpaths: a view on the dirs' paths, an INSERT of a path adds it with its missing ancestors
+        (a recursive trigger, the connections have recursive_triggers on)
+      - <tablename>_files: the files_in_tree fields with dir_id in place of parentpath
+      - <tablename>: a view with the files_in_tree fields, its INSTEAD OF triggers write to the tables above,
+        ie the selects, inserts, updates & deletes on files_in_tree work unchanged
+    """
+    interpol_dict = {
+      'tablename': self.tablename, 'files': self.tablename + '_files',
+      'dirs': self.dirs_tablename, 'dirpaths': self.dirpaths_tablename,
+    }
+    # the path's parent & basename, the sqlite way: rtrim(p, <p without its slashes>) is p up to its last slash
+    parent_expr = """CASE WHEN rtrim(rtrim(NEW.path, replace(NEW.path, '/', '')), '/') = '' THEN '/'
+          ELSE rtrim(rtrim(NEW.path, replace(NEW.path, '/', '')), '/') END"""
+    basename_expr = "substr(NEW.path, length(rtrim(NEW.path, replace(NEW.path, '/', ''))) + 1)"
+    sqls = [
+      '''CREATE TABLE IF NOT EXISTS "%(dirs)s" (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        parent_id INTEGER,
+        name TEXT NOT NULL,
+        path TEXT NOT NULL UNIQUE,
+        UNIQUE(parent_id, name)
+      );''',
+      'CREATE VIEW IF NOT EXISTS "%(dirpaths)s" AS SELECT path FROM "%(dirs)s";',
+      '''CREATE TRIGGER IF NOT EXISTS "trg_%(dirpaths)s_insert" INSTEAD OF INSERT ON "%(dirpaths)s"
+        WHEN NOT EXISTS (SELECT 1 FROM "%(dirs)s" WHERE path=NEW.path)
+      BEGIN
+        INSERT INTO "%(dirpaths)s" (path) SELECT ''' + parent_expr + ''' WHERE NEW.path != '/';
+        INSERT INTO "%(dirs)s" (parent_id, name, path) VALUES (
+          CASE WHEN NEW.path = '/' THEN NULL
+            ELSE (SELECT id FROM "%(dirs)s" WHERE path=''' + parent_expr + ''') END,
+          CASE WHEN NEW.path = '/' THEN '' ELSE ''' + basename_expr + ''' END,
+          NEW.path
+        );
+      END;''',
+      '''CREATE TABLE IF NOT EXISTS "%(files)s" (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        dir_id INTEGER NOT NULL,
+        sha1 BLOB NOT NULL,
+        bytesize INTEGER NOT NULL,
+        mdatetime TEXT,
+        hashalgo TEXT NOT NULL DEFAULT 'sha1',
+        UNIQUE(dir_id, name)
+      );''',
+      '''CREATE VIEW IF NOT EXISTS "%(tablename)s" AS
+        SELECT f.id AS id, f.name AS name, d.path AS parentpath, f.sha1 AS sha1, f.bytesize AS bytesize,
+          f.mdatetime AS mdatetime, f.hashalgo AS hashalgo
+        FROM "%(files)s" f JOIN "%(dirs)s" d ON d.id = f.dir_id;''',
+      '''CREATE TRIGGER IF NOT EXISTS "trg_%(tablename)s_view_insert" INSTEAD OF INSERT ON "%(tablename)s"
+      BEGIN
+        INSERT INTO "%(dirpaths)s" (path) VALUES (NEW.parentpath);
+        INSERT INTO "%(files)s" (id, name, dir_id, sha1, bytesize, mdatetime, hashalgo) VALUES (
+          NEW.id, NEW.name, (SELECT id FROM "%(dirs)s" WHERE path=NEW.parentpath),
+          NEW.sha1, NEW.bytesize, NEW.mdatetime, ifnull(NEW.hashalgo, 'sha1')
+        );
+      END;''',
+      '''CREATE TRIGGER IF NOT EXISTS "trg_%(tablename)s_view_update" INSTEAD OF UPDATE ON "%(tablename)s"
+      BEGIN
+        INSERT INTO "%(dirpaths)s" (path) VALUES (NEW.parentpath);
+        UPDATE "%(files)s" SET
+          id=NEW.id, name=NEW.name, dir_id=(SELECT id FROM "%(dirs)s" WHERE path=NEW.parentpath),
+          sha1=NEW.sha1, bytesize=NEW.bytesize, mdatetime=NEW.mdatetime, hashalgo=NEW.hashalgo
+        WHERE id=OLD.id;
+      END;''',
+      '''CREATE TRIGGER IF NOT EXISTS "trg_%(tablename)s_view_delete" INSTEAD OF DELETE ON "%(tablename)s"
+      BEGIN
+        DELETE FROM "%(files)s" WHERE id=OLD.id;
+      END;''',
+    ]
+    return [sql % interpol_dict for sql in sqls]
+
+  def create_storage_indexes_n_triggers(self, cursor):
+    """
+    (Re)creates, on the storage table, what the migrations created on files_in_tree: the indexes,
+      the stats triggers & the file_repeats triggers (the latter two are recounted/refilled)
+    """
+    self.create_sha1_index(cursor)
+    self.create_bytesize_n_mdatetime_index(cursor)
+    self.create_parentpath_index(cursor)
+    self.create_stats_tables_n_triggers(cursor)
+    self.create_repeats_triggers(cursor)
+
+  def change_storage_with_sqls(self, sqls, is_view):
+    """
+    Runs the storage conversion (see normalize_storage() & flatten_storage()) in one transaction
+    """
+    if self.is_in_session():
+      error_msg = 'Storage conversion error: it cannot run inside a session (the conversion has its own transaction).'
+      raise ValueError(error_msg)
+    self.flush_writes()
+    was_view = self.is_view
+    try:
+      # the session keeps the other instances' commits (eg DBRepeat's create-table) from ending the transaction
+      with self.session() as conn:
+        conn.commit()
+        cursor = conn.cursor()
+        # an explicit BEGIN: the sqlite3 module would otherwise run the DDL statements in autocommit
+        cursor.execute('BEGIN;')
+        for sql in sqls:
+          cursor.execute(sql)
+        self.is_view = is_view
+        self.create_storage_indexes_n_triggers(cursor)
+        cursor.close()
+    except sqlite3.Error:
+      self.is_view = was_view
+      raise
+    return True
+
+  def normalize_storage(self):
+    """
+    Moves the rows to the normalized storage (see form_normalized_ddl_sqls()), the ids are kept.
+      Returns False if the dirtree is already normalized
+    """
+    if self.is_view:
+      return False
+    interpol_dict = {
+      'tablename': self.tablename, 'files': self.tablename + '_files',
+      'dirs': self.dirs_tablename, 'dirpaths': self.dirpaths_tablename,
+    }
+    ddl_sqls = self.form_normalized_ddl_sqls()
+    # the view named tablename (and its triggers) can only be created after the table is dropped
+    i_view = [i for i, sql in enumerate(ddl_sqls) if sql.startswith('CREATE VIEW IF NOT EXISTS "%s"' % self.tablename)][0]
+    sqls = ddl_sqls[:i_view] + [
+      'INSERT INTO "%(dirpaths)s" (path) SELECT DISTINCT parentpath FROM "%(tablename)s";' % interpol_dict,
+      '''INSERT INTO "%(files)s" (id, name, dir_id, sha1, bytesize, mdatetime, hashalgo)
+        SELECT t.id, t.name, d.id, t.sha1, t.bytesize, t.mdatetime, t.hashalgo
+        FROM "%(tablename)s" t JOIN "%(dirs)s" d ON d.path = t.parentpath;''' % interpol_dict,
+      'DROP TABLE "%(tablename)s";' % interpol_dict,
+    ] + ddl_sqls[i_view:]
+    return self.change_storage_with_sqls(sqls, is_view=True)
+
+  def flatten_storage(self):
+    """
+    The reverse of normalize_storage(): the rows go back to table files_in_tree (with its parentpath column).
+      Returns False if the dirtree is not normalized
+    """
+    if not self.is_view:
+      return False
+    interpol_dict = {
+      'tablename': self.tablename, 'files': self.tablename + '_files', 'flat': self.tablename + '_flat',
+      'dirs': self.dirs_tablename, 'dirpaths': self.dirpaths_tablename,
+    }
+    create_sql = self.interpolate_create_table_sql().replace(
+      '"%s"' % self.tablename, '"%s"' % interpol_dict['flat'], 1
+    )
+    sqls = [
+      '''INSERT INTO "%(flat)s" (id, name, parentpath, sha1, bytesize, mdatetime, hashalgo)
+        SELECT id, name, parentpath, sha1, bytesize, mdatetime, hashalgo FROM "%(tablename)s";''',
+      'DROP VIEW "%(tablename)s";',
+      'DROP TABLE "%(files)s";',
+      'DROP VIEW "%(dirpaths)s";',
+      'DROP TABLE "%(dirs)s";',
+      'ALTER TABLE "%(flat)s" RENAME TO "%(tablename)s";',
+    ]
+    sqls = [create_sql] + [sql % interpol_dict for sql in sqls]
+    return self.change_storage_with_sqls(sqls, is_view=False)
+
+  def rename_dir(self, old_parentpath, new_parentpath):
+    """
+    Renames (or moves) a folder in the db, ie the rows of the folder and of its subfolders get the new parentpath.
+      Normalized, it's the folder's row in the dirs table (plus the path of its subfolders' rows),
+        the files' rows are not touched. Flat, it's an update of the rows' parentpath.
+      Returns False if old_parentpath is not in the db or if new_parentpath already is
+    """
+    if old_parentpath == '/' or new_parentpath.startswith(old_parentpath + '/'):
+      error_msg = 'Rename dir error: cannot move (%s) to (%s).' % (old_parentpath, new_parentpath)
+      raise ValueError(error_msg)
+    interpol_dict = {
+      'tablename': self.tablename, 'dirs': self.dirs_tablename, 'dirpaths': self.dirpaths_tablename,
+    }
+    # the folder & its subfolders: path = old OR path starts with old/ (a range, ie an index search)
+    subtree_where = '%(pathfield)s = ? OR (%(pathfield)s >= ? AND %(pathfield)s < ?)'
+    old_range = (old_parentpath, old_parentpath + '/', old_parentpath + '0')  # '0' is the char after '/'
+    new_range = (new_parentpath, new_parentpath + '/', new_parentpath + '0')
+    with self.session():
+      conn = self.get_connection()
+      cursor = conn.cursor()
+      if self.is_view:
+        interpol_dict['pathfield'] = 'path'
+        sql_from = 'SELECT count(*) FROM "%(dirs)s" WHERE ' + subtree_where
+        sql = sql_from % interpol_dict
+        if cursor.execute(sql, old_range).fetchone()[0] == 0 or cursor.execute(sql, new_range).fetchone()[0] > 0:
+          cursor.close()
+          return False
+        new_dir_parentpath, new_dir_name = os.path.split(new_parentpath)
+        sqls_n_tuplevalues = [
+          ('INSERT INTO "%(dirpaths)s" (path) VALUES (?);', (new_dir_parentpath, )),
+          ('''UPDATE "%(dirs)s" SET parent_id=(SELECT id FROM "%(dirs)s" WHERE path=?), name=?
+            WHERE path=?;''', (new_dir_parentpath, new_dir_name, old_parentpath)),
+          ('UPDATE "%(dirs)s" SET path = ? || substr(path, ?) WHERE ' + subtree_where + ';',
+           (new_parentpath, len(old_parentpath) + 1) + old_range),
+        ]
+      else:
+        interpol_dict['pathfield'] = 'parentpath'
+        sql = ('SELECT count(*) FROM "%(tablename)s" WHERE ' + subtree_where) % interpol_dict
+        if cursor.execute(sql, old_range).fetchone()[0] == 0 or cursor.execute(sql, new_range).fetchone()[0] > 0:
+          cursor.close()
+          return False
+        sqls_n_tuplevalues = [
+          ('UPDATE "%(tablename)s" SET parentpath = ? || substr(parentpath, ?) WHERE ' + subtree_where + ';',
+           (new_parentpath, len(old_parentpath) + 1) + old_range),
+        ]
+      for sql, tuplevalues in sqls_n_tuplevalues:
+        cursor.execute(sql % interpol_dict, tuplevalues)
+      cursor.close()
+    return True
+
+  def open_read_replica(self, max_bytes=None):
+    """
+    The buffered rows are written out (to disk) before the copy, see DBBase.open_read_replica()
+    """
+    self.flush_writes()
+    return super().open_read_replica(max_bytes)
+
+  def can_upsert(self):
+    """
+    sqlite does not upsert into a view, a normalized dirtree falls back to INSERT OR REPLACE (see add_row())
+    """
+    return not self.is_view and super().can_upsert()
+
+  def stats(self):
+    """
+    Returns a dict with n_rows, total_bytes & n_unique_sha1s, read from the trigger-maintained stats table,
+      ie a one-row lookup instead of a count(*) or a count(distinct sha1) over the whole table
+    """
+    sql = 'SELECT n_rows, total_bytes, n_unique_sha1s FROM "%(stats)s" WHERE id=1;' \
+          % {'stats': self.stats_tablename}
+    conn = self.get_connection()
+    cursor = conn.cursor()
+    rows = cursor.execute(sql).fetchall()
+    cursor.close()
+    if len(rows) == 0:
+      return {'n_rows': 0, 'total_bytes': 0, 'n_unique_sha1s': 0}
+    n_rows, total_bytes, n_unique_sha1s = rows[0]
+    return {'n_rows': n_rows, 'total_bytes': total_bytes, 'n_unique_sha1s': n_unique_sha1s}
+
+  def count_rows_as_int(self):
+    return self.stats()['n_rows']
 
   def total_files(self):
     """
     total_files = total number of entries
     """
-    _total_files = 0
-    result_as_tuplelist = self.count_rows()
-    try:
-      _total_files = result_as_tuplelist[0][0]
-    except IndexError:
-      pass
-    return _total_files
+    return self.stats()['n_rows']
 
   def fetch_row_by_id(self, _id):
     sql = 'SELECT * FROM %(tablename)s WHERE id=?;' % {'tablename': self.tablename}
@@ -78,7 +613,6 @@ class DBDirTree(dbb.DBBase):
     fetch_result = cursor.execute(sql, tuplevalues)
     result_tuple_list = fetch_result.fetchall()
     cursor.close()
-    conn.close()
     return result_tuple_list
 
   def transform_row_to_dirnode(self, row):
@@ -94,7 +628,9 @@ class DBDirTree(dbb.DBBase):
       bytesize = row[idx]
       idx = self.fieldnames.index('mdatetime')
       mdatetime = row[idx]
-      dirnode = dn.DirNode(name, parentpath, sha1, bytesize, mdatetime)
+      idx = self.fieldnames.index('hashalgo')
+      hashalgo = row[idx]
+      dirnode = dn.DirNode(name, parentpath, sha1, bytesize, mdatetime, hashalgo)
       dirnode.set_db_id(_id)
       return dirnode
     except (AttributeError, IndexError):
@@ -120,24 +656,33 @@ class DBDirTree(dbb.DBBase):
       row = result_tuple_list[0]
       return self.transform_row_to_dirnode(row)
     cursor.close()
-    conn.close()
     return dirnode
 
+  def fetch_dirnodes_in_folder(self, parentpath, see_pending_writes=True):
+    """
+    Returns the dirnodes of the rows with parentpath (one SELECT on the parentpath index).
+      With see_pending_writes=False, the buffered writes are not executed before the read (they are left
+      for the next flush), ie the caller knows none of them concerns this folder (see FilesUpDirTreeWalker)
+    """
+    self.ensure_table_exists()
+    sql = 'SELECT * FROM %(tablename)s WHERE parentpath=?;' % {'tablename': self.tablename}
+    if see_pending_writes:
+      conn = self.get_connection()
+    else:
+      conn = self.get_connection_leaving_pending_writes()
+    cursor = conn.cursor()
+    rows = cursor.execute(sql, (parentpath, )).fetchall()
+    cursor.close()
+    return [self.transform_row_to_dirnode(row) for row in rows]
+
   def count_unique_sha1s_as_int(self):
     """
-    This count method uses the direct SELECT as following:
+    This count used to be a direct SELECT as following:
       SELECT count(distinct sha1) FROM files_in_tree ORDER BY sha1;
-
-    Another option with a SELECT and an inner SELECT is:
-      SELECT count(T.sha1) FROM (SELECT distinct sha1 FROM files_in_tree) as T;
-      Notice in the SELECT above that the count() function uses a table/field from an inner SELECT:
-    # sql = 'SELECT count(T.sha1) FROM (SELECT distinct sha1 FROM %(tablename)s) as T;' % {'tablename': self.tablename}
+    ie a full sort of the table at each call, now it's read from the stats (see stats()),
+      where the distinct count is per (sha1, hashalgo)
     """
-    sql = 'SELECT count(distinct sha1) FROM %(tablename)s ORDER BY sha1;' % {'tablename': self.tablename}
-    fetched_list = self.do_select_with_sql_without_tuplevalues(sql)
-    if fetched_list or len(fetched_list) == 1:
-      return fetched_list[0][0]
-    return 0
+    return self.stats()['n_unique_sha1s']
 
   def do_insert_with_dict(self, pdict):
     """
@@ -164,7 +709,8 @@ class DBDirTree(dbb.DBBase):
         parentpath=?, 
         sha1=?,
         bytesize=?, 
-        mdatetime=? 
+        mdatetime=?,
+        hashalgo=?
       WHERE
         id=?;
       '''
@@ -174,42 +720,363 @@ class DBDirTree(dbb.DBBase):
     """
     This method is not implemented in the super class
     """
-    pass
-    plimit = 50
-    offset = 0
-    ids = []
-    rowsgenerator = self.do_select_all_w_limit_n_offset(plimit, offset)
-    for rows in rowsgenerator:
-      for row in rows:
-        idx = self.fieldnames.index('name')
-        name = row[idx]
-        idx = self.fieldnames.index('parentpath')
-        parentpath = row[idx]
-        middlepath = os.path.join(parentpath, name)
-        if middlepath.startswith('/'):
-          middlepath = middlepath.lstrip('/')
-        fpath = os.path.join(mountpath, middlepath)
-        if not os.path.isfile(fpath):
-          ids.append(row[0])
-    print('Deleting', ids)
-    conn = self.get_connection()
+    scandir_walker = scdw.ScandirDirTreeWalker(mountpath, restricted_dirnames=[], forbidden_first_level_dirs=[])
+    orphan_rows, n_deleted = self.delete_rows_without_os_entries(
+      scandir_walker.generate_parentpath_n_filename(), scandir_walker.failed_parentpaths
+    )
+    if len(scandir_walker.failed_parentpaths) > 0:
+      print('Not deleting under the unlisted folders', scandir_walker.failed_parentpaths)
+    print('Deleting', [row[0] for row in orphan_rows])
+    print('Deleted/Committed', n_deleted, 'records')
+
+  @staticmethod
+  def load_os_entries_into_temp_table(cursor, os_entries):
+    """
+    Fills temp table OS_ENTRIES_TEMP_TABLENAME (of cursor's connection) with os_entries' (parentpath, name),
+      returns their number
+    """
+    interpol_dict = {'os_entries': OS_ENTRIES_TEMP_TABLENAME}
+    cursor.execute('''CREATE TEMP TABLE IF NOT EXISTS "%(os_entries)s" (
+      parentpath TEXT NOT NULL,
+      name TEXT NOT NULL,
+      PRIMARY KEY(parentpath, name)
+    ) WITHOUT ROWID;''' % interpol_dict)
+    cursor.execute('DELETE FROM temp."%(os_entries)s";' % interpol_dict)
+    sql = 'INSERT OR IGNORE INTO temp."%(os_entries)s" (parentpath, name) VALUES (?, ?);' % interpol_dict
+    cursor.executemany(sql, os_entries)
+    return max(cursor.rowcount, 0)
+
+  @staticmethod
+  def load_unlisted_parentpaths_into_temp_table(cursor, unlisted_parentpaths):
+    """
+    Fills temp table UNLISTED_PARENTPATHS_TEMP_TABLENAME with the folders whose listing failed
+    """
+    interpol_dict = {'unlisted': UNLISTED_PARENTPATHS_TEMP_TABLENAME}
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS "%(unlisted)s" (parentpath TEXT PRIMARY KEY);' % interpol_dict)
+    cursor.execute('DELETE FROM temp."%(unlisted)s";' % interpol_dict)
+    sql = 'INSERT OR IGNORE INTO temp."%(unlisted)s" (parentpath) VALUES (?);' % interpol_dict
+    cursor.executemany(sql, [(parentpath, ) for parentpath in unlisted_parentpaths or []])
+
+  @staticmethod
+  def form_not_in_os_where(alias='t'):
+    """
+    The WHERE for the rows whose file is not in the os entries, the rows in (or below) an unlisted folder left out,
+      for their files are unknown, not missing ('/' unlisted leaves out all rows)
+    """
+    return '''(NOT EXISTS (
+        SELECT 1 FROM temp."%(os_entries)s" o WHERE o.parentpath = ALIAS.parentpath AND o.name = ALIAS.name
+      ) AND NOT EXISTS (
+        SELECT 1 FROM temp."%(unlisted)s" u WHERE u.parentpath = '/' OR u.parentpath = ALIAS.parentpath
+          OR substr(ALIAS.parentpath, 1, length(u.parentpath) + 1) = u.parentpath || '/'
+      ))'''.replace('ALIAS', alias)
+
+  def delete_rows_without_os_entries(self, os_entries, unlisted_parentpaths=None):
+    """
+    The set difference of the rows and the files on disk: os_entries (an iterable of (parentpath, name),
+      eg ScandirDirTreeWalker.generate_parentpath_n_filename()) goes to a temp table, then the rows not in it
+      are selected (for the caller's report) and deleted with one anti-join DELETE, all in one transaction,
+      instead of one os.path.isfile() and one DELETE per row.
+    unlisted_parentpaths are the folders the walk could not list (eg the walker's failed_parentpaths),
+      it's read after os_entries is consumed; the rows in & below them are not deleted.
+    Returns (orphan_rows, n_deleted)
+    """
+    interpol_dict = {
+      'tablename': self.tablename, 'os_entries': OS_ENTRIES_TEMP_TABLENAME,
+      'unlisted': UNLISTED_PARENTPATHS_TEMP_TABLENAME,
+    }
+    not_in_os_where = self.form_not_in_os_where('t')
+    self.flush_writes()
+    with self.session() as conn:
+      cursor = conn.cursor()
+      self.load_os_entries_into_temp_table(cursor, os_entries)
+      self.load_unlisted_parentpaths_into_temp_table(cursor, unlisted_parentpaths)
+      sql = ('SELECT * FROM "%(tablename)s" t WHERE ' + not_in_os_where + ' ORDER BY t.id;') % interpol_dict
+      orphan_rows = cursor.execute(sql).fetchall()
+      n_deleted = 0
+      if len(orphan_rows) > 0:
+        n_rows_before = self.stats()['n_rows']
+        sql = ('DELETE FROM "%(tablename)s" WHERE id IN (SELECT t.id FROM "%(tablename)s" t WHERE '
+               + not_in_os_where + ');') % interpol_dict
+        cursor.execute(sql)
+        # (not the rowcount, that sqlite does not give for a view, see is_view)
+        n_deleted = n_rows_before - self.stats()['n_rows']
+      cursor.execute('DROP TABLE temp."%(os_entries)s";' % interpol_dict)
+      cursor.execute('DROP TABLE temp."%(unlisted)s";' % interpol_dict)
+      cursor.close()
+    return orphan_rows, n_deleted
+
+  def reconcile_moved_rows(self, os_entries, is_move_target=None, unlisted_parentpaths=None):
+    """
+    The moved files' rows get their new (parentpath, name), in bulk:
+      1) os_entries (as in delete_rows_without_os_entries()) goes to a temp table;
+      2) the files on disk without a row are stat'ed (only them) into another temp table,
+         with their bytesize & mdatetime, if is_move_target(parentpath) (when given) says so;
+      3) the rows without their file on disk go to a third temp table;
+      4) the two are joined on (bytesize, mdatetime): a key with one file, one row without its file and
+         no other row (in the whole table) is a move, all moves are applied with one UPDATE;
+         the other keys are ambiguous, their files & rows are written to table file_move_ambiguities
+         (see DBMoveAmbiguity), which is rewritten at each call.
+    The rows in & below unlisted_parentpaths (as in delete_rows_without_os_entries()) are not taken as missing.
+    All in one transaction. Returns a dict with the moves (a list of (id, old_parentpath, old_name, parentpath, name)),
+      n_os_files, n_unregistered_files, n_orphan_rows, n_ambiguous_keys & n_failed_filestats
+    """
+    dbambiguity = dbmamb.DBMoveAmbiguity(self.mount_abspath, self.inlocus_sqlite_filename)
+    interpol_dict = {
+      'tablename': self.tablename, 'os_entries': OS_ENTRIES_TEMP_TABLENAME, 'ambiguities': dbambiguity.tablename,
+      'unlisted': UNLISTED_PARENTPATHS_TEMP_TABLENAME, 'unregistered': 'temp_unregistered_files', 'orphans': 'temp_orphan_rows',
+      'keys': 'temp_move_keys', 'moves': 'temp_moves',
+    }
+    same_key_as_u = 'bytesize = u.bytesize AND %(alias)s.mdatetime = u.mdatetime'
+    is_ambiguous_where = 'NOT (k.n_os_files = 1 AND k.n_orphan_rows = 1 AND k.n_db_rows = 1)'
+    result = {
+      'moves': [], 'n_os_files': 0, 'n_unregistered_files': 0, 'n_orphan_rows': 0,
+      'n_ambiguous_keys': 0, 'n_failed_filestats': 0,
+    }
+    self.flush_writes()
+    with self.session() as conn:
+      cursor = conn.cursor()
+      result['n_os_files'] = self.load_os_entries_into_temp_table(cursor, os_entries)
+      self.load_unlisted_parentpaths_into_temp_table(cursor, unlisted_parentpaths)
+      sql = '''SELECT e.parentpath, e.name FROM temp."%(os_entries)s" e
+        WHERE NOT EXISTS (SELECT 1 FROM "%(tablename)s" t WHERE t.name = e.name AND t.parentpath = e.parentpath);'''
+      unregistered_files = []
+      for parentpath, name in cursor.execute(sql % interpol_dict).fetchall():
+        if is_move_target is not None and not is_move_target(parentpath):
+          continue
+        filepath = os.path.join(self.mount_abspath, parentpath.lstrip('/'), name)
+        try:
+          filestat = os.stat(filepath)
+        except OSError:
+          result['n_failed_filestats'] += 1
+          continue
+        unregistered_files.append((parentpath, name, filestat.st_size, filestat.st_mtime))
+      result['n_unregistered_files'] = len(unregistered_files)
+      sqls = [
+        # mdatetime is TEXT as in files_in_tree, so that st_mtime gets the same conversion
+        '''CREATE TEMP TABLE "%(unregistered)s" (
+          parentpath TEXT NOT NULL,
+          name TEXT NOT NULL,
+          bytesize INTEGER NOT NULL,
+          mdatetime TEXT
+        );''',
+      ]
+      for sql in sqls:
+        cursor.execute(sql % interpol_dict)
+      sql = 'INSERT INTO temp."%(unregistered)s" (parentpath, name, bytesize, mdatetime) VALUES (?, ?, ?, ?);'
+      cursor.executemany(sql % interpol_dict, unregistered_files)
+      sqls = [
+        '''CREATE TEMP TABLE "%(orphans)s" AS
+          SELECT t.id AS file_id, t.name AS name, t.parentpath AS parentpath, t.bytesize AS bytesize,
+            t.mdatetime AS mdatetime
+          FROM "%(tablename)s" t WHERE ''' + self.form_not_in_os_where('t') + ''';''',
+        # the join: one row per (bytesize, mdatetime) having both files without rows & rows without files
+        '''CREATE TEMP TABLE "%(keys)s" AS
+          SELECT u.bytesize AS bytesize, u.mdatetime AS mdatetime,
+            count(DISTINCT u.rowid) AS n_os_files, count(DISTINCT o.file_id) AS n_orphan_rows,
+            (SELECT count(*) FROM "%(tablename)s" t WHERE t.''' + same_key_as_u % {'alias': 't'} + ''') AS n_db_rows
+          FROM temp."%(unregistered)s" u JOIN temp."%(orphans)s" o ON o.''' + same_key_as_u % {'alias': 'o'} + '''
+          GROUP BY u.bytesize, u.mdatetime;''',
+        '''CREATE TEMP TABLE "%(moves)s" AS
+          SELECT o.file_id AS file_id, o.parentpath AS old_parentpath, o.name AS old_name,
+            u.parentpath AS parentpath, u.name AS name
+          FROM temp."%(keys)s" k
+            JOIN temp."%(unregistered)s" u ON u.bytesize = k.bytesize AND u.mdatetime = k.mdatetime
+            JOIN temp."%(orphans)s" o ON o.bytesize = k.bytesize AND o.mdatetime = k.mdatetime
+          WHERE NOT (''' + is_ambiguous_where + ''');''',
+      ]
+      for sql in sqls:
+        cursor.execute(sql % interpol_dict)
+      sql = 'SELECT file_id, old_parentpath, old_name, parentpath, name FROM temp."%(moves)s" ORDER BY file_id;'
+      result['moves'] = cursor.execute(sql % interpol_dict).fetchall()
+      result['n_orphan_rows'] = cursor.execute('SELECT count(*) FROM temp."%(orphans)s";' % interpol_dict).fetchone()[0]
+      sql = 'SELECT count(*) FROM temp."%(keys)s" k WHERE ' + is_ambiguous_where + ';'
+      result['n_ambiguous_keys'] = cursor.execute(sql % interpol_dict).fetchone()[0]
+      sqls = [
+        '''UPDATE "%(tablename)s" SET
+            name = (SELECT m.name FROM temp."%(moves)s" m WHERE m.file_id = "%(tablename)s".id),
+            parentpath = (SELECT m.parentpath FROM temp."%(moves)s" m WHERE m.file_id = "%(tablename)s".id)
+          WHERE id IN (SELECT file_id FROM temp."%(moves)s");''',
+        'DELETE FROM "%(ambiguities)s";',
+        '''INSERT INTO "%(ambiguities)s" (side, file_id, name, parentpath, bytesize, mdatetime)
+          SELECT 'os', NULL, u.name, u.parentpath, u.bytesize, u.mdatetime
+          FROM temp."%(keys)s" k JOIN temp."%(unregistered)s" u ON u.bytesize = k.bytesize AND u.mdatetime = k.mdatetime
+          WHERE ''' + is_ambiguous_where + ''';''',
+        '''INSERT INTO "%(ambiguities)s" (side, file_id, name, parentpath, bytesize, mdatetime)
+          SELECT CASE WHEN EXISTS (SELECT 1 FROM temp."%(orphans)s" o WHERE o.file_id = t.id)
+              THEN 'db_missing' ELSE 'db_present' END,
+            t.id, t.name, t.parentpath, t.bytesize, t.mdatetime
+          FROM temp."%(keys)s" k JOIN "%(tablename)s" t ON t.bytesize = k.bytesize AND t.mdatetime = k.mdatetime
+          WHERE ''' + is_ambiguous_where + ''';''',
+        'DROP TABLE temp."%(moves)s";',
+        'DROP TABLE temp."%(keys)s";',
+        'DROP TABLE temp."%(orphans)s";',
+        'DROP TABLE temp."%(unregistered)s";',
+        'DROP TABLE temp."%(os_entries)s";',
+        'DROP TABLE temp."%(unlisted)s";',
+      ]
+      for sql in sqls:
+        cursor.execute(sql % interpol_dict)
+      cursor.close()
+    return result
+
+  def add_row(self, name, parentpath, sha1, bytesize, mdatetime, hashalgo=None):
+    """
+    Buffers the upsert of a file's row: an existing row with the same (name, parentpath) is updated (keeping its id),
+      ie the row ends up with the given values (as a file registered after a copy would need)
+    """
+    if hashalgo is None:
+      hashalgo = hm.DEFAULT_HASHALGO
+    if self.can_upsert():
+      sql = self.form_upsert_sql(self.fieldnames[1:])
+    else:
+      sql = '''INSERT OR REPLACE INTO %(tablename)s
+        (name, parentpath, sha1, bytesize, mdatetime, hashalgo) VALUES (?,?,?,?,?,?);'''
+    tuplevalues = (name, parentpath, sha1, bytesize, mdatetime, hashalgo)
+    return self.buffer_write(sql, tuplevalues)
+
+  def add_row_with_dirnode(self, dirnode):
+    return self.add_row(
+      dirnode.name, dirnode.parentpath, dirnode.sha1, dirnode.bytesize, dirnode.mdatetime, dirnode.hashalgo
+    )
+
+  def update_row(self, _id, name, parentpath, sha1, bytesize, mdatetime, hashalgo=None):
+    """
+    Buffers the update (all fields) of row _id. An update that would break UNIQUE(name, parentpath) is skipped
+    """
+    if hashalgo is None:
+      hashalgo = hm.DEFAULT_HASHALGO
+    sql = '''UPDATE OR IGNORE %(tablename)s
+      SET name=?, parentpath=?, sha1=?, bytesize=?, mdatetime=?, hashalgo=? WHERE id=?;'''
+    tuplevalues = (name, parentpath, sha1, bytesize, mdatetime, hashalgo, _id)
+    return self.buffer_write(sql, tuplevalues)
+
+  def delete_row(self, _id):
+    """
+    Buffers the delete of row _id
+    """
+    sql = 'DELETE FROM %(tablename)s WHERE id=?;'
+    return self.buffer_write(sql, (_id, ))
+
+  def buffer_write(self, sql, tuplevalues):
+    """
+    sql has the %(tablename)s placeholder as the other do_* methods.
+    Returns True, the write's outcome is only known at the flush (see n_unchanged_rows)
+    """
+    sql = sql % {'tablename': self.tablename}
+    self.pending_writes.append((sql, tuplevalues))
+    self.n_buffered_rows += 1
+    self.flush_writes_if_due()
+    return True
+
+  def is_flush_due(self):
+    if not self.is_buffering:
+      return True
+    n_rows = self.n_rows_since_commit + len(self.pending_writes)
+    if n_rows >= self.flush_n_rows:
+      return True
+    return n_rows > 0 and time.monotonic() - self.last_flush_time >= self.flush_secs
+
+  def flush_writes_if_due(self):
+    if self.is_flush_due():
+      return self.flush_writes()
+    return 0
+
+  def execute_pending_writes(self, conn):
+    """
+    Executes the buffered statements (without committing), each run of consecutive same-sql rows
+      goes in one executemany(). Their order is kept, eg a delete followed by an insert of the same file
+    """
+    if len(self.pending_writes) == 0:
+      return 0
+    pending_writes, self.pending_writes = self.pending_writes, []
+    n_executed = 0
     cursor = conn.cursor()
-    for _id in ids:
-      sql = 'delete from %(tablename)s where id=?;' % {'tablename': self.tablename}
-      tuplevalues = (_id, )
-      cursor.execute(sql, tuplevalues)
-    conn.commit()
+    i = 0
+    while i < len(pending_writes):
+      sql = pending_writes[i][0]
+      j = i
+      while j < len(pending_writes) and pending_writes[j][0] == sql:
+        j += 1
+      tuplevalues_list = [tuplevalues for _, tuplevalues in pending_writes[i:j]]
+      result = cursor.executemany(sql, tuplevalues_list)
+      if not self.is_view:
+        # (sqlite does not count a view's rows, see DBBase.count_changed_rows())
+        self.n_unchanged_rows += len(tuplevalues_list) - max(result.rowcount, 0)
+      n_executed += len(tuplevalues_list)
+      i = j
     cursor.close()
-    conn.close()
-    print('Deleted/Committed', len(ids), 'records')
+    self.n_rows_since_commit += n_executed
+    return n_executed
+
+  def flush_writes(self):
+    """
+    Executes the buffered statements and commits them (unless an outer session defers the commit)
+      returns the number of rows written out in this flush
+    """
+    thread_connection = dbb.get_thread_connection(self.sqlitefile_abspath)
+    conn = thread_connection.get_or_open()
+    n_executed = self.execute_pending_writes(conn)
+    # inside buffered_writes(), this instance's block is one level of the session depth
+    own_depth = 1 if self.is_buffering else 0
+    if thread_connection.session_depth <= own_depth:
+      conn.commit()
+      self.n_rows_since_commit = 0
+    self.n_flushes += 1
+    self.last_flush_time = time.monotonic()
+    return n_executed
+
+  @contextlib.contextmanager
+  def buffered_writes(self, flush_n_rows=None, flush_secs=None):
+    """
+    Opens a block in which add_row(), update_row() and delete_row() are flushed every flush_n_rows rows
+      or flush_secs seconds, with a final flush at the block's exit
+    """
+    if self.is_buffering:
+      # nested blocks are part of the outer one
+      yield self
+      return
+    if flush_n_rows is not None:
+      self.flush_n_rows = flush_n_rows
+    if flush_secs is not None:
+      self.flush_secs = flush_secs
+    thread_connection = dbb.get_thread_connection(self.sqlitefile_abspath)
+    thread_connection.get_or_open()
+    thread_connection.session_depth += 1
+    self.is_buffering = True
+    self.last_flush_time = time.monotonic()
+    try:
+      yield self
+    finally:
+      try:
+        self.flush_writes()
+      finally:
+        self.is_buffering = False
+        thread_connection.session_depth -= 1
+
+  def report_buffered_writes(self):
+    print(
+      'buffered writes', self.tablename, '| n_buffered_rows', self.n_buffered_rows,
+      '| n_flushes', self.n_flushes, '| n_unchanged_rows', self.n_unchanged_rows
+    )
+
+  def fetch_rows_by_sha1_n_hashalgo(self, sha1, hashalgo=None):
+    """
+    Fetches the rows with the content hash sha1 produced by hashalgo (default sha1)
+    """
+    if hashalgo is None:
+      hashalgo = hm.DEFAULT_HASHALGO
+    sql = 'SELECT * FROM %(tablename)s WHERE sha1=? AND hashalgo=?;'
+    tuplevalues = (sha1, hashalgo)
+    return self.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
 
   def does_sha1_exist_in_thisdirtree(self, scr_dirnode):
     try:
       sha1 = scr_dirnode.sha1
+      hashalgo = scr_dirnode.hashalgo
     except AttributeError:
       return False
-    sql = 'SELECT sha1 FROM %(tablename)s WHERE sha1=?;'
-    tuplevalues = (sha1, )
+    sql = 'SELECT sha1 FROM %(tablename)s WHERE sha1=? AND hashalgo=?;'
+    tuplevalues = (sha1, hashalgo)
     fetched_list = self.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
     if fetched_list and len(fetched_list) > 0:
       return True
@@ -221,22 +1088,8 @@ def adhoc_select():
   tuplelist = db.do_select_all()
   print(tuplelist)
   for row in tuplelist:
-    _id = row[0]
-    print('_id', _id)
-    hkey = row[1]
-    print('hkey', hkey)
-    name = row[2]
-    print('name', name)
-    parentpath = row[3]
-    print('parentpath', parentpath)
-    is_file = row[4]
-    print('is_file', bool(is_file))
-    sha1 = row[5]
-    print('sha1', sha1.hex())
-    bytesize = row[6]
-    print('bytesize', bytesize)
-    mdatetime = row[7]
-    print('mdatetime', mdatetime)
+    dirnode = db.transform_row_to_dirnode(row)
+    print(dirnode.get_db_id(), dirnode.hashalgo, dirnode)
 
 
 def adhoc_select_all():
@@ -260,16 +1113,14 @@ def adhoc_delete_all_rows():
 def adhoc_insert_some():
   name = 'file1'
   parentpath = '/folder1/secondç'
-  fpath = os.path.join(parentpath, name)
-  hkey = hm.HashSimple(fpath).num
-  is_file = int(True)
   sha_obj = hashlib.sha1()
   strdata = 'dafbn bnç~pafsdkç'.encode('utf8')
   sha_obj.update(strdata)
   sha1 = sha_obj.digest()
   bytesize = 1000
   mdatetime = datetime.datetime.now()
-  tuple_values = (None, hkey, name, parentpath, is_file, sha1, bytesize, mdatetime)
+  hashalgo = 'sha1'
+  tuple_values = (None, name, parentpath, sha1, bytesize, mdatetime, hashalgo)
   question_marks = '?, ' * len(tuple_values)
   question_marks = question_marks.rstrip(', ')
   insert_sql = "INSERT into %(tablename)s VALUES (" + question_marks + ");"
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+This module (dbhashcache_mod.py) contains:
+ class DBHashCache(dbb.DBBase):
+
+This class models db-table hash_cache which keeps the sha1 of a file keyed by its inode identity,
+  ie the 4-tuple (st_dev, st_ino, bytesize, mtime_ns) taken from os.stat(), plus the hashalgo
+  (a file may be cached both as sha1 and as blake2b, see hash_mod.HASHALGO_FACTORIES).
+
+The point is that a rename or a move inside the same disk (filesystem) keeps that 4-tuple,
+  so the walker (cmm/walkup_dirtree_files_cm.py) finds the sha1 here and reads zero bytes
+  from the file, even when DBEntryUpdater could not resolve the move
+  (eg many files sharing the same bytesize and mdatetime).
+
+Any write to the file changes mtime_ns (and usually bytesize), so a changed file is a cache-miss.
+The walker also seeds the table with the sha1's of the files it finds unchanged in files_in_tree,
+  in bulk and without lookups (see seed_sha1s_if_missing()), ie n_hits & n_misses count the walker's lookups only.
+As the table would only grow, the walker prunes it after a complete walk: the keys not seen in the walk
+  (deleted files, or changed ones, whose old key cannot match again) are deleted, see delete_entries_not_seen().
+"""
+import os
+import llib.db.dbbase_mod as dbb
+import llib.hashfunctions.hash_mod as hm
+SEEN_CACHEKEYS_TEMP_TABLENAME = 'temp_seen_cachekeys'
+
+
+class DBHashCache(dbb.DBBase):
+
+  default_tablename = 'hash_cache'
+
+  def __init__(self, mountpath=None, inlocus_sqlite_filename=None, tablename=None):
+    self.n_hits = 0
+    self.n_misses = 0
+    self.n_stored = 0
+    self.n_seeded = 0
+    self.n_pruned = 0
+    if tablename is None:
+      self.tablename = self.default_tablename
+    super().__init__(mountpath, inlocus_sqlite_filename)
+
+  @property
+  def fieldnames(self):
+    return ['id', 'st_dev', 'st_ino', 'bytesize', 'mtime_ns', 'sha1', 'hashalgo']
+
+  def form_fields_line_for_createtable(self):
+    """
+    This method is to be implemented in child-inherited classes
+    """
+    middle_sql = """
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      st_dev INTEGER NOT NULL,
+      st_ino INTEGER NOT NULL,
+      bytesize INTEGER NOT NULL,
+      mtime_ns INTEGER NOT NULL,
+      sha1 BLOB NOT NULL,
+      hashalgo TEXT NOT NULL DEFAULT 'sha1',
+      UNIQUE(st_dev, st_ino, bytesize, mtime_ns, hashalgo)
+    """
+    return middle_sql
+
+  def sqlite_createtable_if_not_exists(self):
+    self.drop_older_table_without_hashalgo()
+    super().sqlite_createtable_if_not_exists()
+
+  def drop_older_table_without_hashalgo(self):
+    """
+    The first version of the table had no hashalgo in its UNIQUE key. Being a cache, it is just dropped
+    """
+    conn = self.get_connection()
+    cursor = conn.cursor()
+    sql = 'PRAGMA table_info("%(tablename)s");' % {'tablename': self.tablename}
+    existing_colnames = [row[1] for row in cursor.execute(sql).fetchall()]
+    if len(existing_colnames) > 0 and 'hashalgo' not in existing_colnames:
+      cursor.execute('DROP TABLE "%(tablename)s";' % {'tablename': self.tablename})
+      self.commit_unless_in_session(conn)
+    cursor.close()
+
+  def form_update_with_all_fields_sql(self):
+    """
+    Notice that the interpolation %(tablename)s is not done here, it'll be done later on.
+    """
+    sql_before_interpol = '''
+    UPDATE %(tablename)s
+      SET
+        st_dev=?,
+        st_ino=?,
+        bytesize=?,
+        mtime_ns=?,
+        sha1=?,
+        hashalgo=?
+      WHERE
+        id=?
+    '''
+    return sql_before_interpol
+
+  @staticmethod
+  def extract_cachekey_from_filestat(filestat):
+    return filestat.st_dev, filestat.st_ino, filestat.st_size, filestat.st_mtime_ns
+
+  def fetch_sha1_by_cachekey_or_none(self, st_dev, st_ino, bytesize, mtime_ns, hashalgo=None):
+    if hashalgo is None:
+      hashalgo = hm.DEFAULT_HASHALGO
+    sql = 'SELECT sha1 FROM %(tablename)s WHERE st_dev=? AND st_ino=? AND bytesize=? AND mtime_ns=?'
+    sql += ' AND hashalgo=?;'
+    tuplevalues = (st_dev, st_ino, bytesize, mtime_ns, hashalgo)
+    rows = self.do_select_with_sql_n_tuplevalues(sql, tuplevalues)
+    if len(rows) == 0:
+      self.n_misses += 1
+      return None
+    self.n_hits += 1
+    return rows[0][0]
+
+  def fetch_sha1_by_filestat_or_none(self, filestat, hashalgo=None):
+    cachekey = self.extract_cachekey_from_filestat(filestat)
+    return self.fetch_sha1_by_cachekey_or_none(*cachekey, hashalgo)
+
+  def store_sha1_with_cachekey(self, st_dev, st_ino, bytesize, mtime_ns, sha1, hashalgo=None):
+    """
+    Inserts or replaces the cache entry. Returns False if sha1 is None (nothing to cache)
+    """
+    if sha1 is None:
+      return False
+    if hashalgo is None:
+      hashalgo = hm.DEFAULT_HASHALGO
+    sql = '''INSERT OR REPLACE INTO %(tablename)s (st_dev, st_ino, bytesize, mtime_ns, sha1, hashalgo)
+      VALUES (?,?,?,?,?,?);'''
+    tuplevalues = (st_dev, st_ino, bytesize, mtime_ns, sha1, hashalgo)
+    was_stored = self.do_insert_with_sql_n_tuplevalues(sql, tuplevalues)
+    if was_stored:
+      self.n_stored += 1
+    return was_stored
+
+  def store_sha1_with_filestat(self, filestat, sha1, hashalgo=None):
+    cachekey = self.extract_cachekey_from_filestat(filestat)
+    return self.store_sha1_with_cachekey(*cachekey, sha1, hashalgo)
+
+  def store_sha1_with_filestat_if_missing(self, filestat, sha1, hashalgo=None):
+    """
+    Used when the sha1 comes from files_in_tree (a file found with same size & date):
+      it is only written if its key is not already cached (see seed_sha1s_if_missing())
+    """
+    cachekey = self.extract_cachekey_from_filestat(filestat)
+    return self.store_sha1_with_cachekey_if_missing(*cachekey, sha1, hashalgo)
+
+  def store_sha1_with_cachekey_if_missing(self, st_dev, st_ino, bytesize, mtime_ns, sha1, hashalgo=None):
+    if sha1 is None:
+      return False
+    if hashalgo is None:
+      hashalgo = hm.DEFAULT_HASHALGO
+    return self.seed_sha1s_if_missing([(st_dev, st_ino, bytesize, mtime_ns, sha1, hashalgo)]) > 0
+
+  def seed_sha1s_if_missing(self, seed_entries):
+    """
+    Stores, with one executemany() of INSERT OR IGNORE, the sha1's known from files_in_tree,
+      seed_entries being (st_dev, st_ino, bytesize, mtime_ns, sha1, hashalgo)'s.
+      The keys already cached are left as they are; no lookup is done, ie n_hits & n_misses are not touched.
+      Returns the number of entries written (also added to n_seeded)
+    """
+    if len(seed_entries) == 0:
+      return 0
+    sql = '''INSERT OR IGNORE INTO "%(tablename)s" (st_dev, st_ino, bytesize, mtime_ns, sha1, hashalgo)
+      VALUES (?,?,?,?,?,?);''' % {'tablename': self.tablename}
+    conn = self.get_connection()
+    n_total_changes_before = conn.total_changes
+    cursor = conn.cursor()
+    cursor.executemany(sql, seed_entries)
+    cursor.close()
+    n_seeded = conn.total_changes - n_total_changes_before
+    self.commit_unless_in_session(conn)
+    self.n_seeded += n_seeded
+    return n_seeded
+
+  def add_seen_cachekeys(self, cachekeys):
+    """
+    Records cachekeys (as in extract_cachekey_from_filestat()) in temp table SEEN_CACHEKEYS_TEMP_TABLENAME,
+      called in batches during a walk, see delete_entries_not_seen()
+    """
+    interpol_dict = {'seen': SEEN_CACHEKEYS_TEMP_TABLENAME}
+    conn = self.get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TEMP TABLE IF NOT EXISTS "%(seen)s" (
+      st_dev INTEGER NOT NULL,
+      st_ino INTEGER NOT NULL,
+      bytesize INTEGER NOT NULL,
+      mtime_ns INTEGER NOT NULL,
+      PRIMARY KEY(st_dev, st_ino, bytesize, mtime_ns)
+    ) WITHOUT ROWID;''' % interpol_dict)
+    sql = 'INSERT OR IGNORE INTO temp."%(seen)s" (st_dev, st_ino, bytesize, mtime_ns) VALUES (?,?,?,?);'
+    cursor.executemany(sql % interpol_dict, cachekeys)
+    cursor.close()
+
+  def delete_entries_not_seen(self):
+    """
+    Deletes (with one anti-join DELETE) the entries whose key was not added by add_seen_cachekeys(),
+      ie whose inode is gone or whose file changed. Only to be called after a complete walk
+      (a folder that could not be listed would have its files' entries deleted). Returns n_deleted
+    """
+    interpol_dict = {'tablename': self.tablename, 'seen': SEEN_CACHEKEYS_TEMP_TABLENAME}
+    with self.session() as conn:
+      cursor = conn.cursor()
+      cursor.execute('CREATE TEMP TABLE IF NOT EXISTS "%(seen)s" (st_dev, st_ino, bytesize, mtime_ns);' % interpol_dict)
+      sql = '''DELETE FROM "%(tablename)s" WHERE NOT EXISTS (
+        SELECT 1 FROM temp."%(seen)s" s WHERE s.st_dev = "%(tablename)s".st_dev AND s.st_ino = "%(tablename)s".st_ino
+          AND s.bytesize = "%(tablename)s".bytesize AND s.mtime_ns = "%(tablename)s".mtime_ns
+      );'''
+      cursor.execute(sql % interpol_dict)
+      n_deleted = max(cursor.rowcount, 0)
+      cursor.execute('DROP TABLE temp."%(seen)s";' % interpol_dict)
+      cursor.close()
+    self.n_pruned += n_deleted
+    return n_deleted
+
+  def report(self):
+    print(
+      'hash_cache', '| n_hits', self.n_hits, '| n_misses', self.n_misses, '| n_stored', self.n_stored,
+      '| n_seeded', self.n_seeded, '| n_pruned', self.n_pruned
+    )
+
+
+def adhoc_test():
+  """
+  Caches the sha1 of this module's file and looks it up again via its filestat
+  """
+  filepath = os.path.abspath(__file__)
+  folderpath = os.path.dirname(filepath)
+  db = DBHashCache(folderpath, '.adhoctest_hashcache.sqlite')
+  filestat = os.stat(filepath)
+  print('before store', db.fetch_sha1_by_filestat_or_none(filestat))
+  db.store_sha1_with_filestat(filestat, hm.calc_sha1_from_file(filepath))
+  print('after store', db.fetch_sha1_by_filestat_or_none(filestat).hex())
+  db.report()
+  os.remove(db.sqlitefile_abspath)
+
+
+def process():
+  adhoc_test()
+
+
+if __name__ == '__main__':
+  process()
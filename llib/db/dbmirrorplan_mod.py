@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+This module (dbmirrorplan_mod.py) contains:
+ class DBMirrorPlan(dbb.DBBase):
+
+This class models db-table mirror_plan, the list of what is to be done to mirror a source dirtree
+  into a target dirtree. The table lives in the target's sqlitefile (ie at the target's mountpath).
+
+build_plan() ATTACHes the source's sqlitefile to the target's connection and computes the plan
+  with a few set-based statements (joins on the sha1 and the (name, parentpath) indexes),
+  instead of the per-file SELECTs (one per source row against the other sqlitefile) of the two-tree scripts.
+  Each row of the plan has one of the following actions:
+    'missing': the source file's (sha1, hashalgo) does not exist in the target (a copy is needed);
+    'misplaced': the (sha1, hashalgo) is unique on both sides and the target file is elsewhere (a move is needed);
+    'excess': the target file's (sha1, hashalgo) does not exist in the source;
+    'ambiguous': the (sha1, hashalgo) repeats on one side (or both) and its files are not all in place,
+      ie it's up to the script to decide (the row has the first src & trg files and n_src, n_trg);
+  files that are already in place have no rows.
+
+The plan is rebuilt (the previous one is deleted) at each build_plan(), the scripts stream it with:
+  for row in plan.iter_plan_rows('missing'):
+    src_dirnode = plan.transform_row_to_src_dirnode(row)
+"""
+import llib.db.dbbase_mod as dbb
+import llib.db.dbdirtree_mod as dbdt
+import models.entries.dirnode_mod as dn
+import default_settings as defaults
+PLAN_ACTIONS = ['missing', 'misplaced', 'excess', 'ambiguous']
+ATTACHED_SRC_SCHEMANAME = 'plansrc'
+
+
+class DBMirrorPlan(dbb.DBBase):
+
+  default_tablename = 'mirror_plan'
+
+  def __init__(self, src_mountpath, trg_mountpath, inlocus_sqlite_filename=None, tablename=None):
+    if tablename is None:
+      self.tablename = self.default_tablename
+    # both dirtrees are opened first, so that their tables (and sha1 indexes) exist and are migrated
+    self.src_dbtree = dbdt.DBDirTree(src_mountpath, inlocus_sqlite_filename)
+    self.trg_dbtree = dbdt.DBDirTree(trg_mountpath, inlocus_sqlite_filename)
+    self.src_mountpath = self.src_dbtree.mountpath
+    self.trg_mountpath = self.trg_dbtree.mountpath
+    self.n_actions = {action: 0 for action in PLAN_ACTIONS}
+    super().__init__(trg_mountpath, inlocus_sqlite_filename)
+
+  @property
+  def fieldnames(self):
+    return [
+      'id', 'action', 'sha1', 'hashalgo', 'bytesize', 'mdatetime', 'n_src', 'n_trg',
+      'src_id', 'src_name', 'src_parentpath', 'trg_id', 'trg_name', 'trg_parentpath'
+    ]
+
+  def form_fields_line_for_createtable(self):
+    """
+    This method is to be implemented in child-inherited classes
+    """
+    middle_sql = """
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      action TEXT NOT NULL,
+      sha1 BLOB NOT NULL,
+      hashalgo TEXT NOT NULL,
+      bytesize INTEGER,
+      mdatetime TEXT,
+      n_src INTEGER NOT NULL,
+      n_trg INTEGER NOT NULL,
+      src_id INTEGER,
+      src_name TEXT,
+      src_parentpath TEXT,
+      trg_id INTEGER,
+      trg_name TEXT,
+      trg_parentpath TEXT
+    """
+    return middle_sql
+
+  def sqlite_createtable_if_not_exists(self):
+    conn = self.get_connection()
+    cursor = conn.cursor()
+    sql = self.interpolate_create_table_sql()
+    cursor.execute(sql)
+    self.migrate_schema(cursor)
+    self.commit_unless_in_session(conn)
+    cursor.close()
+
+  def get_schema_migrations(self):
+    """
+    Version 1 is the index the plan is streamed with (action=? in id order, see iter_plan_rows())
+    """
+    return [
+      (1, 'create index on action', self.create_action_index),
+    ]
+
+  def create_action_index(self, cursor):
+    sql = 'CREATE INDEX IF NOT EXISTS "idx_%(tablename)s_action" ON "%(tablename)s" (action);' \
+          % {'tablename': self.tablename}
+    cursor.execute(sql)
+
+  def form_plan_sqls(self):
+    """
+    The statements that (re)build the plan, in execution order.
+      plan_src_sha1s & plan_trg_sha1s: per (sha1, hashalgo), its number of files and its first file's id
+      plan_inplace_sha1s: per (sha1, hashalgo), the number of source files having a same-content target file
+        at the same name & parentpath (a lookup on the target's UNIQUE(name, parentpath))
+    """
+    interpol_dict = {
+      'plan': self.tablename,
+      'src': '%s."%s"' % (ATTACHED_SRC_SCHEMANAME, self.src_dbtree.tablename),
+      'trg': 'main."%s"' % self.trg_dbtree.tablename,
+    }
+    sqls = [
+      'DELETE FROM "%(plan)s";',
+      '''CREATE TEMP TABLE plan_src_sha1s AS
+        SELECT sha1, hashalgo, count(*) AS n, min(id) AS first_id FROM %(src)s GROUP BY sha1, hashalgo;''',
+      'CREATE UNIQUE INDEX temp.idx_plan_src_sha1s ON plan_src_sha1s (sha1, hashalgo);',
+      '''CREATE TEMP TABLE plan_trg_sha1s AS
+        SELECT sha1, hashalgo, count(*) AS n, min(id) AS first_id FROM %(trg)s GROUP BY sha1, hashalgo;''',
+      'CREATE UNIQUE INDEX temp.idx_plan_trg_sha1s ON plan_trg_sha1s (sha1, hashalgo);',
+      '''CREATE TEMP TABLE plan_inplace_sha1s AS
+        SELECT s.sha1, s.hashalgo, count(*) AS n FROM %(src)s s
+          JOIN %(trg)s t ON t.name=s.name AND t.parentpath=s.parentpath AND t.sha1=s.sha1 AND t.hashalgo=s.hashalgo
+        GROUP BY s.sha1, s.hashalgo;''',
+      'CREATE UNIQUE INDEX temp.idx_plan_inplace_sha1s ON plan_inplace_sha1s (sha1, hashalgo);',
+      # missing-in-target: one row per source file
+      '''INSERT INTO "%(plan)s"
+          (action, sha1, hashalgo, bytesize, mdatetime, n_src, n_trg, src_id, src_name, src_parentpath)
+        SELECT 'missing', s.sha1, s.hashalgo, s.bytesize, s.mdatetime, ss.n, 0, s.id, s.name, s.parentpath
+        FROM %(src)s s JOIN plan_src_sha1s ss ON ss.sha1=s.sha1 AND ss.hashalgo=s.hashalgo
+        WHERE NOT EXISTS (SELECT 1 FROM plan_trg_sha1s ts WHERE ts.sha1=s.sha1 AND ts.hashalgo=s.hashalgo)
+        ORDER BY s.id;''',
+      # present-but-misplaced: unique on both sides, at another name or parentpath
+      '''INSERT INTO "%(plan)s"
+          (action, sha1, hashalgo, bytesize, mdatetime, n_src, n_trg,
+           src_id, src_name, src_parentpath, trg_id, trg_name, trg_parentpath)
+        SELECT 'misplaced', s.sha1, s.hashalgo, s.bytesize, s.mdatetime, 1, 1,
+          s.id, s.name, s.parentpath, t.id, t.name, t.parentpath
+        FROM plan_src_sha1s ss
+          JOIN plan_trg_sha1s ts ON ts.sha1=ss.sha1 AND ts.hashalgo=ss.hashalgo
+          JOIN %(src)s s ON s.id=ss.first_id
+          JOIN %(trg)s t ON t.id=ts.first_id
+        WHERE ss.n=1 AND ts.n=1 AND (s.name != t.name OR s.parentpath != t.parentpath)
+        ORDER BY s.id;''',
+      # excess-in-target: one row per target file
+      '''INSERT INTO "%(plan)s"
+          (action, sha1, hashalgo, bytesize, mdatetime, n_src, n_trg, trg_id, trg_name, trg_parentpath)
+        SELECT 'excess', t.sha1, t.hashalgo, t.bytesize, t.mdatetime, 0, ts.n, t.id, t.name, t.parentpath
+        FROM %(trg)s t JOIN plan_trg_sha1s ts ON ts.sha1=t.sha1 AND ts.hashalgo=t.hashalgo
+        WHERE NOT EXISTS (SELECT 1 FROM plan_src_sha1s ss WHERE ss.sha1=t.sha1 AND ss.hashalgo=t.hashalgo)
+        ORDER BY t.id;''',
+      # ambiguous repeats: one row per (sha1, hashalgo) that repeats and is not all in place
+      '''INSERT INTO "%(plan)s"
+          (action, sha1, hashalgo, bytesize, mdatetime, n_src, n_trg,
+           src_id, src_name, src_parentpath, trg_id, trg_name, trg_parentpath)
+        SELECT 'ambiguous', s.sha1, s.hashalgo, s.bytesize, s.mdatetime, ss.n, ts.n,
+          s.id, s.name, s.parentpath, t.id, t.name, t.parentpath
+        FROM plan_src_sha1s ss
+          JOIN plan_trg_sha1s ts ON ts.sha1=ss.sha1 AND ts.hashalgo=ss.hashalgo
+          JOIN %(src)s s ON s.id=ss.first_id
+          JOIN %(trg)s t ON t.id=ts.first_id
+          LEFT JOIN plan_inplace_sha1s ip ON ip.sha1=ss.sha1 AND ip.hashalgo=ss.hashalgo
+        WHERE (ss.n > 1 OR ts.n > 1) AND NOT (ss.n = ts.n AND ifnull(ip.n, 0) = ss.n)
+        ORDER BY s.id;''',
+    ]
+    return [sql % interpol_dict for sql in sqls]
+
+  def drop_temp_tables(self, cursor):
+    for temp_tablename in ['plan_src_sha1s', 'plan_trg_sha1s', 'plan_inplace_sha1s']:
+      cursor.execute('DROP TABLE IF EXISTS temp.%s;' % temp_tablename)
+
+  def build_plan(self):
+    """
+    (Re)builds the plan in one transaction, returns the number of plan rows
+      ATTACH/DETACH cannot run inside a transaction, so the target's pending writes are committed first
+      and a build inside a session (see DBBase.session()) is refused.
+    """
+    if self.is_in_session():
+      error_msg = 'The mirror plan cannot be built inside a session (sqlitefile %s).' % self.sqlitefile_abspath
+      raise ValueError(error_msg)
+    self.trg_dbtree.flush_writes()
+    self.src_dbtree.flush_writes()
+    conn = self.get_connection()
+    conn.commit()
+    cursor = conn.cursor()
+    sql = 'ATTACH DATABASE ? AS %s;' % ATTACHED_SRC_SCHEMANAME
+    cursor.execute(sql, (self.src_dbtree.sqlitefile_abspath, ))
+    try:
+      for sql in self.form_plan_sqls():
+        cursor.execute(sql)
+      self.drop_temp_tables(cursor)
+      conn.commit()
+    except BaseException:
+      conn.rollback()
+      self.drop_temp_tables(cursor)
+      raise
+    finally:
+      cursor.execute('DETACH DATABASE %s;' % ATTACHED_SRC_SCHEMANAME)
+      cursor.close()
+    self.count_actions()
+    return sum(self.n_actions.values())
+
+  def count_actions(self):
+    self.n_actions = {action: 0 for action in PLAN_ACTIONS}
+    sql = 'SELECT action, count(*) FROM %(tablename)s GROUP BY action;'
+    for action, n in self.do_select_with_sql_without_tuplevalues(sql):
+      self.n_actions[action] = n
+    return self.n_actions
+
+  def iter_plan_rows(self, action=None):
+    """
+    Streams the plan's rows (of one action or all) in id order, page by page (see do_select_rows_by_keyset())
+      ie the target dirtree may be written to along the way
+    """
+    if action is None:
+      return self.do_select_rows_by_keyset()
+    if action not in PLAN_ACTIONS:
+      error_msg = 'Plan action (%s) is not one of %s.' % (str(action), str(PLAN_ACTIONS))
+      raise ValueError(error_msg)
+    return self.do_select_rows_by_keyset('action=?', (action, ))
+
+  def transform_row_to_dirnode_with_prefix(self, row, prefix):
+    idx = self.fieldnames.index(prefix + 'id')
+    _id = row[idx]
+    if _id is None:
+      return None
+    name = row[self.fieldnames.index(prefix + 'name')]
+    parentpath = row[self.fieldnames.index(prefix + 'parentpath')]
+    sha1 = row[self.fieldnames.index('sha1')]
+    bytesize = row[self.fieldnames.index('bytesize')]
+    mdatetime = row[self.fieldnames.index('mdatetime')]
+    hashalgo = row[self.fieldnames.index('hashalgo')]
+    dirnode = dn.DirNode(name, parentpath, sha1, bytesize, mdatetime, hashalgo)
+    dirnode.set_db_id(_id)
+    return dirnode
+
+  def transform_row_to_src_dirnode(self, row):
+    """
+    Returns None for the 'excess' rows (they have no source file)
+    """
+    return self.transform_row_to_dirnode_with_prefix(row, 'src_')
+
+  def transform_row_to_trg_dirnode(self, row):
+    """
+    Returns None for the 'missing' rows (they have no target file)
+    Notice that the bytesize & mdatetime of the 'misplaced' and 'ambiguous' rows are the source file's
+    """
+    return self.transform_row_to_dirnode_with_prefix(row, 'trg_')
+
+  def report(self):
+    print('mirror plan', self.tablename, '@', self.sqlitefile_abspath)
+    print('src', self.src_mountpath)
+    print('trg', self.trg_mountpath)
+    for action in PLAN_ACTIONS:
+      print('n_' + action, self.n_actions[action])
+
+
+def adhoc_test():
+  """
+  Builds the plan for the src & trg mountpaths in the cli args (or the defaults) and prints it
+  """
+  src_mountpath, trg_mountpath = defaults.get_src_n_trg_mountpath_args_or_default()
+  plan = DBMirrorPlan(src_mountpath, trg_mountpath)
+  plan.build_plan()
+  for row in plan.iter_plan_rows():
+    src_dirnode = plan.transform_row_to_src_dirnode(row)
+    trg_dirnode = plan.transform_row_to_trg_dirnode(row)
+    src_path = None if src_dirnode is None else src_dirnode.path
+    trg_path = None if trg_dirnode is None else trg_dirnode.path
+    print(row[0], row[1], src_path, '=>', trg_path)
+  plan.report()
+
+
+def process():
+  adhoc_test()
+
+
+if __name__ == '__main__':
+  process()
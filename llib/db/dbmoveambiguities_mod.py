@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+This module (dbmoveambiguities_mod.py) contains:
+ class DBMoveAmbiguity(dbb.DBBase):
+
+This class models db-table file_move_ambiguities, the report of the last move reconciliation
+  (see DBDirTree.reconcile_moved_rows() and cmm/clean/dbclean/dbentry_updater_by_filemove_based_on_size_n_mdt_cm.py)
+  that could not be applied: the (bytesize, mdatetime) keys shared by more than one file on disk
+  or by more than one db row, ie a move that cannot be told apart by size & date alone.
+
+Each row is one side of an ambiguous key:
+  - 'os': a file on disk without a db row
+  - 'db_missing': a db row without its file on disk
+  - 'db_present': a db row (with its file on disk) having the same key
+The table is rewritten by each reconciliation (it lives in the same sqlite file as files_in_tree).
+"""
+import llib.db.dbbase_mod as dbb
+AMBIGUITY_SIDES = ['os', 'db_missing', 'db_present']
+
+
+class DBMoveAmbiguity(dbb.DBBase):
+
+  default_tablename = 'file_move_ambiguities'
+
+  def __init__(self, mountpath=None, inlocus_sqlite_filename=None, tablename=None):
+    if tablename is None:
+      self.tablename = self.default_tablename
+    super().__init__(mountpath, inlocus_sqlite_filename)
+
+  @property
+  def fieldnames(self):
+    return ['id', 'side', 'file_id', 'name', 'parentpath', 'bytesize', 'mdatetime']
+
+  def form_fields_line_for_createtable(self):
+    """
+    This method is to be implemented in child-inherited classes
+    """
+    middle_sql = """
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      side TEXT NOT NULL,
+      file_id INTEGER,
+      name TEXT NOT NULL,
+      parentpath TEXT NOT NULL,
+      bytesize INTEGER NOT NULL,
+      mdatetime TEXT
+    """
+    return middle_sql
+
+  def form_update_with_all_fields_sql(self):
+    """
+    Notice that the interpolation %(tablename)s is not done here, it'll be done later on.
+    """
+    sql_before_interpol = '''
+    UPDATE %(tablename)s
+      SET
+        side=?,
+        file_id=?,
+        name=?,
+        parentpath=?,
+        bytesize=?,
+        mdatetime=?
+      WHERE
+        id=?
+    '''
+    return sql_before_interpol
+
+  def fetch_rows_ordered_by_key(self):
+    sql = 'SELECT * FROM %(tablename)s ORDER BY bytesize DESC, mdatetime, side, parentpath, name;'
+    return self.do_select_with_sql_without_tuplevalues(sql)
+
+  def count_keys_as_int(self):
+    sql = 'SELECT count(*) FROM (SELECT DISTINCT bytesize, mdatetime FROM %(tablename)s);'
+    rows = self.do_select_with_sql_without_tuplevalues(sql)
+    return rows[0][0] if len(rows) > 0 else 0
+
+
+def adhoc_select_all():
+  db = DBMoveAmbiguity()
+  result_tuple_list = db.fetch_rows_ordered_by_key()
+  for tuplerow in result_tuple_list:
+    print(tuplerow)
+  return result_tuple_list
+
+
+def process():
+  adhoc_select_all()
+
+
+if __name__ == '__main__':
+  process()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+llib/db/dbprofile_mod.py
+  Contains the named PRAGMA profiles applied to each connection DBBase opens (see ThreadConnection.get_or_open()).
+
+The problem it solves:
+  - the sqlitefiles were used with sqlite's defaults, ie a rollback journal with an fsync at each commit
+    (synchronous=FULL), a 2MB page cache and no mmap, whatever the script;
+  - a walk (lots of small writes) and a report (lots of small reads) on an external disk paid
+    full-durability costs they don't need: a walk can be rerun, a report does not write at all.
+
+The profiles are:
+  1) 'none' (the default): no PRAGMA's, ie sqlite's defaults (the previous behavior);
+  2) 'safe': the rollback journal and synchronous=FULL, ie each commit is on disk when it returns;
+  3) 'bulk-walk': WAL with synchronous=NORMAL (a commit is not fsync'ed, only the checkpoints are:
+     a power loss may lose the last commits, not corrupt the db), a 256MB page cache, temp tables in memory;
+  4) 'read-only-report': query_only (a write raises an error) with a 256MB mmap and page cache.
+
+A script chooses its profile with set_default_profile() (eg the walker 'bulk-walk'),
+  the cli arg --db-profile=<profile> overrides it (see set_default_profile_from_args()).
+  The profile should be set at the script's start, the connections opened before keep their PRAGMA's.
+
+Notice that WAL's journal_mode is persistent (it stays on the sqlitefile, with its -wal & -shm side files,
+  until 'safe' sets the rollback journal back) and that WAL does not work on network filesystems.
+"""
+import contextlib
+import os
+import sqlite3
+import sys
+import tempfile
+DB_PROFILES = {
+  'none': [],
+  'safe': [
+    ('journal_mode', 'DELETE'),
+    ('synchronous', 'FULL'),
+  ],
+  'bulk-walk': [
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', '-262144'),  # negative is in KiB, ie 256MB
+    ('temp_store', 'MEMORY'),
+  ],
+  'read-only-report': [
+    ('query_only', 'ON'),
+    ('mmap_size', '268435456'),
+    ('cache_size', '-262144'),
+    ('temp_store', 'MEMORY'),
+  ],
+}
+DEFAULT_DB_PROFILE = 'none'
+DB_PROFILE_ARG_PREFIX = '--db-profile='
+_default_profile = DEFAULT_DB_PROFILE
+
+
+def get_default_profile():
+  return _default_profile
+
+
+def set_default_profile(profile):
+  """
+  profile is one of DB_PROFILES' keys
+  """
+  global _default_profile
+  if profile not in DB_PROFILES:
+    error_msg = 'DB profile error: profile (%s) is not one of %s.' % (profile, list(DB_PROFILES.keys()))
+    raise ValueError(error_msg)
+  _default_profile = profile
+  return _default_profile
+
+
+def get_arg_db_profile_or_none():
+  """
+  This cli arg (--db-profile=<none|safe|bulk-walk|read-only-report>) sets the PRAGMA profile of a run
+  """
+  for arg in sys.argv:
+    if arg.startswith(DB_PROFILE_ARG_PREFIX):
+      return arg[len(DB_PROFILE_ARG_PREFIX):]
+  return None
+
+
+def set_default_profile_from_args(script_profile=None):
+  """
+  script_profile is the script's own choice, the cli arg (if given) takes precedence over it
+  """
+  profile = get_arg_db_profile_or_none()
+  if profile is None:
+    profile = script_profile
+  if profile is None:
+    return _default_profile
+  return set_default_profile(profile)
+
+
+def apply_profile(conn, profile=None):
+  """
+  Runs the profile's PRAGMA's on conn (profile defaults to the default profile)
+  """
+  if profile is None:
+    profile = _default_profile
+  for pragma_name, pragma_value in DB_PROFILES[profile]:
+    conn.execute('PRAGMA %s = %s;' % (pragma_name, pragma_value))
+  return profile
+
+
+@contextlib.contextmanager
+def allowing_schema_writes(conn):
+  """
+  Lifts query_only (if on) for the block, for the create-tables & migrations run when a table is opened,
+    ie a report with 'read-only-report' still brings an older sqlitefile's schema up to date
+  """
+  was_query_only = conn.execute('PRAGMA query_only;').fetchone()[0] == 1
+  if was_query_only:
+    conn.execute('PRAGMA query_only = OFF;')
+  try:
+    yield conn
+  finally:
+    if was_query_only:
+      conn.execute('PRAGMA query_only = ON;')
+
+
+def adhoc_test():
+  """
+  Applies each profile to a temp sqlitefile and prints the resulting PRAGMA values
+  """
+  with tempfile.TemporaryDirectory() as tmpdir:
+    for profile in DB_PROFILES:
+      conn = sqlite3.connect(os.path.join(tmpdir, 'adhoctest_profile.sqlite'))
+      apply_profile(conn, profile)
+      values = []
+      for pragma_name in ['journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'query_only']:
+        values.append((pragma_name, conn.execute('PRAGMA %s;' % pragma_name).fetchone()[0]))
+      print(profile, values)
+      conn.close()
+
+
+def process():
+  adhoc_test()
+
+
+if __name__ == '__main__':
+  process()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+llib/db/dbquerytiming_mod.py
+  Contains the opt-in timing of the SQL statements executed through DBBase's connections
+    (see ThreadConnection.get_or_open() in dbbase_mod), to tell which ones dominate a walk or a mirror run.
+
+When on, the connections are InstrumentedConnection's, whose cursors time each execute() & executemany()
+  and count the rows they return (fetched) or change. The timings are aggregated per SQL template
+  (the statement with its whitespace collapsed and its literals replaced by ?, see normalize_sql()):
+    n_calls, total_secs, p50 & p99 latency (of the execute() calls, the fetches are in fetch_secs), n_rows.
+  The first execution of each template (and every EXPLAIN_SAMPLE_EVERY_N-th after it) is looked at
+    with EXPLAIN QUERY PLAN, a plan with a full table scan (SCAN <table> without an index) flags the template.
+  At the process' exit, the templates are printed as a table (the slowest first) and,
+    if a filepath is given, dumped to a JSON file.
+
+It's switched on by either:
+  - environment variable PYMIRROR_DB_TIMING=1 (PYMIRROR_DB_TIMING_JSON=<filepath> for the JSON dump)
+  - or, in default_settings.py, DB_QUERY_TIMING = True (DB_QUERY_TIMING_JSON_FILEPATH = <filepath>)
+It's off by default, for the timing itself costs a little on each statement (and on each fetched row).
+"""
+import atexit
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import default_settings as defaults
+DB_TIMING_ENV_VAR = 'PYMIRROR_DB_TIMING'
+DB_TIMING_JSON_ENV_VAR = 'PYMIRROR_DB_TIMING_JSON'
+EXPLAIN_SAMPLE_EVERY_N = 1000
+MAX_LATENCY_SAMPLES = 10000  # per template, a reservoir sample beyond it
+N_TEMPLATES_IN_REPORT = 30
+EXPLAINABLE_SQL_PREFIXES = ('SELECT', 'WITH', 'INSERT', 'REPLACE', 'UPDATE', 'DELETE')
+
+
+def normalize_sql(sql):
+  """
+  The SQL template: whitespace collapsed, string/blob/number literals replaced by ?, runs of ? in a list by '?, ...'
+  """
+  template = ' '.join(sql.split())
+  template = re.sub(r"[xX]?'(?:[^']|'')*'", '?', template)
+  template = re.sub(r'(?<![\w.])-?\d+(?:\.\d+)?\b', '?', template)
+  template = re.sub(r'\?(?:\s*,\s*\?)+', '?, ...', template)
+  return template
+
+
+class QueryTemplateTiming:
+
+  def __init__(self, template):
+    self.template = template
+    self.n_calls = 0
+    self.total_secs = 0.0
+    self.fetch_secs = 0.0
+    self.n_rows = 0
+    self.latencies = []
+    self.n_explained = 0
+    self.query_plan = None
+    self.full_scan_tables = []
+
+  def add_call(self, secs):
+    self.n_calls += 1
+    self.total_secs += secs
+    if len(self.latencies) < MAX_LATENCY_SAMPLES:
+      self.latencies.append(secs)
+      return
+    i = random.randrange(self.n_calls)
+    if i < MAX_LATENCY_SAMPLES:
+      self.latencies[i] = secs
+
+  def is_explain_due(self):
+    return (self.n_calls - 1) % EXPLAIN_SAMPLE_EVERY_N == 0
+
+  def set_query_plan(self, plan_details):
+    self.n_explained += 1
+    self.query_plan = plan_details
+    for detail in plan_details:
+      # eg 'SCAN files_in_tree' (a full scan) as opposed to 'SCAN f USING COVERING INDEX ...' or 'SEARCH ...'
+      if detail.startswith('SCAN ') and ' USING ' not in detail and not detail.startswith('SCAN CONSTANT'):
+        table = detail.split()[1]
+        if table not in self.full_scan_tables:
+          self.full_scan_tables.append(table)
+
+  def percentile(self, fraction):
+    if len(self.latencies) == 0:
+      return 0.0
+    latencies = sorted(self.latencies)
+    idx = min(len(latencies) - 1, int(fraction * len(latencies)))
+    return latencies[idx]
+
+  def as_dict(self):
+    return {
+      'template': self.template, 'n_calls': self.n_calls, 'total_secs': self.total_secs,
+      'p50_secs': self.percentile(0.50), 'p99_secs': self.percentile(0.99), 'fetch_secs': self.fetch_secs,
+      'n_rows': self.n_rows, 'is_full_scan': len(self.full_scan_tables) > 0,
+      'full_scan_tables': self.full_scan_tables, 'query_plan': self.query_plan,
+    }
+
+
+class QueryTimings:
+  """
+  The per-template aggregates of all threads' connections
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.timings = {}  # {template: QueryTemplateTiming}
+
+  def get_or_add(self, sql):
+    template = normalize_sql(sql)
+    with self.lock:
+      timing = self.timings.get(template)
+      if timing is None:
+        timing = QueryTemplateTiming(template)
+        self.timings[template] = timing
+      return timing
+
+  def add_call(self, timing, secs, n_rows):
+    with self.lock:
+      timing.add_call(secs)
+      timing.n_rows += n_rows
+      return timing.is_explain_due()
+
+  def add_fetch(self, timing, secs, n_rows):
+    with self.lock:
+      timing.fetch_secs += secs
+      timing.n_rows += n_rows
+
+  def set_query_plan(self, timing, plan_details):
+    with self.lock:
+      timing.set_query_plan(plan_details)
+
+  def get_sorted_timings(self):
+    with self.lock:
+      return sorted(self.timings.values(), key=lambda t: t.total_secs + t.fetch_secs, reverse=True)
+
+  def dump_json(self, json_filepath):
+    dicts = [timing.as_dict() for timing in self.get_sorted_timings()]
+    with open(json_filepath, 'w') as f:
+      json.dump(dicts, f, indent=2)
+
+  def report(self):
+    timings = self.get_sorted_timings()
+    print('-'*50)
+    print('SQL timings:', len(timings), 'templates (the slowest', N_TEMPLATES_IN_REPORT, 'below, * = full scan)')
+    print('n_calls | total_secs | p50_ms | p99_ms | fetch_secs | n_rows | template')
+    for timing in timings[:N_TEMPLATES_IN_REPORT]:
+      scan_mark = '*' if len(timing.full_scan_tables) > 0 else ' '
+      print(
+        '%7d | %10.3f | %6.2f | %6.2f | %10.3f | %6d |%s %s' % (
+          timing.n_calls, timing.total_secs, timing.percentile(0.50) * 1000, timing.percentile(0.99) * 1000,
+          timing.fetch_secs, timing.n_rows, scan_mark, timing.template[:120]
+        )
+      )
+
+
+_query_timings = QueryTimings()
+_is_enabled = None  # None until is_enabled() reads the settings
+_enabled_lock = threading.Lock()
+
+
+def get_query_timings():
+  return _query_timings
+
+
+def get_json_filepath_or_none():
+  json_filepath = os.environ.get(DB_TIMING_JSON_ENV_VAR)
+  if json_filepath:
+    return json_filepath
+  return getattr(defaults, 'DB_QUERY_TIMING_JSON_FILEPATH', None)
+
+
+def report_at_exit():
+  _query_timings.report()
+  json_filepath = get_json_filepath_or_none()
+  if json_filepath is not None:
+    _query_timings.dump_json(json_filepath)
+    print('SQL timings dumped to', json_filepath)
+
+
+def enable():
+  """
+  Switches the timing on (for the connections opened from then on), with the report at the process' exit
+  """
+  global _is_enabled
+  with _enabled_lock:
+    if _is_enabled:
+      return
+    _is_enabled = True
+  atexit.register(report_at_exit)
+
+
+def is_enabled():
+  if _is_enabled is None:
+    env_value = os.environ.get(DB_TIMING_ENV_VAR, '')
+    if env_value.lower() in ['1', 'true', 'yes', 'on'] or getattr(defaults, 'DB_QUERY_TIMING', False):
+      enable()
+  return bool(_is_enabled)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+  """
+  Times execute() & executemany() (see the module's docstring), the rows fetched after an execute()
+    are counted for its template
+  """
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.last_timing = None
+
+  def run_timed(self, method, sql, parameters, explain_parameters):
+    timing = _query_timings.get_or_add(sql)
+    start = time.perf_counter()
+    result = method(sql, parameters)
+    secs = time.perf_counter() - start
+    self.last_timing = timing
+    n_changed = max(self.rowcount, 0)
+    if _query_timings.add_call(timing, secs, n_changed):
+      self.explain(timing, sql, explain_parameters)
+    return result
+
+  def explain(self, timing, sql, parameters):
+    if not sql.lstrip().upper().startswith(EXPLAINABLE_SQL_PREFIXES):
+      return
+    try:
+      cursor = sqlite3.Cursor(self.connection)
+      plan_rows = cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+      cursor.close()
+    except (sqlite3.Error, ValueError):
+      return
+    _query_timings.set_query_plan(timing, [row[-1] for row in plan_rows])
+
+  def execute(self, sql, parameters=()):
+    return self.run_timed(super().execute, sql, parameters, parameters)
+
+  def executemany(self, sql, seq_of_parameters):
+    seq_of_parameters = list(seq_of_parameters)
+    first_parameters = seq_of_parameters[0] if len(seq_of_parameters) > 0 else ()
+    return self.run_timed(super().executemany, sql, seq_of_parameters, first_parameters)
+
+  def timed_fetch(self, method, *args):
+    start = time.perf_counter()
+    result = method(*args)
+    if self.last_timing is not None:
+      n_rows = len(result) if isinstance(result, list) else (0 if result is None else 1)
+      _query_timings.add_fetch(self.last_timing, time.perf_counter() - start, n_rows)
+    return result
+
+  def fetchone(self):
+    return self.timed_fetch(super().fetchone)
+
+  def fetchmany(self, *args):
+    return self.timed_fetch(super().fetchmany, *args)
+
+  def fetchall(self):
+    return self.timed_fetch(super().fetchall)
+
+  def __next__(self):
+    row = self.timed_fetch(super().fetchone)
+    if row is None:
+      raise StopIteration
+    return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+  """
+  Its cursors (also the ones behind conn.execute()) are InstrumentedCursor's
+  """
+
+  def cursor(self, factory=InstrumentedCursor):
+    return super().cursor(factory)
+
+  def execute(self, sql, parameters=()):
+    return self.cursor().execute(sql, parameters)
+
+  def executemany(self, sql, seq_of_parameters):
+    return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def get_connection_factory():
+  """
+  The factory for sqlite3.connect(): InstrumentedConnection when the timing is on, sqlite3.Connection otherwise
+  """
+  if is_enabled():
+    return InstrumentedConnection
+  return sqlite3.Connection
+
+
+def adhoc_test():
+  enable()
+  conn = sqlite3.connect(':memory:', factory=get_connection_factory())
+  conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT, n INTEGER);')
+  conn.executemany('INSERT INTO t (name, n) VALUES (?, ?);', [('a%d' % i, i) for i in range(1000)])
+  for i in range(100):
+    conn.execute('SELECT * FROM t WHERE id=?;', (i, )).fetchall()
+    conn.execute('SELECT * FROM t WHERE n=%d;' % i).fetchall()
+  for _ in conn.execute('SELECT name FROM t;'):
+    pass
+  conn.close()
+
+
+def process():
+  adhoc_test()
+
+
+if __name__ == '__main__':
+  process()
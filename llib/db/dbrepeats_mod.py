@@ -1,20 +1,42 @@
 #!/usr/bin/env python3
-import datetime
 import hashlib
 import os
 import llib.hashfunctions.hash_mod as hm
 import llib.db.dbbase_mod as dbb
+import models.entries.dirnode_mod as dn
 
 
 class DBRepeat(dbb.DBBase):
+  """
+  Table file_repeats has one row per repeated file (ie a file whose sha1 appears more than once).
+  Fields name, parentpath & bytesize were added after the first version of the table,
+    sqlite_createtable_if_not_exists() adds them (ALTER TABLE) to a previously created table.
+
+  The table has two kinds of rows:
+    1) rows with a file_id: they mirror the repeated rows of files_in_tree (file_id is files_in_tree's id),
+       kept current by triggers on files_in_tree (see DBDirTree.create_repeats_triggers()),
+       ie it's a materialized view of the repeats, updated row by row as the walker and the other scripts
+       insert, update or delete rows (no GROUP BY sha1 over the whole dirtree is needed);
+    2) rows without a file_id (hkey is their path's hash): the ones recorded by the staged finder
+       (cmm/rpt/report_filerepeats_by_staged_hashing_cm.py), which does not use files_in_tree.
+  iter_repeat_groups() streams the former as groups, the ones wasting more bytes first.
+  """
 
   default_tablename = 'file_repeats'
+  added_columns = [
+    ('name', 'TEXT'), ('parentpath', 'TEXT'), ('bytesize', 'INTEGER'), ('file_id', 'INTEGER'), ('hashalgo', 'TEXT'),
+    ('mdatetime', 'TEXT')
+  ]
 
   def __init__(self, mount_abspath=None, inlocus_sqlite_filename=None, tablename=None):
     if tablename is None:
       self.tablename = self.default_tablename
     super().__init__(mount_abspath, inlocus_sqlite_filename)
 
+  @property
+  def fieldnames(self):
+    return ['id', 'hkey', 'sha1', 'is_to_delete', 'name', 'parentpath', 'bytesize', 'file_id', 'hashalgo', 'mdatetime']
+
   def form_fields_line_for_createtable(self):
     """
     This method is to be implemented in child-inherited classes
@@ -23,10 +45,38 @@ class DBRepeat(dbb.DBBase):
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       hkey INTEGER UNIQUE,
       sha1 BLOB,
-      is_to_delete INTEGER
+      is_to_delete INTEGER,
+      name TEXT,
+      parentpath TEXT,
+      bytesize INTEGER,
+      file_id INTEGER,
+      hashalgo TEXT,
+      mdatetime TEXT
     """
     return middle_sql
 
+  def sqlite_createtable_if_not_exists(self):
+    super().sqlite_createtable_if_not_exists()
+    self.add_missing_columns_to_older_table()
+
+  def add_missing_columns_to_older_table(self):
+    conn = self.get_connection()
+    cursor = conn.cursor()
+    sql = 'PRAGMA table_info("%(tablename)s");' % {'tablename': self.tablename}
+    existing_colnames = [row[1] for row in cursor.execute(sql).fetchall()]
+    for colname, coltype in self.added_columns:
+      if colname in existing_colnames:
+        continue
+      sql = 'ALTER TABLE "%(tablename)s" ADD COLUMN ' % {'tablename': self.tablename}
+      sql += colname + ' ' + coltype + ';'
+      cursor.execute(sql)
+    sql = 'CREATE UNIQUE INDEX IF NOT EXISTS "idx_%(tablename)s_file_id" ON "%(tablename)s" (file_id);'
+    cursor.execute(sql % {'tablename': self.tablename})
+    sql = 'CREATE INDEX IF NOT EXISTS "idx_%(tablename)s_sha1" ON "%(tablename)s" (sha1, hashalgo);'
+    cursor.execute(sql % {'tablename': self.tablename})
+    self.commit_unless_in_session(conn)
+    cursor.close()
+
   def form_update_with_all_fields_sql(self):
     """
     Notice that the interpolation %(tablename)s is not done here, it'll be done later on.
@@ -35,11 +85,83 @@ class DBRepeat(dbb.DBBase):
     UPDATE %(tablename)s
       SET
         sha1=?
-      WHERE 
+      WHERE
         hkey=?
     '''
     return sql_before_interpol
 
+  def insert_or_replace_repeat(self, name, parentpath, sha1, bytesize, is_to_delete=False):
+    """
+    hkey is the HashSimple of the file's path (parentpath + name), so a file has at most one row
+    """
+    fpath = os.path.join(parentpath, name)
+    hkey = hm.HashSimple(fpath).num
+    sql = 'INSERT OR REPLACE INTO %(tablename)s (hkey, sha1, is_to_delete, name, parentpath, bytesize)'
+    sql += ' VALUES (?,?,?,?,?,?);'
+    tuplevalues = (hkey, sha1, int(is_to_delete), name, parentpath, bytesize)
+    return self.do_insert_with_sql_n_tuplevalues(sql, tuplevalues)
+
+  def delete_rows_without_file_id(self):
+    """
+    Deletes the staged finder's rows, the ones kept by the triggers (with a file_id) stay
+    """
+    sql = 'DELETE FROM %(tablename)s WHERE file_id IS NULL;'
+    return self.delete_with_sql_n_tuplevalues(sql, tuple())
+
+  def fetch_repeat_groups(self, min_bytesize=None):
+    """
+    Returns [(sha1, hashalgo, n_files, wasted_bytes), ...] of the files_in_tree repeats,
+      ordered by wasted_bytes (bytesize x (n_files - 1)) descending
+    """
+    sql = '''SELECT sha1, hashalgo, count(*) AS n, max(bytesize) * (count(*) - 1) AS wasted
+      FROM %(tablename)s WHERE file_id IS NOT NULL AND bytesize >= ?
+      GROUP BY sha1, hashalgo HAVING n > 1
+      ORDER BY wasted DESC, sha1;'''
+    min_bytesize = 0 if min_bytesize is None else min_bytesize
+    return self.do_select_with_sql_n_tuplevalues(sql, (min_bytesize, ))
+
+  def fetch_rows_by_sha1_n_hashalgo(self, sha1, hashalgo):
+    sql = '''SELECT * FROM %(tablename)s WHERE sha1=? AND hashalgo=? AND file_id IS NOT NULL
+      ORDER BY parentpath, name;'''
+    return self.do_select_with_sql_n_tuplevalues(sql, (sha1, hashalgo))
+
+  def transform_row_to_dirnode(self, row):
+    """
+    The dirnode's db_id is the files_in_tree id (field file_id)
+    """
+    idx = self.fieldnames.index('name')
+    name = row[idx]
+    idx = self.fieldnames.index('parentpath')
+    parentpath = row[idx]
+    idx = self.fieldnames.index('sha1')
+    sha1 = row[idx]
+    idx = self.fieldnames.index('bytesize')
+    bytesize = row[idx]
+    idx = self.fieldnames.index('mdatetime')
+    mdatetime = row[idx]
+    idx = self.fieldnames.index('hashalgo')
+    hashalgo = row[idx]
+    dirnode = dn.DirNode(name, parentpath, sha1, bytesize, mdatetime, hashalgo)
+    idx = self.fieldnames.index('file_id')
+    dirnode.set_db_id(row[idx])
+    return dirnode
+
+  def iter_repeat_groups(self, min_bytesize=None):
+    """
+    Yields (sha1, hashalgo, n_files, wasted_bytes, rows) per repeated (sha1, hashalgo), the most wasteful first,
+      rows being file_repeats rows (their file_id is the files_in_tree id).
+      The group list is taken at the start and each group's rows when it's yielded,
+      ie files deleted along the way (eg by a deleter) are not in the later groups' rows.
+    min_bytesize: groups of smaller files are not yielded (eg 1 skips the empty files)
+    """
+    for sha1, hashalgo, _, _ in self.fetch_repeat_groups(min_bytesize):
+      rows = self.fetch_rows_by_sha1_n_hashalgo(sha1, hashalgo)
+      if len(rows) < 2:
+        continue
+      idx = self.fieldnames.index('bytesize')
+      wasted_bytes = rows[0][idx] * (len(rows) - 1)
+      yield sha1, hashalgo, len(rows), wasted_bytes, rows
+
 
 def adhoc_select():
   db = DBRepeat()
@@ -48,20 +170,24 @@ def adhoc_select():
   for row in tuplelist:
     _id = row[0]
     print('_id', _id)
-    hkey = row[1]
+    idx = db.fieldnames.index('hkey')
+    hkey = row[idx]
     print('hkey', hkey)
-    name = row[2]
+    idx = db.fieldnames.index('name')
+    name = row[idx]
     print('name', name)
-    parentpath = row[3]
+    idx = db.fieldnames.index('parentpath')
+    parentpath = row[idx]
     print('parentpath', parentpath)
-    is_file = row[4]
-    print('is_file', bool(is_file))
-    sha1 = row[5]
+    idx = db.fieldnames.index('sha1')
+    sha1 = row[idx]
     print('sha1', sha1.hex())
-    bytesize = row[6]
+    idx = db.fieldnames.index('bytesize')
+    bytesize = row[idx]
     print('bytesize', bytesize)
-    mdatetime = row[7]
-    print('mdatetime', mdatetime)
+    idx = db.fieldnames.index('is_to_delete')
+    is_to_delete = row[idx]
+    print('is_to_delete', bool(is_to_delete))
 
 
 def adhoc_select_all():
@@ -85,22 +211,14 @@ def adhoc_delete_all_rows():
 def adhoc_insert_some():
   name = 'file1'
   parentpath = '/folder1/secondç'
-  fpath = os.path.join(parentpath, name)
-  hkey = hm.HashSimple(fpath).num
-  is_file = int(True)
   sha_obj = hashlib.sha1()
   strdata = 'dafbn bnç~pafsdkç'.encode('utf8')
   sha_obj.update(strdata)
   sha1 = sha_obj.digest()
   bytesize = 1000
-  mdatetime = datetime.datetime.now()
-  tuple_values = (None, hkey, name, parentpath, is_file, sha1, bytesize, mdatetime)
-  question_marks = '?, ' * len(tuple_values)
-  question_marks = question_marks.rstrip(', ')
-  insert_sql = "INSERT into %(tablename)s VALUES (" + question_marks + ");"
   print('Exec adhoc_insert_some()')
   db = DBRepeat()
-  return db.do_insert_with_sql_n_tuplevalues(insert_sql, tuple_values)
+  return db.insert_or_replace_repeat(name, parentpath, sha1, bytesize)
 
 
 def process():
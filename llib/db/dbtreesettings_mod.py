@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+This module (dbtreesettings_mod.py) contains:
+ class DBTreeSettings(dbb.DBBase):
+
+This class models db-table tree_settings, a key-value table with the settings of one dirtree
+  (it lives in the same sqlite file as files_in_tree, ie at the dirtree's mountpath).
+
+At the time of writing, the only setting is 'default_hashalgo', ie the hash algorithm
+  the walker uses for new files in this dirtree (see hash_mod.HASHALGO_FACTORIES).
+"""
+import llib.db.dbbase_mod as dbb
+import llib.hashfunctions.hash_mod as hm
+DEFAULT_HASHALGO_KEY = 'default_hashalgo'
+
+
+class DBTreeSettings(dbb.DBBase):
+
+  default_tablename = 'tree_settings'
+
+  def __init__(self, mountpath=None, inlocus_sqlite_filename=None, tablename=None):
+    if tablename is None:
+      self.tablename = self.default_tablename
+    super().__init__(mountpath, inlocus_sqlite_filename)
+
+  @property
+  def fieldnames(self):
+    return ['id', 'key', 'value']
+
+  def form_fields_line_for_createtable(self):
+    """
+    This method is to be implemented in child-inherited classes
+    """
+    middle_sql = """
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      key TEXT NOT NULL UNIQUE,
+      value TEXT
+    """
+    return middle_sql
+
+  def form_update_with_all_fields_sql(self):
+    """
+    Notice that the interpolation %(tablename)s is not done here, it'll be done later on.
+    """
+    sql_before_interpol = '''
+    UPDATE %(tablename)s
+      SET
+        key=?,
+        value=?
+      WHERE
+        id=?
+    '''
+    return sql_before_interpol
+
+  def get_value_or_default(self, key, default=None):
+    sql = 'SELECT value FROM %(tablename)s WHERE key=?;'
+    rows = self.do_select_with_sql_n_tuplevalues(sql, (key, ))
+    if len(rows) == 0 or rows[0][0] is None:
+      return default
+    return rows[0][0]
+
+  def set_value(self, key, value):
+    sql = 'INSERT OR REPLACE INTO %(tablename)s (key, value) VALUES (?,?);'
+    return self.do_insert_with_sql_n_tuplevalues(sql, (key, value))
+
+  def get_default_hashalgo(self):
+    return self.get_value_or_default(DEFAULT_HASHALGO_KEY, hm.DEFAULT_HASHALGO)
+
+  def set_default_hashalgo(self, hashalgo):
+    _ = hm.get_hashobj_factory(hashalgo)  # raises ValueError for an unknown hashalgo
+    return self.set_value(DEFAULT_HASHALGO_KEY, hashalgo)
+
+
+def adhoc_select_all():
+  db = DBTreeSettings()
+  result_tuple_list = db.do_select_all()
+  for tuplerow in result_tuple_list:
+    print(tuplerow)
+  return result_tuple_list
+
+
+def process():
+  adhoc_select_all()
+
+
+if __name__ == '__main__':
+  process()
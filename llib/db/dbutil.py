@@ -50,6 +50,28 @@ def prep_updatesql_with_dict_n_frow_return_sql_n_tuplevalues(pdict, dbfieldnames
   return sql, tuplevalues
 
 
+def prep_upsert_sql_from_fieldnames(fieldnames, conflict_fieldnames):
+  """
+  Forms an INSERT ... ON CONFLICT(<conflict_fieldnames>) DO UPDATE (an sqlite 3.24+ UPSERT) for fieldnames.
+    The update only happens when some value differs, ie an unchanged row counts 0 in the cursor's rowcount.
+    As the other sql's here, the %(tablename)s interpolation is done later on.
+  """
+  str_fieldlist_for_sql = ', '.join(fieldnames)
+  str_questionmarks = ', '.join(['?'] * len(fieldnames))
+  str_conflictlist_for_sql = ', '.join(conflict_fieldnames)
+  sql = 'INSERT INTO %(tablename)s (' + str_fieldlist_for_sql + ') VALUES (' + str_questionmarks + ')'
+  sql += '\nON CONFLICT(' + str_conflictlist_for_sql + ') DO '
+  update_fieldnames = [fieldname for fieldname in fieldnames if fieldname not in conflict_fieldnames]
+  if len(update_fieldnames) == 0:
+    return sql + 'NOTHING;'
+  set_line = ', '.join([fieldname + '=excluded.' + fieldname for fieldname in update_fieldnames])
+  where_line = ' OR '.join(
+    ['%(tablename)s.' + fieldname + ' IS NOT excluded.' + fieldname for fieldname in update_fieldnames]
+  )
+  sql += 'UPDATE SET ' + set_line + '\nWHERE ' + where_line + ';'
+  return sql
+
+
 globaldict = {'name': 'test1', 'parentpath': '/dir1/folder2', 'bytesize': 2000, 'mdatetime': 87334132.656}
 fieldnames = ['id', 'name', 'parentpath', 'bytesize', 'mdatetime']
 
@@ -61,6 +83,11 @@ def adhoc_test2():
   print('tuplevalues', tuplevalues)
 
 
+def adhoc_test3():
+  sql = prep_upsert_sql_from_fieldnames(fieldnames[1:], ('name', 'parentpath'))
+  print('sql', sql)
+
+
 def adhoc_test1():
   sql, tuplevalues = prep_insert_sql_from_dict_n_return_sql_n_tuplevalues(globaldict, fieldnames)
   print('sql', sql)
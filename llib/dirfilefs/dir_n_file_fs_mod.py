@@ -6,6 +6,7 @@ import copy
 import os
 import default_settings as defaults
 import itertools
+import llib.dirfilefs.scandir_walk_mod as scdw
 DEFAULT_SQLITE_FILENAME = '.updirfileentries.sqlite'
 
 
@@ -65,46 +66,42 @@ def count_total_files_n_folders_with_restriction(
     restricted_dirnames=None,
     forbidden_first_level_dirs=None
   ):
-  if restricted_dirnames is None:
-    restricted_dirnames = defaults.RESTRICTED_DIRNAMES_FOR_WALK
-  if forbidden_first_level_dirs is None:
-    forbidden_first_level_dirs = defaults.FORBIBBEN_FIRST_LEVEL_DIRS
-  total_files = 0
-  total_dirs = 0
-  for current_path, folders, files in os.walk(mountpath):
-    if current_path == mountpath:
-      # do not count files in root dir/folder nor count itself as a dir/folder
-      continue
-    if is_forbidden_dirpass(current_path, restricted_dirnames, forbidden_first_level_dirs):
-      # do not count files or folder inside forbidden_first_level_dirs
-      continue
-    if is_any_name_in_path_startingwith_any_prefix_in_list(current_path, restricted_dirnames):
-      # do not count files or folder with paths having any restricted_dirnames (eg z-del or z-tri [for z-Triage])
-      continue
-    total_dirs += 1
-    total_files += len(files)
-  return total_files, total_dirs
+  """
+  Counts the files & folders below mountpath (the root folder and its files not counted),
+    the restricted dirs (and their subtrees) pruned, see scandir_walk_mod.ScandirDirTreeWalker
+  """
+  walker = scdw.ScandirDirTreeWalker(mountpath, restricted_dirnames, forbidden_first_level_dirs)
+  return walker.count_files_n_folders(include_root=False)
+
+
+def generate_parentpath_n_filename_by_scandir(mountpath):
+  """
+  Yields (parentpath, filename) for each file under mountpath (the ones at its root included),
+    parentpath as in the db, ie '/' + the folder's path relative to mountpath ('/' at the root).
+  One os.scandir() per folder (whose entries carry their type, ie no stat per file),
+    symlinked folders are not followed, no folder is pruned.
+  The folders that cannot be read are skipped silently: when the files' absence matters (eg deleting rows),
+    use scdw.ScandirDirTreeWalker directly and look at its failed_parentpaths
+  """
+  walker = scdw.ScandirDirTreeWalker(mountpath, restricted_dirnames=[], forbidden_first_level_dirs=[])
+  return walker.generate_parentpath_n_filename(include_root_files=True)
 
 
 def count_total_files_n_folders_inc_root(mountpath):
-  src_total_files = 0
-  src_total_dirs = 0
-  for current_path, folders, files in os.walk(mountpath):
-    src_total_dirs += len(folders)
-    src_total_files += len(files)
-  return src_total_files, src_total_dirs
+  """
+  Counts all files & subfolders (the root's files included), nothing pruned
+  """
+  walker = scdw.ScandirDirTreeWalker(mountpath, restricted_dirnames=[], forbidden_first_level_dirs=[])
+  src_total_files, src_total_dirs = walker.count_files_n_folders(include_root=True)
+  return src_total_files, max(src_total_dirs - 1, 0)  # the root folder itself is not counted
 
 
 def count_total_files_n_folders_excl_root(mountpath):
-  src_total_files = 0
-  src_total_dirs = 0
-  for current_path, folders, files in os.walk(mountpath):
-    src_total_dirs += len(folders)
-    if current_path == mountpath:
-      # do not count files in root dir only count folders
-      continue
-    src_total_files += len(files)
-  return src_total_files, src_total_dirs
+  """
+  Counts all subfolders and their files (the root's files not counted), nothing pruned
+  """
+  walker = scdw.ScandirDirTreeWalker(mountpath, restricted_dirnames=[], forbidden_first_level_dirs=[])
+  return walker.count_files_n_folders(include_root=False)
 
 
 def put_sufix_to_bytesize(p_bytesize):
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+llib/dirfilefs/scandir_walk_mod.py
+  Contains the os.scandir()-based traversal the dirtree walkers are built on (see class ScandirDirTreeWalker).
+
+The problem it solves:
+  - the walkers used os.walk() and then os.stat() again on each file, plus one more os.walk() just to count;
+  - the restricted dirs (RESTRICTED_DIRNAMES_FOR_WALK, FORBIBBEN_FIRST_LEVEL_DIRS) were only skipped
+    after os.walk() had already listed them and all their subfolders.
+
+Here:
+  - each folder is read with one os.scandir(), whose DirEntry's carry their type (no stat to tell dirs from files)
+    and their inode; DirEntry.stat() is cached in the DirEntry, ie a file is stat'ed once per walk;
+  - a restricted subfolder is pruned before descending into it, ie its subtree is never read;
+    the restricted dirnames are looked up in the names below mountpath, the forbidden ones at its first level only;
+  - symlinked folders are not followed (as os.walk()'s default), the folders that cannot be read are skipped
+    and kept in failed_parentpaths (a caller taking the walk as "all files on disk" must leave their subtrees out);
+  - the order is os.walk()'s top-down order (a folder's files, then its subfolders' in scandir order),
+    so that a walk's sequence positions (eg the walker's -r=<restart position>) stay as before.
+
+The file entries are ScandirFileEntry's: (parentpath, name, size, mtime_ns, inode, dev),
+  parentpath as in the db, ie '/' + the folder's path relative to mountpath ('/' at the root).
+"""
+import collections
+import os
+import sys
+import default_settings as defaults
+ROOT_PARENTPATH = '/'
+
+
+class ScandirFileEntry(collections.namedtuple('ScandirFileEntry', 'parentpath name size mtime_ns inode dev')):
+
+  __slots__ = ()
+
+  @property
+  def mdatetime(self):
+    """
+    The mtime in seconds as os.stat().st_mtime gives it (the value stored in files_in_tree's mdatetime)
+    """
+    return self.mtime_ns // 10**9 + (self.mtime_ns % 10**9) * 1e-9
+
+  @property
+  def cachekey(self):
+    """
+    The hashcache's key (see DBHashCache.extract_cachekey_from_filestat())
+    """
+    return self.dev, self.inode, self.size, self.mtime_ns
+
+  def form_filepath(self, mountpath):
+    return os.path.join(mountpath, self.parentpath.lstrip('/'), self.name)
+
+
+class ScandirDirTreeWalker:
+
+  def __init__(self, mountpath, restricted_dirnames=None, forbidden_first_level_dirs=None):
+    """
+    restricted_dirnames & forbidden_first_level_dirs default to the settings', an empty list means no pruning
+    """
+    self.mountpath = mountpath
+    if restricted_dirnames is None:
+      restricted_dirnames = defaults.RESTRICTED_DIRNAMES_FOR_WALK
+    if forbidden_first_level_dirs is None:
+      forbidden_first_level_dirs = defaults.FORBIBBEN_FIRST_LEVEL_DIRS
+    self.restricted_prefixes = [prefix.lower() for prefix in restricted_dirnames]
+    self.forbidden_first_level_dirs = list(forbidden_first_level_dirs)
+    self.n_folders = 0
+    self.n_files = 0
+    self.n_root_files = 0
+    self.n_restricted_dirs = 0
+    self.n_failed_scandirs = 0
+    self.n_failed_filestats = 0
+    self.failed_parentpaths = []  # the folders that could not be listed, ie whose files are unknown
+
+  def is_restricted_dirname(self, dirname, parentpath):
+    if parentpath == ROOT_PARENTPATH and dirname in self.forbidden_first_level_dirs:
+      return True
+    return dirname.lower().startswith(tuple(self.restricted_prefixes))
+
+  def is_restricted_parentpath(self, parentpath):
+    """
+    Tells whether a folder (by its parentpath) is one this walker would prune or lies below one,
+      ie lets a caller walking unpruned know which of its folders a pruned walk would have left out
+    """
+    upper_parentpath = ROOT_PARENTPATH
+    for dirname in parentpath.strip('/').split('/'):
+      if dirname == '':
+        continue
+      if self.is_restricted_dirname(dirname, upper_parentpath):
+        return True
+      upper_parentpath = os.path.join(upper_parentpath, dirname)
+    return False
+
+  def generate_folders(self):
+    """
+    Yields (folder_abspath, parentpath, file_direntries) for each folder not pruned (the root first),
+      file_direntries are the folder's os.DirEntry's that are files (symlinks to files included)
+    """
+    folder_stack = [(self.mountpath, ROOT_PARENTPATH)]
+    while len(folder_stack) > 0:
+      folder_abspath, parentpath = folder_stack.pop()
+      file_direntries, subfolders = [], []
+      try:
+        with os.scandir(folder_abspath) as direntries:
+          for direntry in direntries:
+            if direntry.is_dir(follow_symlinks=False):
+              if self.is_restricted_dirname(direntry.name, parentpath):
+                self.n_restricted_dirs += 1
+                continue
+              subfolders.append((direntry.path, os.path.join(parentpath, direntry.name)))
+            elif direntry.is_file():
+              file_direntries.append(direntry)
+      except OSError:
+        self.n_failed_scandirs += 1
+        self.failed_parentpaths.append(parentpath)
+        continue
+      self.n_folders += 1
+      self.n_files += len(file_direntries)
+      if parentpath == ROOT_PARENTPATH:
+        self.n_root_files = len(file_direntries)
+      yield folder_abspath, parentpath, file_direntries
+      # reversed, so that the subfolders are popped (ie walked) in their scandir order
+      folder_stack.extend(reversed(subfolders))
+
+  def generate_file_entries(self, include_root_files=True):
+    """
+    Yields a ScandirFileEntry per file, its size & mtime from the DirEntry's (cached) stat,
+      the files whose stat fails are counted in n_failed_filestats and skipped
+    """
+    for folder_abspath, parentpath, file_direntries in self.generate_folders():
+      if parentpath == ROOT_PARENTPATH and not include_root_files:
+        continue
+      for direntry in file_direntries:
+        try:
+          filestat = direntry.stat()
+          inode = direntry.inode()
+        except OSError:
+          self.n_failed_filestats += 1
+          continue
+        yield ScandirFileEntry(
+          parentpath, direntry.name, filestat.st_size, filestat.st_mtime_ns, inode, filestat.st_dev
+        )
+
+  def generate_parentpath_n_filename(self, include_root_files=True):
+    """
+    As generate_file_entries() without the stat's, ie the (parentpath, filename) from the directory listings only
+    """
+    for folder_abspath, parentpath, file_direntries in self.generate_folders():
+      if parentpath == ROOT_PARENTPATH and not include_root_files:
+        continue
+      for direntry in file_direntries:
+        yield parentpath, direntry.name
+
+  def get_totals(self, include_root=False):
+    """
+    Returns (total_files, total_dirs) from the counters of the walk done (a walker's totals come from its own walk,
+      no separate count pass), include_root=False leaves out the root folder itself and its files (as the walkers do)
+    """
+    if include_root:
+      return self.n_files, self.n_folders
+    return self.n_files - self.n_root_files, max(self.n_folders - 1, 0)
+
+  def count_files_n_folders(self, include_root=False):
+    """
+    Walks (without stat'ing any file) just to count, returns get_totals()
+    """
+    for _ in self.generate_folders():
+      pass
+    return self.get_totals(include_root)
+
+  def report(self):
+    print(
+      'scandir walk', self.mountpath, '| n_folders', self.n_folders, '| n_files', self.n_files,
+      '| n_restricted_dirs', self.n_restricted_dirs, '| n_failed_scandirs', self.n_failed_scandirs,
+      '| n_failed_filestats', self.n_failed_filestats
+    )
+
+
+def adhoc_test():
+  """
+  Walks the folder given as cli arg (this module's folder if none) and prints its file entries
+  """
+  mountpath = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+  walker = ScandirDirTreeWalker(mountpath)
+  for fileentry in walker.generate_file_entries():
+    print(fileentry)
+  walker.report()
+
+
+def process():
+  adhoc_test()
+
+
+if __name__ == '__main__':
+  process()
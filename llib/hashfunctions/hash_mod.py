@@ -15,26 +15,314 @@ In the client app, the db-field hkey is declared as UNIQUE. In case a collision
   (due to the 10-digit compression explained above) the db-engine will raise an exception
   avoiding a possible consequent data error.  On the other side,
   one solution might be to increase the charsize of the hash.
+
+File hashing
+------------
+Class HashingEngine hashes file contents through one reused buffer (readinto), or via mmap when asked for.
+  Function calc_sha1_from_file() is a thin wrapper over the default engine.
+Function calc_hash_from_file() does the same for the other algorithms in HASHALGO_FACTORIES (eg blake2b).
+For sparse files (eg VM images), only the data extents are read (os.lseek SEEK_DATA/SEEK_HOLE),
+  the holes are fed to the hash as zeros from memory, so the digest is the same as a plain read's.
+While reading, the engine gives the kernel page-cache hints (posix_fadvise) via an IOPolicy
+  (see llib/os/io_policy_mod.py), eg policy 'nocache' keeps a whole-disk hashing from evicting the page cache.
 """
 import hashlib
 import binascii
+import errno
+import mmap
+import os
+import tempfile
+import threading
+import llib.os.io_policy_mod as iopol
 EMPTY_SHA1HEX_STR = 'da39a3ee5e6b4b0d3255bfef95601890afd80709'
 EMPTY_SHA1_AS_BIN = binascii.unhexlify(EMPTY_SHA1HEX_STR)
 BUF_SIZE = 65536
+READINTO_BLOCK_SIZE = 1024 * 1024
+MMAP_BLOCK_SIZE = 8 * 1024 * 1024
+MMAP_THRESHOLD = 64 * 1024 * 1024
+PARTIAL_HASH_EDGE_SIZE = 64 * 1024
+SPARSE_MIN_HOLE_SIZE = 1024 * 1024
+DEFAULT_HASHALGO = 'sha1'
+
+
+def blake2b_160():
+  """
+  blake2b is faster than sha1 on 64-bit CPUs. Its digest is cut to 20 bytes (160 bits),
+    the size of a sha1, so the digests fit where sha1's are expected (db-field sha1, 40-char hexes).
+  """
+  return hashlib.blake2b(digest_size=20)
+
+
+# hashalgo (as recorded in db-field hashalgo) => hashlib constructor
+HASHALGO_FACTORIES = {
+  'sha1': hashlib.sha1,
+  'blake2b': blake2b_160,
+}
+
+
+def get_hashobj_factory(hashalgo=None):
+  if hashalgo is None:
+    hashalgo = DEFAULT_HASHALGO
+  try:
+    return HASHALGO_FACTORIES[hashalgo]
+  except KeyError:
+    error_msg = 'Hash algorithm (%s) is not one of %s.' % (str(hashalgo), str(list(HASHALGO_FACTORIES.keys())))
+    raise ValueError(error_msg)
+
+
+def get_empty_digest(hashalgo=None):
+  """
+  Returns the digest of the empty content for hashalgo (for sha1, it's EMPTY_SHA1_AS_BIN)
+  """
+  return get_hashobj_factory(hashalgo)().digest()
+
+
+class HashingEngine:
+  """
+  HashingEngine hashes a file's content with one of three strategies:
+    1) 'readinto': one preallocated buffer (per thread) is refilled with f.readinto()
+       and passed to the hash object via a memoryview, ie no new bytes-object per block;
+    2) 'mmap': the file is memory-mapped and hashed in memoryview slices of mmap_block_size,
+       ie no copy into user-space buffers at all.
+    3) 'sparse': only the data extents are read (as in readinto), found via os.lseek(SEEK_DATA/SEEK_HOLE),
+       the holes are fed to the hash object as zeros taken from a preallocated zero-filled buffer,
+       ie holes cost hashing CPU but no disk I/O. Where SEEK_DATA is not supported, readinto is used.
+  Strategy 'auto' (the default) picks sparse for files with at least SPARSE_MIN_HOLE_SIZE bytes unallocated
+    (os.fstat().st_blocks), readinto otherwise.
+  Strategy 'auto-mmap' (opt-in) is 'auto' with mmap for files from mmap_threshold bytes on
+    (for small files, setting up a mapping costs more than copying them).
+  mmap is not the default because of the SIGBUS risk: if a mapped file is truncated while being hashed
+    (eg a download or a log in the dirtree), touching the pages past its new end kills the process,
+    whereas readinto just gets a short read. Use 'mmap'/'auto-mmap' only on dirtrees not being written to.
+
+  Buffers are kept per thread (threading.local), so one engine can be shared by hashing worker threads.
+  As before, an OSError while reading returns None, an OSError while opening propagates to the caller.
+
+  io_policy is an IOPolicy (see llib/os/io_policy_mod.py), if None the module's default policy
+    at the time of hashing is used (so that cli arg --io-policy= also applies to the default engine).
+  """
+
+  STRATEGIES = ['auto', 'auto-mmap', 'readinto', 'mmap', 'sparse']
+
+  def __init__(
+      self, readinto_block_size=None, mmap_block_size=None, mmap_threshold=None, strategy=None, io_policy=None
+    ):
+    self.readinto_block_size = READINTO_BLOCK_SIZE if readinto_block_size is None else int(readinto_block_size)
+    self.mmap_block_size = MMAP_BLOCK_SIZE if mmap_block_size is None else int(mmap_block_size)
+    self.mmap_threshold = MMAP_THRESHOLD if mmap_threshold is None else int(mmap_threshold)
+    self.strategy = 'auto' if strategy is None else strategy
+    if self.strategy not in self.STRATEGIES:
+      error_msg = 'Hashing strategy (%s) is not one of %s.' % (str(self.strategy), str(self.STRATEGIES))
+      raise ValueError(error_msg)
+    self.threadlocal = threading.local()
+    self.io_policy = io_policy
+    self.zero_block = bytes(self.readinto_block_size)  # immutable, so shared by all threads
+
+  def get_io_policy(self):
+    if self.io_policy is None:
+      return iopol.get_default_policy()
+    return self.io_policy
+
+  def get_threadlocal_buffer(self):
+    buffer = getattr(self.threadlocal, 'buffer', None)
+    if buffer is None or len(buffer) != self.readinto_block_size:
+      buffer = bytearray(self.readinto_block_size)
+      self.threadlocal.buffer = buffer
+    return buffer
+
+  @staticmethod
+  def is_sparse_supported():
+    return hasattr(os, 'SEEK_DATA') and hasattr(os, 'SEEK_HOLE')
+
+  def pick_strategy(self, bytesize, allocated_bytesize=None):
+    """
+    allocated_bytesize is the file's space on disk (st_blocks * 512), None if unknown (eg on Windows)
+    """
+    if self.strategy not in ['auto', 'auto-mmap']:
+      if self.strategy == 'mmap' and bytesize == 0:
+        return 'readinto'  # an empty file cannot be memory-mapped
+      if self.strategy == 'sparse' and not self.is_sparse_supported():
+        return 'readinto'
+      return self.strategy
+    if allocated_bytesize is not None and bytesize - allocated_bytesize >= SPARSE_MIN_HOLE_SIZE:
+      if self.is_sparse_supported():
+        return 'sparse'
+    if self.strategy == 'auto-mmap' and bytesize >= self.mmap_threshold and bytesize > 0:
+      return 'mmap'
+    return 'readinto'
+
+  def update_hashobj_via_readinto(self, hashobj, f, io_policy):
+    buffer = self.get_threadlocal_buffer()
+    view = memoryview(buffer)
+    fd = f.fileno()
+    offset = 0
+    while True:
+      io_policy.before_chunk(fd, offset, len(buffer))
+      n_read = f.readinto(buffer)
+      if not n_read:
+        break
+      hashobj.update(view[:n_read])
+      io_policy.after_chunk(fd, offset, n_read)
+      offset += n_read
+
+  def update_hashobj_via_mmap(self, hashobj, f, bytesize, io_policy):
+    """
+    Length 0 maps the file's current size, which may differ from bytesize (fstat()'s) if the file changed
+      in between: that is taken as a failed read (OSError). A truncation after this check cannot be caught,
+      it's the SIGBUS explained in the class' docstring.
+    """
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+      if len(mapped) != bytesize:
+        raise OSError(errno.EIO, 'File size changed while being hashed', f.name)
+      if io_policy.gives_hints and hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+      view = memoryview(mapped)
+      try:
+        for pos in range(0, bytesize, self.mmap_block_size):
+          hashobj.update(view[pos:pos + self.mmap_block_size])
+      finally:
+        view.release()
+    # mapped pages cannot be dropped while mapped, so the whole file is let go after unmapping
+    io_policy.after_chunk(f.fileno(), 0, 0)
+
+  def update_hashobj_with_zeros(self, hashobj, n_zeros):
+    zero_view = memoryview(self.zero_block)
+    block_size = len(self.zero_block)
+    while n_zeros > 0:
+      n_fed = min(n_zeros, block_size)
+      hashobj.update(zero_view[:n_fed])
+      n_zeros -= n_fed
+
+  def update_hashobj_with_data_extent(self, hashobj, f, start, end, io_policy):
+    """
+    Reads [start, end) into the hash object. Raises OSError if the file ends before end (it shrank)
+    """
+    buffer = self.get_threadlocal_buffer()
+    view = memoryview(buffer)
+    fd = f.fileno()
+    f.seek(start)
+    offset = start
+    while offset < end:
+      chunk_size = min(len(buffer), end - offset)
+      io_policy.before_chunk(fd, offset, chunk_size)
+      n_read = f.readinto(view[:chunk_size])
+      if not n_read:
+        raise OSError(errno.EIO, 'File shrank while being hashed', f.name)
+      hashobj.update(view[:n_read])
+      io_policy.after_chunk(fd, offset, n_read)
+      offset += n_read
+
+  def update_hashobj_via_sparse(self, hashobj, f, bytesize, io_policy):
+    """
+    Walks the file's data extents and holes. Returns False (nothing hashed) when the filesystem
+      does not support SEEK_DATA, so that the caller falls back to readinto
+    """
+    fd = f.fileno()
+    offset = 0
+    while offset < bytesize:
+      try:
+        data_start = os.lseek(fd, offset, os.SEEK_DATA)
+      except OSError as e:
+        if e.errno == errno.ENXIO:
+          data_start = bytesize  # no more data, ie the rest of the file is a hole
+        elif offset == 0 and e.errno in (errno.EINVAL, errno.EOPNOTSUPP):
+          return False
+        else:
+          raise
+      data_start = min(data_start, bytesize)
+      self.update_hashobj_with_zeros(hashobj, data_start - offset)
+      if data_start >= bytesize:
+        break
+      # there is always a (virtual) hole at the end of the file, so SEEK_HOLE finds one
+      data_end = min(os.lseek(fd, data_start, os.SEEK_HOLE), bytesize)
+      self.update_hashobj_with_data_extent(hashobj, f, data_start, data_end, io_policy)
+      offset = data_end
+    return True
+
+  def hash_file(self, filepath, hashobj_factory=None):
+    """
+    Returns the digest (bytes) of the file's content (None if it could not be read through)
+    hashobj_factory is a hashlib constructor, default hashlib.sha1
+    """
+    hashobj = hashlib.sha1() if hashobj_factory is None else hashobj_factory()
+    io_policy = self.get_io_policy()
+    with open(filepath, 'rb', buffering=0) as f:
+      try:
+        filestat = os.fstat(f.fileno())
+        bytesize = filestat.st_size
+        allocated_bytesize = filestat.st_blocks * 512 if hasattr(filestat, 'st_blocks') else None
+        io_policy.on_open(f.fileno())
+        strategy = self.pick_strategy(bytesize, allocated_bytesize)
+        if strategy == 'sparse':
+          if not self.update_hashobj_via_sparse(hashobj, f, bytesize, io_policy):
+            f.seek(0)
+            self.update_hashobj_via_readinto(hashobj, f, io_policy)
+        elif strategy == 'mmap':
+          self.update_hashobj_via_mmap(hashobj, f, bytesize, io_policy)
+        else:
+          self.update_hashobj_via_readinto(hashobj, f, io_policy)
+      except (OSError, ValueError):
+        # ValueError comes from mmap() when the file was emptied after fstat() (an empty file cannot be mapped)
+        return None
+    return hashobj.digest()
+
+
+_default_engine = HashingEngine()
+
+
+def get_default_engine():
+  return _default_engine
+
+
+def set_default_engine(engine):
+  """
+  Lets a script tune the engine (block sizes, strategy) for all calc_sha1_from_file() callers
+  """
+  global _default_engine
+  _default_engine = engine
 
 
 def calc_sha1_from_file(filepath):
+  return _default_engine.hash_file(filepath)
+
+
+def calc_hash_from_file(filepath, hashalgo=None):
+  """
+  Same as calc_sha1_from_file() for any hashalgo in HASHALGO_FACTORIES (default sha1)
+  """
+  return _default_engine.hash_file(filepath, get_hashobj_factory(hashalgo))
+
+
+def calc_partial_sha1_from_file(filepath, edge_size=None):
+  """
+  Calculates the sha1 of the first and the last edge_size bytes (default 64KiB) of a file.
+  It's a cheap prefilter for duplicate detection: files with different partial sha1's are different,
+    files with equal ones still need the full sha1 to be considered equal.
+  For a file up to 2*edge_size bytes, the whole content is read, so the result is its (full) sha1
+    (function is_partial_sha1_the_full_sha1() tells that case apart).
+  """
+  if edge_size is None:
+    edge_size = PARTIAL_HASH_EDGE_SIZE
   sha1 = hashlib.sha1()
   with open(filepath, 'rb') as f:
-    while True:
-      try:
-        data = f.read(BUF_SIZE)
-        if not data:
-          break
+    try:
+      bytesize = os.fstat(f.fileno()).st_size
+      if bytesize <= 2 * edge_size:
+        data = f.read()
         sha1.update(data)
-      except OSError:
-        return None
-    return sha1.digest()
+        return sha1.digest()
+      sha1.update(f.read(edge_size))
+      f.seek(bytesize - edge_size)
+      sha1.update(f.read(edge_size))
+    except OSError:
+      return None
+  return sha1.digest()
+
+
+def is_partial_sha1_the_full_sha1(bytesize, edge_size=None):
+  if edge_size is None:
+    edge_size = PARTIAL_HASH_EDGE_SIZE
+  return bytesize <= 2 * edge_size
 
 
 def convert_to_size_w_unit(bytesize):
@@ -137,8 +425,46 @@ def adhoc_test1():
   print(hs)
 
 
+def adhoc_test2():
+  """
+  compares the strategies of HashingEngine with hashlib over this module's file
+  """
+  filepath = os.path.abspath(__file__)
+  with open(filepath, 'rb') as f:
+    expected_sha1 = hashlib.sha1(f.read()).digest()
+  for strategy in HashingEngine.STRATEGIES:
+    for policy_name in iopol.IO_POLICIES:
+      engine = HashingEngine(
+        readinto_block_size=4096, mmap_block_size=4096, mmap_threshold=0, strategy=strategy,
+        io_policy=iopol.IOPolicy(policy_name)
+      )
+      sha1 = engine.hash_file(filepath)
+      print(strategy, policy_name, sha1.hex(), 'ok' if sha1 == expected_sha1 else 'DIFFERENT')
+
+
+def adhoc_test3():
+  """
+  hashes a sparse file (data, hole, data, trailing hole) with strategies readinto, sparse and auto
+  """
+  fd, filepath = tempfile.mkstemp(prefix='sparse_')
+  with os.fdopen(fd, 'wb') as f:
+    f.write(b'head' * 1024)
+    f.seek(64 * 1024 * 1024)
+    f.write(b'middle' * 1024)
+    f.truncate(128 * 1024 * 1024)
+  filestat = os.stat(filepath)
+  print('bytesize', filestat.st_size, 'allocated', filestat.st_blocks * 512)
+  for strategy in ['readinto', 'sparse', 'auto']:
+    engine = HashingEngine(strategy=strategy)
+    picked = engine.pick_strategy(filestat.st_size, filestat.st_blocks * 512)
+    print(strategy, '=>', picked, engine.hash_file(filepath).hex())
+  os.remove(filepath)
+
+
 def process():
   adhoc_test1()
+  adhoc_test2()
+  adhoc_test3()
 
 
 if __name__ == '__main__':
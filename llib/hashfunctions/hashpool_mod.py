@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+hashpool_mod.py
+
+This module contains class Sha1HashingPool which hashes files with a pool of worker threads.
+
+The motivation is that a dirtree walk (see cmm/walkup_dirtree_files_cm.py) hashes its files
+  one at a time, leaving one core busy and the disk queue mostly empty.
+hashlib releases the GIL when updating with large buffers, so threads do scale here.
+
+How it works:
+  1) the walker (the producer) submits HashJob's (filepath, name, parentpath, bytesize, mdatetime);
+  2) worker threads calculate the sha1's;
+  3) the collector (the caller's own thread) fetches the finished jobs, in submission order,
+     and does the db-inserts (db-connections are not shared across threads).
+
+The number of pending jobs is bounded (max_pending), so a large dirtree will not pile up
+  millions of jobs in memory: when the bound is reached, submit() waits for the oldest job.
+
+The worker threads belong to a DeviceIOScheduler (llib/os/device_io_scheduler_mod.py),
+  so n_workers is the concurrency for SSDs while an HDD is read by one thread at a time.
+"""
+import collections
+import concurrent.futures
+import os
+import time
+import llib.hashfunctions.hash_mod as hm
+import llib.os.device_io_scheduler_mod as devsched
+DEFAULT_N_HASH_WORKERS = 1
+PENDING_JOBS_PER_WORKER = 8
+
+
+class HashJob:
+  """
+  A HashJob carries the file's attributes from the walker to the collector.
+  Attribute sha1 is filled in by a worker thread (it stays None if the file could not be read).
+  st_dev is optional, when the walker already has it, the scheduler does not need to stat the file again.
+  st_ino and mtime_ns are optional, they complete the hash-cache key (see llib/db/dbhashcache_mod.py).
+  hashalgo is the algorithm (default sha1, see hash_mod.HASHALGO_FACTORIES), attribute sha1 keeps its digest.
+  """
+
+  def __init__(
+      self, filepath, name, parentpath, bytesize, mdatetime, st_dev=None, st_ino=None, mtime_ns=None, hashalgo=None
+    ):
+    self.filepath = filepath
+    self.name = name
+    self.parentpath = parentpath
+    self.bytesize = bytesize
+    self.mdatetime = mdatetime
+    self.st_dev = st_dev
+    self.st_ino = st_ino
+    self.mtime_ns = mtime_ns
+    self.hashalgo = hm.DEFAULT_HASHALGO if hashalgo is None else hashalgo
+    self.sha1 = None
+
+  def __str__(self):
+    outstr = 'HashJob %s @ %s (%s)' % (self.name, self.parentpath, hm.convert_to_size_w_unit(self.bytesize))
+    return outstr
+
+
+def hash_job(job):
+  """
+  This function runs in a worker thread. IOError/OSError (eg a file removed in the meanwhile)
+    are caught here so that they reach the collector as a job with sha1 None.
+  """
+  try:
+    job.sha1 = hm.calc_hash_from_file(job.filepath, job.hashalgo)
+  except (IOError, OSError):
+    job.sha1 = None
+  return job
+
+
+class Sha1HashingPool:
+
+  def __init__(self, n_workers=None, max_pending=None, scheduler=None):
+    """
+    If scheduler is None, the pool creates (and later shuts down) its own one with n_workers for SSDs
+    """
+    if n_workers is None:
+      n_workers = DEFAULT_N_HASH_WORKERS
+    self.n_workers = max(1, int(n_workers))
+    if max_pending is None:
+      max_pending = self.n_workers * PENDING_JOBS_PER_WORKER
+    self.max_pending = max(1, int(max_pending))
+    self.owns_scheduler = scheduler is None
+    if scheduler is None:
+      scheduler = devsched.DeviceIOScheduler(ssd_concurrency=self.n_workers)
+    self.scheduler = scheduler
+    self.pending_futures = collections.deque()
+    self.n_submitted = 0
+    self.n_hashed = 0
+    self.n_failed = 0
+    self.total_bytes_hashed = 0
+    self.start_time = None
+    self.finish_time = None
+
+  def submit(self, job):
+    """
+    Submits a HashJob and returns the list of jobs that have finished in the meanwhile (possibly empty).
+    The caller is expected to db-insert the returned jobs.
+    """
+    if self.start_time is None:
+      self.start_time = time.monotonic()
+    finished_jobs = []
+    while len(self.pending_futures) >= self.max_pending:
+      # backpressure: wait for the oldest job
+      finished_jobs.append(self.pop_oldest_job())
+    self.pending_futures.append(self.submit_to_scheduler(job))
+    self.n_submitted += 1
+    finished_jobs += self.fetch_finished_jobs()
+    return finished_jobs
+
+  def submit_to_scheduler(self, job):
+    try:
+      if job.st_dev is not None:
+        return self.scheduler.submit_for_devices([job.st_dev], hash_job, job)
+      return self.scheduler.submit_for_paths([job.filepath], hash_job, job)
+    except (IOError, OSError):
+      # the file vanished before its device could be found out: it reaches the collector as a failed job
+      future = concurrent.futures.Future()
+      future.set_result(job)
+      return future
+
+  def pop_oldest_job(self):
+    future = self.pending_futures.popleft()
+    job = future.result()
+    self.account_for_job(job)
+    return job
+
+  def account_for_job(self, job):
+    if job.sha1 is None:
+      self.n_failed += 1
+      return
+    self.n_hashed += 1
+    if job.bytesize is not None:
+      self.total_bytes_hashed += job.bytesize
+    self.finish_time = time.monotonic()
+
+  def fetch_finished_jobs(self):
+    """
+    Returns the finished jobs without blocking. Jobs are returned in submission order,
+      so a finished job behind a still-running one waits for the next fetch.
+    """
+    finished_jobs = []
+    while len(self.pending_futures) > 0 and self.pending_futures[0].done():
+      finished_jobs.append(self.pop_oldest_job())
+    return finished_jobs
+
+  def drain(self):
+    """
+    Generates all remaining jobs, blocking as needed. It should be called at the end of a walk.
+    """
+    while len(self.pending_futures) > 0:
+      yield self.pop_oldest_job()
+
+  def shutdown(self):
+    if self.owns_scheduler:
+      self.scheduler.shutdown()
+
+  @property
+  def elapsed_secs(self):
+    if self.start_time is None or self.finish_time is None:
+      return 0.0
+    return self.finish_time - self.start_time
+
+  @property
+  def throughput_mb_per_s(self):
+    elapsed = self.elapsed_secs
+    if elapsed <= 0:
+      return 0.0
+    return self.total_bytes_hashed / (1024 * 1024) / elapsed
+
+  def report(self):
+    print('hashing workers', self.n_workers, '| max pending jobs', self.max_pending)
+    print('n_submitted', self.n_submitted, '| n_hashed', self.n_hashed, '| n_failed', self.n_failed)
+    print(
+      'total hashed', hm.convert_to_size_w_unit(self.total_bytes_hashed),
+      'in %.1f s' % self.elapsed_secs, '=> throughput %.2f MB/s' % self.throughput_mb_per_s
+    )
+    self.scheduler.report()
+
+
+def adhoc_test():
+  """
+  Hashes the files in this module's folder with 4 workers
+  """
+  folderpath = os.path.dirname(os.path.abspath(__file__))
+  pool = Sha1HashingPool(n_workers=4)
+  jobs = []
+  for filename in sorted(os.listdir(folderpath)):
+    filepath = os.path.join(folderpath, filename)
+    if not os.path.isfile(filepath):
+      continue
+    job = HashJob(filepath, filename, '/', os.path.getsize(filepath), None)
+    jobs += pool.submit(job)
+  jobs += list(pool.drain())
+  pool.shutdown()
+  for job in jobs:
+    print(job.sha1.hex(), job)
+  pool.report()
+
+
+def process():
+  adhoc_test()
+
+
+if __name__ == '__main__':
+  process()
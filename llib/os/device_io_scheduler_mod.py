@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+llib/os/device_io_scheduler_mod.py
+  Contains class DeviceIOScheduler which runs file-reading jobs (hashing and copying)
+    grouped by the physical device (os.stat().st_dev) the files live on.
+
+The problem it solves:
+  - when two dirtrees live on the same spinning disk (HDD), parallel reads thrash the disk heads;
+  - when they live on separate disks, serial reads leave one disk idle.
+
+How it works:
+  1) each device has a concurrency limit: 1 for HDDs, N for SSDs
+     (rotational devices are detected via /sys/dev/block/<major>:<minor>/queue/rotational;
+      when that is not available, eg on non-Linux systems, the device is treated as an HDD);
+  2) each device has its own "lane" (a thread pool with limit threads),
+     a job is run by the lane of the device it reads from;
+  3) a job that also touches another device (eg a copy from one disk to another)
+     acquires that device's slot as well, slots are always acquired in st_dev order to avoid deadlocks.
+
+Module-level functions calc_sha1_from_file() and copy_file() submit to a default scheduler
+  and wait for the result, so sequential scripts can use them as drop-in replacements
+  for hash_mod.calc_sha1_from_file() and shutil.copy2().
+
+Copies follow the run's IOPolicy (see llib/os/io_policy_mod.py): with hints on, the file is copied
+  chunk by chunk, so that the kernel may read ahead the source and (policy 'nocache')
+  drop both source and target chunks from the page cache once copied.
+"""
+import concurrent.futures
+import os
+import shutil
+import threading
+import llib.hashfunctions.hash_mod as hm
+import llib.os.io_policy_mod as iopol
+DEFAULT_HDD_CONCURRENCY = 1
+DEFAULT_SSD_CONCURRENCY = 4
+SYSFS_BLOCKDEV_DIRPATH = '/sys/dev/block'
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def find_nearest_existing_path(fpath):
+  """
+  A copy's target file (and perhaps its folder) does not exist yet,
+    so its device is taken from the nearest existing ancestor folder.
+  """
+  fpath = os.path.abspath(fpath)
+  while not os.path.exists(fpath):
+    parentpath = os.path.dirname(fpath)
+    if parentpath == fpath:
+      break
+    fpath = parentpath
+  return fpath
+
+
+def get_device_of_path(fpath):
+  return os.stat(find_nearest_existing_path(fpath)).st_dev
+
+
+def is_device_rotational(st_dev):
+  """
+  Returns True for rotational devices (HDDs), False for non-rotational ones (SSDs)
+    and None when it cannot be found out.
+  For a partition (eg sda1) the queue attributes live in its parent block device (eg sda).
+  """
+  try:
+    majmin = '%d:%d' % (os.major(st_dev), os.minor(st_dev))
+  except (AttributeError, TypeError, ValueError):
+    return None
+  blockdev_path = os.path.realpath(os.path.join(SYSFS_BLOCKDEV_DIRPATH, majmin))
+  for candidate_path in [blockdev_path, os.path.dirname(blockdev_path)]:
+    rotational_filepath = os.path.join(candidate_path, 'queue', 'rotational')
+    try:
+      with open(rotational_filepath) as fd:
+        return fd.read().strip() == '1'
+    except (IOError, OSError, ValueError):
+      continue
+  return None
+
+
+def copy_chunks_with_io_policy(fsrc, ftrg, io_policy, chunk_size=None):
+  """
+  Copies the open file fsrc into ftrg giving io_policy's hints on both of them.
+  os.sendfile() (zero-copy) is used where available, plain read/write otherwise.
+  """
+  if chunk_size is None:
+    chunk_size = COPY_CHUNK_SIZE
+  src_fd, trg_fd = fsrc.fileno(), ftrg.fileno()
+  io_policy.on_open(src_fd)
+  use_sendfile = hasattr(os, 'sendfile')
+  offset = 0
+  while True:
+    io_policy.before_chunk(src_fd, offset, chunk_size)
+    if use_sendfile:
+      try:
+        n_copied = os.sendfile(trg_fd, src_fd, offset, chunk_size)
+      except OSError:
+        if offset > 0:
+          raise
+        # eg a filesystem without sendfile support: the plain way below
+        use_sendfile = False
+        continue
+    else:
+      data = fsrc.read(chunk_size)
+      n_copied = ftrg.write(data) if data else 0
+    if not n_copied:
+      break
+    io_policy.after_chunk(src_fd, offset, n_copied)
+    io_policy.after_chunk(trg_fd, offset, n_copied)
+    offset += n_copied
+  return offset
+
+
+def run_copy(srcpath, trgpath, io_policy=None):
+  """
+  Same as shutil.copy2(): contents plus metadata, trgpath may be a folder. Returns the target filepath
+  """
+  if io_policy is None:
+    io_policy = iopol.get_default_policy()
+  if not io_policy.gives_hints:
+    return shutil.copy2(srcpath, trgpath)
+  if os.path.isdir(trgpath):
+    trgpath = os.path.join(trgpath, os.path.basename(srcpath))
+  with open(srcpath, 'rb', buffering=0) as fsrc, open(trgpath, 'wb', buffering=0) as ftrg:
+    copy_chunks_with_io_policy(fsrc, ftrg, io_policy)
+  shutil.copystat(srcpath, trgpath)
+  return trgpath
+
+
+class DeviceIOScheduler:
+
+  def __init__(self, ssd_concurrency=None, hdd_concurrency=None, device_limits=None):
+    """
+    device_limits is an optional dict {st_dev: concurrency} that overrides the detected limits
+    """
+    if ssd_concurrency is None:
+      ssd_concurrency = DEFAULT_SSD_CONCURRENCY
+    if hdd_concurrency is None:
+      hdd_concurrency = DEFAULT_HDD_CONCURRENCY
+    self.ssd_concurrency = max(1, int(ssd_concurrency))
+    self.hdd_concurrency = max(1, int(hdd_concurrency))
+    self.device_limits = {}
+    if device_limits is not None:
+      self.device_limits.update(device_limits)
+    self.device_semaphores = {}
+    self.device_lanes = {}
+    self.n_jobs_per_device = {}
+    self.lock = threading.Lock()
+
+  def set_path_concurrency(self, fpath, concurrency):
+    """
+    Overrides the detected limit for the device of fpath (eg when a USB-SSD is reported as rotational)
+    """
+    st_dev = get_device_of_path(fpath)
+    with self.lock:
+      if st_dev in self.device_lanes or st_dev in self.device_semaphores:
+        error_msg = 'Cannot change concurrency for device %d after jobs were submitted to it.' % st_dev
+        raise ValueError(error_msg)
+      self.device_limits[st_dev] = max(1, int(concurrency))
+
+  def get_device_concurrency(self, st_dev):
+    if st_dev in self.device_limits:
+      return self.device_limits[st_dev]
+    if is_device_rotational(st_dev) is False:
+      concurrency = self.ssd_concurrency
+    else:
+      # rotational or unknown: the safe choice is the HDD limit
+      concurrency = self.hdd_concurrency
+    self.device_limits[st_dev] = concurrency
+    return concurrency
+
+  def get_device_semaphore(self, st_dev):
+    with self.lock:
+      if st_dev not in self.device_semaphores:
+        concurrency = self.get_device_concurrency(st_dev)
+        self.device_semaphores[st_dev] = threading.BoundedSemaphore(concurrency)
+      return self.device_semaphores[st_dev]
+
+  def get_device_lane(self, st_dev):
+    with self.lock:
+      if st_dev not in self.device_lanes:
+        concurrency = self.get_device_concurrency(st_dev)
+        self.device_lanes[st_dev] = concurrent.futures.ThreadPoolExecutor(
+          max_workers=concurrency, thread_name_prefix='devio-%d' % st_dev
+        )
+        self.n_jobs_per_device[st_dev] = 0
+      self.n_jobs_per_device[st_dev] += 1
+      return self.device_lanes[st_dev]
+
+  def run_holding_device_slots(self, st_devs, fn, *args):
+    semaphores = [self.get_device_semaphore(st_dev) for st_dev in st_devs]
+    acquired = []
+    try:
+      for semaphore in semaphores:
+        semaphore.acquire()
+        acquired.append(semaphore)
+      return fn(*args)
+    finally:
+      for semaphore in reversed(acquired):
+        semaphore.release()
+
+  def submit_for_devices(self, st_devs, fn, *args):
+    """
+    Submits fn(*args) as a job that reads/writes files on the devices in st_devs.
+    The first device is the one read from: its lane runs the job.
+    Returns a concurrent.futures.Future
+    """
+    primary_st_dev = st_devs[0]
+    sorted_st_devs = sorted(set(st_devs))
+    lane = self.get_device_lane(primary_st_dev)
+    return lane.submit(self.run_holding_device_slots, sorted_st_devs, fn, *args)
+
+  def submit_for_paths(self, fpaths, fn, *args):
+    """
+    Same as submit_for_devices() with the devices taken from the paths (the first path is the one read from)
+    """
+    st_devs = [get_device_of_path(fpath) for fpath in fpaths]
+    return self.submit_for_devices(st_devs, fn, *args)
+
+  def submit_hash(self, filepath, hashalgo=None):
+    return self.submit_for_paths([filepath], hm.calc_hash_from_file, filepath, hashalgo)
+
+  def submit_copy(self, srcpath, trgpath):
+    return self.submit_for_paths([srcpath, trgpath], run_copy, srcpath, trgpath)
+
+  def shutdown(self):
+    with self.lock:
+      lanes = list(self.device_lanes.values())
+      self.device_lanes = {}
+    for lane in lanes:
+      lane.shutdown(wait=True)
+
+  def report(self):
+    for st_dev in sorted(self.n_jobs_per_device):
+      rotational = is_device_rotational(st_dev)
+      devtype = 'unknown (treated as HDD)' if rotational is None else ('HDD' if rotational else 'SSD')
+      print(
+        'device', st_dev, devtype, '| concurrency', self.device_limits.get(st_dev),
+        '| n_jobs', self.n_jobs_per_device[st_dev]
+      )
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_default_scheduler():
+  global _default_scheduler
+  with _default_scheduler_lock:
+    if _default_scheduler is None:
+      _default_scheduler = DeviceIOScheduler()
+    return _default_scheduler
+
+
+def calc_sha1_from_file(filepath):
+  """
+  Same as hash_mod.calc_sha1_from_file() but scheduled by the file's device
+  """
+  return get_default_scheduler().submit_hash(filepath).result()
+
+
+def calc_hash_from_file(filepath, hashalgo=None):
+  """
+  Same as hash_mod.calc_hash_from_file() but scheduled by the file's device
+  """
+  return get_default_scheduler().submit_hash(filepath, hashalgo).result()
+
+
+def copy_file(srcpath, trgpath):
+  """
+  Same as shutil.copy2() but scheduled by the devices of both source and target
+  """
+  return get_default_scheduler().submit_copy(srcpath, trgpath).result()
+
+
+def adhoc_test():
+  filepath = os.path.abspath(__file__)
+  st_dev = get_device_of_path(filepath)
+  print('device', st_dev, 'of', filepath, 'rotational =', is_device_rotational(st_dev))
+  sha1 = calc_sha1_from_file(filepath)
+  print('scheduled sha1', sha1.hex(), 'plain sha1', hm.calc_sha1_from_file(filepath).hex())
+  get_default_scheduler().report()
+  get_default_scheduler().shutdown()
+
+
+def process():
+  adhoc_test()
+
+
+if __name__ == '__main__':
+  process()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+llib/os/io_policy_mod.py
+  Contains class IOPolicy which gives the kernel page-cache hints (os.posix_fadvise())
+    while files are read (hashing) or copied, ie while they are streamed from start to end.
+
+The problem it solves:
+  - hashing a whole disk reads every byte once, yet each read lands in the page cache
+    and evicts the working set of the other services running on the same machine;
+  - the kernel gets no hint that the reads are sequential, so its read-ahead stays small.
+
+The policies are:
+  1) 'none': no hints at all (the previous behavior);
+  2) 'sequential' (the default): POSIX_FADV_SEQUENTIAL when a file is opened
+     and POSIX_FADV_WILLNEED on the next chunk before the current one is read;
+  3) 'nocache': as 'sequential' plus POSIX_FADV_DONTNEED on each chunk after it has been hashed
+     (or written, for a copy's target), ie a hashed file does not stay in the page cache.
+
+The policy is chosen per run with cli arg --io-policy=<policy> (see set_default_policy_from_args()).
+Where os.posix_fadvise() does not exist (eg macOS, Windows) or the filesystem rejects it,
+  the hints are just skipped (and counted as failed in report()), reading itself is not affected.
+"""
+import os
+import sys
+import threading
+IO_POLICIES = ['none', 'sequential', 'nocache']
+DEFAULT_IO_POLICY = 'sequential'
+IO_POLICY_ARG_PREFIX = '--io-policy='
+
+
+def is_fadvise_supported():
+  return hasattr(os, 'posix_fadvise')
+
+
+class IOPolicy:
+
+  def __init__(self, policy=None):
+    self.policy = DEFAULT_IO_POLICY if policy is None else policy
+    if self.policy not in IO_POLICIES:
+      error_msg = 'IO policy (%s) is not one of %s.' % (str(self.policy), str(IO_POLICIES))
+      raise ValueError(error_msg)
+    self.is_supported = is_fadvise_supported()
+    self.n_advised = 0
+    self.n_failed = 0
+    self.lock = threading.Lock()  # the counters are updated from the hashing/copying worker threads
+
+  @property
+  def gives_hints(self):
+    return self.policy != 'none' and self.is_supported
+
+  @property
+  def drops_cache(self):
+    return self.policy == 'nocache' and self.is_supported
+
+  def advise(self, fd, offset, length, advice):
+    """
+    Returns True if the hint was taken by the kernel. An OSError (eg EINVAL on some filesystems)
+      is not propagated: reading/writing goes on without the hint.
+    """
+    try:
+      os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+      with self.lock:
+        self.n_failed += 1
+      return False
+    with self.lock:
+      self.n_advised += 1
+    return True
+
+  def on_open(self, fd):
+    """
+    To be called right after opening a file that is going to be read from start to end
+    """
+    if not self.gives_hints:
+      return False
+    return self.advise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+  def before_chunk(self, fd, offset, length):
+    """
+    To be called before reading the chunk at offset: it asks for the read-ahead of the chunk after it
+    """
+    if not self.gives_hints:
+      return False
+    return self.advise(fd, offset + length, length, os.POSIX_FADV_WILLNEED)
+
+  def after_chunk(self, fd, offset, length):
+    """
+    To be called after a chunk was consumed (hashed or written). length 0 means "up to the end of the file"
+    """
+    if not self.drops_cache:
+      return False
+    return self.advise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+
+  def report(self):
+    print(
+      'io policy', self.policy, '| fadvise supported', self.is_supported,
+      '| n_advised', self.n_advised, '| n_failed', self.n_failed
+    )
+
+
+_default_policy = IOPolicy()
+
+
+def get_default_policy():
+  return _default_policy
+
+
+def set_default_policy(policy):
+  """
+  policy may be an IOPolicy or one of IO_POLICIES
+  """
+  global _default_policy
+  if not isinstance(policy, IOPolicy):
+    policy = IOPolicy(policy)
+  _default_policy = policy
+  return _default_policy
+
+
+def get_arg_io_policy_or_none():
+  """
+  This cli arg (--io-policy=<none|sequential|nocache>) sets the page-cache policy of a run
+  """
+  for arg in sys.argv:
+    if arg.startswith(IO_POLICY_ARG_PREFIX):
+      return arg[len(IO_POLICY_ARG_PREFIX):]
+  return None
+
+
+def set_default_policy_from_args():
+  policy = get_arg_io_policy_or_none()
+  if policy is None:
+    return _default_policy
+  return set_default_policy(policy)
+
+
+def adhoc_test():
+  """
+  Streams this module's file in 1KiB chunks under each policy
+  """
+  filepath = os.path.abspath(__file__)
+  chunk_size = 1024
+  for policy_name in IO_POLICIES:
+    policy = IOPolicy(policy_name)
+    with open(filepath, 'rb', buffering=0) as f:
+      fd = f.fileno()
+      policy.on_open(fd)
+      offset = 0
+      while True:
+        policy.before_chunk(fd, offset, chunk_size)
+        data = f.read(chunk_size)
+        if not data:
+          break
+        policy.after_chunk(fd, offset, len(data))
+        offset += len(data)
+    policy.report()
+
+
+def process():
+  adhoc_test()
+
+
+if __name__ == '__main__':
+  process()
@@ -7,14 +7,58 @@ models/datagens/random_files_generator.py
   example: a 512Gb card memory might be recorded to its full capacity
     in order to avaliable its byte-size capacity
 
+  class RandomFilesGenerator builds a synthetic dirtree for the mirror, dedupe and walker benchmarks:
+    - depth & fanout give the folder structure (fanout subfolders per folder, depth levels);
+    - n_files_to_create files are spread over the folders (none in the root folder itself,
+      as the walker does not process files there);
+    - bytesizes follow a size distribution ('lognormal', 'uniform' or 'fixed', see SIZE_DISTRIBUTIONS);
+    - duplicate_ratio of the files are byte-copies of earlier files (elsewhere, mostly under other names);
+    - hostile_name_ratio of the files get NTFS-hostile names (forbidden chars, trailing space or dot,
+      reserved names, very long names, NFD-unicode names and case-only twins);
+    - everything is seeded, ie the same parameters & seed give the same dirtree
+      (excepting the mdatetimes, which are spread over the years before the run's time).
+
+  class TargetTreeMutator copies a (source) dirtree to a "target" dirtree keeping mdatetimes (shutil.copy2)
+    and then moves, renames, deletes and edits a ratio of the target's files.
+    Its journal lists each mutation, so a mirror run may be checked against it.
+
+Usage:
+  $random_files_generator.py <dirpath> [-n=<n_files>] [--depth=<d>] [--fanout=<f>] [--size-dist=<dist>]
+    [--min-size=<bytes>] [--median-size=<bytes>] [--max-size=<bytes>] [--dup-ratio=<float>]
+    [--hostile-ratio=<float>] [--seed=<int>]
+    [--target=<dirpath> [--moves=<float>] [--renames=<float>] [--deletes=<float>] [--edits=<float>]
+     [--journal=<filepath>]]
+
+Example:
+  $random_files_generator.py /tmp/src -n=100000 --depth=4 --fanout=6 --dup-ratio=0.15 --target=/tmp/trg
+
 @created_at 2024-12-27
 """
+import json
+import math
 import os
 import random
+import shutil
 import string
+import sys
+import tempfile
+import time
+import unicodedata
+import llib.os.regexfs.filenamevalidator_cls as fnv
 LF = '\n'
 PREFIX_FOR_FILES_LINEPATH = 'F '
 charcontent = string.ascii_uppercase + ' ' + string.digits + ' ' + string.ascii_lowercase
+SIZE_DISTRIBUTIONS = ['lognormal', 'uniform', 'fixed']
+HOSTILE_NAME_KINDS = [
+  'forbidden_char', 'trailing_space', 'trailing_dot', 'reserved', 'long', 'nfd_unicode', 'case_twin'
+]
+NTFS_FORBIDDEN_CHARS = '<>:"\\|?*'
+NFD_UNICODE_WORDS = ['ação', 'coração', 'élève', 'Müller', 'niño', 'façade']
+LONG_NAME_CHARSIZE = 240
+FILE_EXTENSIONS = ['.bin', '.txt', '.mp4', '.pdf', '.jpg', '.mkv']
+WRITE_CHUNK_SIZE = 1024 * 1024
+DUPLICATE_SOURCES_RESERVOIR_SIZE = 10000
+MDATETIME_SPAN_SECS = 5 * 365 * 24 * 3600  # files' mdatetimes are spread over the last 5 years
 
 
 def generate_random_text_content(inisize=1024, trunksize=1024):
@@ -24,24 +68,331 @@ def generate_random_text_content(inisize=1024, trunksize=1024):
   print('size =', len(res))
 
 
+def write_random_bytes_file(filepath, bytesize, rng):
+  with open(filepath, 'wb') as f:
+    n_remaining = bytesize
+    while n_remaining > 0:
+      chunk_size = min(n_remaining, WRITE_CHUNK_SIZE)
+      f.write(rng.randbytes(chunk_size))
+      n_remaining -= chunk_size
+
+
 class RandomFilesGenerator:
   DIR = 'DIR'
   FILE = 'FILE'
   MAX_DIRS_LEVEL = 500
   DEFAULT_N_FILES_TO_CREATE = 500
+  DEFAULT_DEPTH = 3
+  DEFAULT_FANOUT = 4
+  DEFAULT_SIZE_DISTRIBUTION = 'lognormal'
+  DEFAULT_MIN_SIZE = 1
+  DEFAULT_MEDIAN_SIZE = 64 * 1024
+  DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+  LOGNORMAL_SIGMA = 1.5
+  DEFAULT_DUPLICATE_RATIO = 0.15
+  DEFAULT_HOSTILE_NAME_RATIO = 0.02
 
-  def __init__(self, dirpath, n_files_to_create=None):
+  def __init__(
+      self, dirpath, n_files_to_create=None, depth=None, fanout=None,
+      size_distribution=None, min_size=None, median_size=None, max_size=None,
+      duplicate_ratio=None, hostile_name_ratio=None, seed=None
+    ):
     if n_files_to_create is None:
       self.n_files_to_create = self.DEFAULT_N_FILES_TO_CREATE
     else:
       self.n_files_to_create = int(n_files_to_create)
     if dirpath is None or not os.path.isdir(dirpath):
-      errmsg = 'dirpath %s is not valid. Please, enter a valid dirpath for random files creation.'
-      raise OSError(dirpath)
+      errmsg = 'dirpath %s is not valid. Please, enter a valid dirpath for random files creation.' % str(dirpath)
+      raise OSError(errmsg)
     self.base_dirpath = dirpath
+    self.depth = self.DEFAULT_DEPTH if depth is None else max(1, min(int(depth), self.MAX_DIRS_LEVEL))
+    self.fanout = self.DEFAULT_FANOUT if fanout is None else max(1, int(fanout))
+    self.size_distribution = self.DEFAULT_SIZE_DISTRIBUTION if size_distribution is None else size_distribution
+    if self.size_distribution not in SIZE_DISTRIBUTIONS:
+      errmsg = 'Size distribution (%s) is not one of %s.' % (str(self.size_distribution), str(SIZE_DISTRIBUTIONS))
+      raise ValueError(errmsg)
+    self.min_size = self.DEFAULT_MIN_SIZE if min_size is None else max(0, int(min_size))
+    self.median_size = self.DEFAULT_MEDIAN_SIZE if median_size is None else max(1, int(median_size))
+    self.max_size = self.DEFAULT_MAX_SIZE if max_size is None else max(self.min_size, int(max_size))
+    self.duplicate_ratio = self.DEFAULT_DUPLICATE_RATIO if duplicate_ratio is None else float(duplicate_ratio)
+    self.hostile_name_ratio = self.DEFAULT_HOSTILE_NAME_RATIO if hostile_name_ratio is None \
+        else float(hostile_name_ratio)
+    self.seed = seed
+    self.rng = random.Random(seed)
+    self.folderpaths = []
+    self.duplicate_sources = []  # a reservoir sample of the created (non-duplicate) filepaths
+    self.n_originals_seen = 0
+    self.now_ts = time.time()
+    self.n_files_created = 0
+    self.n_duplicates = 0
+    self.n_hostile_names = 0
+    self.n_dirs_created = 0
+    self.total_bytes = 0
+
+  def create_folders(self):
+    """
+    Creates the folder tree breadth-first: fanout subfolders per folder, depth levels.
+    The root folder itself gets no files, so it's not in self.folderpaths
+    """
+    level_folderpaths = [self.base_dirpath]
+    for level in range(1, self.depth + 1):
+      next_level_folderpaths = []
+      for parent_folderpath in level_folderpaths:
+        for i in range(self.fanout):
+          folderpath = os.path.join(parent_folderpath, 'dir_L%d_%d' % (level, i + 1))
+          os.makedirs(folderpath, exist_ok=True)
+          self.n_dirs_created += 1
+          next_level_folderpaths.append(folderpath)
+      self.folderpaths += next_level_folderpaths
+      level_folderpaths = next_level_folderpaths
+
+  def draw_bytesize(self):
+    if self.size_distribution == 'fixed':
+      return self.median_size
+    if self.size_distribution == 'uniform':
+      return self.rng.randint(self.min_size, self.max_size)
+    bytesize = int(self.rng.lognormvariate(math.log(self.median_size), self.LOGNORMAL_SIGMA))
+    return max(self.min_size, min(self.max_size, bytesize))
+
+  def draw_mdatetime(self):
+    return self.now_ts - self.rng.uniform(0, MDATETIME_SPAN_SECS)
+
+  def form_plain_name(self, seq):
+    return 'file%07d%s' % (seq, self.rng.choice(FILE_EXTENSIONS))
+
+  def form_hostile_name(self, seq, kind):
+    ext = self.rng.choice(FILE_EXTENSIONS)
+    basename = 'file%07d' % seq
+    if kind == 'forbidden_char':
+      return basename + self.rng.choice(NTFS_FORBIDDEN_CHARS) + 'x' + ext
+    if kind == 'trailing_space':
+      return basename + ext + ' '
+    if kind == 'trailing_dot':
+      return basename + ext + '.'
+    if kind == 'reserved':
+      # a reserved name cannot be unique by itself, so it's made unique by its extension
+      return self.rng.choice(sorted(fnv.RESERVED_NAMES)) + '.%07d' % seq
+    if kind == 'long':
+      return basename + '_' + 'L' * (LONG_NAME_CHARSIZE - len(basename) - len(ext) - 1) + ext
+    if kind == 'nfd_unicode':
+      return unicodedata.normalize('NFD', self.rng.choice(NFD_UNICODE_WORDS)) + '%07d' % seq + ext
+    # case_twin: the caller also creates the same name in other case
+    return 'File%07d' % seq + ext
+
+  def pick_duplicate_source_or_none(self):
+    if len(self.duplicate_sources) == 0 or self.rng.random() >= self.duplicate_ratio:
+      return None
+    return self.rng.choice(self.duplicate_sources)
+
+  def add_to_duplicate_sources(self, filepath):
+    """
+    Reservoir sampling keeps the memory bounded even for millions of files
+    """
+    self.n_originals_seen += 1
+    if len(self.duplicate_sources) < DUPLICATE_SOURCES_RESERVOIR_SIZE:
+      self.duplicate_sources.append(filepath)
+      return
+    idx = self.rng.randrange(self.n_originals_seen)
+    if idx < DUPLICATE_SOURCES_RESERVOIR_SIZE:
+      self.duplicate_sources[idx] = filepath
+
+  def create_file(self, filepath):
+    duplicate_source = self.pick_duplicate_source_or_none()
+    if duplicate_source is not None:
+      shutil.copyfile(duplicate_source, filepath)
+      bytesize = os.path.getsize(filepath)
+      self.n_duplicates += 1
+    else:
+      bytesize = self.draw_bytesize()
+      write_random_bytes_file(filepath, bytesize, self.rng)
+      self.add_to_duplicate_sources(filepath)
+    mdatetime = self.draw_mdatetime()
+    os.utime(filepath, (mdatetime, mdatetime))
+    self.n_files_created += 1
+    self.total_bytes += bytesize
+
+  def create_files(self):
+    seq = 0
+    while self.n_files_created < self.n_files_to_create:
+      seq += 1
+      folderpath = self.rng.choice(self.folderpaths)
+      if self.rng.random() < self.hostile_name_ratio:
+        kind = self.rng.choice(HOSTILE_NAME_KINDS)
+        filename = self.form_hostile_name(seq, kind)
+        self.create_file(os.path.join(folderpath, filename))
+        self.n_hostile_names += 1
+        if kind == 'case_twin' and self.n_files_created < self.n_files_to_create:
+          self.create_file(os.path.join(folderpath, filename.lower()))
+          self.n_hostile_names += 1
+        continue
+      self.create_file(os.path.join(folderpath, self.form_plain_name(seq)))
 
   def process(self):
-    pass
+    self.create_folders()
+    self.create_files()
+
+  def as_dict(self):
+    return {
+      'dirpath': self.base_dirpath,
+      'seed': self.seed,
+      'depth': self.depth,
+      'fanout': self.fanout,
+      'size_distribution': self.size_distribution,
+      'n_dirs_created': self.n_dirs_created,
+      'n_files_created': self.n_files_created,
+      'n_duplicates': self.n_duplicates,
+      'n_hostile_names': self.n_hostile_names,
+      'total_bytes': self.total_bytes,
+    }
+
+  def report(self):
+    print('RandomFilesGenerator', self.as_dict())
+
+
+class TargetTreeMutator:
+  """
+  Copies src_dirpath to trg_dirpath and mutates the target:
+    - move: the file goes to another folder (same name);
+    - rename: the file gets another name (same folder);
+    - delete: the file is removed;
+    - edit: the file's content is changed, half of the times with the same bytesize, otherwise appended to.
+  Each file gets at most one mutation, the ratios are per file (their sum should not exceed 1).
+  """
+
+  DEFAULT_MOVE_RATIO = 0.05
+  DEFAULT_RENAME_RATIO = 0.05
+  DEFAULT_DELETE_RATIO = 0.02
+  DEFAULT_EDIT_RATIO = 0.02
+  EDIT_CHUNK_SIZE = 4096
+
+  def __init__(
+      self, src_dirpath, trg_dirpath, move_ratio=None, rename_ratio=None, delete_ratio=None, edit_ratio=None,
+      seed=None
+    ):
+    if src_dirpath is None or not os.path.isdir(src_dirpath):
+      errmsg = 'src_dirpath %s is not valid.' % str(src_dirpath)
+      raise OSError(errmsg)
+    if os.path.exists(trg_dirpath) and len(os.listdir(trg_dirpath)) > 0:
+      errmsg = 'trg_dirpath %s is not empty, the target copy needs an empty or non-existing folder.' % trg_dirpath
+      raise OSError(errmsg)
+    self.src_dirpath = src_dirpath
+    self.trg_dirpath = trg_dirpath
+    self.move_ratio = self.DEFAULT_MOVE_RATIO if move_ratio is None else float(move_ratio)
+    self.rename_ratio = self.DEFAULT_RENAME_RATIO if rename_ratio is None else float(rename_ratio)
+    self.delete_ratio = self.DEFAULT_DELETE_RATIO if delete_ratio is None else float(delete_ratio)
+    self.edit_ratio = self.DEFAULT_EDIT_RATIO if edit_ratio is None else float(edit_ratio)
+    self.rng = random.Random(seed)
+    self.folderpaths = []
+    self.journal = []
+    self.moved_in_filepaths = set()
+    self.n_files_seen = 0
+    self.n_moved = 0
+    self.n_renamed = 0
+    self.n_deleted = 0
+    self.n_edited = 0
+
+  def copy_tree(self):
+    shutil.copytree(self.src_dirpath, self.trg_dirpath, copy_function=shutil.copy2, dirs_exist_ok=True)
+
+  def gather_folderpaths(self):
+    for currentpath, _, _ in os.walk(self.trg_dirpath):
+      if currentpath != self.trg_dirpath:
+        self.folderpaths.append(currentpath)
+
+  def get_relpath(self, filepath):
+    return '/' + os.path.relpath(filepath, self.trg_dirpath)
+
+  def form_free_filepath(self, folderpath, filename):
+    filepath = os.path.join(folderpath, filename)
+    n = 0
+    while os.path.exists(filepath):
+      n += 1
+      filepath = os.path.join(folderpath, 'mut%d_%s' % (n, filename))
+    return filepath
+
+  def move_file(self, filepath):
+    folderpath = self.rng.choice(self.folderpaths)
+    if folderpath == os.path.dirname(filepath):
+      return None
+    new_filepath = self.form_free_filepath(folderpath, os.path.basename(filepath))
+    os.rename(filepath, new_filepath)
+    self.moved_in_filepaths.add(new_filepath)
+    self.n_moved += 1
+    return new_filepath
+
+  def rename_file(self, filepath):
+    folderpath, filename = os.path.split(filepath)
+    new_filepath = self.form_free_filepath(folderpath, 'renamed_' + filename)
+    os.rename(filepath, new_filepath)
+    self.n_renamed += 1
+    return new_filepath
+
+  def delete_file(self, filepath):
+    os.remove(filepath)
+    self.n_deleted += 1
+    return None
+
+  def edit_file(self, filepath):
+    bytesize = os.path.getsize(filepath)
+    with open(filepath, 'r+b') as f:
+      if bytesize > 0 and self.rng.random() < 0.5:
+        # same bytesize, different content
+        chunk_size = min(bytesize, self.EDIT_CHUNK_SIZE)
+        f.seek(self.rng.randrange(bytesize - chunk_size + 1))
+        f.write(self.rng.randbytes(chunk_size))
+      else:
+        f.seek(0, os.SEEK_END)
+        f.write(self.rng.randbytes(self.rng.randint(1, self.EDIT_CHUNK_SIZE)))
+    self.n_edited += 1
+    return filepath
+
+  def mutate_file(self, filepath):
+    draw = self.rng.random()
+    mutations = [
+      ('move', self.move_ratio, self.move_file),
+      ('rename', self.rename_ratio, self.rename_file),
+      ('delete', self.delete_ratio, self.delete_file),
+      ('edit', self.edit_ratio, self.edit_file),
+    ]
+    threshold = 0.0
+    for kind, ratio, mutation_fn in mutations:
+      threshold += ratio
+      if draw >= threshold:
+        continue
+      relpath_before = self.get_relpath(filepath)
+      new_filepath = mutation_fn(filepath)
+      if kind == 'move' and new_filepath is None:
+        return  # the drawn folder was its own
+      relpath_after = None if new_filepath is None else self.get_relpath(new_filepath)
+      self.journal.append({'mutation': kind, 'before': relpath_before, 'after': relpath_after})
+      return
+
+  def mutate_files(self):
+    for folderpath in self.folderpaths:
+      for filename in sorted(os.listdir(folderpath)):
+        filepath = os.path.join(folderpath, filename)
+        if not os.path.isfile(filepath) or filepath in self.moved_in_filepaths:
+          # a file moved into a folder not yet visited is not to be mutated twice
+          continue
+        self.n_files_seen += 1
+        self.mutate_file(filepath)
+
+  def write_journal(self, journal_filepath):
+    with open(journal_filepath, 'w', encoding='utf8') as f:
+      for entry in self.journal:
+        f.write(json.dumps(entry, ensure_ascii=False) + LF)
+
+  def process(self):
+    self.copy_tree()
+    self.gather_folderpaths()
+    self.mutate_files()
+
+  def report(self):
+    print(
+      'TargetTreeMutator', self.trg_dirpath, '| n_files_seen', self.n_files_seen,
+      '| n_moved', self.n_moved, '| n_renamed', self.n_renamed,
+      '| n_deleted', self.n_deleted, '| n_edited', self.n_edited
+    )
 
 
 def adhoc_test():
@@ -49,8 +400,72 @@ def adhoc_test():
   generate_random_text_content(inisize=0, trunksize=3)
 
 
+def adhoc_test2():
+  """
+  Generates a small dirtree and its mutated target in a temp folder
+  """
+  basefolder = tempfile.mkdtemp(prefix='randfiles_')
+  src_dirpath = os.path.join(basefolder, 'src')
+  os.makedirs(src_dirpath)
+  generator = RandomFilesGenerator(
+    src_dirpath, n_files_to_create=300, depth=2, fanout=3, median_size=4096, max_size=256*1024,
+    duplicate_ratio=0.2, hostile_name_ratio=0.1, seed=1
+  )
+  generator.process()
+  generator.report()
+  mutator = TargetTreeMutator(src_dirpath, os.path.join(basefolder, 'trg'), seed=1)
+  mutator.process()
+  mutator.report()
+  for entry in mutator.journal[:5]:
+    print(entry)
+  shutil.rmtree(basefolder)
+
+
+def get_args():
+  """
+  The cli args are read as <name>=<value>, see Usage in the module's docstring
+  """
+  prefixes = {
+    '-n=': ('n_files_to_create', int), '--depth=': ('depth', int), '--fanout=': ('fanout', int),
+    '--size-dist=': ('size_distribution', str), '--min-size=': ('min_size', int),
+    '--median-size=': ('median_size', int), '--max-size=': ('max_size', int),
+    '--dup-ratio=': ('duplicate_ratio', float), '--hostile-ratio=': ('hostile_name_ratio', float),
+    '--seed=': ('seed', int), '--target=': ('target', str), '--moves=': ('move_ratio', float),
+    '--renames=': ('rename_ratio', float), '--deletes=': ('delete_ratio', float),
+    '--edits=': ('edit_ratio', float), '--journal=': ('journal', str),
+  }
+  args = {'dirpath': None}
+  for arg in sys.argv[1:]:
+    for prefix, (name, convert) in prefixes.items():
+      if arg.startswith(prefix):
+        args[name] = convert(arg[len(prefix):])
+        break
+    else:
+      if not arg.startswith('-'):
+        args['dirpath'] = arg
+  return args
+
+
 def process():
-  adhoc_test()
+  args = get_args()
+  if args['dirpath'] is None:
+    adhoc_test2()
+    return
+  generator_argnames = [
+    'n_files_to_create', 'depth', 'fanout', 'size_distribution', 'min_size', 'median_size', 'max_size',
+    'duplicate_ratio', 'hostile_name_ratio', 'seed'
+  ]
+  generator = RandomFilesGenerator(args['dirpath'], **{k: args[k] for k in generator_argnames if k in args})
+  generator.process()
+  generator.report()
+  if 'target' not in args:
+    return
+  mutator_argnames = ['move_ratio', 'rename_ratio', 'delete_ratio', 'edit_ratio', 'seed']
+  mutator = TargetTreeMutator(args['dirpath'], args['target'], **{k: args[k] for k in mutator_argnames if k in args})
+  mutator.process()
+  mutator.report()
+  if 'journal' in args:
+    mutator.write_journal(args['journal'])
 
 
 if __name__ == '__main__':
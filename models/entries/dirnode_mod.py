@@ -6,6 +6,8 @@ import llib.hashfunctions.hash_mod as hm
 import llib.dirfilefs.dir_n_file_fs_mod as dirf
 LF = '\n'
 PREFIX_FOR_FILES_LINEPATH = 'F '
+# mdatetime is TEXT in db (the float's 15 significant digits, ie ~10us today), os.stat().st_mtime is a float
+MDATETIME_TOLERANCE_SECS = 0.001
 
 
 class MockDirEntryType:
@@ -24,7 +26,8 @@ def from_dbres_tuple_to_dirnode(restuple):
     parentpath=r[2],
     sha1=r[3],
     bytesize=r[4],
-    mdatetime=r[5]
+    mdatetime=r[5],
+    hashalgo=r[6] if len(r) > 6 else None
   )
   print(node)
   return node
@@ -126,7 +129,8 @@ class DirNode:
     parentpath, name = os.path.split(npath)
     bytesize = bytesize
     mdatetime = mdatetime
-    tuplevalues = (None, name, parentpath, sha1, bytesize, mdatetime)
+    hashalgo = hm.DEFAULT_HASHALGO
+    tuplevalues = (None, name, parentpath, sha1, bytesize, mdatetime, hashalgo)
     question_marks = '?, ' * len(tuplevalues)
     question_marks = question_marks.rstrip(', ')
     sql = "insert into %(tablename)s VALUES (" + question_marks + ");"
@@ -139,7 +143,7 @@ class DirNode:
     else:
       # id exists, an update should be tried
       row_found = fetched_list[0]
-      new_row = (row_found[0], name, parentpath, sha1, bytesize, mdatetime)
+      new_row = (row_found[0], name, parentpath, sha1, bytesize, mdatetime, hashalgo)
       dbtree.do_update_with_all_fields_with_tuplevalues(new_row)
     return cls.fetch_node_from_db(dbtree, npath)
 
@@ -160,7 +164,11 @@ class DirNode:
     bytesize = tuplerow[idx]
     idx = fieldnames.index('mdatetime')
     mdatetime = tuplerow[idx]
-    dirnode = DirNode(name, parentpath, sha1, bytesize, mdatetime)
+    hashalgo = None
+    if 'hashalgo' in fieldnames:
+      idx = fieldnames.index('hashalgo')
+      hashalgo = tuplerow[idx]
+    dirnode = DirNode(name, parentpath, sha1, bytesize, mdatetime, hashalgo)
     dirnode.db_id = _id
     return dirnode
 
@@ -171,9 +179,12 @@ class DirNode:
     self.db_id = db_id
 
   def has_same_size_n_date(self, bytesize, mdatetime):
-    if self.bytesize == bytesize and self.mdatetime == mdatetime:
-      return True
-    return False
+    if self.bytesize != bytesize:
+      return False
+    try:
+      return abs(float(self.mdatetime) - float(mdatetime)) < MDATETIME_TOLERANCE_SECS
+    except (TypeError, ValueError):
+      return False
 
   @classmethod
   def get_root_cls(cls):
@@ -194,7 +205,7 @@ class DirNode:
       line = fileprefixifneeded + fpath
       print(line)
 
-  def __init__(self, name, parentpath=None, sha1=None, bytesize=None, mdatetime=None):
+  def __init__(self, name, parentpath=None, sha1=None, bytesize=None, mdatetime=None, hashalgo=None):
     """
     This constructor should be CONSIDERED "private"
     The idea is that a unique path maps to a unique instantiated object
@@ -218,6 +229,8 @@ class DirNode:
     self.sha1 = sha1
     self.bytesize = bytesize
     self.mdatetime = mdatetime
+    # hashalgo is the algorithm that produced the content hash in attribute sha1 (see hash_mod.HASHALGO_FACTORIES)
+    self.hashalgo = hm.DEFAULT_HASHALGO if hashalgo is None else hashalgo
     # self.treat_attributes(None)
     """
     if not self.is_root:
@@ -231,6 +244,7 @@ class DirNode:
       'sha1': self.sha1,
       'bytesize': self.bytesize,
       'mdatetime': self.mdatetime,
+      'hashalgo': self.hashalgo,
     }
     return outdict
 
@@ -238,7 +252,7 @@ class DirNode:
   def fieldvalue_dict(self):
     _fieldnames_dict = {
       'name': self.name, 'parentpath': self.parentpath, 'sha1': self.sha1,
-      'bytesize': self.bytesize, 'mdatetime': self.mdatetime
+      'bytesize': self.bytesize, 'mdatetime': self.mdatetime, 'hashalgo': self.hashalgo
     }
     return _fieldnames_dict
 
@@ -289,6 +303,9 @@ class DirNode:
 
   def insert_into_db(self, dbtree):
     dirnodedict = self.fieldvalue_dict
+    if dbtree.can_upsert():
+      # one statement: INSERT ... ON CONFLICT(name, parentpath) DO UPDATE
+      return dbtree.do_upsert_with_dict(dirnodedict)
     # try db table keys existence before trying to insert it
     sql = 'SELECT * FROM %(tablename)s WHERE name=? AND parentpath=?;'
     tuplevalues = (dirnodedict['name'], dirnodedict['parentpath'])
@@ -314,12 +331,15 @@ class DirNode:
       sibling_bytesize = dictrow[idx]
       idx = dbtree.fieldnames.index('mdatetime')
       sibling_mdatetime = dictrow[idx]
+      idx = dbtree.fieldnames.index('hashalgo')
+      sibling_hashalgo = dictrow[idx]
       dirnode = DirNode(
         name=sibling_name,
         parentpath=sibling_parentpath,
         sha1=sibling_sha1,
         bytesize=sibling_bytesize,
-        mdatetime=sibling_mdatetime
+        mdatetime=sibling_mdatetime,
+        hashalgo=sibling_hashalgo
       )
       siblings.append(dirnode)
     return siblings